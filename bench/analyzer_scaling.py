@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This benchmark measures the time spent by the rule analyzer (see
+    tcbin/rule_analyzer.py) on synthetic configurations of increasing size,
+    the same ones of netfilter_scaling.py. The benchmark fails if the analysis
+    of the biggest configuration takes more than MAX_SECONDS seconds.
+    Usage: ./bench/analyzer_scaling.py [<max_rules>]
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "tcbin"))
+
+import rule_analyzer
+from netfilter_scaling import build_configuration
+
+# Maximum time for the analysis of the biggest configuration
+MAX_SECONDS = 10.0
+
+
+''' Main function '''
+def main():
+    max_rules = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    sizes = []
+    n = 1000
+    while n < max_rules:
+        sizes.append(n)
+        n *= 2
+    sizes.append(max_rules)
+
+    print("NumPy: %s" % ("yes" if rule_analyzer.numpy is not None else "no"))
+    print("%10s %12s %16s %10s" % ("rules", "seconds", "us/rule", "findings"))
+    for n in sizes:
+        configuration = build_configuration(n)
+        findings = []
+        seconds = min(timeit.repeat(
+            lambda: findings.append(rule_analyzer.analyze(configuration)),
+            repeat=3, number=1))
+        print("%10d %12.4f %16.2f %10d" % (n, seconds, seconds / n * 1e6,
+                                           len(findings[-1])))
+
+    if seconds > MAX_SECONDS:
+        print("FAIL: the analysis of %d rules took more than %.1f seconds"
+              % (max_rules, MAX_SECONDS))
+        exit(1)
+    print("OK: %d rules analyzed in %.2f seconds" % (max_rules, seconds))
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This benchmark checks the frontend of tcbin/mignis_frontend.py against
+    utils/mignis_ic and compares their times. For each configuration file the
+    intermediate representations compiled in memory must be byte-identical to
+    the files written by mignis_ic, and the warnings must be the same; if
+    mignis_ic rejects the file, the in-process frontend must reject it too.
+    The configurations are the given files or, if none is given, the ones of
+    the golden files (see below) and a synthetic configuration (see
+    synthetic.py). mignis_ic runs on a copy of each file in a temporary
+    directory, since it deletes the compiled folder next to it.
+    The golden files, in tests/golden/, keep the expected output of a few
+    configurations (<name>.mignis): the fw<i>.config files in <name>/ and,
+    if any, the warnings in <name>/warnings.txt. If mignis_ic is not
+    available, the in-process frontend is checked against them, and only
+    its time is measured. With --update-golden they are written again from
+    the output of mignis_ic. Until then, they were derived by hand from the
+    sources of mignis_ic, and tests/golden/UNVERIFIED says so.
+    The time of each frontend is the best of some runs: mignis_ic includes
+    the writing of the files and the start of its process.
+    Usage: ./bench/frontend.py [<synthetic.py parameters>] [--repeat <n>]
+               [--update-golden] [<file> ...]
+'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+
+import mignis_frontend
+from synthetic import generate, parse_parameters, FILE_NAME
+
+# The OCaml frontend
+MIGNIS_IC = os.path.join(BASE_DIR, "utils", "mignis_ic")
+# The golden files: the output of mignis_ic for some configurations
+GOLDEN_DIR = os.path.join(BASE_DIR, "tests", "golden")
+GOLDEN_WARNINGS = "warnings.txt"
+# The file that marks the golden files not written by mignis_ic
+GOLDEN_UNVERIFIED = os.path.join(GOLDEN_DIR, "UNVERIFIED")
+# The line mignis_ic prints before the warnings and the beginning of the one
+# it prints after them
+CREATED = "Directory %s created\n"
+WRITTEN = "Configuration file "
+
+USAGE = "Usage: ./bench/frontend.py [<synthetic.py parameters>] " + \
+        "[--repeat <n>] [--update-golden] [<file> ...]"
+
+
+''' This function returns the best time of repeat runs of function '''
+def measure(function, repeat):
+    return min(timeit.repeat(function, repeat=repeat, number=1))
+
+
+''' This function compiles file_name with the in-process frontend. It returns
+    a tuple made of the list of the intermediate representations and of the
+    warnings, or the message of the error
+'''
+def run_python(file_name):
+    try:
+        conf_list, warnings = mignis_frontend.compile_file(file_name)
+    except mignis_frontend.FrontendError as e:
+        return str(e)
+    return (conf_list, "".join(warnings))
+
+
+''' This function compiles file_name with mignis_ic, in directory. It returns
+    a tuple made of the list of the intermediate representations and of the
+    warnings, or the messages of mignis_ic if it fails
+'''
+def run_mignis_ic(file_name, directory):
+    compiled = os.path.join(directory, "compiled") + "/"
+    process = subprocess.Popen([MIGNIS_IC, "-f", file_name],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode()
+    if process.returncode != 0:
+        return output
+
+    conf_list = []
+    while True:
+        conf_name = compiled + "fw%d.config" % len(conf_list)
+        if not os.path.isfile(conf_name):
+            break
+        in_stream = open(conf_name, "rb")
+        conf_list.append(in_stream.read().decode())
+        in_stream.close()
+    warnings = output.split(CREATED % compiled, 1)[-1]
+    return (conf_list, warnings[:max(0, warnings.find(WRITTEN))])
+
+
+''' This function returns the configuration files of the golden files '''
+def golden_configurations():
+    return [os.path.join(GOLDEN_DIR, name)
+            for name in sorted(os.listdir(GOLDEN_DIR))
+            if name.endswith(".mignis")]
+
+
+''' This function returns the golden files of the configuration file_name
+    (see golden_configurations): a tuple made of the list of the
+    intermediate representations and of the warnings
+'''
+def read_golden(file_name):
+    folder = file_name[:-len(".mignis")]
+    conf_list = []
+    while True:
+        conf_name = os.path.join(folder, "fw%d.config" % len(conf_list))
+        if not os.path.isfile(conf_name):
+            break
+        in_stream = open(conf_name, "rb")
+        conf_list.append(in_stream.read().decode())
+        in_stream.close()
+    warnings = ""
+    if os.path.isfile(os.path.join(folder, GOLDEN_WARNINGS)):
+        in_stream = open(os.path.join(folder, GOLDEN_WARNINGS), "rb")
+        warnings = in_stream.read().decode()
+        in_stream.close()
+    return (conf_list, warnings)
+
+
+''' This function writes the golden files of the configuration file_name,
+    given the result of mignis_ic (see run_mignis_ic). It returns False if
+    mignis_ic rejected the configuration
+'''
+def write_golden(file_name, expected):
+    if not isinstance(expected, tuple):
+        return False
+    folder = file_name[:-len(".mignis")]
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.mkdir(folder)
+    conf_list, warnings = expected
+    files = [("fw%d.config" % index, conf)
+             for index, conf in enumerate(conf_list)]
+    if warnings:
+        files.append((GOLDEN_WARNINGS, warnings))
+    for name, content in files:
+        out_stream = open(os.path.join(folder, name), "wb")
+        out_stream.write(content.encode())
+        out_stream.close()
+    return True
+
+
+''' This function compares the results of the two frontends (see run_python)
+    on the configuration name: expected is the one of reference. It returns
+    the list of the differences
+'''
+def compare(name, result, expected, reference="mignis_ic"):
+    if not isinstance(expected, tuple):  # Rejected
+        if isinstance(result, tuple):
+            return ["%s: accepted, rejected by %s: %s"
+                    % (name, reference, expected.strip())]
+        return []
+    if not isinstance(result, tuple):
+        return ["%s: rejected, accepted by %s: %s"
+                % (name, reference, result)]
+
+    differences = []
+    conf_list, warnings = result
+    if len(conf_list) != len(expected[0]):
+        differences.append("%s: %d firewalls, %d by %s"
+                           % (name, len(conf_list), len(expected[0]),
+                              reference))
+    for index, (conf, other) in enumerate(zip(conf_list, expected[0])):
+        if conf != other:
+            lines = conf.split("\n")
+            other_lines = other.split("\n")
+            number = 0
+            while number + 1 < min(len(lines), len(other_lines)) and \
+                    lines[number] == other_lines[number]:
+                number += 1
+            differences.append("%s: fw%d.config differs at line %d:\n"
+                               "    %r\n    %r (%s)"
+                               % (name, index, number + 1, lines[number],
+                                  other_lines[number], reference))
+    if expected[1] is not None and warnings != expected[1]:
+        differences.append("%s: the warnings differ" % name)
+    return differences
+
+
+''' This function checks and times the frontends on the configuration
+    file_name, with mignis_ic running in directory. It returns the list of
+    the differences
+'''
+def check_file(file_name, directory, repeat):
+    name = os.path.basename(file_name)
+    copy = os.path.join(directory, name)
+    shutil.copyfile(file_name, copy)
+    result = run_python(copy)
+    expected = run_mignis_ic(copy, directory)
+
+    seconds = measure(lambda: run_python(copy), repeat)
+    ic_seconds = measure(lambda: run_mignis_ic(copy, directory), repeat)
+    print("%-24s %12.4f %12.4f %8.1fx" % (name[:24], seconds, ic_seconds,
+                                          ic_seconds / max(seconds, 1e-9)))
+    differences = compare(name, result, expected)
+    if os.path.dirname(os.path.abspath(file_name)) == \
+            os.path.abspath(GOLDEN_DIR):
+        differences += compare(name, read_golden(file_name), expected)
+    return differences
+
+
+''' This function writes the golden files again from the output of
+    mignis_ic, running in directory (see write_golden), and removes
+    GOLDEN_UNVERIFIED if they are all written. It returns the list of the
+    configurations rejected
+'''
+def update_golden(directory):
+    rejected = []
+    for file_name in golden_configurations():
+        name = os.path.basename(file_name)
+        copy = os.path.join(tempfile.mkdtemp(dir=directory), name)
+        shutil.copyfile(file_name, copy)
+        if write_golden(file_name, run_mignis_ic(copy,
+                                                 os.path.dirname(copy))):
+            print("INF: %s written" % file_name[:-len(".mignis")])
+        else:
+            rejected.append("%s: rejected by mignis_ic" % name)
+    if not rejected and os.path.isfile(GOLDEN_UNVERIFIED):
+        os.remove(GOLDEN_UNVERIFIED)
+    return rejected
+
+
+''' Main function '''
+def main():
+    parameters, argv = parse_parameters(sys.argv[1:])
+    repeat = 3
+    files = []
+    update = False
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--update-golden":
+            update = True
+            i += 1
+        elif argv[i] == "--repeat":
+            try:
+                repeat = max(1, int(argv[i + 1]))
+            except (IndexError, ValueError) as _:
+                print("FATAL: --repeat requires a number")
+                exit(-1)
+            i += 2
+        elif argv[i].startswith("--"):
+            print(USAGE)
+            exit(0)
+        else:
+            files.append(argv[i])
+            i += 1
+
+    available = os.access(MIGNIS_IC, os.X_OK)
+    if (files or update) and not available:
+        print("FATAL: %s is not available, build it with make in utils"
+              % MIGNIS_IC)
+        exit(-1)
+
+    differences = []
+    directory = tempfile.mkdtemp(prefix="mignis-frontend-")
+    try:
+        if update:
+            differences += update_golden(directory)
+        text = generate(parameters)[0]
+        synthetic = os.path.join(directory, FILE_NAME)
+        out_stream = open(synthetic, "w")
+        out_stream.write(text)
+        out_stream.close()
+
+        print("%-24s %12s %12s %9s" % ("configuration", "python",
+                                       "mignis_ic", "speedup"))
+        if available:
+            for file_name in files or golden_configurations() + [synthetic]:
+                run_directory = tempfile.mkdtemp(dir=directory)
+                differences += check_file(file_name, run_directory, repeat)
+        else:
+            print("%-24s %12.4f %12s" % (FILE_NAME, measure(
+                lambda: run_python(synthetic), repeat), "-"))
+            for file_name in golden_configurations():
+                differences += compare(os.path.basename(file_name),
+                                       run_python(file_name),
+                                       read_golden(file_name),
+                                       "the golden files")
+    finally:
+        shutil.rmtree(directory, True)
+
+    for difference in differences:
+        print("FAIL: " + difference)
+    if differences:
+        exit(1)
+    if available:
+        print("OK: the intermediate representations are byte-identical")
+    else:
+        print("OK: the intermediate representations are the ones of the "
+              "golden files (%s is not available)" % MIGNIS_IC)
+        if os.path.isfile(GOLDEN_UNVERIFIED):
+            print("WARNING: the golden files are not verified against "
+                  "mignis_ic, see %s" % GOLDEN_UNVERIFIED)
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
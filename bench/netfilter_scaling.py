@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This benchmark shows how the time spent by NetfilterEngine.translate grows
+    with the number of rules of a configuration.
+    A synthetic configuration is translated for increasing numbers of rules and
+    the time per rule is printed for every size. The translation is linear if
+    the time per rule stays (roughly) the same: if the time per rule of the
+    biggest configuration is more than MAX_RATIO times the one of the smallest
+    configuration the benchmark fails.
+    Usage: ./bench/netfilter_scaling.py [<max_rules>]
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "tcbin"))
+
+from netfilter_engine import NetfilterEngine
+
+# Tolerated growth of the time per rule between the smallest and the biggest
+# configuration
+MAX_RATIO = 2.0
+
+# Header of every synthetic configuration
+HEADER = "OPTN:default_rules;yes\n" + \
+         "OPTN:logging;yes\n" + \
+         "OPTN:established;yes\n" + \
+         "BIND:eth0;10.0.0.0/8\n" + \
+         "BIND:eth1;172.16.0.0/12\n" + \
+         "BIND:eth2;0.0.0.0/0\n"
+
+# Rule templates, {0} is a counter used to have different hosts
+RULES = [
+    "ALLW:eth0;;0;MASQUERADE;;0;eth2;;0;;;0;ANY;\n",
+    "ALLW:h-10.0.{1}.{2};;0;;;0;h-172.16.{1}.{2};;{0};;;0;TCP;\n",
+    "TALW:eth1;;0;;;0;h-10.1.{1}.{2};;22;;;0;TCP;{{mark {0}}}\n",
+    "DROP:ANY;;0;;;0;n-192.168.{1}.0/24;;0;;;0;ANY;\n",
+    "ALLW:ANY;;0;;;0;h-10.2.{1}.{2};;80;h-1.2.{1}.{2};;80;TCP;\n",
+    "ALLW:LOCAL;;0;;;0;h-172.17.{1}.{2};;53;;;0;UDP;\n",
+]
+
+
+''' This function builds a synthetic configuration with n rules, two policies
+    and a custom rule
+'''
+def build_configuration(n):
+    rules = [RULES[i % len(RULES)].format(i % 65536, (i // 250) % 256,
+                                          i % 250 + 1) for i in range(n)]
+    return HEADER + "".join(rules) + \
+           "PDRP:ANY;;0;eth0;;0;ANY\n" + \
+           "PRJC:eth2;;0;LOCAL;;0;TCP\n" + \
+           "CSTM:-A INPUT -p tcp --dport 7792 -j ACCEPT\n"
+
+
+''' Main function '''
+def main():
+    max_rules = int(sys.argv[1]) if len(sys.argv) > 1 else 64000
+
+    engine = NetfilterEngine("")
+    sizes = []
+    n = 1000
+    while n <= max_rules:
+        sizes.append(n)
+        n *= 2
+
+    print("%10s %12s %16s" % ("rules", "seconds", "us/rule"))
+    per_rule = []
+    for n in sizes:
+        configuration = build_configuration(n)
+        # Best of three runs, in order to reduce the noise
+        seconds = min(timeit.repeat(lambda: engine.translate(configuration),
+                                    repeat=3, number=1))
+        per_rule.append(seconds / n)
+        print("%10d %12.4f %16.2f" % (n, seconds, per_rule[-1] * 1e6))
+
+    ratio = per_rule[-1] / per_rule[0]
+    print("\nTime per rule ratio (biggest/smallest): %.2f" % ratio)
+    if ratio > MAX_RATIO:
+        print("FAIL: the translation time is not linear in the number of rules")
+        exit(1)
+    print("OK: the translation time is linear in the number of rules")
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This benchmark measures each stage of the compilation of a synthetic
+    configuration (see synthetic.py) separately: the frontend (the one of
+    tcbin/mignis_frontend.py, and utils/mignis_ic too), the reading of the
+    intermediate representation (GenericEngine.read_files), the translation
+    of each target language and the writing of its final files.
+    The startup is measured too, in new processes: the listing of the target
+    languages (target_compiler.py list) and the selection of the engine of
+    each target language.
+    The time of each stage is the best of some runs, in order to reduce the
+    noise. mignis_ic is skipped if it is not available. The stages after the
+    frontend read the intermediate representation written by the generator.
+    The results can be saved as JSON and compared with the ones of a previous
+    run (the baseline): the benchmark fails if a stage got slower than the
+    baseline by more than the threshold (a fraction, 0.25 means 25%).
+    Usage: ./bench/pipeline.py [<synthetic.py parameters>]
+               [--languages <L1,L2,...>] [--repeat <n>] [--output <file>]
+               [--baseline <file>] [--threshold <fraction>]
+'''
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BASE_DIR)
+
+import mignis
+import mignis_frontend
+import target_compiler
+from synthetic import parse_parameters, write_configuration
+
+# The target languages benchmarked by default. JUNOS needs Mignis+
+LANGUAGES = ["IPTABLES", "NFTABLES"]
+PLUS_LANGUAGES = ["IPTABLES", "NFTABLES", "JUNOS"]
+# The default tolerated slowdown of a stage
+THRESHOLD = 0.25
+# Stages faster than this (in seconds) are too noisy to be compared
+MIN_SECONDS = 0.01
+# The program that lists the target languages
+TARGET_COMPILER = os.path.join(BASE_DIR, "tcbin", "target_compiler.py")
+# The program run to measure the startup of an engine: it selects the engine
+# of the language given as its argument
+STARTUP = "import sys; sys.path.insert(0, %r); import target_compiler; " \
+          "target_compiler.get_engine(sys.argv[1], '')" \
+          % os.path.join(BASE_DIR, "tcbin")
+
+USAGE = "Usage: ./bench/pipeline.py [<synthetic.py parameters>] " + \
+        "[--languages <L1,L2,...>] [--repeat <n>] [--output <file>] " + \
+        "[--baseline <file>] [--threshold <fraction>]"
+
+
+''' This function runs function repeat times and returns a tuple made of the
+    best time and of the result of the last run. The messages printed by
+    function are discarded, they would only slow it down
+'''
+def measure(function, repeat):
+    results = []
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        seconds = min(timeit.repeat(lambda: results.append(function()),
+                                    repeat=repeat, number=1))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return (seconds, results[-1])
+
+
+''' This function runs a new Python process with the given arguments,
+    discarding its output
+'''
+def run_process(args):
+    null = open(os.devnull, "w")
+    try:
+        subprocess.check_call([sys.executable] + args, stdout=null)
+    finally:
+        null.close()
+
+
+''' This function benchmarks the compilation of a synthetic configuration,
+    generated with the given parameters in directory, into the given
+    languages. It returns the dictionary of the times of the stages, in
+    seconds
+'''
+def run(parameters, languages, directory, repeat):
+    stages = {}
+    stages["startup list"] = measure(
+        lambda: run_process([TARGET_COMPILER, "list"]), repeat)[0]
+    for language in languages:
+        stages["startup " + language] = measure(
+            lambda: run_process(["-c", STARTUP, language]), repeat)[0]
+    file_name = write_configuration(parameters, directory + "/")
+
+    stages["frontend"] = measure(
+        lambda: mignis_frontend.compile_file(file_name), repeat)[0]
+    if os.access(mignis.FRONTEND, os.X_OK):
+        stages["frontend mignis_ic"] = measure(
+            lambda: mignis.run_frontend(file_name), repeat)[0]
+    else:
+        print("INF: %s is not available, it is not benchmarked"
+              % mignis.FRONTEND)
+
+    reader = target_compiler.get_engine(languages[0], directory + "/")
+    stages["read_files"], conf_list = measure(reader.read_files, repeat)
+
+    # The final files are written in a generation of final, never published
+    engines = [target_compiler.get_engine(language, directory + "/")
+               for language in languages]
+    generation = target_compiler.open_generation(directory + "/", engines)
+    if generation is None:
+        print("FATAL: I/O error")
+        exit(-1)
+    for language, engine in zip(languages, engines):
+        try:
+            seconds, final_confs = measure(
+                lambda: list(engine.translate_all(conf_list)), repeat)
+        except SystemExit as _:
+            print("WARNING: %s skipped, the translation failed" % language)
+            continue
+        stages["translate " + language] = seconds
+        stages["write " + language] = measure(
+            lambda: engine.write_files(final_confs), repeat)[0]
+    return stages
+
+
+''' This function compares the results with the baseline. It returns the
+    list of the regressions, as tuples (stage, baseline time, time)
+'''
+def compare(results, baseline, threshold):
+    if results["parameters"] != baseline["parameters"]:
+        print("WARNING: the baseline has been taken with different parameters")
+    regressions = []
+    for stage in sorted(results["stages"]):
+        if stage not in baseline["stages"]:
+            print("INF: %s is not in the baseline" % stage)
+            continue
+        old = baseline["stages"][stage]
+        new = results["stages"][stage]
+        if new > old * (1 + threshold) and new - old > MIN_SECONDS:
+            regressions.append((stage, old, new))
+    return regressions
+
+
+''' Main function '''
+def main():
+    parameters, argv = parse_parameters(sys.argv[1:])
+    languages = PLUS_LANGUAGES if parameters["plus"] else LANGUAGES
+    repeat = 3
+    output = None
+    baseline = None
+    threshold = THRESHOLD
+
+    i = 0
+    while i < len(argv):
+        if i + 1 == len(argv) or argv[i] not in ("--languages", "--repeat",
+                                                 "--output", "--baseline",
+                                                 "--threshold"):
+            print(USAGE)
+            exit(0)
+        try:
+            if argv[i] == "--languages":
+                languages = argv[i + 1].split(",")
+            elif argv[i] == "--repeat":
+                repeat = max(1, int(argv[i + 1]))
+            elif argv[i] == "--threshold":
+                threshold = float(argv[i + 1])
+            elif argv[i] == "--output":
+                output = argv[i + 1]
+            else:
+                baseline = argv[i + 1]
+        except ValueError as _:
+            print("FATAL: %s requires a number" % argv[i])
+            exit(-1)
+        i += 2
+
+    for language in languages:
+        if target_compiler.get_engine(language, "") is None:
+            print("FATAL: unknown language %s" % language)
+            exit(-1)
+
+    directory = tempfile.mkdtemp(prefix="mignis-bench-")
+    try:
+        stages = run(parameters, languages, directory, repeat)
+    finally:
+        shutil.rmtree(directory, True)
+
+    results = {"parameters": parameters, "languages": languages,
+               "repeat": repeat, "python": platform.python_version(),
+               "stages": stages}
+    print("%-24s %12s" % ("stage", "seconds"))
+    for stage in sorted(stages):
+        print("%-24s %12.4f" % (stage, stages[stage]))
+
+    if output is not None:
+        try:
+            out_stream = open(output, "w")
+            json.dump(results, out_stream, indent=2, sort_keys=True)
+            out_stream.write("\n")
+            out_stream.close()
+        except IOError as _:
+            print("FATAL: unable to write %s" % output)
+            exit(-1)
+
+    if baseline is None:
+        return
+    try:
+        in_stream = open(baseline, "r")
+        regressions = compare(results, json.load(in_stream), threshold)
+        in_stream.close()
+    except (IOError, ValueError, KeyError) as _:
+        print("FATAL: unable to read the baseline %s" % baseline)
+        exit(-1)
+    for stage, old, new in regressions:
+        print("FAIL: %s took %.4f seconds, %.4f in the baseline"
+              % (stage, new, old))
+    if regressions:
+        exit(1)
+    print("OK: no stage is more than %d%% slower than the baseline"
+          % round(threshold * 100))
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
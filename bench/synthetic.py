@@ -0,0 +1,358 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This module generates big synthetic Mignis(+) configurations, used by the
+    benchmarks. A configuration is described by its parameters (see
+    DEFAULTS): the number of firewalls, of interfaces, of aliases, of rules
+    and of policies of each firewall, the fraction of allow rules with a NAT
+    and whether the Mignis+ syntax is used. The same parameters (seed
+    included) always give the same configuration.
+    Both the Mignis(+) configuration file and its intermediate representation
+    are generated: the intermediate representation is written as the frontend
+    (utils/mignis_ic) would write it, so that the other stages can be
+    benchmarked even where the frontend is not available.
+    Usage: ./bench/synthetic.py [--firewalls <n>] [--interfaces <n>]
+               [--aliases <n>] [--rules <n>] [--policies <n>]
+               [--nat <fraction>] [--plus] [--seed <n>] <directory>
+    The configuration is written in <directory>/synthetic.mignis and its
+    intermediate representation in <directory>/compiled/
+'''
+
+import os
+import random
+import sys
+
+# The default parameters of a synthetic configuration
+DEFAULTS = {"firewalls": 1, "interfaces": 4, "aliases": 50, "rules": 1000,
+            "policies": 5, "nat": 0.2, "plus": False, "seed": 0}
+
+# The name of the generated configuration file
+FILE_NAME = "synthetic.mignis"
+
+# The operators, with their command in intermediate representation and their
+# weight. Mignis+ has no negative rules
+OPERATORS = [(">", "ALLW", 60), ("<>", "TALW", 15), ("/", "DROP", 15),
+             ("//", "RJCT", 10)]
+PLUS_OPERATORS = [(">", "ALLW", 80), ("<>", "TALW", 20)]
+# The protocols, with their name in intermediate representation. A port can
+# only be used with TCP and UDP
+PROTOCOLS = [("tcp", "TCP"), ("udp", "UDP"), ("icmp", "ICMP"), ("", "ANY")]
+# Ports that are used more often than the others
+COMMON_PORTS = [22, 25, 53, 80, 443, 8080]
+# The custom rule of every firewall
+CUSTOM_RULE = "-A INPUT -p tcp --dport 7792 -j ACCEPT"
+
+USAGE = "Usage: ./bench/synthetic.py [--firewalls <n>] [--interfaces <n>] " + \
+        "[--aliases <n>] [--rules <n>] [--policies <n>] " + \
+        "[--nat <fraction>] [--plus] [--seed <n>] <directory>"
+
+
+''' This function separates the parameters of the synthetic configuration
+    from the other command line arguments. It returns a tuple made of the
+    dictionary of the parameters and the list of the remaining arguments
+'''
+def parse_parameters(argv):
+    parameters = dict(DEFAULTS)
+    args = []
+
+    i = 0
+    while i < len(argv):
+        name = argv[i][2:]
+        if argv[i] == "--plus":
+            parameters["plus"] = True
+            i += 1
+        elif argv[i].startswith("--") and name in DEFAULTS:
+            try:
+                if name == "nat":
+                    parameters[name] = float(argv[i + 1])
+                else:
+                    parameters[name] = int(argv[i + 1])
+            except (IndexError, ValueError) as _:
+                print("FATAL: %s requires a number" % argv[i])
+                exit(-1)
+            i += 2
+        else:
+            args.append(argv[i])
+            i += 1
+
+    if parameters["interfaces"] < 2 or parameters["interfaces"] > 100:
+        print("FATAL: the number of interfaces must be between 2 and 100")
+        exit(-1)
+    if parameters["firewalls"] < 1 or parameters["rules"] < 0 or \
+            parameters["aliases"] < 0 or parameters["policies"] < 0 or \
+            not 0 <= parameters["nat"] <= 1:
+        print("FATAL: bad parameters of the synthetic configuration")
+        exit(-1)
+    return (parameters, args)
+
+
+''' This class generates a single firewall. Every element is generated both
+    in Mignis(+) syntax and in intermediate representation
+'''
+class Firewall(object):
+
+    ''' Constructor. rng is the random generator, parameters are the
+        parameters of the configuration
+    '''
+    def __init__(self, rng, parameters):
+        self.rng = rng
+        self.parameters = parameters
+        self.plus = parameters["plus"]
+        # The interfaces: (name, nic, network). The first one is the wan,
+        # bound to any address, the others are bound to 10.<index>.0.0/16
+        self.interfaces = []
+        for i in range(parameters["interfaces"]):
+            if self.plus:  # JunOS names, see JunosEngine
+                nic = "ge_0_%d_%d" % (i // 10, i % 10)
+            else:
+                nic = "eth%d" % i
+            network = "0.0.0.0/0" if i == 0 else "10.%d.0.0/16" % i
+            self.interfaces.append(("if%d" % i, nic, network))
+        # The aliases: (name, address in intermediate representation,
+        # index of the interface)
+        self.aliases = []
+        for i in range(parameters["aliases"]):
+            interface = self.lan()
+            if i % 4 == 3:
+                address = "n-" + self.network(interface)
+            else:
+                address = "h-" + self.host(interface)
+            self.aliases.append(("a%d" % i, address, interface))
+        # The aliases of each interface
+        self.interface_aliases = dict((i, []) for i in
+                                      range(len(self.interfaces)))
+        for alias in self.aliases:
+            self.interface_aliases[alias[2]].append(alias)
+
+    ''' This method returns the index of a random interface, but the wan '''
+    def lan(self):
+        return self.rng.randrange(1, len(self.interfaces))
+
+    ''' This method returns a random host address on the given interface '''
+    def host(self, interface):
+        if interface == 0:
+            return "198.51.%d.%d" % (self.rng.randrange(256),
+                                     self.rng.randrange(1, 255))
+        return "10.%d.%d.%d" % (interface, self.rng.randrange(256),
+                                self.rng.randrange(1, 255))
+
+    ''' This method returns a random /24 network on the given interface '''
+    def network(self, interface):
+        if interface == 0:
+            return "203.0.%d.0/24" % self.rng.randrange(256)
+        return "10.%d.%d.0/24" % (interface, self.rng.randrange(256))
+
+    ''' This method returns a random port: half of the times no port (0) '''
+    def port(self):
+        if self.rng.random() < 0.5:
+            return 0
+        if self.rng.random() < 0.5:
+            return self.rng.choice(COMMON_PORTS)
+        return self.rng.randrange(1024, 65536)
+
+    ''' This method returns a random endpoint as a tuple (Mignis text, fields
+        in intermediate representation). The endpoint is on the given
+        interface, unless it is local or any (only if with_special is True).
+        Ports are used only if with_port is True
+    '''
+    def endpoint(self, interface, with_port=True, with_special=True):
+        choice = self.rng.random()
+        if with_special and choice < 0.05:
+            port = self.port() if with_port else 0
+            return ("local" + (":%d" % port if port else ""),
+                    ["LOCAL", "", str(port)])
+        if with_special and choice < 0.15:
+            return ("*", ["ANY", "", "0"])
+
+        choice = self.rng.random()
+        aliases = self.interface_aliases[interface]
+        if aliases and choice < 0.5:
+            name, address, _ = self.rng.choice(aliases)
+            text = name
+        elif choice < 0.7:
+            address = self.host(interface)
+            text = address
+            address = "h-" + address
+        elif choice < 0.8:
+            address = self.network(interface)
+            text = address
+            address = "n-" + address
+        else:
+            text, address, _ = self.interfaces[interface]
+
+        nic = ""
+        if self.plus:  # Mignis+: every endpoint is localized
+            text += "@" + self.interfaces[interface][0]
+            nic = self.interfaces[interface][1]
+        port = self.port() if with_port else 0
+        if port:
+            text += ":%d" % port
+        return (text, [address, nic, str(port)])
+
+    ''' This method returns a random rule as a tuple (Mignis text, line of
+        intermediate representation)
+    '''
+    def rule(self):
+        operators = PLUS_OPERATORS if self.plus else OPERATORS
+        total = sum(weight for _, _, weight in operators)
+        choice = self.rng.randrange(total)
+        for operator, command, weight in operators:
+            if choice < weight:
+                break
+            choice -= weight
+
+        s_intf = self.rng.randrange(len(self.interfaces))
+        d_intf = self.rng.choice([i for i in range(len(self.interfaces))
+                                  if i != s_intf])
+        # Mignis+ rules are localized, as JunOS needs: no local and no any
+        source = self.endpoint(s_intf, True, not self.plus)
+        destination = self.endpoint(d_intf, True, not self.plus)
+        snat = ("", ["", "", "0"])
+        dnat = ("", ["", "", "0"])
+
+        # NAT, never with local or any (see the frontend)
+        if command == "ALLW" and self.rng.random() < self.parameters["nat"] \
+                and destination[1][0] != "LOCAL":
+            choice = self.rng.random()
+            if source[1][0] not in ("LOCAL", "ANY") and choice < 0.3:
+                snat = (" [.]", ["MASQUERADE", "", "0"])
+            elif source[1][0] not in ("LOCAL", "ANY") and choice < 0.6:
+                address = self.host(0)
+                port = self.rng.choice([0, 1024])
+                snat = (" [%s%s]" % (address, ":%d" % port if port else ""),
+                        ["h-" + address, "", str(port)])
+            elif destination[1][0][:2] == "h-":
+                address = self.host(0)
+                port = self.rng.choice(COMMON_PORTS)
+                dnat = ("[%s:%d] " % (address, port),
+                        ["h-" + address, "", str(port)])
+
+        # The protocol, TCP or UDP when there are ports
+        if source[1][2] != "0" or destination[1][2] != "0" or \
+                dnat[1][2] != "0" or snat[1][2] != "0":
+            protocol = self.rng.choice(PROTOCOLS[:2])
+        else:
+            protocol = self.rng.choice(PROTOCOLS)
+
+        formula = ""
+        if self.plus and self.rng.random() < 0.1:
+            formula = "-m mark --mark %d" % self.rng.randrange(1, 256)
+
+        text = "%s%s %s %s%s" % (source[0], snat[0], operator, dnat[0],
+                                 destination[0])
+        if protocol[0]:
+            text += " " + protocol[0]
+        if formula:
+            text += " | " + formula
+        fields = source[1] + snat[1] + destination[1] + dnat[1] + \
+            [protocol[1], formula]
+        return (text, "%s:%s" % (command, ";".join(fields)))
+
+    ''' This method returns a random policy as a tuple (Mignis text, line of
+        intermediate representation)
+    '''
+    def policy(self):
+        operator, command = self.rng.choice([("/", "PDRP"), ("//", "PRJC")])
+        s_intf = self.rng.randrange(len(self.interfaces))
+        d_intf = self.rng.choice([i for i in range(len(self.interfaces))
+                                  if i != s_intf])
+        source = self.endpoint(s_intf, False)
+        destination = self.endpoint(d_intf, False)
+        protocol = self.rng.choice(PROTOCOLS)
+        text = "%s %s %s" % (source[0], operator, destination[0])
+        if protocol[0]:
+            text += " " + protocol[0]
+        fields = source[1] + destination[1] + [protocol[1]]
+        return (text, "%s:%s" % (command, ";".join(fields)))
+
+    ''' This method generates the firewall. It returns a tuple made of the
+        Mignis(+) configuration and of its intermediate representation
+    '''
+    def generate(self):
+        rules = [self.rule() for _ in range(self.parameters["rules"])]
+        # The frontend tells Mignis+ from Mignis by the first endpoint it
+        # resolves: the dNAT of the first rule, if any, that is not localized
+        while self.plus and rules and rules[0][1].split(";")[9]:
+            rules[0] = self.rule()
+        policies = [self.policy() for _ in range(self.parameters["policies"])]
+
+        text = ["OPTIONS", "default_rules yes", "logging no",
+                "established yes", "", "INTERFACES"]
+        text += ["%s %s %s" % interface for interface in self.interfaces]
+        text += ["", "ALIASES"]
+        text += ["%s %s" % (name, address[2:])
+                 for name, address, _ in self.aliases]
+        text += ["", "FIREWALL"] + [rule[0] for rule in rules]
+        text += ["", "POLICIES"] + [policy[0] for policy in policies]
+        text += ["", "CUSTOM", CUSTOM_RULE, ""]
+
+        ir = ["OPTN:default_rules;yes", "OPTN:logging;no",
+              "OPTN:established;yes"]
+        ir += ["BIND:%s;%s" % (nic, network)
+               for _, nic, network in self.interfaces]
+        # The frontend writes the negative rules first, in their order, and
+        # then the positive ones in reverse order
+        ir += [rule[1] for rule in rules if rule[1][:4] in ("DROP", "RJCT")]
+        ir += [rule[1] for rule in reversed(rules)
+               if rule[1][:4] in ("ALLW", "TALW")]
+        ir += [policy[1] for policy in policies]
+        ir += ["CSTM:" + CUSTOM_RULE]
+
+        return ("\n".join(text) + "\n", "\n".join(ir) + "\n")
+
+
+''' This function generates a synthetic configuration. It returns a tuple made
+    of the Mignis(+) configuration file and of the list of the intermediate
+    representations of its firewalls
+'''
+def generate(parameters):
+    rng = random.Random(parameters["seed"])
+    texts = []
+    irs = []
+    for _ in range(parameters["firewalls"]):
+        text, ir = Firewall(rng, parameters).generate()
+        texts.append(text)
+        irs.append(ir)
+    return ("\n".join(texts), irs)
+
+
+''' This function writes a synthetic configuration in the given directory:
+    the Mignis(+) configuration file and, in the compiled folder, its
+    intermediate representation. It returns the name of the configuration
+    file
+'''
+def write_configuration(parameters, directory):
+    text, irs = generate(parameters)
+    compiled = os.path.join(directory, "compiled")
+    if not os.path.isdir(compiled):
+        os.makedirs(compiled)
+    file_name = os.path.join(directory, FILE_NAME)
+    out_stream = open(file_name, "w")
+    out_stream.write(text)
+    out_stream.close()
+    for index, ir in enumerate(irs):
+        out_stream = open(os.path.join(compiled, "fw%d.config" % index), "w")
+        out_stream.write(ir)
+        out_stream.close()
+    return file_name
+
+
+''' Main function '''
+def main():
+    parameters, argv = parse_parameters(sys.argv[1:])
+    if len(argv) != 1:
+        print(USAGE)
+        exit(0)
+    try:
+        file_name = write_configuration(parameters, argv[0])
+    except (IOError, OSError) as e:
+        print("FATAL: unable to write the configuration: %s" % e)
+        exit(-1)
+    print("INF: %d firewalls of %d rules written in %s"
+          % (parameters["firewalls"], parameters["rules"], file_name))
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
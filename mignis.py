@@ -2,48 +2,325 @@
 
 __author__ = 'Alessio Zennaro'
 
+''' This is the Mignis(+) compiler. It can be used from the command line or
+    imported as a module: the compile_config function compiles a Mignis(+)
+    configuration file and returns the final configurations and the
+    warnings, without printing anything. The frontend
+    (see tcbin/mignis_frontend.py) and the translation into the target
+    language both run inside the current process, and the intermediate
+    representations are handed to the engines in memory. With the
+    --mignis-ic option the OCaml frontend (utils/mignis_ic) is run instead,
+    and it writes them in the compiled directory.
+'''
+
 import subprocess
 import sys
 import os
 
+# The directory this file is located in: the frontend and the engines are
+# found from here, whatever the current directory is
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The OCaml frontend: it compiles the Mignis(+) configuration file into the
+# intermediate representation, written in the compiled directory
+FRONTEND = os.path.join(BASE_DIR, "utils", "mignis_ic")
+
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+import target_compiler
+import compile_watcher
+import mignis_frontend
+from generic_engine import Capture
+
+USAGE = "Usage: ./mignis.py [-j <jobs>] [--cache <cache_dir>] " + \
+        "[--cache-size <MB>] [--analyze] [--ipset] [--dispatch] " + \
+        "[--dispatch-protocol] [--multiport] [--counters <file>] " + \
+        "[--consolidate] [--summarize] [--delta <deployed_dir>] " + \
+        "[--profile <file>] [--profile-dump <file>] [--stream] " + \
+        "[--bundle] [--mignis-ic] [--stdout | --watch [--poll]] " + \
+        "[list | <language>[,<language>...]] <file>"
+
+
+''' This function returns the directory where the configuration file is
+    located: the compiled and final directories are created in there
+'''
+def get_directory(file_name):
+    directory = os.path.dirname(file_name) + "/"
+    if directory == "/":  # If there's no directory
+        directory = '.' + directory  # Add it as the local one
+    return directory
+
+
+''' This function runs the OCaml frontend (utils/mignis_ic) on the given
+    configuration file, so that the intermediate representation is written in
+    the compiled directory. It returns the messages of the frontend. If the
+    frontend fails, a subprocess.CalledProcessError is raised
+'''
+def run_frontend(file_name):
+    return subprocess.check_output([FRONTEND, "-f", file_name],
+                                   stderr=subprocess.STDOUT).decode()
+
+
+''' This function compiles the given configuration file with the frontend of
+    mignis_frontend.py and hands the intermediate representations to the
+    engines in memory (see GenericEngine.conf_list): nothing is written in
+    the compiled directory. It returns the messages of the frontend, i.e. the
+    warnings of mignis_ic. If the configuration cannot be compiled, a
+    mignis_frontend.FrontendError is raised
+'''
+def read_config(file_name, engines):
+    conf_list, warnings = mignis_frontend.compile_file(file_name)
+    for engine in engines:
+        engine.conf_list = conf_list
+    return "".join(warnings) + "INF: %d firewalls compiled from %s" \
+        % (len(conf_list), file_name)
+
+
+''' This function returns the frontend of the given engines: the function
+    that compiles a configuration file for them. It is the one of
+    mignis_frontend.py (see read_config), or mignis_ic if external is True
+    (see run_frontend)
+'''
+def frontend(engines, external=False):
+    if external:
+        return run_frontend
+    return lambda file_name: read_config(file_name, engines)
+
+
+''' This function analyzes the rules of the intermediate representations
+    that the frontend compiled for engine (see rule_analyzer.py): the ones in
+    memory, or the ones written in directory by mignis_ic
+'''
+def analyze(directory, engine):
+    if engine.conf_list is None:
+        return target_compiler.analyze_directory(directory)
+    return target_compiler.analyze_configurations(engine.conf_list)
+
+
+''' This function runs function with the given arguments and returns a
+    tuple made of its result and of the list of the warnings it printed: the
+    lines that are not informational messages (INF). Nothing is printed on
+    the standard output
+'''
+def quietly(function, *args, **kwargs):
+    stdout = sys.stdout
+    sys.stdout = Capture(open(os.devnull, "w"))
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        sys.stdout.stream.close()
+        capture, sys.stdout = sys.stdout, stdout
+    return (result, [line for line in capture.lines()
+                     if line.strip() and not line.startswith("INF")])
+
+
+''' This function compiles the Mignis(+) configuration file file_name into the
+    target language and returns a tuple made of the list of the final
+    configurations (the n-th element is the configuration of the n-th
+    firewall) and of the list of the warnings of the frontend and of the
+    engine (see quietly). Nothing is printed, and nothing is written in the
+    final directory. jobs is the number of processes
+    used for the translation (see GenericEngine.translate_all), cache is an
+    optional CompileCache and options are the options of the engine (see
+    target_compiler.get_engine). If external is True, the frontend is
+    mignis_ic (see frontend).
+    A ValueError is raised if the language is unknown, a
+    mignis_frontend.FrontendError if the configuration cannot be compiled
+    (a subprocess.CalledProcessError if mignis_ic fails)
+'''
+def compile_config(file_name, language, jobs=1, cache=None, options=None,
+                   external=False):
+    engine = get_engine(file_name, language, options)
+    final_files, warnings = quietly(translate_config, file_name, engine,
+                                    jobs, cache, external=external)
+    return ([files[engine.suffix()] for files in final_files], warnings)
+
+
+''' This function works as compile_config, but the n-th element of the
+    returned list of final configurations is the dictionary of all the files
+    of the n-th firewall, by suffix (see GenericEngine.translate_files). If
+    a profiler is given (see compile_profiler.py), every stage is measured.
+    If analyze_rules is True, the rules are analyzed before they are
+    translated
+'''
+def compile_files(file_name, language, jobs=1, cache=None, options=None,
+                  profiler=None, external=False, analyze_rules=False):
+    return quietly(translate_config, file_name,
+                   get_engine(file_name, language, options), jobs, cache,
+                   profiler, external, analyze_rules)
+
+
+''' This function returns the engine of the given language for the
+    configuration file file_name (see target_compiler.get_engine). A
+    ValueError is raised if the language is unknown
+'''
+def get_engine(file_name, language, options=None):
+    engine = target_compiler.get_engine(language, get_directory(file_name),
+                                        options)
+    if engine is None:
+        raise ValueError("Unknown language %s" % language)
+    return engine
+
+
+''' This function works as compile_files, given the engine of the target
+    language (see get_engine), but it returns only the final files: the
+    messages of the frontend and of the engine are printed
+'''
+def translate_config(file_name, engine, jobs=1, cache=None, profiler=None,
+                     external=False, analyze_rules=False):
+    directory = get_directory(file_name)
+    print(target_compiler.run_stage(profiler, "frontend",
+                                    frontend([engine], external), file_name))
+    if analyze_rules:
+        target_compiler.run_stage(profiler, "analyze", analyze, directory,
+                                  engine)
+    if profiler is not None:
+        conf_list = profiler.stage("read_files", engine.read_files)
+        return profiler.translate_all(engine, conf_list)
+    if cache is None:
+        return list(engine.translate_all(engine.read_files(), jobs))
+    return list(cache.translate_all(engine, engine.read_files(), jobs))
+
+
+''' This function writes the files of the final configurations (as returned
+    by translate_config) on the given stream, one after the other. When
+    there is more than one file, each one is preceded by a comment line with
+    the name it would have in the final directory
+'''
+def write_configurations(final_files, stream):
+    total = sum(len(files) for files in final_files)
+    for index, files in enumerate(final_files):
+        for suffix in sorted(files):
+            if total > 1:
+                stream.write("# fw%d%s\n" % (index, suffix))
+            stream.write(files[suffix])
+    stream.flush()
+
 
 ''' The main function '''
 def main():
-    if len(sys.argv) < 2:  # This is how the file must be used
-        print("Usage: ./mignis.py [list | <language>] <file>")
+    options, argv = target_compiler.parse_options(sys.argv)
+
+    # --stdout: the final configurations are written on the standard output
+    # instead of the final directory, so that they can be piped
+    to_stdout = "--stdout" in argv
+    # --watch: the file is compiled again whenever it changes, until the
+    # compiler is interrupted (--poll: the file is polled, without inotify)
+    watch = "--watch" in argv
+    poll = "--poll" in argv
+    # --mignis-ic: the frontend is utils/mignis_ic, that writes the
+    # intermediate representations in the compiled directory
+    external = "--mignis-ic" in argv
+    argv = [arg for arg in argv if arg not in ("--stdout", "--watch",
+                                               "--poll", "--mignis-ic")]
+
+    if len(argv) < 2:  # This is how the file must be used
+        print(USAGE)
         exit(0)
 
     # Show a list of supported language
-    if len(sys.argv) == 2 and sys.argv[1] == "list":
-        print(
-            subprocess.check_output("./tcbin/target_compiler.py list",
-                                    shell=True)
-            .decode())
+    if len(argv) == 2 and argv[1] == "list":
+        target_compiler.print_languages()
         exit(0)
-    elif len(sys.argv) == 2 and sys.argv[1] != "list":  # This is a wrong usage
-        print("Usage: ./mignis.py [list | <language>] <file>")
+    elif len(argv) == 2 and argv[1] != "list":  # This is a wrong usage
+        print(USAGE)
         exit(0)
 
-    language = sys.argv[1]  # The language to be used
-    file_name = sys.argv[2]  # The complete file name
+    language = argv[1]  # The language to be used
+    file_name = argv[2]  # The complete file name
     # The directory the file is located in
-    directory = os.path.dirname(file_name) + "/"
-    if directory == "/":  # If there's no directory
-        directory = '.' + directory  # Add it as the local one
+    directory = get_directory(file_name)
+
+    # One engine for each target language: with more than one, the final
+    # files of each language are written in their own folder
+    engines = target_compiler.get_engines(language, directory, options)
+    if engines is None:
+        print("Unknown language. Type './mignis.py list' for the " + \
+              "complete list of supported target languages")
+        exit(1)
+    if len(engines) > 1 and (to_stdout or watch):
+        print("FATAL: --stdout and --watch support a single language")
+        exit(-1)
+
+    if watch:
+        if to_stdout or options["profile"] is not None or \
+                options["profile_dump"] is not None:
+            print("FATAL: --watch cannot be used with --stdout or --profile")
+            exit(-1)
+        compile_watcher.CompileWatcher(
+            file_name, directory, frontend(engines, external), engines[0],
+            options, target_compiler.open_cache(options)).run(poll)
+        exit(0)
 
     # Try to execute the compiler and the translator
     try:
-        print(
-            subprocess.check_output("./utils/mignis_ic -f " + file_name,
-                                    shell=True)
-            .decode())
-        print(
-            subprocess.check_output("./tcbin/target_compiler.py " +
-                                    language + " " + directory, shell=True)
-            .decode())
-    except subprocess.CalledProcessError, e:
-        print(e.output)
+        if to_stdout:
+            # The messages of the compiler must not be mixed up with the
+            # final configurations
+            stdout = sys.stdout
+            sys.stdout = sys.stderr
+            try:
+                profiler = target_compiler.open_profiler(options)
+                final_files = translate_config(
+                    file_name, engines[0], options["jobs"],
+                    target_compiler.open_cache(options), profiler, external,
+                    options["analyze"]
+                )
+            finally:
+                sys.stdout = stdout
+            target_compiler.run_stage(profiler, "write",
+                                      write_configurations, final_files,
+                                      sys.stdout)
+            # The profile is written last, its messages go on stderr too
+            sys.stdout = sys.stderr
+            try:
+                target_compiler.write_profile(profiler, options)
+            finally:
+                sys.stdout = stdout
+        else:
+            profiler = target_compiler.open_profiler(options)
+            print(target_compiler.run_stage(profiler, "frontend",
+                                            frontend(engines, external),
+                                            file_name))
+            generation = target_compiler.open_generation(directory, engines)
+            if generation is None:
+                print("FATAL: I/O error")
+                exit(-1)
+            published = False
+            try:
+                if options["analyze"]:
+                    target_compiler.run_stage(profiler, "analyze", analyze,
+                                              directory, engines[0])
+                print(target_compiler.complete_message(
+                    engines, target_compiler.compile_targets(
+                        engines, options["jobs"],
+                        target_compiler.open_cache(options), profiler,
+                        options["stream"])))
+                target_compiler.run_stage(profiler, "delta",
+                                          target_compiler.write_deltas,
+                                          engines, options)
+                published = target_compiler.run_stage(
+                    profiler, "publish", target_compiler.publish_generation,
+                    generation, options)
+            finally:
+                # The generation of a failed compilation is not left behind
+                if not published:
+                    generation.discard()
+            if not published:
+                exit(1)
+            target_compiler.write_profile(profiler, options)
+    except subprocess.CalledProcessError as e:
+        print(e.output.decode())
+        exit(1)
+    except mignis_frontend.FrontendError as e:
+        print("FATAL: %s" % e)
+        exit(1)
+    except (IOError, OSError) as e:
+        if external:  # mignis_ic cannot be executed at all
+            print("FATAL: unable to run %s: %s" % (FRONTEND, e))
+        else:
+            print("FATAL: I/O error: %s" % e)
+        exit(1)
+
 
 ''' The entry point of the program is the main() function '''
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,146 @@
+__author__ = "Alessio Zennaro"
+
+''' This module summarizes the addresses of a configuration written in
+    intermediate representation, before it is translated. Aliases often
+    expand into many rules that differ only in one address, and the
+    addresses are often adjacent or overlapping networks: each run of such
+    rules (see ir_model.runs) is replaced by one rule for each network of the
+    shortest list of networks covering exactly the same addresses (see
+    cidr.summarize). Runs are made of consecutive rules with the same
+    command, NATs, ports, protocol and formula, so the verdicts do not
+    change, and the summarized rules are shorter and fewer for every engine.
+    The policies are summarized in the same way.
+    An endpoint that is not localized belongs to the interface whose network
+    contains its address (e.g. the JunOS zones): a run is summarized only if
+    each new network belongs to the same interface of the addresses of the
+    run.
+'''
+
+import cidr
+import ir_model
+from symbol_table import SymbolTable
+
+
+''' This class summarizes the addresses of the configurations (see the module
+    documentation) and counts the rules (and policies) before and after the
+    summarization
+'''
+class AddressSummarizer(object):
+
+    # The axes along which the rules are summarized
+    AXES = ("src", "dst")
+
+    ''' Constructor '''
+    def __init__(self):
+        self.symbols = SymbolTable()
+        self.rules_before = 0  # Rules and policies of the configurations
+        self.rules_after = 0  # The same, once summarized
+
+    ''' This method returns the given configuration (see ir_model.py) with
+        its addresses summarized. The summary along one axis may make more
+        runs along the other one (e.g. the rules of two lists of sources and
+        destinations), so the runs are summarized until nothing changes
+    '''
+    def summarize(self, configuration):
+        self.symbols = SymbolTable()
+        for record in configuration.records:
+            if record.command == ir_model.BIND:
+                self.symbols.bind(record.interface, record.network)
+
+        records = configuration.records
+        while True:
+            summarized = []
+            for axis, run in ir_model.runs(records, self.key, self.AXES):
+                if axis is not None:
+                    run = self.summarize_run(axis, run)
+                summarized += run
+            if len(summarized) == len(records):
+                break
+            records = summarized
+
+        self.rules_before += count_rules(configuration.records)
+        self.rules_after += count_rules(records)
+        return ir_model.Configuration(records)
+
+    ''' This method returns the key of a rule (or policy) along the given axis
+        ("src" or "dst"): two rules with the same key differ only in the
+        address of that endpoint (see ir_model.runs). None is returned if the
+        endpoint is not an address, or if it is not matched by the packets
+    '''
+    def key(self, record, axis):
+        if record.command in ir_model.POLICIES:
+            others = (str(record.source if axis == "dst"
+                          else record.destination),)
+        elif record.command in ir_model.RULES:
+            others = (str(record.source if axis == "dst"
+                          else record.destination),
+                      str(record.snat), str(record.dnat), record.formula)
+        else:
+            return None
+
+        varying = record.source if axis == "src" else record.destination
+        if not varying.is_address():
+            return None
+        if axis == "dst" and record.command in ir_model.RULES and \
+                record.dnat.kind != ir_model.NONE:
+            # The destination of a dNAT is where the packets are sent to, not
+            # an address they are matched against
+            return None
+        zone = None
+        if varying.interface == "":
+            zone = self.symbols.interface_of(varying.address)
+        return (record.command, varying.interface, varying.port, zone,
+                record.protocol) + others
+
+    ''' This method returns the rules (or policies) that replace a run along
+        the given axis: one for each network of the summary of the addresses
+        of the run. The run is returned as it is if it cannot be shortened
+    '''
+    def summarize_run(self, axis, run):
+        endpoints = [record.source if axis == "src" else record.destination
+                     for record in run]
+        try:
+            networks = cidr.summarize([cidr.parse_network(endpoint.address)
+                                       for endpoint in endpoints])
+        except ValueError as _:  # Not an IPv4 address
+            return run
+        if len(networks) >= len(run):
+            return run
+
+        varying = endpoints[0]
+        if varying.interface == "":
+            zone = self.symbols.interface_of(varying.address)
+            for network in networks:
+                if self.symbols.interface_of(network) != zone:
+                    return run
+
+        records = []
+        for network in networks:
+            if network[1] == cidr.BITS:
+                host = "h-" + cidr.format_network(network, True)
+            else:
+                host = "n-" + cidr.format_network(network)
+            endpoint = ir_model.Endpoint(host, varying.interface,
+                                         varying.port)
+            records.append(replace_endpoint(run[0], axis, endpoint))
+        return records
+
+
+''' This function returns a copy of a rule (or policy) whose endpoint along
+    the given axis is replaced by endpoint
+'''
+def replace_endpoint(record, axis, endpoint):
+    source = endpoint if axis == "src" else record.source
+    destination = endpoint if axis == "dst" else record.destination
+    if record.command in ir_model.POLICIES:
+        return ir_model.Policy(record.command, source, destination,
+                               record.protocol)
+    return ir_model.Rule(record.command, source, record.snat, destination,
+                         record.dnat, record.protocol, record.formula)
+
+
+''' This function returns the number of rules and policies among records '''
+def count_rules(records):
+    return len([record for record in records
+                if record.command in ir_model.RULES
+                or record.command in ir_model.POLICIES])
@@ -0,0 +1,243 @@
+__author__ = "Alessio Zennaro"
+
+''' This module contains the functions used to deal with IPv4 addresses and
+    networks (CIDR notation) and a radix trie that maps networks to values and
+    performs longest prefix matches.
+    Addresses are represented as integers and networks as tuples
+    (address, prefix length), where the address has no host bits set.
+'''
+
+# Number of bits of an IPv4 address
+BITS = 32
+# All the bits of an address set
+ALL_ONES = (1 << BITS) - 1
+
+
+''' This function converts an address in dotted notation into an integer.
+    A ValueError is raised if the address is not well-formed
+'''
+def ip_to_int(address):
+    octets = address.split(".")
+    if len(octets) != 4:
+        raise ValueError("Bad IPv4 address %s" % address)
+
+    value = 0
+    for octet in octets:
+        number = int(octet)
+        if number < 0 or number > 255:
+            raise ValueError("Bad IPv4 address %s" % address)
+        value = (value << 8) | number
+    return value
+
+
+''' This function converts an integer into an address in dotted notation '''
+def int_to_ip(value):
+    return "%d.%d.%d.%d" % ((value >> 24) & 255, (value >> 16) & 255,
+                            (value >> 8) & 255, value & 255)
+
+
+''' This function returns the netmask of the given prefix length as an
+    integer
+'''
+def netmask(length):
+    return (ALL_ONES << (BITS - length)) & ALL_ONES
+
+
+''' This function parses an address (a.b.c.d) or a network (a.b.c.d/n) and
+    returns the tuple (address, prefix length). Host bits are cleared.
+    A ValueError is raised if the string is not well-formed
+'''
+def parse_network(network):
+    if "/" in network:
+        address, length = network.split("/", 1)
+        length = int(length)
+        if length < 0 or length > BITS:
+            raise ValueError("Bad prefix length in %s" % network)
+    else:
+        address, length = network, BITS
+
+    return (ip_to_int(address) & netmask(length), length)
+
+
+''' This function formats a network tuple in CIDR notation. Hosts (/32) are
+    written without the prefix length only if host is True
+'''
+def format_network(network, host=False):
+    address, length = network
+    if host and length == BITS:
+        return int_to_ip(address)
+    return "%s/%d" % (int_to_ip(address), length)
+
+
+''' This function returns the first and the last address of a network as a
+    tuple of integers
+'''
+def network_range(network):
+    address, length = network
+    return (address, address | (ALL_ONES >> length if length < BITS else 0))
+
+
+''' This function returns True if network a contains network b '''
+def contains(a, b):
+    return a[1] <= b[1] and (b[0] & netmask(a[1])) == a[0]
+
+
+''' This function returns the shortest list of networks that covers exactly
+    the addresses from first to last (integers), in ascending order
+'''
+def range_to_networks(first, last):
+    networks = []
+    while first <= last:
+        # The longest network starting at first that does not go past last
+        length = BITS
+        while length > 0:
+            size = 1 << (BITS - length + 1)
+            if first & (size - 1) or first + size - 1 > last:
+                break
+            length -= 1
+        networks.append((first, length))
+        first += 1 << (BITS - length)
+    return networks
+
+
+''' This function returns the shortest list of networks that covers exactly
+    the same addresses of the given networks (tuples): the networks contained
+    in other ones are removed and the adjacent ones are aggregated. The
+    networks are returned in ascending order
+'''
+def summarize(networks):
+    ranges = sorted(network_range(network) for network in networks)
+    networks = []
+    first = last = None
+    for start, end in ranges:
+        if first is not None and start <= last + 1:  # Overlapping or adjacent
+            last = max(last, end)
+            continue
+        if first is not None:
+            networks += range_to_networks(first, last)
+        first, last = start, end
+    if first is not None:
+        networks += range_to_networks(first, last)
+    return networks
+
+
+''' This class implements a binary radix trie over IPv4 networks. Each network
+    is associated with a value; lookup returns the value of the longest
+    network that contains an address (longest prefix match) in at most 32
+    steps, whatever the number of networks.
+    Each node is a list [child for bit 0, child for bit 1, value, has value].
+'''
+class RadixTrie(object):
+
+    ''' Constructor '''
+    def __init__(self):
+        self.root = [None, None, None, False]
+        self.size = 0
+
+    ''' This method associates a value with a network (string or tuple). If
+        the network is already in the trie, its value is replaced
+    '''
+    def insert(self, network, value):
+        if not isinstance(network, tuple):
+            network = parse_network(network)
+        address, length = network
+
+        node = self.root
+        for i in range(length):
+            bit = (address >> (BITS - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None, False]
+            node = node[bit]
+
+        if not node[3]:
+            self.size += 1
+        node[2] = value
+        node[3] = True
+
+    ''' This method returns the value of the longest network containing the
+        given address or network (string or tuple). If there is no such
+        network, default is returned
+    '''
+    def lookup(self, address, default=None):
+        if not isinstance(address, tuple):
+            address = parse_network(address)
+        address, length = address
+
+        node = self.root
+        result = node[2] if node[3] else default
+        for i in range(length):
+            node = node[(address >> (BITS - 1 - i)) & 1]
+            if node is None:
+                break
+            if node[3]:
+                result = node[2]
+        return result
+
+    ''' This method returns the value of the given network (string or tuple).
+        If the network is not in the trie, it is inserted with value default,
+        that is returned
+    '''
+    def setdefault(self, network, default):
+        if not isinstance(network, tuple):
+            network = parse_network(network)
+        address, length = network
+
+        node = self.root
+        for i in range(length):
+            bit = (address >> (BITS - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None, False]
+            node = node[bit]
+
+        if not node[3]:
+            self.size += 1
+            node[2] = default
+            node[3] = True
+        return node[2]
+
+    ''' This method yields the values of all the networks containing the given
+        address or network (string or tuple), from the shortest to the longest
+    '''
+    def matches(self, address):
+        if not isinstance(address, tuple):
+            address = parse_network(address)
+        address, length = address
+
+        node = self.root
+        if node[3]:
+            yield node[2]
+        for i in range(length):
+            node = node[(address >> (BITS - 1 - i)) & 1]
+            if node is None:
+                return
+            if node[3]:
+                yield node[2]
+
+    ''' This method yields the values of all the networks contained in the
+        given network (string or tuple), the network itself included
+    '''
+    def within(self, network):
+        if not isinstance(network, tuple):
+            network = parse_network(network)
+        address, length = network
+
+        node = self.root
+        for i in range(length):
+            node = node[(address >> (BITS - 1 - i)) & 1]
+            if node is None:
+                return
+
+        # Depth first visit of the subtree, without recursion
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node[3]:
+                yield node[2]
+            if node[1] is not None:
+                stack.append(node[1])
+            if node[0] is not None:
+                stack.append(node[0])
+
+    ''' Number of networks in the trie '''
+    def __len__(self):
+        return self.size
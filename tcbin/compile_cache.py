@@ -0,0 +1,197 @@
+__author__ = "Alessio Zennaro"
+
+import hashlib
+import json
+import os
+import tempfile
+
+''' This class implements a persistent cache of final configurations.
+    The files of each final configuration (see GenericEngine.translate_files)
+    are stored, as JSON, together with the messages printed while translating
+    it (see GenericEngine.translate_captured), that are printed again when the
+    entry is used, in a file whose name is the hash of the intermediate
+    representation they have been translated from and of the signature of the
+    engine that translated it (see GenericEngine.signature).
+    So a configuration is translated again only if it changed or if the engine
+    changed.
+    The cache is bounded in size: when it grows bigger than max_size bytes, the
+    least recently used entries are deleted. Hits and misses are counted for
+    the current run and saved, in total, in the stats.json file of the cache.
+'''
+class CompileCache(object):
+
+    # Default maximum size of the cache: 256MB
+    DEFAULT_SIZE = 256 * 1024 * 1024
+
+    STATS_FILE = "stats.json"
+
+    # The version of the format of the entries, part of their key
+    ENTRY_VERSION = 2
+
+    ''' Constructor '''
+    def __init__(self, directory, max_size=DEFAULT_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0  # Configurations found in the cache
+        self.misses = 0  # Configurations translated
+        self.duplicates = 0  # Configurations equal to another one of the run
+        self.evicted = 0  # Entries deleted to keep the cache small
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    ''' This method returns the key of a configuration translated by the given
+        engine
+    '''
+    def key(self, engine, configuration):
+        digest = hashlib.sha256()
+        digest.update(engine.signature().encode("utf-8"))
+        digest.update(("\0%d\0" % self.ENTRY_VERSION).encode("utf-8"))
+        digest.update(configuration.encode("utf-8"))
+        return digest.hexdigest()
+
+    ''' The file of the entry with the given key. Entries are spread in 256
+        subdirectories to avoid huge directories
+    '''
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    ''' This method returns the entry with the given key, as a tuple made of
+        the files of the final configuration and of the messages of its
+        translation, or None if it is not in the cache. The entry is marked
+        as recently used
+    '''
+    def load(self, key):
+        file_name = self.path(key)
+        try:
+            in_stream = open(file_name, "r")
+            entry = json.load(in_stream)
+            in_stream.close()
+            os.utime(file_name, None)
+            return (entry["files"], entry["messages"])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as _:
+            return None
+
+    ''' This method stores the files of a final configuration and the
+        messages of its translation (see load). The entry is
+        written in a temporary file and then renamed, so that a concurrent run
+        never reads a partial entry. Errors are not fatal: the cache is just
+        not updated
+    '''
+    def store(self, key, final_files, messages):
+        file_name = self.path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name))
+            out_stream = os.fdopen(fd, "w")
+            json.dump({"files": final_files, "messages": messages},
+                      out_stream)
+            out_stream.close()
+            os.rename(tmp_name, file_name)
+        except (IOError, OSError) as _:
+            print("WARNING: Unable to write cache entry %s" % file_name)
+
+    ''' This method translates the configurations in conf_list with the given
+        engine, using the cache: only the configurations not in the cache are
+        actually translated (via engine.translate_all, with the given number of
+        jobs) and equal configurations are translated only once.
+        It yields the files of the final configurations in the same order of
+        conf_list. The messages of the configurations found in the cache are
+        printed as their translation printed them.
+    '''
+    def translate_all(self, engine, conf_list, jobs=1):
+        keys = [self.key(engine, conf) for conf in conf_list]
+
+        # Final configurations of this run, by key. The ones found in the
+        # cache are loaded when needed, so that they are not all in memory
+        translated = {}
+        missing = []  # Keys that must be translated, without repetitions
+        missing_confs = []
+        seen = set()
+        for key, conf in zip(keys, conf_list):
+            if key in seen:
+                self.duplicates += 1
+                continue
+            seen.add(key)
+            if not os.path.isfile(self.path(key)):
+                missing.append(key)
+                missing_confs.append(conf)
+
+        self.misses += len(missing)
+        self.hits += len(seen) - len(missing)
+
+        for key, (final_files, messages) in zip(
+                missing, engine.translate_all(missing_confs, jobs, True)):
+            self.store(key, final_files, messages)
+            translated[key] = final_files
+
+        for key, conf in zip(keys, conf_list):
+            final_files = translated.get(key)
+            if final_files is None:
+                entry = self.load(key)
+                if entry is None:  # The entry disappeared in the meantime
+                    final_files = engine.translate_files(conf)
+                else:
+                    final_files = entry[0]
+                    engine.print_captured(entry[1])
+            yield final_files
+
+        self.evict()
+        self.save_stats()
+        print("INF: Cache: %d hits, %d misses, %d duplicates, %d evicted"
+              % (self.hits, self.misses, self.duplicates, self.evicted))
+
+    ''' This method deletes the least recently used entries until the size of
+        the cache is not greater than max_size
+    '''
+    def evict(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if root == self.directory:  # Not an entry (i.e. stats.json)
+                    continue
+                file_name = os.path.join(root, name)
+                try:
+                    info = os.stat(file_name)
+                except OSError as _:
+                    continue
+                entries.append((info.st_mtime, info.st_size, file_name))
+                total += info.st_size
+
+        # Oldest first
+        entries.sort()
+        for _, size, file_name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(file_name)
+                total -= size
+                self.evicted += 1
+            except OSError as _:
+                continue
+
+    ''' This method adds the statistics of the current run to the total ones
+        saved in the cache directory
+    '''
+    def save_stats(self):
+        file_name = os.path.join(self.directory, self.STATS_FILE)
+        stats = {"hits": 0, "misses": 0, "duplicates": 0, "evicted": 0}
+        try:
+            in_stream = open(file_name, "r")
+            stats.update(json.load(in_stream))
+            in_stream.close()
+        except (IOError, OSError, ValueError) as _:
+            pass  # No stats yet, or broken ones: start from scratch
+
+        stats["hits"] += self.hits
+        stats["misses"] += self.misses
+        stats["duplicates"] += self.duplicates
+        stats["evicted"] += self.evicted
+        try:
+            out_stream = open(file_name, "w")
+            json.dump(stats, out_stream, indent=2, sort_keys=True)
+            out_stream.close()
+        except (IOError, OSError) as _:
+            print("WARNING: Unable to write the cache statistics")
@@ -0,0 +1,161 @@
+__author__ = "Alessio Zennaro"
+
+import collections
+import cProfile
+import json
+import time
+
+try:
+    import tracemalloc  # Python 3.4+
+except ImportError:
+    tracemalloc = None
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+''' This class measures a compilation, stage by stage: for each stage (e.g.
+    frontend, read_files, translate, write) the wall time and the peak of the
+    memory allocated during the stage are recorded, and so they are for the
+    translation of each firewall.
+    The records of intermediate representation are counted by command (ALLW,
+    TALW, DROP, PDRP, CSTM...), and the engines time the translation of each
+    record (see GenericEngine.timed), in order to give the number of records
+    translated per second for each command. The rest of the translation
+    (e.g. the final configuration put together) is not shared by the
+    commands.
+    The peak memory is traced with tracemalloc, that slows the stages down:
+    the times are comparable with the ones of other profiled runs only. Where
+    tracemalloc is not available (Python 2) the peak memory of the whole
+    process so far is given instead.
+    If a dump file is given, the translations are also run under cProfile and
+    its statistics are saved in the dump file (see the pstats module).
+    The metrics are written as JSON (see report).
+'''
+class CompileProfiler(object):
+
+    ''' Constructor. dump_file is the file of the cProfile statistics, None
+        if cProfile is not needed
+    '''
+    def __init__(self, dump_file=None):
+        self.stages = []  # The measured stages, in their order
+        self.firewalls = []  # The translation of each firewall
+        # The records translated and their seconds, by command
+        self.opcodes = {}
+        self.dump_file = dump_file
+        self.profile = cProfile.Profile() if dump_file is not None else None
+
+    ''' This method calls function with the given arguments and returns its
+        result. Its wall time and peak memory are recorded as a stage with
+        the given name
+    '''
+    def stage(self, name, function, *args):
+        seconds, memory, result = self.measure(function, *args)
+        self.stages.append(collections.OrderedDict(
+            [("stage", name), ("seconds", seconds), ("peak_memory", memory)]))
+        return result
+
+    ''' This method calls function with the given arguments and returns a
+        tuple made of the wall time, the peak memory in bytes and the result
+    '''
+    def measure(self, function, *args):
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = time.time()
+        try:
+            result = function(*args)
+        finally:
+            seconds = time.time() - start
+            if tracemalloc is not None:
+                memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            elif resource is not None:
+                # Kilobytes on Linux
+                memory = resource.getrusage(resource.RUSAGE_SELF) \
+                    .ru_maxrss * 1024
+            else:
+                memory = None
+        return (seconds, memory, result)
+
+    ''' This method translates all the configurations of conf_list with the
+        engine, one after the other in the current process, and returns the
+        list of their final files (see GenericEngine.translate_files). Each
+        translation is measured, and all of them are recorded as the
+        translate stage: its peak memory is the biggest one of a firewall
+    '''
+    def translate_all(self, engine, conf_list):
+        final_confs = []
+        start = time.time()
+        for index, configuration in enumerate(conf_list):
+            records = count_records(configuration)
+            engine.opcode_times = {}
+            if self.profile is not None:
+                self.profile.enable()
+            try:
+                seconds, memory, final_files = self.measure(
+                    engine.translate_files, configuration)
+            finally:
+                if self.profile is not None:
+                    self.profile.disable()
+                for command, (n, spent) in engine.opcode_times.items():
+                    entry = self.opcodes.setdefault(command, [0, 0.0])
+                    entry[0] += n
+                    entry[1] += spent
+                engine.opcode_times = None
+            self.firewalls.append(collections.OrderedDict(
+                [("index", index), ("seconds", seconds),
+                 ("peak_memory", memory), ("records", records)]))
+            final_confs.append(final_files)
+
+        memory = [firewall["peak_memory"] for firewall in self.firewalls
+                  if firewall["peak_memory"] is not None]
+        self.stages.append(collections.OrderedDict(
+            [("stage", "translate"), ("seconds", time.time() - start),
+             ("peak_memory", max(memory) if memory else None)]))
+        return final_confs
+
+    ''' This method returns the metrics as a dictionary: the stages, the
+        firewalls and, for each command, the number of records translated,
+        the time spent on them and the records per second
+    '''
+    def report(self):
+        opcodes = collections.OrderedDict()
+        for command in sorted(self.opcodes):
+            n, seconds = self.opcodes[command]
+            opcodes[command] = collections.OrderedDict(
+                [("records", n), ("seconds", seconds),
+                 ("records_per_second", n / seconds if seconds > 0 else None)])
+
+        return collections.OrderedDict(
+            [("memory", "tracemalloc" if tracemalloc is not None
+              else "maxrss"),
+             ("total_seconds", sum(stage["seconds"]
+                                   for stage in self.stages)),
+             ("stages", self.stages),
+             ("firewalls", self.firewalls),
+             ("opcodes", opcodes)])
+
+    ''' This method writes the metrics (see report) in the given file as JSON
+        and the cProfile statistics in the dump file, if any. An IOError is
+        raised if a file cannot be written
+    '''
+    def write(self, file_name):
+        if file_name is not None:
+            out_stream = open(file_name, "w")
+            json.dump(self.report(), out_stream, indent=2)
+            out_stream.write("\n")
+            out_stream.close()
+        if self.profile is not None:
+            self.profile.dump_stats(self.dump_file)
+
+
+''' This function counts the records of a configuration written in
+    intermediate representation, by command. It returns a dictionary sorted
+    by command
+'''
+def count_records(configuration):
+    records = {}
+    for line in configuration.splitlines():
+        if line.strip() != "":
+            records[line[:4]] = records.get(line[:4], 0) + 1
+    return collections.OrderedDict(sorted(records.items()))
@@ -0,0 +1,294 @@
+__author__ = "Alessio Zennaro"
+
+''' This module keeps a Mignis(+) configuration file compiled while it is
+    being edited: the file is watched (with inotify where it is available,
+    polling it otherwise) and, whenever it changes, the frontend is run and
+    only the firewalls whose intermediate representation changed are
+    translated again. The engine and the intermediate representations and
+    final configurations of the last good compilation stay in memory between
+    the compilations.
+    Each compilation is published as a new generation of the final directory
+    (see output_generation.py), so a reader sees either the old or the new
+    final configurations, never a mix of them. If the frontend or the
+    translation fails, the error is reported and the final directory is left
+    as it is, until the next change.
+    For each compilation the time taken and the time since the file changed
+    (its modification time) are reported.
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import subprocess
+import time
+
+import mignis_frontend
+import target_compiler
+
+
+# The events of inotify that may mean that the watched file changed. The
+# directory is watched, since editors often write a new file and rename it
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_EVENTS = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# The header of an inotify event: watch descriptor, mask, cookie and length
+# of the name that follows
+IN_HEADER = struct.Struct("iIII")
+
+# Seconds between two checks of the file, when it is polled
+POLL_INTERVAL = 0.5
+# Seconds without events after which an edit is considered complete: an
+# editor may write a file in several steps
+SETTLE_TIME = 0.05
+
+''' This class waits for the changes of a file. It uses inotify on Linux
+    and it polls the file every POLL_INTERVAL seconds elsewhere, or if
+    inotify cannot be used (e.g. too many watches)
+'''
+class FileWatcher(object):
+
+    ''' Constructor. If poll is True, the file is polled even if inotify is
+        available
+    '''
+    def __init__(self, file_name, poll=False):
+        self.file_name = os.path.abspath(file_name)
+        self.fd = None
+        if not poll:
+            self.fd = inotify_watch(os.path.dirname(self.file_name))
+        self.last = file_state(self.file_name)
+
+    ''' The name of the method used to watch the file '''
+    def method(self):
+        return "polling" if self.fd is None else "inotify"
+
+    ''' This method blocks until the file changes (it is written, replaced or
+        deleted) and returns the time the change was noticed at
+    '''
+    def wait(self):
+        while True:
+            if self.fd is None:
+                time.sleep(POLL_INTERVAL)
+            else:
+                self.read_events(None)
+                # The rest of the edit
+                while self.read_events(SETTLE_TIME):
+                    pass
+            state = file_state(self.file_name)
+            if state != self.last:
+                self.last = state
+                return time.time()
+
+    ''' This method reads the pending events of inotify, waiting at most
+        timeout seconds (forever if None) for the first one. It returns True
+        if some of them are about the watched file
+    '''
+    def read_events(self, timeout):
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except (OSError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        if not ready:
+            return False
+        data = os.read(self.fd, 64 * 1024)
+        name = os.path.basename(self.file_name).encode("utf-8")
+        found = False
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = IN_HEADER.unpack_from(data, offset)
+            offset += IN_HEADER.size
+            if data[offset:offset + length].rstrip(b"\0") == name:
+                found = True
+            offset += length
+        return found
+
+    ''' This method stops watching the file '''
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+''' This class compiles a Mignis(+) configuration file every time it changes
+    (see the module documentation). frontend is the function that runs the
+    frontend on the file (see mignis.frontend), engine the engine of the
+    target language and options the options of target_compiler.parse_options
+'''
+class CompileWatcher(object):
+
+    ''' Constructor '''
+    def __init__(self, file_name, directory, frontend, engine, options,
+                 cache=None):
+        self.file_name = file_name
+        self.directory = directory
+        self.frontend = frontend
+        self.engine = engine
+        self.options = options
+        self.cache = cache
+        # The source, the intermediate representations and the final files
+        # of the last good compilation
+        self.source = None
+        self.conf_list = []
+        self.final_confs = []
+
+    ''' This method compiles the file and then compiles it again at every
+        change, until it is interrupted (i.e. with Ctrl-C)
+    '''
+    def run(self, poll=False):
+        watcher = FileWatcher(self.file_name, poll)
+        print("INF: watching %s (%s)" % (self.file_name, watcher.method()))
+        try:
+            self.update(None)
+            while True:
+                self.update(watcher.wait())
+        except KeyboardInterrupt:
+            print("\nINF: stopped watching %s" % self.file_name)
+        finally:
+            watcher.close()
+
+    ''' This method compiles the file, if its content changed since the last
+        good compilation, and writes the firewalls whose final files changed.
+        noticed is the time the change was noticed at (None for the first
+        compilation). It returns False if the compilation failed
+    '''
+    def update(self, noticed):
+        start = time.time()
+        try:
+            in_stream = open(self.file_name, "r")
+            source = in_stream.read()
+            changed = os.fstat(in_stream.fileno()).st_mtime
+            in_stream.close()
+        except (IOError, OSError) as e:
+            print("ERR: unable to read %s: %s" % (self.file_name, e))
+            return False
+        if source == self.source:
+            return True  # Touched, or written again as it was
+
+        try:
+            self.frontend(self.file_name)
+        except subprocess.CalledProcessError as e:
+            print(e.output.decode())
+            print("ERR: the frontend failed, %s left as it is"
+                  % self.final_directory())
+            return False
+        except mignis_frontend.FrontendError as e:
+            print("ERR: %s" % e)
+            print("ERR: the frontend failed, %s left as it is"
+                  % self.final_directory())
+            return False
+        except OSError as e:  # The frontend cannot be executed at all
+            print("ERR: unable to run the frontend: %s" % e)
+            return False
+
+        conf_list = self.engine.read_files()
+        if self.options["analyze"]:
+            target_compiler.analyze_configurations(conf_list)
+        # Only the configurations that changed are translated again
+        changed_indexes = [index for index, conf in enumerate(conf_list)
+                           if index >= len(self.conf_list)
+                           or self.conf_list[index] != conf]
+        try:
+            translated = self.translate([conf_list[index]
+                                         for index in changed_indexes])
+        except SystemExit:
+            # The translation gave up, its error has already been printed
+            print("ERR: the translation failed, %s left as it is"
+                  % self.final_directory())
+            return False
+
+        final_confs = list(self.final_confs[:len(conf_list)])
+        final_confs += [None] * (len(conf_list) - len(final_confs))
+        for index, final_files in zip(changed_indexes, translated):
+            final_confs[index] = final_files
+        if not self.write(final_confs):
+            return False
+        self.source = source
+        self.conf_list = conf_list
+        self.final_confs = final_confs
+
+        end = time.time()
+        message = "INF: %d of %d firewalls translated again, final " \
+                  "configurations written in %d ms" \
+                  % (len(changed_indexes), len(conf_list),
+                     (end - start) * 1000)
+        if noticed is not None:
+            # The modification time, unless the clocks disagree
+            message += " (%d ms since the change)" \
+                       % ((end - min(changed, noticed)) * 1000)
+        print(message)
+        return True
+
+    ''' This method translates the configurations of conf_list and returns
+        the list of their final files
+    '''
+    def translate(self, conf_list):
+        if self.cache is None:
+            return list(self.engine.translate_all(conf_list,
+                                                  self.options["jobs"]))
+        return list(self.cache.translate_all(self.engine, conf_list,
+                                             self.options["jobs"]))
+
+    ''' The final directory '''
+    def final_directory(self):
+        return self.directory + "final/"
+
+    ''' This method writes the final configurations in a new generation of
+        the final directory, with their deltas, and publishes it (see
+        output_generation.py). It returns False if something goes wrong
+    '''
+    def write(self, final_confs):
+        generation = target_compiler.open_generation(self.directory,
+                                                     [self.engine])
+        if generation is None:
+            print("ERR: unable to create a new generation of %s"
+                  % self.final_directory())
+            return False
+        if self.engine.write_files(final_confs) != len(final_confs):
+            generation.discard()
+            return False
+        target_compiler.write_deltas([self.engine], self.options)
+        if not target_compiler.publish_generation(generation, self.options):
+            generation.discard()
+            return False
+        return True
+
+
+''' This function returns the state of a file, in order to notice any change
+    to it: its inode, size and modification time (None if it does not exist)
+'''
+def file_state(file_name):
+    try:
+        info = os.stat(file_name)
+    except OSError as _:
+        return None
+    return (info.st_ino, info.st_size, info.st_mtime)
+
+
+''' This function returns an inotify file descriptor that watches the changes
+    of the files in the given directory, or None if inotify is not available
+'''
+def inotify_watch(directory):
+    library = ctypes.util.find_library("c")
+    if library is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        inotify_init = libc.inotify_init
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError) as _:  # Not Linux
+        return None
+
+    fd = inotify_init()
+    if fd < 0:
+        return None
+    if inotify_add_watch(fd, directory.encode("utf-8"), IN_EVENTS) < 0:
+        os.close(fd)
+        return None
+    return fd
@@ -0,0 +1,110 @@
+__author__ = "Alessio Zennaro"
+
+''' This module is the registry of the engines of the target languages.
+    Each engine is described by a few metadata (see EngineInfo): its language,
+    where it is found (module:attribute) and a description. The metadata are
+    all that is needed to list the languages, so no engine is imported until
+    it is selected, and then only that one is imported.
+    Besides the built-in engines, other packages can provide engines through
+    the "mignis.engines" entry point group: the name of an entry point is the
+    language and its value is the engine class (module:Class), that is built
+    with the directory as its only argument. The entry points are read only
+    when a language is not a built-in one, or when all the languages are
+    listed, and they never replace a built-in engine.
+'''
+
+import importlib
+
+
+# The group of the entry points of the engines of other packages
+ENTRY_POINT_GROUP = "mignis.engines"
+
+
+''' This class describes an engine without importing it: the language it
+    translates into, its target ("module:attribute", the attribute being the
+    engine class or a function that returns the engine) and a description.
+    If options is True, the target is called with the directory and the
+    options of target_compiler.parse_options, otherwise with the directory
+    only
+'''
+class EngineInfo(object):
+
+    ''' Constructor '''
+    def __init__(self, language, target, description, options=False):
+        self.language = language
+        self.target = target
+        self.description = description
+        self.options = options
+
+    ''' This method imports the module of the engine and returns its target.
+        An ImportError is raised if the module cannot be imported, an
+        AttributeError if the target is not in the module
+    '''
+    def load(self):
+        module_name, attribute = self.target.split(":")
+        return getattr(importlib.import_module(module_name), attribute)
+
+    ''' This method returns a new engine working on the given directory '''
+    def create(self, directory, options):
+        target = self.load()
+        if self.options:
+            return target(directory, options)
+        return target(directory)
+
+
+# The built-in engines, in the order they are listed
+BUILTIN_ENGINES = [
+    EngineInfo("IPTABLES", "netfilter_engine:from_options",
+               "Standard Netfilter/iptables for Linux OS", True),
+    EngineInfo("NFTABLES", "nftables_engine:NftablesEngine",
+               "Netfilter/nftables for Linux OS (nft -f)"),
+    EngineInfo("JUNOS", "junos_engine:from_options",
+               "Juniper firewall appliance", True),
+    EngineInfo("EXAMPLE", "example_engine:ExampleEngine",
+               "An example used as test that produces a fake final "
+               "configuration"),
+]
+
+
+''' This function returns the list of the engines provided by other packages
+    through their entry points, without importing them. The ones whose
+    language is a built-in one are skipped
+'''
+def plugin_engines():
+    # Imported only when needed, it takes longer than the registry itself
+    try:
+        from importlib.metadata import entry_points  # Python 3.8+
+    except ImportError:  # No engines from other packages
+        return []
+    try:
+        found = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # Python 3.8 and 3.9: a dictionary of all the groups
+        found = entry_points().get(ENTRY_POINT_GROUP, [])
+
+    builtin = set(info.language for info in BUILTIN_ENGINES)
+    engines = []
+    for entry_point in sorted(found, key=lambda entry: entry.name):
+        if entry_point.name not in builtin:
+            engines.append(EngineInfo(entry_point.name, entry_point.value,
+                                      "Provided by %s" % entry_point.value))
+    return engines
+
+
+''' This function returns the metadata of all the engines: the built-in ones
+    first, then the ones of other packages
+'''
+def all_engines():
+    return BUILTIN_ENGINES + plugin_engines()
+
+
+''' This function returns the metadata of the engine of the given language,
+    or None if the language is unknown
+'''
+def find_engine(language):
+    for info in BUILTIN_ENGINES:
+        if info.language == language:
+            return info
+    for info in plugin_engines():
+        if info.language == language:
+            return info
+    return None
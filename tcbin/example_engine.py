@@ -10,7 +10,10 @@ from generic_engine import GenericEngine
        implementing
      * The translate method is the one that actually translate the intermediate
        representation into the final target language. Needless to say, this is
-       the method that must perform the most important operations
+       the method that must perform the most important operations.
+       The configuration should be parsed with the parse_configuration method:
+       it returns the records defined in ir_model.py (options, bindings,
+       rules, policies and custom rules) in the same order of the lines
 '''
 class ExampleEngine(GenericEngine):
 
@@ -25,5 +28,7 @@ class ExampleEngine(GenericEngine):
         intermediate representation into the target language
     '''
     def translate(self, configuration):
+        # Parse the configuration: all the lines are in its records
+        configuration = self.parse_configuration(configuration)
         # Again, this is just an example
         return "This is just an example of final target language!"
\ No newline at end of file
@@ -1,8 +1,228 @@
 __author__ = "Alessio Zennaro"
 
 from abc import ABCMeta, abstractmethod
+import hashlib
+import mmap
 import os
 import itertools
+import multiprocessing
+import sys
+import time
+import types
+
+from address_summarizer import AddressSummarizer
+import ir_model
+import output_generation
+from symbol_table import SymbolTable
+
+
+''' Raised inside a worker process when a translation gives up (i.e. the
+    translate method calls exit). The parent process catches it and exits as
+    the sequential compilation would do
+'''
+class TranslationAborted(Exception):
+    pass
+
+
+# The signatures of the engine classes, computed only once (see
+# GenericEngine.signature)
+signatures = {}
+
+# Files of intermediate representation at least this big (in bytes) are
+# memory-mapped when they are streamed (see read_lines)
+MMAP_MIN = 1024 * 1024
+
+# The engine used by the current worker process of the pool (the list of the
+# engines, for translate_targets). It is set once per worker by init_worker,
+# so that the engine is not pickled for every single configuration
+worker_engine = None
+
+# The warnings of the current worker process that must be printed only once
+# (see GenericEngine.warn_once): they are sent back to the parent process
+# with the result of each task, and printed there
+worker_warnings = []
+
+
+''' Initializer of the worker processes: it just saves the engine '''
+def init_worker(engine):
+    global worker_engine
+    worker_engine = engine
+
+
+''' This function returns the result of a task of a worker process together
+    with the warnings collected while computing it (see worker_warnings)
+'''
+def with_warnings(result):
+    warnings = list(worker_warnings)
+    del worker_warnings[:]
+    return (result, warnings)
+
+
+''' This function is executed by the worker processes. It translates a single
+    configuration with the engine of the worker (see
+    GenericEngine.translate_files). It must be a module level function,
+    otherwise it could not be sent to the workers
+'''
+def translate_worker(configuration):
+    try:
+        return with_warnings(worker_engine.translate_files(configuration))
+    except SystemExit:
+        # A worker that exits would hang the whole pool: report it instead
+        raise TranslationAborted()
+
+
+''' This function is executed by the worker processes when the messages of
+    each translation are needed (see GenericEngine.translate_captured)
+'''
+def capture_worker(configuration):
+    try:
+        return with_warnings(worker_engine.translate_captured(configuration))
+    except SystemExit:
+        raise TranslationAborted()
+
+
+''' This function is executed by the worker processes when the
+    configurations are streamed: it translates a single file with the engine
+    of the worker (see GenericEngine.stream_file)
+'''
+def stream_worker(task):
+    try:
+        return with_warnings(worker_engine.stream_file(*task))
+    except SystemExit:
+        raise TranslationAborted()
+
+
+''' This function is executed by the worker processes when several engines
+    translate the same configurations (see translate_targets)
+'''
+def targets_worker(configuration):
+    try:
+        return with_warnings(translate_for_targets(worker_engine,
+                                                   configuration))
+    except SystemExit:
+        raise TranslationAborted()
+
+
+''' This class is the standard output while a translation is captured: what
+    is printed is still written on the real standard output (stream), and it
+    is kept too
+'''
+class Capture(object):
+
+    ''' Constructor '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.text = []
+
+    def write(self, text):
+        self.stream.write(text)
+        self.text.append(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    ''' The lines printed so far '''
+    def lines(self):
+        return "".join(self.text).splitlines()
+
+
+''' This function parses a configuration only once and translates it with
+    each engine of the list. It returns the list of the final files of the
+    configuration (see GenericEngine.translate_files), one for each engine
+'''
+def translate_for_targets(engines, configuration):
+    configuration = ir_model.parse_configuration(configuration)
+    return [engine.translate_files(configuration) for engine in engines]
+
+
+''' This function translates all the configurations in conf_list with
+    several engines and yields, for each configuration, the list of its
+    final files (one for each engine), in the same order. Each configuration
+    is parsed only once, and then shared by all the engines. With more than
+    one job, the configurations are translated by a pool of worker processes,
+    as in GenericEngine.translate_all
+'''
+def translate_targets(engines, conf_list, jobs=1):
+    if jobs == 0:  # As many workers as the available cores
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(conf_list))
+
+    if jobs <= 1:
+        for conf in conf_list:
+            yield translate_for_targets(engines, conf)
+        return
+
+    pool = multiprocessing.Pool(jobs, init_worker, (engines,))
+    try:
+        for final_confs, warnings in pool.imap(targets_worker, conf_list):
+            for message in warnings:
+                engines[0].warn_once(message)
+            yield final_confs
+    except TranslationAborted as _:
+        pool.terminate()
+        exit(-1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+''' This function returns the folder of the source file of a module, or None
+    for the built-in modules
+'''
+def module_folder(module):
+    file_name = getattr(module, "__file__", None)
+    if file_name is None:
+        return None
+    return os.path.dirname(os.path.abspath(file_name))
+
+
+''' This function returns the sorted names of the modules an engine class is
+    made of: the modules of its classes and, transitively, every module they
+    import (or import something from) that is in the same folders. The
+    standard library and the third-party packages are left out
+'''
+def engine_modules(engine_class):
+    modules = [sys.modules[cls.__module__] for cls in engine_class.__mro__
+               if cls.__module__ in sys.modules]
+    folders = set(module_folder(module) for module in modules)
+    folders.discard(None)
+
+    found = set()
+    while modules:
+        module = modules.pop()
+        if module.__name__ in found or module_folder(module) not in folders:
+            continue
+        found.add(module.__name__)
+        for value in list(vars(module).values()):
+            if isinstance(value, types.ModuleType):
+                modules.append(value)
+                continue
+            name = getattr(value, "__module__", None)
+            if isinstance(name, str) and name in sys.modules:
+                modules.append(sys.modules[name])
+    return sorted(found)
+
+
+''' This function yields the lines of an open file of intermediate
+    representation, one at a time. Big files (see MMAP_MIN) are
+    memory-mapped, so that they are not copied in memory: the pages are read
+    by the kernel when needed and dropped when memory is short
+'''
+def read_lines(in_stream):
+    if os.fstat(in_stream.fileno()).st_size < MMAP_MIN:
+        for line in in_stream:
+            yield line
+        return
+
+    mapped = mmap.mmap(in_stream.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for line in iter(mapped.readline, b""):
+            if bytes is not str:  # Python 3: records are made of strings
+                line = line.decode("utf-8")
+            yield line
+    finally:
+        mapped.close()
+
 
 ''' This class is used as a model for all target languages.
     Basically it is an abstract class that is able to read all the files written
@@ -17,24 +237,52 @@ class GenericEngine:
         intermediate language. These are useful in order to avoid to use direct
         strings in the code
     '''
-    OPTN = "OPTN"
-    BIND = "BIND"
-    ALLW = "ALLW"
-    DROP = "DROP"
-    RJCT = "RJCT"
-    TALW = "TALW"
-    PDRP = "PDRP"
-    PRJC = "PRJC"
-    CSTM = "CSTM"
+    OPTN = ir_model.OPTN
+    BIND = ir_model.BIND
+    ALLW = ir_model.ALLW
+    DROP = ir_model.DROP
+    RJCT = ir_model.RJCT
+    TALW = ir_model.TALW
+    PDRP = ir_model.PDRP
+    PRJC = ir_model.PRJC
+    CSTM = ir_model.CSTM
 
     LOCAL = "LOCAL"
     ANY = "ANY"
     MASQUERADE = "MASQUERADE"
 
-    ''' This method just inits the language property '''
+    # Version of the engine, it is part of its signature
+    VERSION = "2.5.1"
+
+    ''' This method just inits the language property and the symbol table '''
     def __init__(self, directory):
         self.language = ""
         self.directory = directory
+        # The folder of the final files (e.g. a generation of ../final, see
+        # output_generation.py) and its sub-folder for this engine, if any
+        # (see final_directory)
+        self.output_dir = directory + "final/"
+        self.final_subdir = ""
+        # The generation being written, if any: it writes the final files
+        # (see write_batch)
+        self.generation = None
+        # If True, the addresses of the configurations are summarized before
+        # they are translated (see parse_configuration)
+        self.summarize = False
+        # The intermediate representations compiled in memory by the
+        # frontend (see mignis_frontend.py), read instead of the files of
+        # ../compiled if they are given (see read_files)
+        self.conf_list = None
+        # The symbol table of the configuration being translated
+        self.symbols = SymbolTable()
+        # The warnings already printed by warn_once
+        self.warned = set()
+        # The warnings given to warn_once by the translation being captured,
+        # if any (see translate_captured)
+        self.captured = None
+        # When the translation is profiled, the number of records translated
+        # and the seconds spent on them, by command (see timed)
+        self.opcode_times = None
 
 
     ''' This method is used to actually read all the intermediate
@@ -43,41 +291,371 @@ class GenericEngine:
         The ../final folder is supposed to already exist.
         The files inside the ../final folder are look like the following
         fw<index>.<target_language>
-        If an IOErr occurs, the current file is skipped.
+        where <index> is the same index of the intermediate representation the
+        file has been translated from. Engines may write companion files
+        next to it, with the same name and a different suffix (see
+        translate_files).
+        The jobs parameter is the number of worker processes used to translate
+        the configurations: 1 means no parallelism at all, 0 means one worker
+        for each available core.
+        If a cache (see compile_cache.py) is given, only the configurations
+        that are not in the cache are translated.
+        The files are written by write_files.
+        If a profiler (see compile_profiler.py) is given, every stage is
+        measured: the configurations are translated one after the other in
+        the current process, without the cache.
+        If stream is True, the configurations are streamed instead (see
+        compile_stream), without the cache and the profiler.
         It returns the number of final configurations written to disk
     '''
-    def compile(self):
-        # The complete file name structure is
-        # ../final/fw<index>.<targe_language>
-        prefix = self.directory + "final/fw"
-        suffix = "." + self.language
+    def compile(self, jobs=1, cache=None, profiler=None, stream=False):
+        if stream:
+            return self.compile_stream(jobs)
+        if profiler is not None:
+            conf_list = profiler.stage("read_files", self.read_files)
+            final_confs = profiler.translate_all(self, conf_list)
+            return profiler.stage("write", self.write_files, final_confs)
 
         # We get all the configurations written in the intermediate
         # representation
         conf_list = self.read_files()
 
-        n = 0
-        # For all the configurations found
-        for conf in conf_list:
-            final_conf = self.translate(conf)  # Translate it
-            file_name = prefix + str(n) + suffix  # Create the file name
+        if cache is None:
+            final_confs = self.translate_all(conf_list, jobs)
+        else:
+            final_confs = cache.translate_all(self, conf_list, jobs)
+
+        # Return the number of final configurations written
+        return self.write_files(final_confs)
+
+    ''' This method writes the final files of each configuration (see
+        translate_files), given in the same order of the intermediate
+        representations, in the ../final folder (see final_directory).
+        All of them are written in a single batch (see write_batch).
+        It returns the number of final configurations written to disk
+    '''
+    def write_files(self, final_confs):
+        batch = []
+        names = []  # The file names of each configuration
+        # For all the translated configurations, in their order
+        for index, final_files in enumerate(final_confs):
+            files = self.configuration_files(index, final_files)
+            batch += files
+            names.append([file_name for file_name, _ in files])
+        failed = set(self.write_batch(batch))
+
+        # Return the number of final configurations written
+        return len([files for files in names if failed.isdisjoint(files)])
+
+    ''' This method writes the final files of the configuration with the
+        given index. It returns False if some file has been skipped because
+        of an I/O error
+    '''
+    def write_configuration(self, index, final_files):
+        return not self.write_batch(self.configuration_files(index,
+                                                             final_files))
+
+    ''' This method returns the final files of the configuration with the
+        given index, as tuples (file name, content)
+    '''
+    def configuration_files(self, index, final_files):
+        # The complete file name structure is
+        # ../final/fw<index>.<targe_language>
+        prefix = self.final_directory() + "fw" + str(index)
+        return [(prefix + suffix, final_files[suffix])
+                for suffix in sorted(final_files)]
+
+    ''' This method writes a batch of final files, given as tuples (file
+        name, content), in the generation being written if any: it hashes
+        them for its manifest, and none of them is flushed, since a
+        generation is flushed to disk all at once (see output_generation.py).
+        If an IOError occurs, the file is skipped. It returns the names of
+        the files skipped
+    '''
+    def write_batch(self, files):
+        if self.generation is not None:
+            failed = self.generation.write(files)
+        else:
+            failed = output_generation.write_batch(files)
+        for file_name in failed:
+            print("ERR: Skipping output file %s because of an I/O error"
+                  % file_name)
+        return failed
+
+    ''' This method reads, translates and writes the configurations one at a
+        time, so that the memory used does not depend on the number of
+        firewalls: each file of intermediate representation is read line by
+        line (see read_lines) and its final configuration is written while it
+        is being translated (see translate_fragments). The final files keep
+        the index of their intermediate representation.
+        With more than one job, each worker process streams its own files.
+        It returns the number of final configurations written to disk
+    '''
+    def compile_stream(self, jobs=1):
+        if jobs == 0:  # As many workers as the available cores
+            jobs = multiprocessing.cpu_count()
+        if self.conf_list is None:
+            tasks = ((file_name, index)
+                     for index, file_name in enumerate(self.config_files()))
+        else:
+            tasks = ((None, index, conf)
+                     for index, conf in enumerate(self.conf_list))
+
+        if jobs <= 1:
+            return len([task for task in tasks if self.stream_file(*task)])
+
+        pool = multiprocessing.Pool(jobs, init_worker, (self,))
+        try:
+            n = 0
+            for written, warnings in pool.imap(stream_worker, tasks):
+                for message in warnings:
+                    self.warn_once(message)
+                if written:
+                    n += 1
+            return n
+        except TranslationAborted as _:
+            pool.terminate()
+            exit(-1)
+        finally:
+            pool.close()
+            pool.join()
+
+    ''' This method translates the file of intermediate representation
+        file_name while reading it, and writes the final files of the
+        configuration with the given index in the ../final folder while
+        translating it. If conf is given, it is the intermediate
+        representation itself (see conf_list) and no file is read.
+        It returns False if the configuration has not been written because
+        of an I/O error
+    '''
+    def stream_file(self, file_name, index, conf=None):
+        in_stream = None
+        lines = conf
+        if conf is None:
             try:
-                # Create a new file and write the final configuration in it
-                out_stream = open(file_name, "w")
-                out_stream.write(final_conf)
-                out_stream.flush()
-                out_stream.close()
-                n += 1
+                in_stream = open(file_name, "r")
             except IOError as _:
-                # If something goes wrong, skip the file and continue with
-                # the next
-                print("ERR: Skipping output file %s because of an I/O error"
+                print("ERR: Skipping input file %s since it isn't readable"
                       % file_name)
-                continue
+                return False
+            lines = read_lines(in_stream)
 
-        # Return the number of final configurations written
-        return n
+        prefix = self.final_directory() + "fw" + str(index)
+        try:
+            out_name = prefix + self.suffix()
+            out_stream = open(out_name, "w")
+            for fragment in self.translate_fragments(lines):
+                out_stream.write(fragment)
+            out_stream.close()
+            companion_files = self.companion_files()
+            for suffix in sorted(companion_files):
+                out_name = prefix + suffix
+                out_stream = open(out_name, "w")
+                out_stream.write(companion_files[suffix])
+                out_stream.close()
+        except IOError as _:
+            print("ERR: Skipping output file %s because of an I/O error"
+                  % out_name)
+            return False
+        finally:
+            if in_stream is not None:
+                in_stream.close()
+        return True
+
+    ''' This method translates all the configurations in conf_list and yields
+        the final files of each configuration (see translate_files) in the
+        same order.
+        When more than one job is requested, the configurations are translated
+        by a pool of worker processes, each of them with its own copy of the
+        engine: translations are independent, so the result is the same of the
+        sequential case.
+        If capture is True, the final files of each configuration come with
+        the messages printed while translating it (see translate_captured).
+    '''
+    def translate_all(self, conf_list, jobs=1, capture=False):
+        if jobs == 0:  # As many workers as the available cores
+            jobs = multiprocessing.cpu_count()
+        # No need to start workers that would not have anything to do
+        jobs = min(jobs, len(conf_list))
+
+        if jobs <= 1:  # Sequential translation
+            for conf in conf_list:
+                if capture:
+                    yield self.translate_captured(conf)
+                else:
+                    yield self.translate_files(conf)
+            return
+
+        pool = multiprocessing.Pool(jobs, init_worker, (self,))
+        try:
+            # imap keeps the order of conf_list, so the results can be written
+            # while the other configurations are still being translated
+            for final_files, warnings in pool.imap(
+                    capture_worker if capture else translate_worker,
+                    conf_list):
+                # The warnings of the workers are printed only once
+                for message in warnings:
+                    self.warn_once(message)
+                yield final_files
+        except TranslationAborted as _:
+            # A configuration could not be translated: the error has already
+            # been printed by the worker
+            pool.terminate()
+            exit(-1)
+        finally:
+            pool.close()
+            pool.join()
+
+    ''' This method returns the signature of the engine: a string that changes
+        whenever the same configuration could be translated differently, i.e.
+        when the engine, its version or its source code (see engine_modules)
+        change. Engines with options that change the translation must add
+        them to the signature
+    '''
+    def signature(self):
+        engine_class = type(self)
+        if engine_class not in signatures:
+            # The source code of all the modules the engine is made of
+            digest = hashlib.sha256()
+            for module in engine_modules(engine_class):
+                file_name = getattr(sys.modules.get(module), "__file__", None)
+                if file_name is None:  # Built-in module
+                    continue
+                if file_name.endswith(".pyc"):
+                    file_name = file_name[:-1]
+                try:
+                    in_stream = open(file_name, "rb")
+                    digest.update(in_stream.read())
+                    in_stream.close()
+                except IOError as _:
+                    digest.update(module.encode("utf-8"))
+            signatures[engine_class] = "%s %s %s" % (engine_class.__name__,
+                                                     self.VERSION,
+                                                     digest.hexdigest())
+
+        if self.summarize:
+            return signatures[engine_class] + " summarize"
+        return signatures[engine_class]
+
+    ''' The folder the final files are written in: ../final (or the generation
+        of it being written), or a sub-folder of it when several target
+        languages are compiled together (see target_compiler.compile_targets)
+    '''
+    def final_directory(self):
+        return self.output_dir + self.final_subdir
+
+    ''' The suffix of the final configuration files, i.e. .<target_language> '''
+    def suffix(self):
+        return "." + self.language
+
+    ''' This method translates a configuration into all the files of the
+        final configuration. It returns a dictionary that maps the suffix of
+        each file to its content: the final configuration itself (see
+        translate) has the suffix returned by the suffix method, the others
+        are its companion files (see companion_files)
+    '''
+    def translate_files(self, configuration):
+        final_files = {self.suffix(): self.translate(configuration)}
+        final_files.update(self.companion_files())
+        return final_files
+
+    ''' This method works as translate_files, but it returns a tuple made of
+        the final files and of the messages printed while translating them:
+        a dictionary with the lines printed ("printed") and the warnings
+        given to warn_once ("once"). The messages are still printed as usual
+    '''
+    def translate_captured(self, configuration):
+        capture = Capture(sys.stdout)
+        self.captured = []
+        sys.stdout = capture
+        try:
+            final_files = self.translate_files(configuration)
+        finally:
+            sys.stdout = capture.stream
+            once = self.captured
+            self.captured = None
+        once_lines = set(line for message in once
+                         for line in message.splitlines())
+        printed = [line for line in capture.lines()
+                   if line not in once_lines]
+        return (final_files, {"printed": printed, "once": once})
+
+    ''' This method prints again the messages of a translation, as returned by
+        translate_captured: the warnings of warn_once are still printed only
+        once
+    '''
+    def print_captured(self, messages):
+        for line in messages["printed"]:
+            print(line)
+        for message in messages["once"]:
+            self.warn_once(message)
+
+    ''' This method returns the companion files of the configuration
+        translated last, as a dictionary that maps their suffix to their
+        content. Engines that need companion files (e.g. definitions that must
+        be loaded before the final configuration) override this method
+    '''
+    def companion_files(self):
+        return {}
+
+    ''' This method prints a warning only the first time it is given to the
+        engine. In a worker process the warning is sent to the parent
+        process instead (see worker_warnings), so that it is printed once
+        whatever the number of jobs
+    '''
+    def warn_once(self, message):
+        if self.captured is not None:
+            self.captured.append(message)
+        if message in self.warned:
+            return
+        self.warned.add(message)
+        if worker_engine is None:
+            print(message)
+        else:
+            worker_warnings.append(message)
+
+    ''' This method yields the records of a configuration, or the runs of
+        records of ir_model.runs, one at a time. When the translation is
+        profiled (see opcode_times), the time the caller spends on each of
+        them, until it asks for the next one, is added to the command of its
+        records: the records of a run, translated together, share it evenly
+    '''
+    def timed(self, items):
+        if self.opcode_times is None:
+            for item in items:
+                yield item
+            return
+        for item in items:
+            records = item[1] if isinstance(item, tuple) else [item]
+            start = time.time()
+            yield item
+            seconds = (time.time() - start) / len(records)
+            for record in records:
+                entry = self.opcode_times.setdefault(record.command,
+                                                     [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
 
+    ''' This method yields the fragments of the final configuration: all
+        together they are the result of translate. Engines that build their
+        final configuration piece by piece override this method, so that the
+        final configuration is written while it is being translated (see
+        compile_stream) and it is never in memory as a whole
+    '''
+    def translate_fragments(self, configuration):
+        yield self.translate(configuration)
+
+    ''' This method yields the names of the files written in the intermediate
+        mignis representation, in the order of their index, until a file does
+        not exist (see read_files). Nothing is read
+    '''
+    def config_files(self):
+        prefix = self.directory + "compiled/fw"
+        for i in itertools.count():
+            file_name = prefix + str(i) + ".config"
+            if not os.path.isfile(file_name):
+                return
+            yield file_name
 
     ''' This method is used to read all the configuration files
         written in the intermediate mignis representation.
@@ -88,6 +666,12 @@ class GenericEngine:
         If a file does not exist, the procedure terminates
     '''
     def read_files(self):
+        if self.conf_list is not None:
+            # Compiled in memory by the frontend: there are no files
+            print("\nINF: Successfully received %d configurations\n"
+                  % len(self.conf_list))
+            return list(self.conf_list)
+
         # The complete file name structure is ../compiled/fw<index>.config
         prefix = self.directory + "compiled/fw"
         suffix = ".config"
@@ -123,6 +707,38 @@ class GenericEngine:
         print("\nINF: Successfully read %d files\n" % total)
         return conf_list
 
+    ''' This method is used to parse a whole configuration into the model of
+        ir_model.py: engines should always work on it rather than on the raw
+        lines. A configuration that has already been parsed is returned as it
+        is, so that it can be shared by several engines.
+        If summarize is set, the addresses of the configuration are summarized
+        (see address_summarizer.py) and the number of rules before and after
+        the summarization is reported
+    '''
+    def parse_configuration(self, configuration):
+        if not isinstance(configuration, ir_model.Configuration):
+            configuration = ir_model.parse_configuration(configuration)
+        if self.summarize:
+            summarizer = AddressSummarizer()
+            configuration = summarizer.summarize(configuration)
+            print("INF: %s: addresses summarized, %d rules -> %d"
+                  % (self.language, summarizer.rules_before,
+                     summarizer.rules_after))
+        return configuration
+
+    ''' This method builds the symbol table of a parsed configuration: all
+        the interfaces are bound to their networks. The table becomes the
+        symbols of the engine and it is returned. It must be called at the
+        beginning of each translation, so that nothing is inherited from the
+        configurations translated before
+    '''
+    def build_symbol_table(self, configuration):
+        self.symbols = SymbolTable()
+        for record in configuration.records:
+            if record.command == self.BIND:
+                self.symbols.bind(record.interface, record.network)
+        return self.symbols
+
     ''' This method is used to parse a line. A line is made of a string
         (of 4 chars), a colon and then another string made of a sequence of
         string separated by a semicolon. It returns a tuple of two elements:
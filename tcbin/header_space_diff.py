@@ -0,0 +1,872 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This module compares two versions of a firewall and finds exactly which
+    packets changed verdict or NAT, without sampling: it is meant to be run
+    before deploying a change.
+    The firewalls are final configurations of NetfilterEngine (the filter,
+    mangle and nat tables, as written for iptables-restore) or files written
+    in intermediate representation, that are translated by NetfilterEngine
+    first. The tables are walked as in the kernel (see netfilter_simulator.py)
+    but, instead of single packets, boxes of the header space are walked: a
+    box is a range of values for each field of a packet (input and output
+    interface, protocol, connection state, source and destination address and
+    port). The jumps to user chains are flattened, so that each hook is a
+    list of boxes with their action: a RETURN (or the end of a chain reached
+    through a goto) becomes a skip to the end of the chain.
+    The header space is split into equivalence classes by interval
+    partitioning: the ranges of a field are cut at the bounds of all the
+    rules of both versions that overlap the box, one field after the other,
+    and adjacent pieces overlapped by the same rules are kept together. At
+    the end each rule either covers a class or does not overlap it, so the
+    class has a single verdict. The classes rewritten by a NAT rule walk the
+    following hooks with the rewritten fields. Rules after the first rule that
+    covers the whole box are ignored, and a box where the old and the new
+    rules are the same (and so are the hooks that follow) is not split at all,
+    so the work grows with the size of the change, not with the size of the
+    firewalls. The classes that a hook leaves as they are walk the following
+    hooks together, instead of one by one. NumPy is used, if it is
+    installed, to find the rules that overlap a box in big firewalls.
+    Rules with options that are not understood (e.g. the formulas of Mignis+)
+    never match, as in the simulator.
+    Usage: ./header_space_diff.py <old> <new>
+    The ipsets of a final configuration fw<index>.iptables are read from
+    fw<index>.ipset, if it exists. The exit status is 1 if some classes
+    differ, so that the diff can be used as a gate.
+'''
+
+import bisect
+import difflib
+import itertools
+import os
+import sys
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional: the diff is just slower
+    numpy = None
+
+import cidr
+import netfilter_delta
+from netfilter_engine import NetfilterEngine
+from netfilter_simulator import Rule, ACTIONS, FORWARDED, INCOMING, \
+    OUTGOING, MAX_DEPTH, PROTOCOLS, STATES, NEW, parse_ipsets
+
+
+USAGE = "Usage: ./header_space_diff.py <old> <new>"
+
+# The fields of a box, in the order they are split: the interfaces first,
+# since most rules are bound to them
+DIMENSIONS = ("iif", "oif", "proto", "state", "src", "dst", "sport", "dport")
+IIF, OIF, PROTO, STATE, SRC, DST, SPORT, DPORT = range(len(DIMENSIONS))
+# No interface (e.g. the input interface of a packet sent by the firewall).
+# The interfaces of the rules are numbered from 1 and the last number is
+# any other interface
+NO_INTERFACE = 0
+# The paths of the packets, by name
+PATHS = (("forwarded", FORWARDED), ("incoming", INCOMING),
+         ("outgoing", OUTGOING))
+
+# The buckets of entries (see Program) are checked with NumPy only if they
+# have at least this many entries: for fewer entries plain Python is faster
+VECTOR_MIN = 64
+# The options of the interfaces
+INTERFACE_OPTIONS = ("-i", "--in-interface", "-o", "--out-interface")
+# The kind of the entries that skip to another entry (see Program)
+SKIP = "SKIP"
+# The verdicts that end the walk of a packet
+DENY = ("DROP", "REJECT")
+ACCEPT = "ACCEPT"
+
+
+''' This function returns the intersection of two boxes (tuples of ranges),
+    None if they do not overlap
+'''
+def intersection(a, b):
+    box = []
+    for (low_a, high_a), (low_b, high_b) in zip(a, b):
+        low = max(low_a, low_b)
+        high = min(high_a, high_b)
+        if low > high:
+            return None
+        box.append((low, high))
+    return tuple(box)
+
+
+''' This function returns True if two boxes overlap. Only the fields of the
+    shorter box are checked
+'''
+def overlap(a, b):
+    for (low_a, high_a), (low_b, high_b) in zip(a, b):
+        if low_a > high_b or low_b > high_a:
+            return False
+    return True
+
+
+''' This function returns True if the box a contains the box b in the fields
+    from start onwards
+'''
+def covers(a, b, start=0):
+    for i in range(start, len(DIMENSIONS)):
+        if a[i][0] > b[i][0] or a[i][1] < b[i][1]:
+            return False
+    return True
+
+
+''' This function groups sorted integers into ranges of consecutive values '''
+def runs(values):
+    ranges = []
+    for value in values:
+        if ranges and ranges[-1][1] + 1 == value:
+            ranges[-1] = (ranges[-1][0], value)
+        else:
+            ranges.append((value, value))
+    return ranges
+
+
+''' This class is a hook (a built-in chain of a table) flattened into a list
+    of entries, in the order they are walked: the box matched by the entry,
+    its kind (the target: ACCEPT, DROP, REJECT, DNAT, SNAT, MASQUERADE or
+    SKIP), its argument (the rewrite of DNAT and SNAT, the index of the entry
+    to skip to) and its rule. Each entry has a key too: equal entries of
+    different programs share the same key
+'''
+class Program(object):
+
+    ''' Constructor: an empty program with the given policy '''
+    def __init__(self, policy):
+        self.policy = policy
+        self.boxes = []
+        self.kinds = []
+        self.args = []
+        self.rules = []
+        self.keys = []
+        # The indexes of the entries by their interfaces and protocol
+        self.buckets = {}
+        self.index = None  # See make_index
+        self.arrays = None
+
+    ''' This method appends an entry and returns its index '''
+    def add(self, box, kind, arg, rule):
+        self.boxes.append(box)
+        self.kinds.append(kind)
+        self.args.append(arg)
+        self.rules.append(rule)
+        self.buckets.setdefault(box[:STATE], []).append(len(self.boxes) - 1)
+        return len(self.boxes) - 1
+
+    ''' This method sets the keys of the entries, using (and filling) the
+        dictionary of the keys already given
+    '''
+    def make_keys(self, keys):
+        for box, kind, arg in zip(self.boxes, self.kinds, self.args):
+            key = (box, kind, None if kind == SKIP else arg)
+            self.keys.append(keys.setdefault(key, len(keys)))
+
+    ''' This method indexes the entries of each bucket by source and by
+        destination address: the entries are grouped by the size of their
+        range of addresses (its number of bits), and each group is sorted by
+        the first address of the range. The entries of a group that overlap
+        a range of addresses are then found by bisection.
+        When NumPy is available, the ranges of the big buckets are kept in
+        arrays too, so that all their entries are checked at once
+    '''
+    def make_index(self):
+        self.index = {}
+        self.arrays = {}
+        for key, indexes in self.buckets.items():
+            if numpy is not None and len(indexes) >= VECTOR_MIN:
+                ranges = numpy.array([self.boxes[i][STATE:] for i in indexes],
+                                     dtype=numpy.int64)
+                self.arrays[key] = (numpy.array(indexes), ranges[:, :, 0],
+                                    ranges[:, :, 1])
+            self.index[key] = {}
+            for d in (SRC, DST):
+                groups = {}
+                for i in indexes:
+                    low, high = self.boxes[i][d]
+                    groups.setdefault((high - low).bit_length(), []).append(
+                        (low, i))
+                self.index[key][d] = []
+                for bits, group in groups.items():
+                    group.sort()
+                    self.index[key][d].append(
+                        (1 << bits, [low for low, _ in group],
+                         [i for _, i in group]))
+
+    ''' This method returns the entries that overlap box, for packets whose
+        fields have been rewritten by NAT (see State.rewritten), as a
+        dictionary that maps their indexes to their boxes as seen by the
+        packets (see rewrite)
+    '''
+    def overlapping(self, box, fields):
+        if self.index is None:
+            self.make_index()
+        # The narrowest address that is not rewritten is looked up
+        dimensions = [d for d in (SRC, DST) if d not in fields]
+        dimensions.sort(key=lambda d: box[d][1] - box[d][0])
+        state, src, dst, sport, dport = box[STATE:]
+        entries = {}
+        if numpy is not None:
+            lows = numpy.array([low for low, _ in box[STATE:]])
+            highs = numpy.array([high for _, high in box[STATE:]])
+        for key, indexes in self.buckets.items():
+            if key[IIF][0] > box[IIF][1] or key[IIF][1] < box[IIF][0] or \
+                    key[OIF][0] > box[OIF][1] or key[OIF][1] < box[OIF][0] \
+                    or key[PROTO][0] > box[PROTO][1] or \
+                    key[PROTO][1] < box[PROTO][0]:
+                continue
+            if key in self.arrays and not fields:
+                indexes, first, last = self.arrays[key]
+                for i in indexes[(first <= highs).all(1) &
+                                 (last >= lows).all(1)].tolist():
+                    entries[i] = self.boxes[i]
+                continue
+            if dimensions:
+                low, high = box[dimensions[0]]
+                indexes = [group[k] for size, lows, group
+                           in self.index[key][dimensions[0]]
+                           for k in range(
+                               bisect.bisect_left(lows, low - size + 1),
+                               bisect.bisect_right(lows, high))]
+            if fields:
+                for i in indexes:
+                    entry = rewrite(self.boxes[i], fields, box)
+                    if entry is not None:
+                        entries[i] = entry
+                continue
+            # The interfaces and the protocol match already (see the key)
+            for i in indexes:
+                entry = self.boxes[i]
+                if entry[SRC][0] <= src[1] and entry[SRC][1] >= src[0] and \
+                        entry[DST][0] <= dst[1] and entry[DST][1] >= dst[0] \
+                        and entry[DPORT][0] <= dport[1] and \
+                        entry[DPORT][1] >= dport[0] and \
+                        entry[SPORT][0] <= sport[1] and \
+                        entry[SPORT][1] >= sport[0] and \
+                        entry[STATE][0] <= state[1] and \
+                        entry[STATE][1] >= state[0]:
+                    entries[i] = entry
+        return entries
+
+    ''' This method walks the given entries (sorted indexes of entries that
+        cover a class) as a packet of the class would and returns the index
+        of the entry that ends the walk, None if the packet reaches the end
+    '''
+    def walk(self, entries):
+        position = 0
+        for i in entries:
+            if i < position:
+                continue
+            if self.kinds[i] != SKIP:
+                return i
+            position = self.args[i]
+        return None
+
+
+''' This class is the symbolic model of a final configuration of
+    NetfilterEngine: a Program for each hook
+'''
+class Firewall(object):
+
+    ''' Constructor. text is the final configuration, ipsets the content of
+        its ipset file and interfaces the sorted names of all the interfaces
+        of the compared firewalls. keys is shared by the compared firewalls
+        (see Program.make_keys). A ValueError is raised if the ruleset cannot
+        be loaded
+    '''
+    def __init__(self, text, ipsets, interfaces, keys):
+        ruleset = netfilter_delta.load(text)
+        sets = parse_ipsets(ipsets)
+        self.interfaces = interfaces
+        self.full = ((NO_INTERFACE, len(interfaces) + 1),
+                     (NO_INTERFACE, len(interfaces) + 1),
+                     (0, 255), (0, len(STATES) - 1),
+                     (0, cidr.ALL_ONES), (0, cidr.ALL_ONES),
+                     (0, 65535), (0, 65535))
+        self.chains = {}
+        self.unknown = 0  # Rules with options that are not understood
+        for table in ruleset.names:
+            for chain in ruleset.tables[table].chains:
+                self.chains[(table, chain)] = [
+                    Rule(i, table, chain, rule, self.interface, sets)
+                    for i, rule in enumerate(ruleset.tables[table]
+                                             .rules[chain])]
+                self.unknown += len([rule for rule
+                                     in self.chains[(table, chain)]
+                                     if not rule.known])
+
+        self.programs = {}
+        for _, path in PATHS:
+            for table, chain in path:
+                if (table, chain) in self.programs:
+                    continue
+                policy = ruleset.tables[table].policies.get(chain, ACCEPT) \
+                    if table in ruleset.tables else ACCEPT
+                program = Program(policy)
+                context = self.full
+                if table == "nat":  # Only new connections are NATted
+                    context = context[:STATE] + ((NEW, NEW),) + \
+                        context[STATE + 1:]
+                for i in self.flatten(program, table, chain, context, 0):
+                    program.args[i] = len(program.boxes)
+                program.make_keys(keys)
+                self.programs[(table, chain)] = program
+
+    ''' This method returns the numbers of the interfaces matched by a name
+        of iptables ("eth+" matches all the interfaces starting with "eth")
+    '''
+    def interface(self, name):
+        if name.endswith("+"):
+            return [i + 1 for i, interface in enumerate(self.interfaces)
+                    if interface.startswith(name[:-1])]
+        return [self.interfaces.index(name) + 1]
+
+    ''' This method appends the entries of a chain to the program, within the
+        box context, and returns the indexes of the entries that skip to the
+        end of the chain (the caller sets where they skip to)
+    '''
+    def flatten(self, program, table, chain, context, depth):
+        if depth > MAX_DEPTH:
+            raise ValueError("too many nested chains in %s" % chain)
+        returns = []
+        for rule in self.chains[(table, chain)]:
+            target = rule.target
+            if not rule.known or (target not in ACTIONS and
+                                  (table, target) not in self.chains):
+                continue  # LOG rules, unknown rules
+            for box in self.boxes(rule):
+                box = intersection(box, context)
+                if box is None:
+                    continue
+                if target == "RETURN":
+                    returns.append(program.add(box, SKIP, None, rule))
+                elif target not in ACTIONS:
+                    # Back here at the end of the called chain
+                    for i in self.flatten(program, table, target, box,
+                                          depth + 1):
+                        program.args[i] = len(program.boxes)
+                    if rule.goto:  # ...and then back to the caller
+                        returns.append(program.add(box, SKIP, None, rule))
+                else:
+                    program.add(box, target, rule.nat, rule)
+        return returns
+
+    ''' This method returns the boxes matched by a rule: a rule matches more
+        than one box if it has a list of ports or of states, or an ipset
+    '''
+    def boxes(self, rule):
+        ranges = {}
+        for kind, field, arguments in rule.checks:
+            if kind == "network":
+                address, mask = arguments
+                alternatives = [(address, address | (~mask & cidr.ALL_ONES))]
+            elif kind == "in":
+                alternatives = runs(sorted(set(arguments)))
+            elif kind == "ports":
+                alternatives = arguments
+            else:  # ipset
+                alternatives = [cidr.network_range(network)
+                                for network in arguments]
+            dimension = DIMENSIONS.index(field)
+            if dimension in ranges:  # The same field is checked twice
+                alternatives = [(max(a[0], b[0]), min(a[1], b[1]))
+                                for a in ranges[dimension]
+                                for b in alternatives
+                                if max(a[0], b[0]) <= min(a[1], b[1])]
+            ranges[dimension] = alternatives
+        return itertools.product(*[ranges.get(i, [self.full[i]])
+                                   for i in range(len(DIMENSIONS))])
+
+
+''' This class is the state of a class of packets, in one of the compared
+    firewalls, after some hooks: the verdict (None while the packets are
+    still walking), the rule that decided it (the rule that dropped or
+    rejected the packets, or the filter rule that accepted them; None for a
+    policy) and the NAT rewrites, as tuples (target, (address, port)), with
+    the rules that made them
+'''
+class State(object):
+    __slots__ = ("verdict", "rule", "nat", "nat_rules")
+
+    ''' Constructor '''
+    def __init__(self, verdict=None, rule=None, nat=(), nat_rules=()):
+        self.verdict = verdict
+        self.rule = rule
+        self.nat = nat
+        self.nat_rules = nat_rules
+
+    ''' The result of the packets of box, the rules aside: the verdict and the
+        addresses and ports of the packets once rewritten. The fields that
+        the NAT rules do not set are the ones of box (e.g. the port kept by
+        a DNAT without port), so the same rewrite compares equal however the
+        rules are written. The NAT of dropped packets does not matter
+    '''
+    def key(self, box):
+        if self.verdict in DENY:
+            return (self.verdict, ())
+        fields = self.rewritten()
+        return (self.verdict,
+                tuple((fields[i], fields[i]) if i in fields else box[i]
+                      for i in (SRC, DST, SPORT, DPORT)),
+                tuple(nat for nat in self.nat
+                      if nat[0] == "MASQUERADE" or nat[1] is None))
+
+    ''' The fields rewritten by the NAT rules, as a dictionary that maps the
+        index of the field to its new value
+    '''
+    def rewritten(self):
+        fields = {}
+        for target, arguments in self.nat:
+            if target == "MASQUERADE" or arguments is None:
+                continue
+            address, port = arguments
+            fields[DST if target == "DNAT" else SRC] = address
+            if port is not None:
+                fields[DPORT if target == "DNAT" else SPORT] = port
+        return fields
+
+    ''' This method returns the state after the entry of a program (index i,
+        None for the policy) has been reached in hook
+    '''
+    def advance(self, program, i, hook):
+        if i is None:
+            if program.policy in DENY:
+                return State(program.policy, None, self.nat, self.nat_rules)
+            return self
+        kind = program.kinds[i]
+        rule = program.rules[i]
+        if kind in DENY:
+            return State(kind, rule, self.nat, self.nat_rules)
+        elif kind == ACCEPT:
+            if hook[0] == "filter":
+                return State(None, rule, self.nat, self.nat_rules)
+            return self
+        return State(None, self.rule, self.nat + ((kind, program.args[i]),),
+                     self.nat_rules + (rule,))
+
+
+''' This class is a class of packets whose result differs: its path, its box
+    and its old and new State
+'''
+class Difference(object):
+    __slots__ = ("path", "box", "old", "new")
+
+    ''' Constructor '''
+    def __init__(self, path, box, old, new):
+        self.path = path
+        self.box = box
+        self.old = old
+        self.new = new
+
+    ''' The fields, but the box, that must be equal to merge two differences
+    '''
+    def key(self):
+        return (self.path, self.old.verdict, self.new.verdict, self.old.rule,
+                self.new.rule, self.old.nat_rules, self.new.nat_rules)
+
+
+''' This class compares two firewalls (see Firewall). The differences are
+    found by run
+'''
+class HeaderSpaceDiff(object):
+
+    ''' Constructor. The firewalls are given as final configurations and
+        ipsets. A ValueError is raised if a ruleset cannot be loaded
+    '''
+    def __init__(self, old, old_ipsets, new, new_ipsets):
+        # The interfaces are numbered in order of name, so that the ones
+        # matched by a name with a wildcard ("eth+") are a range
+        names = set()
+        for text in (old, new):
+            words = text.split()
+            names.update(words[i + 1] for i in range(len(words) - 1)
+                         if words[i] in INTERFACE_OPTIONS)
+        self.interfaces = sorted(name for name in names
+                                 if not name.endswith("+"))
+        keys = {}
+        self.old = Firewall(old, old_ipsets, self.interfaces, keys)
+        self.new = Firewall(new, new_ipsets, self.interfaces, keys)
+
+    ''' This method returns the list of the classes of packets whose verdict
+        or NAT differs, as Difference objects
+    '''
+    def run(self):
+        differences = []
+        full = self.old.full
+        last = full[IIF][1]
+        for name, path in PATHS:
+            # The boxes where the packets may find a difference, from each
+            # hook onwards. The packets rewritten by a NAT entry may find it
+            # in the hooks that follow, so the entry is part of the region
+            # too
+            regions = [[]]
+            for hook in reversed(path):
+                old = self.old.programs[hook]
+                new = self.new.programs[hook]
+                regions.insert(0, changed_boxes(old, new, full) +
+                               nat_boxes(old, regions[0]) +
+                               nat_boxes(new, regions[0]) + regions[0])
+            if name == "forwarded":
+                interfaces = ((1, last), (1, last))
+            elif name == "incoming":
+                interfaces = ((1, last), (NO_INTERFACE, NO_INTERFACE))
+            else:
+                interfaces = ((NO_INTERFACE, NO_INTERFACE), (1, last))
+            self.explore(name, path, regions, interfaces + full[PROTO:], 0,
+                         State(), State(), differences)
+        return merge(differences)
+
+    ''' This method walks a box through the hooks of path, from the hook at
+        index h, and appends the classes whose result differs to differences
+    '''
+    def explore(self, name, path, regions, box, h, old, new, differences,
+                excluded=()):
+        region = None
+        if old.key(box) == new.key(box):
+            fields = old.rewritten()
+            region = [entry for entry in regions[h]
+                      if rewrite(entry, fields, box) is not None]
+            if not region:
+                return  # Nothing can differ
+        if old.verdict is not None and new.verdict is not None:
+            h = len(path)  # No hook can change the results
+        if h == len(path):
+            if region is None:
+                differences.append(Difference(name, box, old, new))
+            return
+
+        hook = path[h]
+        sides = []
+        for firewall, state in ((self.old, old), (self.new, new)):
+            program = firewall.programs[hook]
+            if state.verdict is None:
+                boxes = program.overlapping(box, state.rewritten())
+            else:
+                boxes = {}  # The packets do not walk the hook
+            sides.append((program, boxes))
+        (old_program, old_boxes), (new_program, new_boxes) = sides
+        partitioner = Partitioner(old_program, old_boxes, new_program,
+                                  new_boxes)
+        excluded = [entry for entry in excluded if overlap(entry, box)]
+        walked = []
+        passed = False
+        for leaf, old_entries, new_entries in partitioner.split(
+                box, sorted(old_boxes), sorted(new_boxes), region, excluded):
+            if old.verdict is None:
+                old_state = old.advance(old_program, old_program.walk(
+                    old_entries), hook)
+            else:
+                old_state = old
+            if new.verdict is None:
+                new_state = new.advance(new_program, new_program.walk(
+                    new_entries), hook)
+            else:
+                new_state = new
+            if old_state is old and new_state is new and h + 1 < len(path):
+                passed = True
+                continue
+            walked.append(leaf)
+            self.explore(name, path, regions, leaf, h + 1, old_state,
+                         new_state, differences)
+        if passed:
+            # The classes that the hook leaves as they are walk the next hooks
+            # together, as the box without the classes walked apart
+            self.explore(name, path, regions, box, h + 1, old, new,
+                         differences, excluded + walked)
+
+
+''' This function returns the boxes of the entries that differ between two
+    programs: the entries are aligned as two sequences, so the entries that
+    are only moved are found as well. If the policies differ, the whole
+    header space (full) differs
+'''
+def changed_boxes(old, new, full):
+    if old.policy != new.policy:
+        return [full]
+    boxes = []
+    matcher = difflib.SequenceMatcher(None, old.keys, new.keys, False)
+    for tag, old_start, old_stop, new_start, new_stop in \
+            matcher.get_opcodes():
+        if tag != "equal":
+            boxes += old.boxes[old_start:old_stop]
+            boxes += new.boxes[new_start:new_stop]
+    return boxes
+
+
+''' This function returns the boxes of the NAT entries of a program that
+    rewrite packets into a box of region
+'''
+def nat_boxes(program, region):
+    boxes = []
+    for box, kind, arguments in zip(program.boxes, program.kinds,
+                                    program.args):
+        if kind not in ("DNAT", "SNAT") or arguments is None:
+            continue
+        fields = State(None, None, ((kind, arguments),)).rewritten()
+        for entry in region:
+            image = list(box)
+            for i, value in fields.items():
+                image[i] = (value, value)
+            if overlap(entry, image):
+                boxes.append(box)
+                break
+    return boxes
+
+
+''' This function returns a box (of an entry of a program, or of a region)
+    as seen by the packets of box whose fields have been rewritten by NAT
+    (see State.rewritten), None if it does not overlap box. The rewritten
+    fields have a single value, so the box either contains it (and the field
+    is not checked any longer) or never matches
+'''
+def rewrite(entry, fields, box):
+    if fields:
+        entry = list(entry)
+        for i, value in fields.items():
+            if entry[i][0] <= value <= entry[i][1]:
+                entry[i] = box[i]
+            else:
+                return None
+        entry = tuple(entry)
+    return entry if overlap(entry, box) else None
+
+
+''' This class splits a box into classes, given the entries of the old and
+    the new program that overlap it: each class is covered by a sub-list of
+    those entries and does not overlap the other ones
+'''
+class Partitioner(object):
+
+    ''' Constructor. old_boxes and new_boxes map the indexes of the entries
+        of the programs that overlap the box to split to their boxes (see
+        Program.overlapping)
+    '''
+    def __init__(self, old, old_boxes, new, new_boxes):
+        self.old = old
+        self.old_boxes = old_boxes
+        self.new = new
+        self.new_boxes = new_boxes
+
+    ''' This method yields the classes of box, from field d onwards, as tuples
+        (box, old entries, new entries). If a region (a list of boxes) is
+        given, the boxes that do not overlap it are dropped: their classes
+        cannot differ. The classes inside the excluded boxes are dropped too
+    '''
+    def split(self, box, old_entries, new_entries, region, excluded, d=0):
+        if region is not None and d > 0:
+            # Only the field d - 1 has been split
+            low, high = box[d - 1]
+            region = [entry for entry in region
+                      if entry[d - 1][0] <= high and entry[d - 1][1] >= low]
+            if not region:
+                return
+        for entry in excluded:
+            if covers(entry, box, d):
+                return
+        old_entries = self.cut(self.old, self.old_boxes, old_entries, box, d)
+        new_entries = self.cut(self.new, self.new_boxes, new_entries, box, d)
+        if d == len(DIMENSIONS):
+            yield (box, old_entries, new_entries)
+            return
+
+        low, high = box[d]
+        bounds = set([low, high + 1])
+        sides = ([self.old_boxes[i] for i in old_entries],
+                 [self.new_boxes[i] for i in new_entries], excluded)
+        for boxes in sides:
+            for entry in boxes:
+                first, last = entry[d]
+                if first > low:
+                    bounds.add(first)
+                if last < high:
+                    bounds.add(last + 1)
+        if len(bounds) == 2:  # Every entry covers the whole range
+            for leaf in self.split(box, old_entries, new_entries, region,
+                                   excluded, d + 1):
+                yield leaf
+            return
+
+        bounds = sorted(bounds)
+        index = dict((bound, k) for k, bound in enumerate(bounds))
+        pieces = [([], [], []) for _ in range(len(bounds) - 1)]
+        for side, (entries, boxes) in enumerate(
+                zip((old_entries, new_entries, excluded), sides)):
+            for i, entry in zip(entries, boxes):
+                first, last = entry[d]
+                for k in range(index[max(first, low)],
+                               index[min(last, high) + 1]):
+                    pieces[k][side].append(i)
+
+        # Adjacent pieces overlapped by the same entries are kept together
+        start = 0
+        for k in range(1, len(pieces) + 1):
+            if k < len(pieces) and pieces[k] == pieces[start]:
+                continue
+            piece = box[:d] + ((bounds[start], bounds[k] - 1),) + box[d + 1:]
+            for leaf in self.split(piece, pieces[start][0],
+                                   pieces[start][1], region,
+                                   pieces[start][2], d + 1):
+                yield leaf
+            start = k
+
+    ''' This method drops the entries that come after the first entry that
+        covers the whole box and ends the walk: they are never reached. The
+        fields before d are covered by all the entries already
+    '''
+    def cut(self, program, boxes, entries, box, d):
+        for n, i in enumerate(entries):
+            if program.kinds[i] == SKIP:
+                return entries  # A skip may jump past the covering entry
+            if covers(boxes[i], box, d):
+                return entries[:n + 1]
+        return entries
+
+
+''' This function merges the differences that are equal but for a field in
+    which they are adjacent, until no merge is possible
+'''
+def merge(differences):
+    merged = True
+    while merged:
+        merged = False
+        for d in range(len(DIMENSIONS)):
+            groups = {}
+            for difference in differences:
+                box = difference.box
+                groups.setdefault((difference.key(), box[:d] + box[d + 1:]),
+                                  []).append(difference)
+            differences = []
+            for group in groups.values():
+                group.sort(key=lambda difference: difference.box[d])
+                current = group[0]
+                for difference in group[1:]:
+                    if difference.box[d][0] == current.box[d][1] + 1:
+                        box = current.box
+                        current = Difference(
+                            current.path, box[:d] + ((box[d][0],
+                                                      difference.box[d][1]),)
+                            + box[d + 1:], current.old, current.new)
+                        merged = True
+                    else:
+                        differences.append(current)
+                        current = difference
+                differences.append(current)
+    differences.sort(key=lambda difference: (difference.path,
+                                             difference.box))
+    return differences
+
+
+''' This function formats a range of addresses as a network, if it is one,
+    or as first-last
+'''
+def format_addresses(low, high):
+    size = high - low + 1
+    length = cidr.BITS - (size.bit_length() - 1)
+    if size & (size - 1) == 0 and low & (size - 1) == 0:
+        return cidr.format_network((low, length), True)
+    return "%s-%s" % (cidr.int_to_ip(low), cidr.int_to_ip(high))
+
+
+''' This function formats the box of a class: the fields that are not
+    restricted are omitted
+'''
+def format_box(box, full, interfaces):
+    names = ["-"] + interfaces + ["<other>"]
+    protocols = dict((number, name) for name, number in PROTOCOLS.items())
+    fields = []
+    for i, (low, high) in enumerate(box):
+        if i in (IIF, OIF):
+            if (low, high) in (full[i], (1, full[i][1])):
+                continue
+            value = ",".join(names[low:high + 1])
+        elif (low, high) == full[i]:
+            continue
+        elif i == PROTO:
+            value = ",".join(protocols.get(p, str(p))
+                             for p in range(low, high + 1)) \
+                if high - low < 4 else "%d-%d" % (low, high)
+        elif i == STATE:
+            value = ",".join(STATES[low:high + 1])
+        elif i in (SRC, DST):
+            value = format_addresses(low, high)
+        else:
+            value = str(low) if low == high else "%d:%d" % (low, high)
+        fields.append("%s %s" % (DIMENSIONS[i], value))
+    return " ".join(fields)
+
+
+''' This function formats the result of a State '''
+def format_state(state):
+    if state.verdict is None:
+        verdict = ACCEPT
+    else:
+        verdict = state.verdict
+    if state.rule is None:
+        text = verdict + " (policy)"
+    else:
+        text = "%s (%s %s: %s)" % (verdict, state.rule.table,
+                                   state.rule.chain, state.rule.text)
+    for (target, arguments), rule in zip(state.nat, state.nat_rules):
+        text += ", %s (%s %s: %s)" % (target, rule.table, rule.chain,
+                                      rule.text)
+    return text
+
+
+''' This function reads a firewall: a final configuration of NetfilterEngine
+    (with the ipset file next to it, if any) or a file written in
+    intermediate representation. It returns a tuple made of the final
+    configuration and of its ipsets
+'''
+def read_firewall(file_name):
+    text = netfilter_delta.read_file(file_name)
+    lines = [line for line in text.split("\n")
+             if line.strip() and not line.startswith("#")]
+    if lines and lines[0].startswith("*"):
+        ipset_name = os.path.splitext(file_name)[0] + \
+            NetfilterEngine.IPSET_SUFFIX
+        if os.path.isfile(ipset_name):
+            return (text, netfilter_delta.read_file(ipset_name))
+        return (text, "")
+    engine = NetfilterEngine("")
+    final_files = engine.translate_files(text)
+    return (final_files[engine.suffix()], "")
+
+
+''' Main function '''
+def main():
+    if len(sys.argv) != 3:
+        print(USAGE)
+        exit(-1)
+    try:
+        old_text, old_ipsets = read_firewall(sys.argv[1])
+        new_text, new_ipsets = read_firewall(sys.argv[2])
+        diff = HeaderSpaceDiff(old_text, old_ipsets, new_text, new_ipsets)
+        differences = diff.run()
+    except IOError as e:
+        print("FATAL: %s" % e)
+        exit(-1)
+    except ValueError as e:
+        print("FATAL: %s" % e)
+        exit(-1)
+
+    for firewall, name in ((diff.old, sys.argv[1]), (diff.new, sys.argv[2])):
+        if firewall.unknown:
+            print("WARNING: %d rules of %s have unknown options and never "
+                  "match" % (firewall.unknown, name))
+    for difference in differences:
+        print("%s %s" % (difference.path,
+                         format_box(difference.box, diff.old.full,
+                                    diff.interfaces) or "(all)"))
+        print("    old: %s" % format_state(difference.old))
+        print("    new: %s" % format_state(difference.new))
+    if differences:
+        print("INF: %d classes of packets differ" % len(differences))
+        exit(1)
+    print("INF: no packet changes verdict or NAT")
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
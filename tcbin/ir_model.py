@@ -0,0 +1,343 @@
+__author__ = "Alessio Zennaro"
+
+''' This module contains the model of the intermediate representation.
+    A configuration written in intermediate representation is parsed only once
+    into a Configuration object: a list of records, one for each line, so that
+    the engines never have to deal with string offsets.
+    All the record classes use __slots__ and all the repeated strings
+    (commands, interfaces, addresses, ports, protocols) are interned. Endpoints
+    are immutable, so equal endpoints found in the same configuration are
+    shared as well. The lines themselves are not kept: each record rebuilds
+    its line when it is needed. This keeps the memory usage low even for
+    configurations with hundreds of thousands of rules.
+'''
+
+try:
+    from sys import intern  # Python 3
+except ImportError:
+    pass  # Python 2: intern is a builtin function
+
+''' Following there are variables that represent the keywords of the
+    intermediate language
+'''
+OPTN = "OPTN"
+BIND = "BIND"
+ALLW = "ALLW"
+DROP = "DROP"
+RJCT = "RJCT"
+TALW = "TALW"
+PDRP = "PDRP"
+PRJC = "PRJC"
+CSTM = "CSTM"
+
+# Commands that define a firewall rule
+RULES = (ALLW, DROP, RJCT, TALW)
+# Commands that define a policy
+POLICIES = (PDRP, PRJC)
+
+''' Following there are the kinds of endpoint: each endpoint of the
+    intermediate representation is classified as one of them
+'''
+HOST = "HOST"  # A host ip address (h-<ip>)
+NET = "NET"  # A network ip address (n-<ip>/<mask>)
+INTERFACE = "INTERFACE"  # The name of a network interface
+LOCAL = "LOCAL"  # The firewall itself (local)
+ANY = "ANY"  # Any endpoint (*)
+MASQUERADE = "MASQUERADE"  # Masquerade, only in sNATs
+NONE = "NONE"  # No endpoint at all, i.e. no NAT is requested
+
+# The port value used when no port is specified
+NO_PORT = "0"
+
+
+''' This class represents an endpoint: a source, a destination or a NAT.
+    host, interface and port are the three fields of the intermediate
+    representation. The host is classified in kind and the address is the
+    host without the h-/n- prefix (for host and network ip addresses) or the
+    host itself (for all the other kinds).
+'''
+class Endpoint(object):
+    __slots__ = ("kind", "host", "address", "interface", "port")
+
+    ''' Constructor '''
+    def __init__(self, host, interface, port):
+        self.host = intern(host)
+        self.interface = intern(interface)
+        self.port = intern(port)
+
+        if host == "":
+            self.kind = NONE
+        elif host == ANY or host == LOCAL or host == MASQUERADE:
+            self.kind = host
+        elif host[1:2] == "-":  # h-<ip> or n-<ip>/<mask>
+            self.kind = HOST if host[0] == "h" else NET
+        else:
+            self.kind = INTERFACE
+
+        self.address = intern(host[2:]) if self.is_address() else self.host
+
+    ''' True if the endpoint is a host or a network ip address '''
+    def is_address(self):
+        return self.kind == HOST or self.kind == NET
+
+    ''' True if a port has been specified '''
+    def has_port(self):
+        return self.port != NO_PORT
+
+    ''' The endpoint as written in the intermediate representation '''
+    def __str__(self):
+        return self.host + ";" + self.interface + ";" + self.port
+
+
+''' An option: OPTN:<keyword>;<value> '''
+class Option(object):
+    __slots__ = ("keyword", "value")
+
+    command = OPTN
+
+    ''' Constructor '''
+    def __init__(self, keyword, value):
+        self.keyword = intern(keyword)
+        self.value = intern(value)
+
+    ''' The line in intermediate representation '''
+    @property
+    def line(self):
+        return OPTN + ":" + self.keyword + ";" + self.value
+
+
+''' A binding between an interface and a network: BIND:<interface>;<net_ip> '''
+class Binding(object):
+    __slots__ = ("interface", "network")
+
+    command = BIND
+
+    ''' Constructor '''
+    def __init__(self, interface, network):
+        self.interface = intern(interface)
+        self.network = intern(network)
+
+    ''' The line in intermediate representation '''
+    @property
+    def line(self):
+        return BIND + ":" + self.interface + ";" + self.network
+
+
+''' A firewall rule (ALLW, DROP, RJCT, TALW) '''
+class Rule(object):
+    __slots__ = ("command", "source", "snat", "destination", "dnat",
+                 "protocol", "formula")
+
+    ''' Constructor '''
+    def __init__(self, command, source, snat, destination, dnat, protocol,
+                 formula):
+        self.command = intern(command)
+        self.source = source
+        self.snat = snat
+        self.destination = destination
+        self.dnat = dnat
+        self.protocol = intern(protocol)
+        self.formula = intern(formula)
+
+    ''' The line in intermediate representation. Some engines use it as
+        comment of the final rules
+    '''
+    @property
+    def line(self):
+        return self.command + ":" + str(self.source) + ";" + \
+               str(self.snat) + ";" + str(self.destination) + ";" + \
+               str(self.dnat) + ";" + self.protocol + ";" + self.formula
+
+
+''' A policy (PDRP, PRJC) between two endpoints '''
+class Policy(object):
+    __slots__ = ("command", "source", "destination", "protocol")
+
+    ''' Constructor '''
+    def __init__(self, command, source, destination, protocol):
+        self.command = intern(command)
+        self.source = source
+        self.destination = destination
+        self.protocol = intern(protocol)
+
+    ''' The line in intermediate representation '''
+    @property
+    def line(self):
+        return self.command + ":" + str(self.source) + ";" + \
+               str(self.destination) + ";" + self.protocol
+
+    ''' A policy can be seen as a DROP or RJCT rule without NATs. This method
+        returns such a rule
+    '''
+    def as_rule(self):
+        command = DROP if self.command == PDRP else RJCT
+        no_nat = Endpoint("", "", NO_PORT)
+        return Rule(command, self.source, no_nat, self.destination, no_nat,
+                    self.protocol, "")
+
+
+''' A custom rule: CSTM:<rule> '''
+class Custom(object):
+    __slots__ = ("rule",)
+
+    command = CSTM
+
+    ''' Constructor '''
+    def __init__(self, rule):
+        self.rule = rule
+
+    ''' The line in intermediate representation '''
+    @property
+    def line(self):
+        return CSTM + ":" + self.rule
+
+
+''' A parsed configuration: the list of its records, in the same order of the
+    lines of the intermediate representation
+'''
+class Configuration(object):
+    __slots__ = ("records",)
+
+    ''' Constructor '''
+    def __init__(self, records):
+        self.records = records
+
+    ''' The records of the given kinds (e.g. ir_model.RULES) '''
+    def select(self, commands):
+        return [record for record in self.records
+                if record.command in commands]
+
+
+''' This class parses the intermediate representation. It keeps a cache of the
+    endpoints already found, so that every endpoint is built only once
+'''
+class Parser(object):
+
+    ''' Constructor '''
+    def __init__(self):
+        self.endpoints = {}
+
+    ''' This method returns the endpoint made of the three given fields '''
+    def endpoint(self, host, interface, port):
+        key = (host, interface, port)
+        endpoint = self.endpoints.get(key)
+        if endpoint is None:
+            endpoint = Endpoint(host, interface, port)
+            self.endpoints[key] = endpoint
+        return endpoint
+
+    ''' This method parses a single line. It returns the corresponding record
+        or None if the line is empty or unknown.
+        A line is made of a string (of 4 chars), a colon and then a sequence of
+        parameters separated by a semicolon.
+    '''
+    def parse_line(self, line):
+        if line == "":
+            return None
+
+        command = line[0:4]
+        if command == CSTM:  # Custom rules are taken as they are
+            return Custom(line[5:])
+
+        par = line[5:].split(';')
+        if command in RULES:
+            if len(par) != 14:  # Here something is wrong, not a rule
+                print("ERR: bad parameter")
+                exit(-1)  # We must exit, unrecoverable error!
+            return Rule(command,
+                        self.endpoint(par[0], par[1], par[2]),
+                        self.endpoint(par[3], par[4], par[5]),
+                        self.endpoint(par[6], par[7], par[8]),
+                        self.endpoint(par[9], par[10], par[11]),
+                        par[12], par[13])
+        elif command in POLICIES:
+            if len(par) != 7:  # Not a policy
+                print("ERR: bad parameter")
+                exit(-1)
+            return Policy(command,
+                          self.endpoint(par[0], par[1], par[2]),
+                          self.endpoint(par[3], par[4], par[5]),
+                          par[6])
+        elif command == OPTN:
+            return Option(par[0], par[1] if len(par) > 1 else "")
+        elif command == BIND:
+            return Binding(par[0], par[1] if len(par) > 1 else "")
+
+        return None
+
+    ''' This method parses a whole configuration. It accepts the configuration
+        as a string or as any iterable of lines (e.g. an open file)
+    '''
+    def parse(self, configuration):
+        if isinstance(configuration, str):
+            configuration = iter_lines(configuration)
+
+        records = []
+        for line in configuration:
+            record = self.parse_line(line.rstrip('\n'))
+            if record is not None:
+                records.append(record)
+
+        return Configuration(records)
+
+
+''' This function yields the lines of a string, one at a time: unlike split,
+    it does not build the list of all the lines, that would take as much
+    memory as the string itself
+'''
+def iter_lines(text):
+    start = 0
+    end = text.find("\n")
+    while end >= 0:
+        yield text[start:end]
+        start = end + 1
+        end = text.find("\n", start)
+    yield text[start:]
+
+
+''' This function parses a configuration written in intermediate
+    representation and returns the corresponding Configuration object
+'''
+def parse_configuration(configuration):
+    return Parser().parse(configuration)
+
+
+''' This function splits a sequence of records into runs of consecutive
+    records that differ only along one axis (e.g. only in the source address).
+    key(record, axis) must return the key of a record along the given axis:
+    two records with the same key differ only along that axis. It returns None
+    if the record cannot be part of a run along that axis.
+    It yields tuples (axis, records), in the same order of the records: axis
+    is None when the run is made of a single record. Since the order is kept,
+    the rules of a run can be merged without changing any verdict
+'''
+def runs(records, key, axes):
+    run = []  # The current run
+    run_axis = None  # Its axis, None until it has two records
+    run_key = None  # The key of its records along the axis
+    for record in records:
+        if run:
+            if run_axis is None:  # The second record sets the axis
+                for axis in axes:
+                    record_key = key(record, axis)
+                    if record_key is not None and \
+                            record_key == key(run[0], axis):
+                        run_axis, run_key = axis, record_key
+                        break
+                if run_axis is not None:
+                    run.append(record)
+                    continue
+            elif key(record, run_axis) == run_key:
+                run.append(record)
+                continue
+            # The record does not belong to the run
+            yield (run_axis, run)
+            run, run_axis, run_key = [], None, None
+
+        if any(key(record, axis) is not None for axis in axes):
+            run = [record]  # A new run starts
+        else:
+            yield (None, [record])
+
+    if run:
+        yield (run_axis, run)
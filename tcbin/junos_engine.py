@@ -1,6 +1,7 @@
 __author__ = 'Alessio Zennaro'
 
 from generic_engine import GenericEngine
+import ir_model
 
 ''' This class allows for the translation from mignis to Juniper (JunOS)
     commands via the intermediate representation.
@@ -54,6 +55,13 @@ class JunosEngine(GenericEngine):
     SET_RPRO = "set firewall family inet filter {0} term 0 from " + \
                "protocol {1}\n"
 
+    # Consolidated filters and policies (see the consolidate option)
+    SET_TERM = "set firewall family inet filter {0} term {1} from {2} {3}\n"
+    SET_TACC = "set firewall family inet filter {0} term {1} then accept\n"
+    SET_PLST = "set policy-options prefix-list {0} {1}\n"
+    SET_ASET = "set security zones security-zone {0} address-book " + \
+               "address-set {1} address {2}\n"
+
     INT_IADD = "set interfaces {0} unit 0 family inet filter input-list {1}\n"
     INT_OADD = "set interfaces {0} unit 0 family inet filter output-list {1}\n"
 
@@ -91,11 +99,22 @@ class JunosEngine(GenericEngine):
     SW_S_PORT = [(SRC_PORT, DST_PORT)]
     SW_D_PORT = [(DST_PORT, SRC_PORT)]
 
-    ''' Constructor '''
-    def __init__(self, directory):
+    ''' Constructor. If consolidate is True, the rules of each interface are
+        written as the terms of a single filter for each direction, instead
+        of a filter for each rule, and the addresses matched by the same
+        terms and policies are grouped in prefix-lists and address-sets
+    '''
+    def __init__(self, directory, consolidate=False):
         GenericEngine.__init__(self, directory)
         self.language = "junos"
-        self.address_book = [{"ip" : "0.0.0.0/0", "name" : "any"}]
+        self.consolidate = consolidate
+
+    ''' The signature depends on the options as well '''
+    def signature(self):
+        signature = GenericEngine.signature(self)
+        if self.consolidate:
+            signature += " consolidate"
+        return signature
 
     ''' Ok, let's do the job! '''
     def translate(self, configuration):
@@ -109,6 +128,7 @@ class JunosEngine(GenericEngine):
         nat = ""  # NAT
         pools = ""  # Address pools
 
+
         ep_counter = 0  # Counter for the endpoints
         pl_counter = 0  # Counter for the policy rules
         ri_counter = 0  # Counter for the input filters
@@ -116,278 +136,306 @@ class JunosEngine(GenericEngine):
         rs_counter = 0  # Counter for the nat rule set
         po_counter = 0  # Counter for the address pools
 
-        # Ok, these are all the lines in the intermediate representation
-        lines = configuration.split('\n')
+        # Consolidated filters by interface and direction, consolidated
+        # policies (see add_policy) and the zone of each address book entry
+        filters = {}
+        filter_list = []
+        policy_list = []
+        last_policies = {}
+        zone_of = {}
+
+        # Ok, these are all the parsed lines of the intermediate
+        # representation
+        configuration = self.parse_configuration(configuration)
+        # Every configuration is a different appliance, so it has its own
+        # symbol table and address book
+        self.build_symbol_table(configuration)
+        self.symbols.add_address("0.0.0.0/0", "any")
 
         # BETA
         print("WARNING: JUNOS LANGUAGE SUPPORT IS STILL IN BETA")
         print("Check the rules before setting up your Juniper appliance.")
 
-        for l in lines:  # For each line
-            if l == "":
-                continue
-
-            parsed = self.parse_line(l)  # Parse it
-
-            if parsed[0] == self.OPTN:  # If the line is an OPTN
-                if parsed[1][0] == "static_route":  # static_route
-                    ip = self.create_ip(parsed[1][1])
+        for record in self.timed(configuration.records):  # For each line
+            if record.command == self.OPTN:  # If the line is an OPTN
+                if record.keyword == "static_route":  # static_route
+                    ip = self.create_ip(record.value)
                     if ip != "":  # If a valid IP is given
                         # The static route string is activated
                         static_route = self.STATIC_ROUTE.format(ip)
                 else:
-                    print("WARNING: Unknown option %s" % parsed[1][0])
-            elif parsed[0] == self.BIND:  # If the line is BIND
+                    print("WARNING: Unknown option %s" % record.keyword)
+            elif record.command == self.BIND:  # If the line is BIND
                 # We get the interface name
-                interface_name = self.create_interface_name(parsed[1][0])
+                interface_name = self.create_interface_name(record.interface)
                 # We reset the interface name
                 reset_int += self.DEL_INT.format(interface_name)
                 # We bind the interface name to the address
-                bindings += self.SET_INT.format(interface_name, parsed[1][1])
+                bindings += self.SET_INT.format(interface_name,
+                                                record.network)
                 # We also set security zones
-                zones += self.SET_ZONE.format(parsed[1][0],
+                zones += self.SET_ZONE.format(record.interface,
                                               interface_name + ".0")
             # DROP and RJCT are not actually needed since they are not allowed
             # in Mignis+. However, to catch this exception we must enter this
             # branch if a DROP or RJCT is present.
-            elif parsed[0] == self.ALLW or \
-                    parsed[0] == self.DROP or \
-                    parsed[0] == self.RJCT or \
-                    parsed[0] == self.TALW:
-                #We need the rule details
-                rule_detail = self.get_rule_details(parsed[1])
+            elif record.command in ir_model.RULES:
+                src = record.source  # Source endpoint
+                dst = record.destination  # Destination endpoint
 
                 # JunOS firewall rules MUST be localized. Mignis+ is mandatory
-                if rule_detail[0][1] == "" or rule_detail[2][1] == "":
+                if src.interface == "" or dst.interface == "":
                     print("FATAL: Rules in Juniper appliance must be " + \
                           "localized! Use Mignis+ syntax")
                     exit(-1)
 
                 # We need the interfaces' names
-                input_interface = self.create_interface_name(rule_detail[0][1])
-                output_interface = self.create_interface_name(rule_detail[2][1])
-
-                # Rules must have a name, we use counters
-                input_name = "ri" + str(ri_counter)
-                output_name = "ro" + str(ro_counter)
-                ri_counter += 1
-                ro_counter += 1
-
-                # Is the rule related to a specific protocol?
-                if rule_detail[4] == "ANY":
-                    protocol_i = ""
-                    protocol_o = ""
-                else:
-                    protocol_i = self.SET_RPRO.format(input_name,
-                                                      rule_detail[4].lower())
-                    protocol_o = self.SET_RPRO.format(output_name,
-                                                      rule_detail[4].lower())
-
-                # Source port
-                if rule_detail[0][2] == "0":
-                    source_port = ""
-                else:
-                    source_port = self.SET_RSPR.format(input_name,
-                                                       rule_detail[0][2])
+                input_interface = self.create_interface_name(src.interface)
+                output_interface = self.create_interface_name(dst.interface)
 
-                # Destination protocol
-                if rule_detail[2][2] == "0":
-                    destination_port = ""
+                if self.consolidate:
+                    self.add_terms(record, filters, filter_list)
                 else:
-                    destination_port = self.SET_RDPR.format(output_name,
-                                                     rule_detail[2][2])
-
-                # Any source/destination address management
-                if rule_detail[0][0] == "n-0.0.0.0/0":
-                    source_addr = "any"
-                else:
-                    source_addr = rule_detail[0][0][2:]
-
-                if rule_detail[2][0] == "n-0.0.0.0/0":
-                    destination_addr = "any"
-                else:
-                    destination_addr = rule_detail[2][0][2:]
-
-                # Rule generation
-                rules += self.SET_RULE.format(input_name, source_addr,
-                                              source_port, protocol_i,
-                                              output_name, destination_addr,
-                                              destination_port, protocol_o)
-                bindings += self.INT_IADD.format(input_interface, input_name)
-                bindings += self.INT_OADD.format(output_interface, output_name)
-
-                # If the rule is two way allow, we must set another rule
-                # with switched parameters!
-                if parsed[0] == self.TALW:
-                    # We set the new rules' names
-                    new_i_name = "ri" + str(ri_counter)
-                    new_o_name = "ro" + str(ro_counter)
+                    # Rules must have a name, we use counters
+                    input_name = "ri" + str(ri_counter)
+                    output_name = "ro" + str(ro_counter)
                     ri_counter += 1
                     ro_counter += 1
 
-                    # Names have to be switched
-                    sw_names = [(input_name, new_i_name),
-                                (output_name, new_o_name)]
-
-                    # Switch all that must be switched!!
-                    protocol_i = self.switch_elements(protocol_i, sw_names)
-                    protocol_o = self.switch_elements(protocol_o, sw_names)
-                    source_port = self.switch_elements(source_port,
-                                                       self.SW_S_PORT + sw_names)
-                    destination_port = self.switch_elements(destination_port,
-                                                            self.SW_D_PORT + \
-                                                             sw_names)
-
-                    # Create the new rule
-                    rules += self.SET_RULE.format(new_i_name, destination_addr,
+                    # Is the rule related to a specific protocol?
+                    if record.protocol == "ANY":
+                        protocol_i = ""
+                        protocol_o = ""
+                    else:
+                        protocol = record.protocol.lower()
+                        protocol_i = self.SET_RPRO.format(input_name,
+                                                          protocol)
+                        protocol_o = self.SET_RPRO.format(output_name,
+                                                          protocol)
+
+                    # Source port
+                    if not src.has_port():
+                        source_port = ""
+                    else:
+                        source_port = self.SET_RSPR.format(input_name,
+                                                           src.port)
+
+                    # Destination protocol
+                    if not dst.has_port():
+                        destination_port = ""
+                    else:
+                        destination_port = self.SET_RDPR.format(
+                            output_name, dst.port)
+
+                    # Any source/destination address management
+                    source_addr = junos_address(src)
+                    if source_addr == "0.0.0.0/0":
+                        source_addr = "any"
+
+                    destination_addr = junos_address(dst)
+                    if destination_addr == "0.0.0.0/0":
+                        destination_addr = "any"
+
+                    # Rule generation
+                    rules += self.SET_RULE.format(input_name, source_addr,
                                                   source_port, protocol_i,
-                                                  new_o_name, source_addr,
-                                                  destination_port, protocol_o)
-
-                    # And the new bounds
-                    bindings += self.INT_IADD.format(output_interface,
-                                                     new_i_name)
-                    bindings += self.INT_OADD.format(input_interface,
-                                                     new_o_name)
+                                                  output_name,
+                                                  destination_addr,
+                                                  destination_port,
+                                                  protocol_o)
+                    bindings += self.INT_IADD.format(input_interface,
+                                                     input_name)
+                    bindings += self.INT_OADD.format(output_interface,
+                                                     output_name)
+
+                    # If the rule is two way allow, we must set another rule
+                    # with switched parameters!
+                    if record.command == self.TALW:
+                        # We set the new rules' names
+                        new_i_name = "ri" + str(ri_counter)
+                        new_o_name = "ro" + str(ro_counter)
+                        ri_counter += 1
+                        ro_counter += 1
+
+                        # Names have to be switched
+                        sw_names = [(input_name, new_i_name),
+                                    (output_name, new_o_name)]
+
+                        # Switch all that must be switched!!
+                        protocol_i = self.switch_elements(protocol_i,
+                                                          sw_names)
+                        protocol_o = self.switch_elements(protocol_o,
+                                                          sw_names)
+                        source_port = self.switch_elements(
+                            source_port, self.SW_S_PORT + sw_names)
+                        destination_port = self.switch_elements(
+                            destination_port, self.SW_D_PORT + sw_names)
+
+                        # Create the new rule
+                        rules += self.SET_RULE.format(new_i_name,
+                                                      destination_addr,
+                                                      source_port,
+                                                      protocol_i,
+                                                      new_o_name,
+                                                      source_addr,
+                                                      destination_port,
+                                                      protocol_o)
+
+                        # And the new bounds
+                        bindings += self.INT_IADD.format(output_interface,
+                                                         new_i_name)
+                        bindings += self.INT_OADD.format(input_interface,
+                                                         new_o_name)
 
                 # Nat must be considered only when the operator is the
                 # one way allow
-                if parsed[0] == self.ALLW:
+                if record.command == self.ALLW:
                     # If a Masquerade has been requested
-                    if rule_detail[1][0] == self.MASQUERADE:
+                    if record.snat.kind == ir_model.MASQUERADE:
                         set_name = "rs" + str(rs_counter)
                         rs_counter += 1
                         nat_name = "masquerade"
 
-                        nat += self.NAT_SNAT.format(set_name, rule_detail[0][1],
-                                                    rule_detail[2][1], nat_name,
-                                                    rule_detail[0][0][2:],
-                                                    rule_detail[2][0][2:],
+                        nat += self.NAT_SNAT.format(set_name, src.interface,
+                                                    dst.interface, nat_name,
+                                                    junos_address(src),
+                                                    junos_address(dst),
                                                     self.NAT_MSQR)
                     # Regular source NAT
-                    elif len(rule_detail[1][0]) > 1 \
-                         and rule_detail[1][0][1] == '-':
+                    elif record.snat.is_address():
                         pool_name = "pool" + str(po_counter)
                         po_counter += 1
                         set_name = "rs" + str(rs_counter)
                         rs_counter += 1
                         nat_name = "source-nat"
 
-                        if rule_detail[1][2] == '0':
+                        if not record.snat.has_port():
                             port = self.NAT_NPRT
                         else:
-                            port = rule_detail[1][2]
+                            port = record.snat.port
 
                         pools += self.NAT_POOL.format(self.SOURCE, pool_name,
-                                                      rule_detail[1][0][2:],
+                                                      record.snat.address,
                                                       port)
 
-                        nat += self.NAT_SNAT.format(set_name, rule_detail[0][1],
-                                                    rule_detail[2][1], nat_name,
-                                                    rule_detail[0][0][2:],
-                                                    rule_detail[2][0][2:],
+                        nat += self.NAT_SNAT.format(set_name, src.interface,
+                                                    dst.interface, nat_name,
+                                                    junos_address(src),
+                                                    junos_address(dst),
                                                     pool_name)
                     # Destination NAT
-                    elif len(rule_detail[3][0]) > 1 \
-                         and rule_detail[3][0][1] == '-':
+                    elif record.dnat.is_address():
                         pool_name = "pool" + str(po_counter)
                         po_counter += 1
                         set_name = "rs" + str(rs_counter)
                         rs_counter += 1
                         nat_name = "destination-nat"
 
-                        if rule_detail[2][2] == '0':
+                        if not dst.has_port():
                             port = self.NAT_NPRT
                         else:
-                            port = rule_detail[2][2]
+                            port = dst.port
 
                         pools += self.NAT_POOL.format(self.DESTINATION,
                                                       pool_name,
-                                                      rule_detail[2][0][2:],
+                                                      junos_address(dst),
                                                       port)
 
                         nat += self.NAT_DNAT.format(set_name, nat_name,
-                                                    rule_detail[3][0][2:],
-                                                    rule_detail[3][2],
+                                                    record.dnat.address,
+                                                    record.dnat.port,
                                                     pool_name)
             # Here we have the policies
-            elif parsed[0] == self.PDRP or parsed[0] == self.PRJC:
-                # JunOS firewall policies MUST be localized as well
-                if parsed[1][1] == "" or parsed[1][4] == "":
+            elif record.command in ir_model.POLICIES:
+                src = record.source  # Source endpoint
+                dst = record.destination  # Destination endpoint
+
+                # JunOS firewall policies MUST be localized as well. If they
+                # are not, the zone is the interface whose network contains
+                # the endpoint
+                src_zone = self.get_zone(src)
+                dst_zone = self.get_zone(dst)
+                if src_zone == "" or dst_zone == "":
                     print("FATAL: Policies in Juniper appliance must be " + \
                          "localized! Use Mignis+ syntax")
                 # If the source endpoin has been never found before in the
                 # configuration, then insert it in the address book
                 # and declare it.
-                if self.get_adbook_entry(parsed[1][0][2:]) == []:
+                if self.symbols.address_name(junos_address(src)) is None:
                     # endpoint number
                     name = "ep" + str(ep_counter)
                     ep_counter += 1  # increment
-                    self.address_book.append(  # Add the new entry
-                        {
-                            "ip"    :   parsed[1][0][2:],
-                            "name"  :   name
-                        }
-                    )
+                    # Add the new entry
+                    self.symbols.add_address(junos_address(src), name)
                     # Declare it in the configuration
-                    adbook += self.SET_AB.format(parsed[1][1], name,
-                                                 parsed[1][0][2:])
+                    adbook += self.SET_AB.format(src_zone, name,
+                                                 junos_address(src))
+                    zone_of[name] = src_zone
 
                 # Same thing for the destination endpoint
-                if self.get_adbook_entry(parsed[1][3][2:]) == []:
+                if self.symbols.address_name(junos_address(dst)) is None:
                     # endpoint number
                     name = "ep" + str(ep_counter)
                     ep_counter += 1  # increment
-                    self.address_book.append(  # Add the new entry
-                        {
-                            "ip"    :   parsed[1][3][2:],
-                            "name"  :   name
-                        }
-                    )
+                    # Add the new entry
+                    self.symbols.add_address(junos_address(dst), name)
                     # Declare it in the configuration
-                    adbook += self.SET_AB.format(parsed[1][4], name,
-                                                 parsed[1][3][2:])
+                    adbook += self.SET_AB.format(dst_zone, name,
+                                                 junos_address(dst))
+                    zone_of[name] = dst_zone
+
+                if self.consolidate:
+                    self.add_policy(record, src_zone, dst_zone, policy_list,
+                                    last_policies, zone_of)
+                    continue
 
                 # Policy number
                 p_number = "pr" + str(pl_counter)
                 pl_counter += 1  # increment
 
                 # Source node
-                source = self.get_adbook_entry(parsed[1][0][2:])[0]['name']
+                source = self.symbols.address_name(junos_address(src))
                 # Destination node
-                destination = self.get_adbook_entry(parsed[1][3][2:])[0]['name']
-                if parsed[1][2] == "0":  # Source port
+                destination = self.symbols.address_name(junos_address(dst))
+                if not src.has_port():  # Source port
                     sport = ""
                 else:
-                    sport = self.SET_SPRT.format(parsed[1][1], parsed[1][4],
+                    sport = self.SET_SPRT.format(src_zone, dst_zone,
                                                  p_number,
-                                                 parsed[1][2])
-                if parsed[1][5] == "0":  # Destination port
+                                                 src.port)
+                if not dst.has_port():  # Destination port
                     dport = ""
                 else:
-                    dport = self.SET_DPRT.format(parsed[1][1], parsed[1][4],
+                    dport = self.SET_DPRT.format(src_zone, dst_zone,
                                                  p_number,
-                                                 parsed[1][5])
-                if parsed[1][6] == "ANY": # Protocol matching
+                                                 dst.port)
+                if record.protocol == "ANY": # Protocol matching
                     protocol = ""  # If no protocol is specified
                 else:
                     # If a protocol is specified
-                    protocol = self.SET_PPRO.format(parsed[1][1], parsed[1][4],
-                                                    p_number,
-                                                    parsed[1][6].lower())
-                if parsed[0] == self.PDRP:  # Action: drop or reject?
+                    protocol = self.SET_PPRO.format(src_zone,
+                                                    dst_zone, p_number,
+                                                    record.protocol.lower())
+                if record.command == self.PDRP:  # Action: drop or reject?
                     action = self.ACT_DISC
                 else:
                     action = self.ACT_RJCT
 
                 # Ok: build the policy rule!!
-                policies += self.SET_PLCY.format(parsed[1][1], parsed[1][4],
+                policies += self.SET_PLCY.format(src_zone, dst_zone,
                                                  p_number, source, sport,
                                                  destination, dport,
                                                  protocol, action)
             # Custom rules, they are put after the policies... Use with cautions
-            elif parsed[0] == self.CSTM:
-                rules += parsed[1][0] + "\n"
+            elif record.command == self.CSTM:
+                rules += record.rule + "\n"
+
+        if self.consolidate:
+            terms, filter_bindings = self.write_filters(filter_list)
+            rules = terms + rules
+            bindings += filter_bindings
+            address_sets, policies = self.write_policies(policy_list)
+            adbook += address_sets
 
         # The whole interface binding string
         interfaces = reset_int + bindings + static_route + zones
@@ -398,6 +446,154 @@ class JunosEngine(GenericEngine):
 
         return rules + interfaces + policies + nats +  "commit\n"
 
+    ''' This method adds the terms of a rule to the consolidated filters: the
+        input term to the filter of the source interface and the output term
+        to the filter of the destination interface (and, for the two way
+        allow, the terms of the replies, with the ports switched). These are
+        the same matches of the filters written for each rule
+    '''
+    def add_terms(self, record, filters, filter_list):
+        src = record.source
+        dst = record.destination
+        if record.protocol == "ANY":
+            protocol = ""
+        else:
+            protocol = record.protocol.lower()
+        sport = src.port if src.has_port() else ""
+        dport = dst.port if dst.has_port() else ""
+
+        self.add_term(filters, filter_list, "ri", src, self.SOURCE,
+                      self.SRC_PORT, sport, protocol)
+        self.add_term(filters, filter_list, "ro", dst, self.DESTINATION,
+                      self.DST_PORT, dport, protocol)
+        if record.command == self.TALW:
+            self.add_term(filters, filter_list, "ri", dst, self.SOURCE,
+                          self.DST_PORT, sport, protocol)
+            self.add_term(filters, filter_list, "ro", src, self.DESTINATION,
+                          self.SRC_PORT, dport, protocol)
+
+    ''' This method adds a term to the consolidated filter of the interface of
+        endpoint (prefix is "ri" for the input filters, "ro" for the output
+        ones), creating the filter if needed
+    '''
+    def add_term(self, filters, filter_list, prefix, endpoint, field,
+                 port_field, port, protocol):
+        name = prefix + "_" + endpoint.interface
+        if name not in filters:
+            filters[name] = FilterTerms(
+                name, self.create_interface_name(endpoint.interface), field)
+            filter_list.append(filters[name])
+        filters[name].add(endpoint, port_field, port, protocol)
+
+    ''' This method writes the consolidated filters. It returns a tuple made
+        of their prefix-lists and terms and of their bindings to the
+        interfaces
+    '''
+    def write_filters(self, filter_list):
+        prefix_lists = ""
+        terms = ""
+        bindings = ""
+        list_names = {}  # Prefix-list name by addresses
+        for filter_terms in filter_list:
+            name = filter_terms.name
+            for number, key in enumerate(filter_terms.terms):
+                port_field, port, protocol, _ = key
+                addresses = filter_terms.addresses[key]
+                if len(addresses) == 1:
+                    match = filter_terms.field + "-address"
+                    value = addresses[0]
+                    if value == "0.0.0.0/0":
+                        value = "any"
+                else:
+                    match = filter_terms.field + "-prefix-list"
+                    value = list_names.get(tuple(addresses))
+                    if value is None:
+                        value = "pl" + str(len(list_names))
+                        list_names[tuple(addresses)] = value
+                        for address in addresses:
+                            prefix_lists += self.SET_PLST.format(value,
+                                                                 address)
+                terms += self.SET_TERM.format(name, number, match, value)
+                if port != "":
+                    terms += self.SET_TERM.format(name, number, port_field,
+                                                  port)
+                if protocol != "":
+                    terms += self.SET_TERM.format(name, number, "protocol",
+                                                  protocol)
+                terms += self.SET_TACC.format(name, number)
+            if filter_terms.field == self.SOURCE:
+                bindings += self.INT_IADD.format(filter_terms.interface, name)
+            else:
+                bindings += self.INT_OADD.format(filter_terms.interface, name)
+        return (prefix_lists + terms, bindings)
+
+    ''' This method adds a policy to the consolidated policies. Policies are
+        evaluated in order within their pair of zones, so a policy is merged
+        only into the last group of its pair of zones, and only if the group
+        has its same action and ports and the same source or destination:
+        the other endpoints are grouped in an address-set. last_policies is
+        the last group of each pair of zones and zone_of the zone each name
+        of the address book has been declared in: the members of an
+        address-set must all be in the zone of the set
+    '''
+    def add_policy(self, record, src_zone, dst_zone, policy_list,
+                   last_policies, zone_of):
+        src = record.source
+        dst = record.destination
+        source = self.symbols.address_name(junos_address(src))
+        destination = self.symbols.address_name(junos_address(dst))
+        key = (src.port if src.has_port() else "",
+               dst.port if dst.has_port() else "",
+               "" if record.protocol == "ANY" else record.protocol.lower(),
+               self.ACT_DISC if record.command == self.PDRP else self.ACT_RJCT)
+
+        last = last_policies.get((src_zone, dst_zone))
+        if last is None or not last.merge(key, source, destination, zone_of):
+            last = PolicyGroup(src_zone, dst_zone, key, source, destination)
+            policy_list.append(last)
+            last_policies[(src_zone, dst_zone)] = last
+
+    ''' This method writes the consolidated policies. It returns a tuple made
+        of their address-sets and of the policies
+    '''
+    def write_policies(self, policy_list):
+        address_sets = ""
+        policies = ""
+        set_names = {}  # Address-set name by zone and names
+        for number, group in enumerate(policy_list):
+            p_number = "pr" + str(number)
+            names = []
+            for zone, members in ((group.src_zone, group.sources),
+                                  (group.dst_zone, group.destinations)):
+                if len(members) == 1:
+                    names.append(members[0])
+                    continue
+                set_name = set_names.get((zone, tuple(members)))
+                if set_name is None:
+                    set_name = "as" + str(len(set_names))
+                    set_names[(zone, tuple(members))] = set_name
+                    for member in members:
+                        address_sets += self.SET_ASET.format(zone, set_name,
+                                                             member)
+                names.append(set_name)
+
+            sport, dport, protocol, action = group.key
+            if sport != "":
+                sport = self.SET_SPRT.format(group.src_zone, group.dst_zone,
+                                             p_number, sport)
+            if dport != "":
+                dport = self.SET_DPRT.format(group.src_zone, group.dst_zone,
+                                             p_number, dport)
+            if protocol != "":
+                protocol = self.SET_PPRO.format(group.src_zone,
+                                                group.dst_zone, p_number,
+                                                protocol)
+            policies += self.SET_PLCY.format(group.src_zone, group.dst_zone,
+                                             p_number, names[0], sport,
+                                             names[1], dport, protocol,
+                                             action)
+        return (address_sets, policies)
+
     ''' Interfaces names in JunOS are called as xx-n/m/i (where xx are two
         letters, n m and i are numbers) but Mignis(+) syntax forbids the use
         of - and / in the identifiers. Interfaces' name must be written in the
@@ -435,7 +631,104 @@ class JunosEngine(GenericEngine):
 
         return toRet
 
-    ''' This method is used to extract the couple {ip, ab_entry} '''
-    def get_adbook_entry(self, ip):
-        # List comprehension approach
-        return [item for item in self.address_book if item['ip'] == ip]
\ No newline at end of file
+    ''' This method returns the security zone of an endpoint of a policy: the
+        interface it is localized on (Mignis+) or, if it is not localized, the
+        interface bound to the longest network containing its address.
+        An empty string is returned if the zone cannot be found
+    '''
+    def get_zone(self, endpoint):
+        if endpoint.interface != "":
+            return endpoint.interface
+        if endpoint.is_address():
+            zone = self.symbols.interface_of(endpoint.address)
+            if zone is not None:
+                return zone
+        return ""
+
+
+''' This function returns the address of an endpoint as it is written in the
+    JunOS configuration: its host without the h-/n- prefix. The first two
+    characters are cut from the interfaces, from local and from * as well,
+    as the JunOS translation has always done
+'''
+def junos_address(endpoint):
+    return endpoint.host[2:]
+
+
+''' This class holds the terms of a consolidated filter, the filter of an
+    interface in one direction. field is the address the terms match (source
+    for the input filters, destination for the output ones). A term is
+    identified by its port, its protocol and, for the endpoints that are not
+    addresses, the endpoint: the addresses of the rules with the same term
+    are grouped in a prefix-list. All the terms accept the packets, so
+    grouping them does not change what the filter accepts, and the terms are
+    kept in the order they are first found
+'''
+class FilterTerms(object):
+
+    ''' Constructor '''
+    def __init__(self, name, interface, field):
+        self.name = name
+        self.interface = interface
+        self.field = field
+        self.terms = []  # The keys of the terms, in order
+        self.addresses = {}  # The addresses of each term
+        self.found = set()  # The (key, address) pairs already added
+
+    ''' This method adds the matches of an endpoint to the filter '''
+    def add(self, endpoint, port_field, port, protocol):
+        if port == "":
+            port_field = ""
+        address = junos_address(endpoint)
+        if endpoint.is_address():
+            key = (port_field, port, protocol, None)
+        else:
+            key = (port_field, port, protocol, address)
+        if key not in self.addresses:
+            self.terms.append(key)
+            self.addresses[key] = []
+        if (key, address) not in self.found:
+            self.found.add((key, address))
+            self.addresses[key].append(address)
+
+
+''' This class is a group of consecutive policies of the same pair of zones
+    with the same key (ports, protocol and action) that differ only in the
+    source or only in the destination
+'''
+class PolicyGroup(object):
+
+    ''' Constructor '''
+    def __init__(self, src_zone, dst_zone, key, source, destination):
+        self.src_zone = src_zone
+        self.dst_zone = dst_zone
+        self.key = key
+        self.sources = [source]
+        self.destinations = [destination]
+
+    ''' This method merges a policy into the group, if it can be. It returns
+        True if the policy has been merged
+    '''
+    def merge(self, key, source, destination, zone_of):
+        if key != self.key:
+            return False
+        if self.destinations == [destination] and \
+           zone_of.get(source) == self.src_zone and \
+           zone_of.get(self.sources[0]) == self.src_zone:
+            if source not in self.sources:
+                self.sources.append(source)
+            return True
+        if self.sources == [source] and \
+           zone_of.get(destination) == self.dst_zone and \
+           zone_of.get(self.destinations[0]) == self.dst_zone:
+            if destination not in self.destinations:
+                self.destinations.append(destination)
+            return True
+        return False
+
+
+''' This function returns the engine with the options of
+    target_compiler.parse_options
+'''
+def from_options(directory, options):
+    return JunosEngine(directory, options["consolidate"])
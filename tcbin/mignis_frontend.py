@@ -0,0 +1,618 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This module is the frontend of the compiler running inside the Python
+    process: it compiles a Mignis(+) configuration file into the intermediate
+    representation of each firewall, in memory, as utils/mignis_ic would write
+    it in the compiled folder. It is a port of the OCaml frontend (lexer.mll,
+    parser.mly, scope.ml and compiler.ml of utils) and the intermediate
+    representations are byte-identical to the ones of mignis_ic, warnings
+    included; bench/frontend.py checks it.
+    The behaviour of mignis_ic is kept even where it is surprising:
+     * the negative rules (DROP, RJCT) are written first, in their order, and
+       then the positive ones (ALLW, TALW) in reverse order
+     * the firewalls are compiled from the last one, the rules in their order
+       and the policies from the last one: the first localized (or not
+       localized) endpoint met decides whether the file is written in Mignis+
+       or Mignis, for all the firewalls
+     * the fields of a rule are resolved from the last one (dNAT, destination,
+       sNAT, source), as OCaml evaluates the operands of ^
+    The errors are the same too, but for the lexing and parsing ones, which
+    tell the line they are found at.
+    Usage: ./mignis_frontend.py <file>
+    The intermediate representations are written on the standard output.
+'''
+
+import re
+import sys
+
+
+# The tokens of the lexer (see utils/lexer.mll)
+OPTION = "OPTION"
+INTERFACE = "INTERFACE"
+ALIAS = "ALIAS"
+FIREWALL = "FIREWALL"
+POLICY = "POLICY"
+CUSTOM = "CUSTOM"
+LOCAL = "LOCAL"
+STAR = "STAR"
+AT = "AT"
+FORMULA = "FORMULA"
+CUSTOMRULE = "CUSTOMRULE"
+IDENTIFIER = "IDENTIFIER"
+NET_IP = "NET_IP"
+HOST_IP = "HOST_IP"
+PORT = "PORT"
+ALLOW = "ALLOW"
+TWALLOW = "TWALLOW"
+DROP = "DROP"
+REJECT = "REJECT"
+LBRACK = "LBRACK"
+DOT = "DOT"
+RBRACK = "RBRACK"
+TCP = "TCP"
+UDP = "UDP"
+ICMP = "ICMP"
+EOF = "EOF"
+
+# The keywords: they take precedence over the identifiers of the same length
+KEYWORDS = {"OPTIONS": OPTION, "INTERFACES": INTERFACE, "ALIASES": ALIAS,
+            "FIREWALL": FIREWALL, "POLICIES": POLICY, "CUSTOM": CUSTOM,
+            "local": LOCAL, "tcp": TCP, "udp": UDP, "icmp": ICMP}
+# The operators and the other tokens made of symbols only
+SYMBOLS = {"<>": TWALLOW, "//": REJECT, ">": ALLOW, "/": DROP, "*": STAR,
+           "@": AT, "[": LBRACK, ".": DOT, "]": RBRACK}
+
+# The tokens of the main part of the configuration. The alternatives are
+# tried in order, and the longer one comes first where two of them match the
+# same text, so the longest match wins as in ocamllex
+OCTET = "[0-9]{1,3}"
+HOST = r"\.".join([OCTET] * 4)
+MAIN_TOKENS = re.compile(
+    r"(?P<blank>[ \t\n]+)"
+    r"|(?P<comment>#[^\n]*\n?)"
+    r"|(?P<word>[A-Za-z][A-Za-z0-9_]*)"
+    r"|(?P<formula>\|[^\n]*)"
+    r"|(?P<net>" + HOST + "/[0-9]{1,2})"
+    r"|(?P<host>" + HOST + ")"
+    r"|(?P<port>: *[0-9]+)"
+    r"|(?P<symbol><>|//|[>/*@\[.\]])")
+# The tokens of the custom rules (see the cstrule entry point of the lexer)
+CUSTOM_TOKENS = re.compile(
+    r"(?P<blank>\n+)"
+    r"|(?P<comment>#[^\n]*\n?)"
+    r"|(?P<custom>[A-Za-z0-9 \"-]+)")
+
+# The greatest integer of OCaml (64 bit): bigger ports are lexing errors
+MAX_INT = 2 ** 62 - 1
+
+# The kinds of configuration file: Mignis or Mignis+ (see
+# IrCompiler.set_interface)
+MIGNIS = "Mignis"
+MIGNIS_PLUS = "Mignis+"
+
+# The fields of a missing NAT and of the endpoint *
+NO_NAT = ("", "", "0")
+ANY = ("ANY", "", "0")
+
+# The warnings and the errors of the checks of the rules
+SAME_RULE = "A rule with same source and destination has been found\n"
+DNAT_OVERLAP = "A rule with dNAT is overlapping a generic rule\n"
+SAME_DNAT = "A rule with an overlapping dNAT has been found\n"
+ANY_OVERLAP = "A rule is overlapping a * destination\n"
+MIXED = "Mignis and Mignis+ rules cannot be used together"
+
+
+''' This exception is raised when a configuration cannot be compiled. Its
+    message is the one of mignis_ic
+'''
+class FrontendError(Exception):
+    pass
+
+
+''' This class splits a Mignis(+) configuration into tokens (see
+    utils/lexer.mll). The custom rules are recognized in their own state,
+    from the keyword CUSTOM to the next keyword OPTIONS
+'''
+class Lexer(object):
+
+    ''' Constructor '''
+    def __init__(self, source):
+        self.source = source
+
+    ''' This method yields the tokens of the configuration as tuples (token,
+        value, position). The last one is EOF. A FrontendError is raised
+        where no token can be recognized, when the parser asks for it
+    '''
+    def tokens(self):
+        source = self.source
+        size = len(source)
+        pattern = MAIN_TOKENS
+        position = 0
+        while position < size:
+            match = pattern.match(source, position)
+            if match is None:
+                raise FrontendError("Lexer error: lexing: empty token%s"
+                                    % line_of(source, position))
+            kind = match.lastgroup
+            value = match.group()
+            start = position
+            position = match.end()
+            if kind in ("blank", "comment"):
+                continue
+
+            if kind == "word":
+                token = KEYWORDS.get(value, IDENTIFIER)
+                if token == CUSTOM:
+                    pattern = CUSTOM_TOKENS
+                yield (token, value, start)
+            elif kind == "custom":
+                if value == "OPTIONS":
+                    pattern = MAIN_TOKENS
+                    yield (OPTION, value, start)
+                else:
+                    yield (CUSTOMRULE, value, start)
+            elif kind == "formula":
+                formula = value.lstrip("| ")
+                if formula == "":  # mignis_ic crashes
+                    raise FrontendError("Lexer error: index out of bounds%s"
+                                        % line_of(source, start))
+                yield (FORMULA, formula, start)
+            elif kind == "net":
+                yield (NET_IP, value, start)
+            elif kind == "host":
+                yield (HOST_IP, value, start)
+            elif kind == "port":
+                port = int(value.lstrip(": "))
+                if port > MAX_INT:
+                    raise FrontendError("Lexer error: int_of_string%s"
+                                        % line_of(source, start))
+                yield (PORT, port, start)
+            else:
+                yield (SYMBOLS[value], value, start)
+        yield (EOF, None, size)
+
+
+''' This class parses a Mignis(+) configuration into its abstract syntax tree
+    (see utils/parser.mly and utils/mast.mli): the list of its firewalls,
+    each one a tuple (options, interfaces, aliases, rules, policies, custom
+    rules). The grammar is LL(1), so it is parsed by recursive descent and
+    the errors are found at the same token as the parser of mignis_ic.
+    The nodes of the tree are tuples:
+     * option: (keyword, value)
+     * interface: (name, nic, network)
+     * alias: (name, address), the address being "h-<ip>" or "n-<network>"
+     * rule: (command, source, sNAT, dNAT, destination, protocol, formula),
+       the command being ALLW, TALW, DROP or RJCT, the protocol TCP, UDP, ICMP
+       or ANY and the formula "" if there is none
+     * policy: (command, source, destination, protocol), the command being
+       PDRP or PRJC
+     * endpoint: ("name", name, interface, port), ("ip", address, interface,
+       port), ("local", port) or ("any",), the interface being None if the
+       endpoint is not localized
+     * NAT: an endpoint, MASQUERADE or None
+'''
+class Parser(object):
+
+    # The operators of the rules and of the policies
+    OPERATORS = {ALLOW: "ALLW", TWALLOW: "TALW", DROP: "DROP",
+                 REJECT: "RJCT"}
+    POLICY_OPERATORS = {DROP: "PDRP", REJECT: "PRJC"}
+    PROTOCOLS = {TCP: "TCP", UDP: "UDP", ICMP: "ICMP"}
+    # The tokens an endpoint begins with
+    ENDPOINTS = (IDENTIFIER, HOST_IP, NET_IP, LOCAL, STAR)
+
+    ''' Constructor '''
+    def __init__(self, source):
+        self.source = source
+        self.tokens = Lexer(source).tokens()
+        self.token = None
+        self.value = None
+        self.position = 0
+        self.advance()
+
+    ''' This method returns the list of the firewalls of the configuration.
+        A FrontendError is raised if it is not well-formed
+    '''
+    def parse(self):
+        firewalls = []
+        while self.token != EOF:
+            firewalls.append(self.firewall())
+        return firewalls
+
+    ''' This method moves to the next token '''
+    def advance(self):
+        self.token, self.value, self.position = next(self.tokens)
+
+    ''' This method returns the value of the current token and moves to the
+        next one. A FrontendError is raised if the current token is not the
+        given one
+    '''
+    def expect(self, token):
+        if self.token != token:
+            raise FrontendError("Parse error%s"
+                                % line_of(self.source, self.position))
+        value = self.value
+        self.advance()
+        return value
+
+    ''' This method parses a firewall: all the sections, in their order '''
+    def firewall(self):
+        self.expect(OPTION)
+        options = []
+        while self.token == IDENTIFIER:
+            keyword = self.expect(IDENTIFIER)
+            options.append((keyword, self.expect(IDENTIFIER)))
+
+        self.expect(INTERFACE)
+        interfaces = []
+        while self.token == IDENTIFIER:
+            name = self.expect(IDENTIFIER)
+            nic = self.expect(IDENTIFIER)
+            interfaces.append((name, nic, self.expect(NET_IP)))
+
+        self.expect(ALIAS)
+        aliases = []
+        while self.token == IDENTIFIER:
+            name = self.expect(IDENTIFIER)
+            if self.token == HOST_IP:
+                aliases.append((name, "h-" + self.expect(HOST_IP)))
+            else:
+                aliases.append((name, "n-" + self.expect(NET_IP)))
+
+        self.expect(FIREWALL)
+        rules = []
+        while self.token in self.ENDPOINTS:
+            source = self.endpoint()
+            snat = self.nat()
+            if self.token not in self.OPERATORS:
+                self.expect(ALLOW)
+            command = self.OPERATORS[self.token]
+            self.advance()
+            dnat = self.nat()
+            destination = self.endpoint()
+            protocol = self.protocol()
+            formula = ""
+            if self.token == FORMULA:
+                formula = self.expect(FORMULA)
+            rules.append((command, source, snat, dnat, destination, protocol,
+                          formula))
+
+        self.expect(POLICY)
+        policies = []
+        while self.token in self.ENDPOINTS:
+            source = self.endpoint()
+            if self.token not in self.POLICY_OPERATORS:
+                self.expect(DROP)
+            command = self.POLICY_OPERATORS[self.token]
+            self.advance()
+            destination = self.endpoint()
+            policies.append((command, source, destination, self.protocol()))
+
+        self.expect(CUSTOM)
+        custom = []
+        while self.token == CUSTOMRULE:
+            custom.append(self.expect(CUSTOMRULE))
+        return (options, interfaces, aliases, rules, policies, custom)
+
+    ''' This method parses an endpoint '''
+    def endpoint(self):
+        if self.token == STAR:
+            self.advance()
+            return ("any",)
+        if self.token == LOCAL:
+            self.advance()
+            return ("local", self.port())
+
+        if self.token == IDENTIFIER:
+            kind, name = "name", self.expect(IDENTIFIER)
+        elif self.token == HOST_IP:
+            kind, name = "ip", "h-" + self.expect(HOST_IP)
+        else:
+            kind, name = "ip", "n-" + self.expect(NET_IP)
+        interface = None
+        if self.token == AT:
+            self.advance()
+            interface = self.expect(IDENTIFIER)
+        return (kind, name, interface, self.port())
+
+    ''' This method parses an optional port: 0 if there is none '''
+    def port(self):
+        if self.token == PORT:
+            return self.expect(PORT)
+        return 0
+
+    ''' This method parses an optional NAT (see the class documentation) '''
+    def nat(self):
+        if self.token != LBRACK:
+            return None
+        self.advance()
+        if self.token == DOT:
+            self.advance()
+            nat = "MASQUERADE"
+        else:
+            nat = self.endpoint()
+        self.expect(RBRACK)
+        return nat
+
+    ''' This method parses an optional protocol: ANY if there is none '''
+    def protocol(self):
+        protocol = self.PROTOCOLS.get(self.token)
+        if protocol is None:
+            return "ANY"
+        self.advance()
+        return protocol
+
+
+''' This class compiles the abstract syntax tree of a configuration (see
+    Parser) into the intermediate representation of each firewall (see
+    utils/compiler.ml). The names are resolved, the rules are checked
+    against the ones before them and the warnings are kept in the order
+    mignis_ic prints them
+'''
+class IrCompiler(object):
+
+    ''' Constructor '''
+    def __init__(self):
+        self.kind = None  # MIGNIS or MIGNIS_PLUS, once known
+        self.warnings = []  # The warnings, as mignis_ic prints them
+        self.names = {}  # Alias or interface name -> address or nic
+
+    ''' This method returns the list of the intermediate representations of
+        the firewalls. A FrontendError is raised if a firewall is not valid
+    '''
+    def compile(self, firewalls):
+        compiled = [None] * len(firewalls)
+        for index in reversed(range(len(firewalls))):
+            compiled[index] = self.compile_firewall(firewalls[index])
+        return compiled
+
+    ''' This method returns the intermediate representation of a firewall '''
+    def compile_firewall(self, firewall):
+        options, interfaces, aliases, rules, policies, custom = firewall
+        # The aliases take precedence over the interfaces, and the first
+        # declaration of a name over the others
+        self.names = {}
+        for name, address in aliases:
+            self.names.setdefault(name, address)
+        for name, nic, _ in interfaces:
+            self.names.setdefault(name, nic)
+
+        lines = ["OPTN:%s;%s\n" % option for option in options]
+        lines += ["BIND:%s;%s\n" % (nic, network)
+                  for _, nic, network in interfaces]
+
+        negative = []
+        positive = []
+        checked = CheckedRules()
+        for rule in rules:
+            command = rule[0]
+            if command in ("DROP", "RJCT") and self.kind == MIGNIS_PLUS:
+                raise FrontendError("Mignis+ does not allow for negative "
+                                    "rules")
+            fields, line = self.compile_rule(rule)
+            self.check_rule(fields, checked)
+            checked.add(fields)
+            if command in ("DROP", "RJCT"):
+                negative.append(line)
+            else:
+                positive.append(line)
+        lines += negative
+        lines += reversed(positive)
+
+        # The endpoints of the policies are resolved from the last one
+        resolved = [None] * len(policies)
+        for index in reversed(range(len(policies))):
+            _, source, destination, _ = policies[index]
+            destination = ";".join(self.set_endpoint(destination, False))
+            resolved[index] = ";".join(self.set_endpoint(source, False)) + \
+                ";" + destination
+        for policy, endpoints in zip(policies, resolved):
+            lines.append("%s:%s;%s\n" % (policy[0], endpoints, policy[3]))
+
+        lines += ["CSTM:%s\n" % rule for rule in custom]
+        return "".join(lines)
+
+    ''' This method returns a tuple made of the fields of a rule (source,
+        sNAT, destination and dNAT, each one a tuple of three fields) and of
+        its line of intermediate representation
+    '''
+    def compile_rule(self, rule):
+        command, source, snat, dnat, destination, protocol, formula = rule
+        dnat = self.set_nat(dnat)
+        destination = self.set_endpoint(destination, False)
+        snat = self.set_nat(snat)
+        source = self.set_endpoint(source, False)
+        fields = (source, snat, destination, dnat)
+        line = "%s:%s;%s;%s;%s;%s;%s\n" % (command, ";".join(source),
+                                           ";".join(snat),
+                                           ";".join(destination),
+                                           ";".join(dnat), protocol, formula)
+        return (fields, line)
+
+    ''' This method returns the three fields of an endpoint (address,
+        interface and port). nat is True if the endpoint is the one of a NAT
+    '''
+    def set_endpoint(self, endpoint, nat):
+        if endpoint[0] == "any":
+            return ANY
+        if endpoint[0] == "local":
+            return ("LOCAL", "", str(endpoint[1]))
+
+        kind, name, interface, port = endpoint
+        if kind == "name":
+            name = self.names.get(name)
+            if name is None:
+                raise FrontendError("Alias or interface not declared")
+        return (name, self.set_interface(interface, nat), str(port))
+
+    ''' This method returns the three fields of a NAT '''
+    def set_nat(self, nat):
+        if nat is None:
+            return NO_NAT
+        if nat == "MASQUERADE":
+            return ("MASQUERADE", "", "0")
+        return self.set_endpoint(nat, True)
+
+    ''' This method returns the nic of the interface of an endpoint ("" if it
+        is not localized). The first endpoint met decides whether the file is
+        written in Mignis (no localized endpoints) or Mignis+ (only localized
+        ones, but the NATs): mixing them is an error
+    '''
+    def set_interface(self, interface, nat):
+        if interface is None:
+            if self.kind == MIGNIS_PLUS and not nat:
+                raise FrontendError(MIXED)
+            if self.kind is None:
+                self.kind = MIGNIS
+            return ""
+
+        resolved = self.names.get(interface)
+        if resolved is None:
+            raise FrontendError("Interface not declared")
+        if self.kind == MIGNIS and not nat:
+            raise FrontendError(MIXED)
+        if self.kind is None:
+            self.kind = MIGNIS_PLUS
+        return resolved
+
+    ''' This method checks a rule against the rules before it (checked, see
+        CheckedRules) and keeps the warnings. A FrontendError is raised if the
+        rule is not valid: this only depends on the rule itself, and
+        mignis_ic then discards the warnings
+    '''
+    def check_rule(self, fields, checked):
+        source, snat, destination, dnat = fields
+        if snat != NO_NAT and dnat != NO_NAT:
+            raise FrontendError("A rule cannot specify a sNAT and a dNAT at "
+                                "the same time")
+        if dnat == ("MASQUERADE", "", "0"):
+            raise FrontendError("Destination masquarade is not allowed")
+        if snat == ANY or dnat == ANY:
+            raise FrontendError("Wildcard * cannot be used in NAT "
+                                "declarations")
+        if "LOCAL" in ",".join(snat) or "LOCAL" in ",".join(dnat):
+            raise FrontendError("Keyword local cannot be used in NAT "
+                                "declarations")
+
+        warning = checked.warning(fields)
+        if warning:
+            self.warnings.append("Warning: " + warning)
+
+
+''' This class keeps the rules of a firewall checked so far (see
+    IrCompiler.check_rule), indexed so that a new rule is compared only with
+    the ones it overlaps: mignis_ic compares it with all of them. The
+    warnings are the same, in the same order
+'''
+class CheckedRules(object):
+
+    ''' Constructor '''
+    def __init__(self):
+        self.count = 0
+        # (source, destination) -> [(index, sNAT, dNAT)]
+        self.by_destination = {}
+        # (source, dNAT) -> [(index, destination)], rules with a dNAT only
+        self.by_dnat = {}
+        # source -> [index], rules whose destination is not * only
+        self.by_source = {}
+
+    ''' This method adds a rule, given its fields (see
+        IrCompiler.compile_rule)
+    '''
+    def add(self, fields):
+        source, snat, destination, dnat = fields
+        self.by_destination.setdefault((source, destination), []).append(
+            (self.count, snat, dnat))
+        if dnat != NO_NAT:
+            self.by_dnat.setdefault((source, dnat), []).append(
+                (self.count, destination))
+        if destination != ANY:
+            self.by_source.setdefault(source, []).append(self.count)
+        self.count += 1
+
+    ''' This method returns the warnings of a rule, given its fields, against
+        the rules added so far: for each one of them that overlaps the rule,
+        in their order, the first warning that applies ("" if none)
+    '''
+    def warning(self, fields):
+        source, snat, destination, dnat = fields
+        warnings = {}  # Index of the rule -> warning
+        for index, other_snat, other_dnat in \
+                self.by_destination.get((source, destination), ()):
+            if snat == other_snat == NO_NAT and dnat == other_dnat == NO_NAT:
+                warnings[index] = SAME_RULE
+            elif dnat != other_dnat and NO_NAT in (dnat, other_dnat) and \
+                    snat == other_snat:
+                warnings[index] = DNAT_OVERLAP
+        if dnat != NO_NAT:
+            for index, other_destination in \
+                    self.by_dnat.get((source, dnat), ()):
+                if other_destination != destination:
+                    warnings[index] = SAME_DNAT
+        # A different destination, one of the two being *
+        if destination == ANY:
+            others = self.by_source.get(source, ())
+        else:
+            others = [index for index, _, _ in
+                      self.by_destination.get((source, ANY), ())]
+        for index in others:
+            warnings.setdefault(index, ANY_OVERLAP)
+        return "".join(warnings[index] for index in sorted(warnings))
+
+
+''' This function returns " (line <n>)", n being the line of the given
+    position of source
+'''
+def line_of(source, position):
+    return " (line %d)" % (source.count("\n", 0, position) + 1)
+
+
+''' This function compiles the Mignis(+) configuration source and returns a
+    tuple made of the list of the intermediate representations of its
+    firewalls and of the list of the warnings. A FrontendError is raised if
+    the configuration is not valid
+'''
+def compile_source(source):
+    firewalls = Parser(source).parse()
+    compiler = IrCompiler()
+    return (compiler.compile(firewalls), compiler.warnings)
+
+
+''' This function works as compile_source, reading the configuration from
+    the file file_name. A FrontendError is raised if the file cannot be read
+'''
+def compile_file(file_name):
+    try:
+        if bytes is str:  # Python 2: the lines are never translated
+            in_stream = open(file_name, "r")
+        else:  # The line ends are kept as they are, as mignis_ic does
+            in_stream = open(file_name, "r", newline="")
+        source = in_stream.read()
+        in_stream.close()
+    except (IOError, OSError) as _:
+        raise FrontendError("File %s does not exist" % file_name)
+    return compile_source(source)
+
+
+''' Main function '''
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: ./mignis_frontend.py <file>")
+        exit(0)
+    try:
+        conf_list, warnings = compile_file(sys.argv[1])
+    except FrontendError as e:
+        sys.stderr.write("ERR: %s\n" % e)
+        exit(1)
+    for warning in warnings:
+        sys.stderr.write(warning)
+    for index, conf in enumerate(conf_list):
+        sys.stdout.write("# fw%d.config\n" % index)
+        sys.stdout.write(conf)
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
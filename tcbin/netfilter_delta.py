@@ -0,0 +1,449 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This module computes the difference between two final configurations of
+    NetfilterEngine (the deployed one and the new one) as a delta for
+    "iptables-restore --noflush": the chains that are not changed are left
+    alone, so the running firewall is not flushed and rebuilt.
+    The delta is made of chain creations and deletions (-N, -F, -X), policy
+    changes (-P) and rule edits by position (-I, -R, -D), computed chain by
+    chain on the longest common sequence of rules. Each table is a single
+    transaction of iptables-restore, as in the full configuration.
+    The rulesets are modeled as iptables-restore would build them, so that a
+    delta is written only after checking that applying it to the deployed
+    ruleset gives exactly the new one.
+    The sets of NetfilterEngine (its ipset option) that a new configuration
+    no longer uses are found too: they can be destroyed once the new rules
+    are loaded (see stale_ipsets).
+    Usage: ./netfilter_delta.py <deployed> <new>
+           ./netfilter_delta.py --check <deployed> <delta> <new>
+           ./netfilter_delta.py --stale-ipsets <new.ipset>  (the names of
+               the existing sets are read from the standard input, as
+               "ipset list -n" prints them)
+'''
+
+import difflib
+import itertools
+import os
+import sys
+
+
+USAGE = "Usage: ./netfilter_delta.py <deployed> <new>\n" + \
+        "       ./netfilter_delta.py --check <deployed> <delta> <new>\n" + \
+        "       ./netfilter_delta.py --stale-ipsets <new.ipset>"
+
+# The built-in chains of each table, with their default policies
+BUILTIN_CHAINS = {
+    "filter": ("INPUT", "FORWARD", "OUTPUT"),
+    "mangle": ("PREROUTING", "INPUT", "FORWARD", "OUTPUT", "POSTROUTING"),
+    "nat": ("PREROUTING", "INPUT", "OUTPUT", "POSTROUTING"),
+    "raw": ("PREROUTING", "OUTPUT"),
+    "security": ("INPUT", "FORWARD", "OUTPUT"),
+}
+DEFAULT_POLICY = "ACCEPT"
+# Options whose argument is the target chain of a rule
+TARGET_OPTIONS = ("-j", "--jump", "-g", "--goto")
+# The prefix of the names of the ipsets of NetfilterEngine (see
+# NetfilterEngine.IPSET_NAME)
+IPSET_PREFIX = "mignis-"
+# The content of a delta that changes nothing
+NO_CHANGES = "# Nothing to change\n"
+
+
+''' This function returns the key of a rule, used to compare rules: the
+    options separated by single spaces
+'''
+def rule_key(rule):
+    return " ".join(rule.split())
+
+
+''' This class is a table of a ruleset: its chains, in order of creation, with
+    their rules and, for the built-in ones, their policies
+'''
+class Table(object):
+
+    ''' Constructor: a table with the empty built-in chains '''
+    def __init__(self, name):
+        self.name = name
+        self.builtin = BUILTIN_CHAINS.get(name, ())
+        self.chains = list(self.builtin)
+        self.rules = dict((chain, []) for chain in self.chains)
+        self.policies = dict((chain, DEFAULT_POLICY) for chain in self.chains)
+
+    ''' This method returns a copy of the table '''
+    def copy(self):
+        table = Table(self.name)
+        table.chains = list(self.chains)
+        table.rules = dict((chain, list(rules))
+                           for chain, rules in self.rules.items())
+        table.policies = dict(self.policies)
+        return table
+
+    ''' This method returns the rules of a chain. A ValueError is raised if the
+        chain does not exist
+    '''
+    def chain(self, name):
+        if name not in self.rules:
+            raise ValueError("chain %s does not exist in table %s"
+                             % (name, self.name))
+        return self.rules[name]
+
+    ''' This method creates a user-defined chain '''
+    def create(self, name):
+        if name in self.rules:
+            raise ValueError("chain %s already exists in table %s"
+                             % (name, self.name))
+        self.chains.append(name)
+        self.rules[name] = []
+
+    ''' This method deletes an empty, unreferenced user-defined chain '''
+    def delete(self, name):
+        if name in self.builtin:
+            raise ValueError("built-in chain %s cannot be deleted" % name)
+        if self.chain(name):
+            raise ValueError("chain %s is not empty" % name)
+        for chain in self.chains:
+            for rule in self.rules[chain]:
+                if name in targets(rule):
+                    raise ValueError("chain %s is referenced by chain %s"
+                                     % (name, chain))
+        self.chains.remove(name)
+        del self.rules[name]
+
+    ''' This method removes all the rules and the user-defined chains, as
+        iptables-restore does without --noflush. Policies are kept
+    '''
+    def flush_all(self):
+        self.chains = list(self.builtin)
+        self.rules = dict((chain, []) for chain in self.chains)
+
+    ''' This method returns the state of the table, used to compare tables:
+        the order of creation of the chains does not matter
+    '''
+    def state(self):
+        return (self.policies,
+                dict((chain, [rule_key(rule) for rule in rules])
+                     for chain, rules in self.rules.items()))
+
+
+''' This class is a ruleset: the tables, in order of appearance '''
+class Ruleset(object):
+
+    ''' Constructor: an empty ruleset '''
+    def __init__(self):
+        self.names = []
+        self.tables = {}
+
+    ''' This method returns a copy of the ruleset '''
+    def copy(self):
+        ruleset = Ruleset()
+        ruleset.names = list(self.names)
+        ruleset.tables = dict((name, table.copy())
+                              for name, table in self.tables.items())
+        return ruleset
+
+    ''' This method returns a table, creating it (empty) if needed '''
+    def table(self, name):
+        if name not in self.tables:
+            self.names.append(name)
+            self.tables[name] = Table(name)
+        return self.tables[name]
+
+    ''' This method applies a file for iptables-restore, given as a string,
+        to the ruleset. Without noflush each table of the file is flushed
+        first. A ValueError is raised if the file cannot be applied: in that
+        case the ruleset is left as it was
+    '''
+    def restore(self, text, noflush=False):
+        tables = {}  # The tables changed so far, committed at the end
+        table = None
+        for number, line in enumerate(text.split("\n")):
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            try:
+                if line.startswith("*"):
+                    table = self.table(line[1:]).copy()
+                    if not noflush:
+                        table.flush_all()
+                elif table is None:
+                    raise ValueError("command outside of a table")
+                elif line == "COMMIT":
+                    tables[table.name] = table
+                    table = None
+                else:
+                    execute(table, line)
+            except ValueError as e:
+                raise ValueError("line %d: %s" % (number + 1, e))
+        if table is not None:
+            raise ValueError("table %s is not committed" % table.name)
+        for name, table in tables.items():
+            self.tables[name] = table
+
+    ''' Two rulesets are equal if their tables have the same chains, rules and
+        policies. A missing table is equal to an empty one
+    '''
+    def __eq__(self, other):
+        for name in set(self.names) | set(other.names):
+            if self.table(name).state() != other.table(name).state():
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+
+''' This function returns the chains a rule jumps (or goes) to '''
+def targets(rule):
+    options = rule.split()
+    return [options[i + 1] for i in range(len(options) - 1)
+            if options[i] in TARGET_OPTIONS]
+
+
+''' This function executes a single command of iptables-restore on a table.
+    A ValueError is raised if the command is not valid
+'''
+def execute(table, line):
+    if line.startswith(":"):  # Chain declaration: :<chain> <policy> [c]
+        fields = line[1:].split()
+        name = fields[0]
+        if name in table.builtin:
+            if len(fields) > 1 and fields[1] != "-":
+                table.policies[name] = fields[1]
+        elif name in table.rules:  # A declared user chain is flushed
+            del table.rules[name][:]
+        else:
+            table.create(name)
+        return
+
+    fields = line.split(None, 2)
+    command = fields[0]
+    name = fields[1] if len(fields) > 1 else None
+    rest = fields[2] if len(fields) > 2 else ""
+    if command == "-N" and rest == "":
+        table.create(name)
+    elif command == "-X" and name is not None and rest == "":
+        table.delete(name)
+    elif command == "-F":
+        for chain in ([name] if name is not None else table.chains):
+            del table.chain(chain)[:]
+    elif command == "-P" and name in table.builtin:
+        table.policies[name] = rest
+    elif command == "-A":
+        table.chain(name).append(rest)
+    elif command in ("-I", "-R", "-D"):
+        rules = table.chain(name)
+        number, rule = None, rest
+        first = rest.split(None, 1)
+        if first and first[0].isdigit():
+            number = int(first[0])
+            rule = first[1] if len(first) > 1 else ""
+        if command == "-I":
+            number = 1 if number is None else number
+            if not 1 <= number <= len(rules) + 1:
+                raise ValueError("bad rule number %d" % number)
+            rules.insert(number - 1, rule)
+        elif command == "-R":
+            if number is None or not 1 <= number <= len(rules):
+                raise ValueError("bad rule number in %s" % line)
+            rules[number - 1] = rule
+        elif number is not None:  # -D by number
+            if not 1 <= number <= len(rules):
+                raise ValueError("bad rule number %d" % number)
+            del rules[number - 1]
+        else:  # -D by rule specification
+            keys = [rule_key(r) for r in rules]
+            if rule_key(rule) not in keys:
+                raise ValueError("rule not found: %s" % rule)
+            del rules[keys.index(rule_key(rule))]
+    else:
+        raise ValueError("unsupported command: %s" % line)
+
+
+''' This function returns the ruleset obtained restoring the given files, one
+    after the other, on an empty firewall
+'''
+def load(*texts):
+    ruleset = Ruleset()
+    for text in texts:
+        ruleset.restore(text)
+    return ruleset
+
+
+''' This function returns the commands that edit the rules of a chain, from
+    the old rules to the new ones. The edits are made from the last rule to
+    the first one, so the positions of the rules still to be edited never
+    change
+'''
+def chain_delta(chain, old, new):
+    commands = []
+    matcher = difflib.SequenceMatcher(None, [rule_key(r) for r in old],
+                                      [rule_key(r) for r in new],
+                                      autojunk=False)
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal":
+            continue
+        replaced = min(i2 - i1, j2 - j1)
+        for k in range(replaced):
+            commands.append("-R %s %d %s" % (chain, i1 + k + 1, new[j1 + k]))
+        # Old rules left: deleted from the last one
+        for k in range(i2, i1 + replaced, -1):
+            commands.append("-D %s %d" % (chain, k))
+        # New rules left: inserted in order
+        for k in range(j1 + replaced, j2):
+            commands.append("-I %s %d %s" % (chain, i1 + k - j1 + 1, new[k]))
+    return commands
+
+
+''' This function returns the commands that turn a table into another one '''
+def table_delta(old, new):
+    commands = []
+    # New chains first, so that the rules can jump to them
+    for chain in new.chains:
+        if chain not in old.rules:
+            commands.append("-N " + chain)
+    for chain in new.chains:
+        commands += chain_delta(chain, old.rules.get(chain, []),
+                                new.rules[chain])
+    # Removed chains: when no rule jumps to them any more
+    removed = [chain for chain in old.chains if chain not in new.rules]
+    for chain in removed:
+        if old.rules[chain]:
+            commands.append("-F " + chain)
+    for chain in removed:
+        commands.append("-X " + chain)
+    for chain in new.builtin:
+        if old.policies[chain] != new.policies[chain]:
+            commands.append("-P %s %s" % (chain, new.policies[chain]))
+    return commands
+
+
+''' This function returns the delta for "iptables-restore --noflush" that
+    turns the deployed configuration into the new one (both given as
+    strings). A ValueError is raised if a configuration cannot be modeled
+    or if the delta does not give the new ruleset
+'''
+def delta(deployed, final):
+    old = load(deployed)
+    new = load(deployed, final)  # The tables not in final are kept
+
+    lines = []
+    for name in new.names:
+        commands = table_delta(old.table(name), new.table(name))
+        if commands:
+            lines.append("*" + name)
+            lines += commands
+            lines.append("COMMIT")
+    result = "\n".join(lines) + "\n" if lines else NO_CHANGES
+
+    if not check(deployed, result, final):
+        raise ValueError("the delta does not give the new configuration")
+    return result
+
+
+''' This function checks that applying the delta (with --noflush) to the
+    deployed configuration gives the same ruleset of the final one
+'''
+def check(deployed, delta_text, final):
+    try:
+        applied = load(deployed)
+        applied.restore(delta_text, True)
+        return applied == load(deployed, final)
+    except ValueError as _:
+        return False
+
+
+''' This function reads a whole file '''
+def read_file(file_name):
+    in_stream = open(file_name, "r")
+    try:
+        return in_stream.read()
+    finally:
+        in_stream.close()
+
+
+''' This function returns the commands of "ipset restore" that destroy the
+    sets of NetfilterEngine (the ones named IPSET_PREFIX...) that are not
+    created by the ipsets of a new configuration (its fw<index>.ipset file,
+    "" if it has none), given the names of the existing sets. The sets are
+    named after their addresses, so the old rules keep matching the old sets
+    until the new rules are loaded: the commands must be run after that,
+    when no rule matches the stale sets any more
+'''
+def stale_ipsets(names, ipsets):
+    used = set(line.split()[1] for line in ipsets.split("\n")
+               if line.startswith("create "))
+    return "".join("destroy %s\n" % name for name in names
+                   if name.startswith(IPSET_PREFIX) and name not in used)
+
+
+''' This function writes the delta of each final configuration in final_dir
+    (e.g. <directory>final/) against the deployed one with the same name in
+    deployed_dir: fw<index>.iptables gives fw<index>.delta. It returns the
+    number of deltas written
+'''
+def delta_directory(final_dir, deployed_dir, suffix=".iptables"):
+    total = 0
+    for i in itertools.count():
+        file_name = final_dir + "fw" + str(i) + suffix
+        if not os.path.isfile(file_name):
+            break
+        deployed_name = os.path.join(deployed_dir, "fw" + str(i) + suffix)
+        if not os.path.isfile(deployed_name):
+            print("WARNING: no deployed configuration %s, fw%d.delta not "
+                  "written" % (deployed_name, i))
+            continue
+        try:
+            result = delta(read_file(deployed_name), read_file(file_name))
+        except IOError as _:
+            print("ERR: fw%d.delta not written because of an I/O error" % i)
+            continue
+        except ValueError as e:
+            print("ERR: fw%d.delta not written: %s" % (i, e))
+            continue
+
+        delta_name = final_dir + "fw" + str(i) + ".delta"
+        try:
+            out_stream = open(delta_name, "w")
+            out_stream.write(result)
+            out_stream.close()
+        except IOError as _:
+            print("ERR: Skipping output file %s because of an I/O error"
+                  % delta_name)
+            continue
+        commands = len([line for line in result.split("\n")
+                        if line.startswith("-")])
+        print("INF: fw%d.delta: %d commands" % (i, commands))
+        total += 1
+    return total
+
+
+''' Main function '''
+def main():
+    try:
+        if len(sys.argv) == 5 and sys.argv[1] == "--check":
+            ok = check(read_file(sys.argv[2]), read_file(sys.argv[3]),
+                       read_file(sys.argv[4]))
+            print("INF: the delta is %s" % ("correct" if ok else "WRONG"))
+            exit(0 if ok else 1)
+        elif len(sys.argv) == 3 and sys.argv[1] == "--stale-ipsets":
+            sys.stdout.write(stale_ipsets(sys.stdin.read().split(),
+                                          read_file(sys.argv[2])))
+        elif len(sys.argv) == 3:
+            sys.stdout.write(delta(read_file(sys.argv[1]),
+                                   read_file(sys.argv[2])))
+        else:
+            print(USAGE)
+            exit(-1)
+    except IOError as e:
+        print("FATAL: %s" % e)
+        exit(-1)
+    except ValueError as e:
+        print("FATAL: %s" % e)
+        exit(-1)
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
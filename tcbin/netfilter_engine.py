@@ -1,6 +1,12 @@
 __author__ = "Alessio Zennaro"
 
+import hashlib
+
 from generic_engine import GenericEngine
+import cidr
+from cidr import RadixTrie
+import ir_model
+import rule_optimizer
 
 ''' This class allows for the translation from mignis to netfilter/iptables
     via the intermediate representation.
@@ -11,15 +17,17 @@ from generic_engine import GenericEngine
 
 class NetfilterEngine(GenericEngine):
 
-    # Flag for the Mignis+ warning
-    migplus = False
+    # The warning for the Mignis+ rules, printed only once (see warn_once)
+    MIGPLUS_WARNING = \
+        "WARNING: MIGNIS+ RULE SPECIFICATION IS A FEATURE STILL IN BETA!!\n" + \
+        "Check the rules before setting up the firewall."
 
     # Here all the iptables rule templates are defined in variables, to avoid
     # the use of strings in the code.
     BASIC_FILTER = "*filter\n" + \
                    "-P INPUT DROP\n" + \
                    "-P FORWARD DROP\n" + \
-                   "-P OUTPUT DROP\n{0}"
+                   "-P OUTPUT DROP\n"
     BASIC_MANGLE = "*mangle\n" + \
                    "-P PREROUTING DROP\n"
     MANGLE_LO = "-A PREROUTING -i lo -j ACCEPT\n"
@@ -27,7 +35,7 @@ class NetfilterEngine(GenericEngine):
     DEFAULT_ESTABLISHED = \
         "-A INPUT -m state --state ESTABLISHED,RELATED -j ACCEPT\n" + \
         "-A OUTPUT -m state --state ESTABLISHED,RELATED -j ACCEPT\n" + \
-        "-A FORWARD -m state --state ESTABLISHED,RELATED -j ACCEPT\n{0}"
+        "-A FORWARD -m state --state ESTABLISHED,RELATED -j ACCEPT\n"
     DEFAULT_FILTER = \
         "-A INPUT -i lo -j ACCEPT -m comment " + \
           "--comment \"loopback (default rules)\"\n" + \
@@ -43,7 +51,7 @@ class NetfilterEngine(GenericEngine):
         "-A PREROUTING -d 224.0.0.0/4 -j ACCEPT -m comment " + \
           "--comment \"default r.\"\n"
     LOGGING_FILTER = "-N filter_drop\n" + \
-                     "-N filter_drop_icmp" + \
+                     "-N filter_drop_icmp\n" + \
                      "-A filter_drop_icmp -j LOG --log-prefix \"DROP-icmp \"\n" + \
                      "-A filter_drop_icmp -j DROP\n" + \
                      "-A filter_drop -p icmp -j filter_drop_icmp\n" + \
@@ -113,6 +121,9 @@ class NetfilterEngine(GenericEngine):
     DESTINATION_INTF = "-o "
     SPORT = "--sport "
     DPORT = "--dport "
+    SPORTS = "--sports "
+    DPORTS = "--dports "
+    MULTIPORT = "-m multiport "
     PROTOCOL = "-p "
     IPT_ACCEPT = "ACCEPT"
     IPT_DROP = "DROP"
@@ -124,356 +135,1010 @@ class NetfilterEngine(GenericEngine):
         [(SOURCE_INTF, DESTINATION_INTF), (SOURCE_HOST, DESTINATION_HOST)]
     SW_DESTINATION = \
         [(DESTINATION_INTF, SOURCE_INTF), (DESTINATION_HOST, SOURCE_HOST)]
-    SW_SPORT = [(SPORT, DPORT)]
-    SW_DPORT = [(DPORT, SPORT)]
+    SW_SPORT = [(SPORT, DPORT), (SPORTS, DPORTS)]
+    SW_DPORT = [(DPORT, SPORT), (DPORTS, SPORTS)]
+
+    # ipset templates, used when the ipset option is set: they are written in
+    # the companion file, in the format of "ipset restore". Each set is named
+    # after a digest of its addresses (see ipset_name), and it is filled in a
+    # temporary set that is then swapped with the live one, so that the rules
+    # that match the live set never see it empty
+    IPSET_SUFFIX = ".ipset"
+    IPSET_NAME = "mignis-{0}-{1}"
+    # The hexadecimal digits of the digest in the name of a set: the names of
+    # the sets, and of their temporary sets, are at most 31 characters
+    IPSET_DIGEST = 16
+    IPSET_TMP = "{0}-tmp"
+    IPSET_CREATE = "create {0} hash:net family inet -exist\n"
+    IPSET_FLUSH = "flush {0}\n"
+    IPSET_ADD = "add {0} {1} -exist\n"
+    IPSET_SWAP = "swap {0} {1}\n"
+    IPSET_DESTROY = "destroy {0}\n"
+    MATCH_SET = "-m set --match-set {0} {1}"
+    IPSET_COMMENT = "{0} (+{1} rules in set {2})"
+    # Runs of rules shorter than this are not collapsed into an ipset
+    IPSET_MIN_RULES = 4
+    # The fields along which the rules may be collapsed: the addresses of
+    # the endpoints (ipset option) and the ports (multiport option)
+    AXES = ("src", "dst", "sport", "dport", "dnat")
+    PORT_AXES = ("sport", "dport", "dnat")
+
+    # Multiport, used when the multiport option is set. The protocols with
+    # ports, as written in the intermediate representation, and the maximum
+    # number of ports of a match (a range counts as two)
+    MULTIPORT_PROTOCOLS = ("TCP", "UDP", "UDPLITE", "SCTP", "DCCP")
+    MULTIPORT_MAX = 15
+    MULTIPORT_COMMENT = "{0} (+{1} rules)"
 
-    ''' Constructor '''
-    def __init__(self, directory):
+    # Dispatch templates, used when the dispatch option is set. For each base
+    # chain: the prefix of its sub-chains and the options of the keys of its
+    # rules (input interface, output interface, protocol)
+    INPUT = "INPUT"
+    FORWARD = "FORWARD"
+    OUTPUT = "OUTPUT"
+    DISPATCH_CHAINS = [(INPUT, "in", (SOURCE_INTF, None, PROTOCOL)),
+                       (FORWARD, "fwd", (SOURCE_INTF, DESTINATION_INTF,
+                                         PROTOCOL)),
+                       (OUTPUT, "out", (None, DESTINATION_INTF, PROTOCOL))]
+    # The forwarded packets whose destination is in one of these networks
+    # (multicast and broadcast) are accepted by the default mangle rules
+    # whatever their input interface, and are not routed by the bindings
+    SPECIAL_NETWORKS = ["224.0.0.0/4", "255.255.255.255"]
+    NEW_CHAIN = "-N {0}\n"
+    JUMP = "-A {0} -j {1}\n"
+    GOTO = "-A {0} {1}{2} -g {3}\n"
+    # Maximum length of the name of a chain
+    MAX_CHAIN_NAME = 28
+
+    ''' Constructor. If ipset is True, the runs of rules that differ only in the
+        address of the source (or of the destination) are collapsed into a
+        single rule that matches an ipset (see translate_files).
+        If dispatch is True, the filter rules are put in sub-chains by
+        interface, and by protocol too if protocols is True (see
+        dispatch_fragments).
+        counters, if given, maps the lines of intermediate representation to
+        the packets matched by their rules in the running firewall: the rules
+        are reordered so that the most matched ones come first (see
+        rule_optimizer.py).
+        If multiport is True, the runs of rules that differ only in a port are
+        collapsed into the fewest rules that match all their ports with the
+        multiport module (see translate_ports)
+    '''
+    def __init__(self, directory, ipset=False, dispatch=False,
+                 protocols=False, counters=None, multiport=False):
         GenericEngine.__init__(self, directory)
         self.language = "iptables"  # The language is iptables for Netfilter
-        # This dictionary list keeps track of the interface name with the
-        # corresponding net ip
-        self.int_ip = []
+        self.ipset = ipset
+        self.dispatch = dispatch or protocols
+        self.protocols = protocols
+        self.counters = counters
+        self.multiport = multiport
+
+    ''' The signature depends on the options as well '''
+    def signature(self):
+        signature = GenericEngine.signature(self)
+        if self.ipset:
+            signature += " ipset"
+        if self.protocols:
+            signature += " dispatch-protocol"
+        elif self.dispatch:
+            signature += " dispatch"
+        if self.counters is not None:
+            signature += " counters " + \
+                         rule_optimizer.counters_digest(self.counters)
+        if self.multiport:
+            signature += " multiport"
+        return signature
+
+    ''' When the ipset option is set, the ipsets used by the final
+        configuration are written in a companion file (fw<index>.ipset) that
+        must be loaded with "ipset restore" before the final configuration.
+        No file is written if the configuration uses no ipset
+    '''
+    def companion_files(self):
+        if self.ipset and self.ipsets:
+            return {self.IPSET_SUFFIX: "".join(self.ipset_fragments())}
+        return {}
+
+    ''' This method yields the definitions of the ipsets of the last
+        translated configuration. The addresses of each set are added to a
+        temporary set, which is swapped with the live set (created empty if
+        it does not exist yet) and then destroyed: the live set is replaced
+        atomically, even while the rules that match it are running
+    '''
+    def ipset_fragments(self):
+        for name, addresses in self.ipsets:
+            tmp_name = self.IPSET_TMP.format(name)
+            yield self.IPSET_CREATE.format(name)
+            yield self.IPSET_CREATE.format(tmp_name)
+            yield self.IPSET_FLUSH.format(tmp_name)
+            for address in addresses:
+                yield self.IPSET_ADD.format(tmp_name, address)
+            yield self.IPSET_SWAP.format(tmp_name, name)
+            yield self.IPSET_DESTROY.format(tmp_name)
 
     ''' Ok, let's do the job! '''
     def translate(self, configuration):
+        # All the pieces of the final configuration are collected in lists and
+        # joined only once, so that the translation time grows linearly with
+        # the number of rules
+        return "".join(self.fragments(configuration))
+
+    ''' The fragments are written as soon as they are translated '''
+    def translate_fragments(self, configuration):
+        return self.fragments(configuration)
+
+    ''' This method does the actual translation. It yields the fragments of the
+        final configuration in the right order: the filter table, the mangle
+        table and the nat table.
+        Rules are never formatted twice, so curly brackets in comments,
+        formulas and custom rules are written as they are.
+    '''
+    def fragments(self, configuration):
         # Default rules
         def_rul = True
         # Logging
         logging = True
         # Established
         estb = False
-        # This string is used to implement all the bindings between
+        # This list is used to implement all the bindings between
         # interfaces and ips
-        bindings = ""
-        # This string is used to implement the filters (with basic rules)
-        filters = self.BASIC_FILTER
-        # This string is used to implement the NAT rules
-        nat = self.BASIC_NAT
+        bindings = []
         # When an interface accepts any ip, the ips bound to other interfaces
         # must be dropped to avoid overlaps.
-        # This string keeps track of the info useful to do such a thing
-        bind_any_drop = self.BIND_ANY_DROP.format("{0}", "127.0.0.0/8", "{1}")
-        # This string is used to set up the mangle rules for the NATs
-        binding_nat = ""
+        # This list keeps track of the ips to be dropped
+        bind_any_drop = ["127.0.0.0/8"]
         # This list keeps track of the interfaces that accept anything
         intfs = []
+        # These lists are used to implement the filters, the NAT rules and
+        # the mangle rules for the NATs. The filter rules are tuples
+        # (key, rule), see translate_rule
+        self.filter_rules = []
+        self.nat_rules = []
+        self.binding_nat = []
+        # The ipsets (name, addresses) created so far
+        self.ipsets = []
 
-        # Ok, here we have all the conf lines
-        lines = configuration.split('\n')
-        for index, l in enumerate(lines):  # For all the lines
-            if l == "":  # If the line is empty, simply continue
-                continue
-
-            parsed = self.parse_line(l)  # Parse the line
-
-            if parsed[0] == self.OPTN:  # If the line is an OPTN
+        # Ok, here we have all the parsed conf lines
+        configuration = self.parse_configuration(configuration)
+        # The symbol table keeps track of the interface names with the
+        # corresponding net ips
+        self.build_symbol_table(configuration)
+        if self.dispatch:
+            self.build_bound_networks(configuration)
+        records = configuration.records
+        # With the counters, the most matched rules are moved up
+        if self.counters is not None:
+            optimizer = rule_optimizer.RuleOptimizer(self.counters,
+                                                     self.symbols)
+            records = optimizer.reorder(records)
+            print("INF: %d rules reordered, average depth of the matched "
+                  "rules: %.2f -> %.2f" % (optimizer.moved,
+                                           optimizer.depth_before,
+                                           optimizer.depth_after))
+        # For all the lines. With the ipset (multiport) option, the runs of
+        # rules that differ only in one address (port) come together
+        for axis, run in self.timed(ir_model.runs(records, self.collapse_key,
+                                                  self.AXES)):
+            record = run[0]
+            if axis is not None:  # A run of rules
+                self.translate_run(axis, run)
+            elif record.command == self.OPTN:  # If the line is an OPTN
                 # We manage the options by setting flags
-                if parsed[1][0] == "default_rules":  # Default rules
-                    if parsed[1][1] == "yes":
+                if record.keyword == "default_rules":  # Default rules
+                    if record.value == "yes":
                         def_rul = True
-                    elif parsed[1][1] == "no":
+                    elif record.value == "no":
                         def_rul = False
                     else:
                         print("WARNING: Value for option '%s' not valid: %s"
-                              % (parsed[1][0], parsed[1][1]))
-                elif parsed[1][0] == "logging":  # Logging
-                    if parsed[1][1] == "yes":
+                              % (record.keyword, record.value))
+                elif record.keyword == "logging":  # Logging
+                    if record.value == "yes":
                         logging = True
-                    elif parsed[1][1] == "no":
+                    elif record.value == "no":
                         logging = False
                     else:
                         print("WARNING: Value for option '%s' not valid: %s"
-                              % (parsed[1][0], parsed[1][1]))
-                elif parsed[1][0] == "established":  # Established management
-                    if parsed[1][1] == "yes":
+                              % (record.keyword, record.value))
+                elif record.keyword == "established":  # Established management
+                    if record.value == "yes":
                         estb = True
-                    elif parsed[1][1] == "no":
+                    elif record.value == "no":
                         estb = False
                     else:
                         print("WARNING: Value for option '%s' not valid: %s"
-                              % (parsed[1][0], parsed[1][1]))
+                              % (record.keyword, record.value))
                 else:
-                    print("WARNING: Unknown option %s" % parsed[1][0])
-            elif parsed[0] == self.BIND:  # If the line is BIND
+                    print("WARNING: Unknown option %s" % record.keyword)
+            elif record.command == self.BIND:  # If the line is BIND
                 # If an interface accepts anything
-                if parsed[1][1] == "0.0.0.0/0":
-                    intfs.append(parsed[1][0])  # Remember it...
+                if record.network == "0.0.0.0/0":
+                    intfs.append(record.interface)  # Remember it...
                 else:  # If it is a "normal" interface
                     # We set the bound
-                    bindings += \
-                        self.BIND_ACCEPT.format(parsed[1][0], parsed[1][1], l)
+                    bindings.append(
+                        self.BIND_ACCEPT.format(record.interface,
+                                                record.network, record.line)
+                    )
                     # drops set enlarged
-                    bind_any_drop += \
-                        self.BIND_ANY_DROP.format("{0}", parsed[1][1], "{1}")
-                self.int_ip.append(
-                    {
-                        "int_name": parsed[1][0],
-                        "net_ip": parsed[1][1]
-                    }
-                )  # Keep track of the int name and ip
-            elif parsed[0] == self.ALLW or \
-                    parsed[0] == self.DROP or \
-                    parsed[0] == self.RJCT or \
-                    parsed[0] == self.TALW:
+                    bind_any_drop.append(record.network)
+            elif record.command in ir_model.RULES:
                 # If we're dealing with a firewall rule
-                source = ""  # String for the source
-                sport = ""  # String for the source port
-                destination = ""  # String for the destination
-                dport = ""  # String for the destination port
-                # String for the protocol, the default case is "-p all"
-                protocol = self.PROTOCOL + "all"
-                action = ""  # The action
-                s_local = False  # Is there a local keyword in the source?
-                d_local = False  # Is there a local keyword in the destination?
-
-                # Let's begin: we get all the details from the rule
-                rule_detail = self.get_rule_details(parsed[1])
-
-                if (rule_detail[0][1] != "" or rule_detail[2][1] != "") \
-                        and not self.migplus:
-                    print("WARNING: MIGNIS+ RULE SPECIFICATION IS A FEATURE STILL IN BETA!!")
-                    print("Check the rules before setting up the firewall.")
-                    self.migplus = True
-
-                # If there's an ip in the source, we set "-s <ip>"
-                if rule_detail[0][0][1] == '-':
-                    source = self.SOURCE_HOST + rule_detail[0][0][2:]
-                # If there's a local il the source field, we set the flag
-                elif rule_detail[0][0] == self.LOCAL:
-                    s_local = True
-                # If there isn't a star in the source field we set "-i <intf>"
-                elif rule_detail[0][0] != self.ANY:
-                    source = self.SOURCE_INTF + rule_detail[0][0]
-
-                # If there's an interface (Mignis+) we set also the -i option
-                if rule_detail[0][1] != "":
-                    source += " " + self.SOURCE_INTF + rule_detail[0][1]
-
-                # Same for destination but with "-d" and "-o" instead of
-                # "-s" and "-i" respectively
-                if rule_detail[2][0][1] == '-':
-                    destination = self.DESTINATION_HOST + rule_detail[2][0][2:]
-                elif rule_detail[2][0] == self.LOCAL:
-                    d_local = True
-                elif rule_detail[2][0] != self.ANY:
-                    destination = self.DESTINATION_INTF + rule_detail[2][0]
-
-                # If there's an interface (Mignis+) we set also the -o option
-                if rule_detail[2][1] != "":
-                    destination += " " + self.DESTINATION_INTF + \
-                                   rule_detail[2][1]
-
-                if rule_detail[0][2] != "0":  # Source port
-                    sport = self.SPORT + rule_detail[0][2]
-                if rule_detail[2][2] != "0":  # Destination port
-                    dport = self.DPORT + rule_detail[2][2]
-
-                # If a protocol is specified, we set it with "-p <protocol>"
-                if rule_detail[4] != self.ANY:
-                    protocol = self.PROTOCOL + rule_detail[4].lower()
-
-                # If the operator is > or <>
-                if parsed[0] == self.ALLW or parsed[0] == self.TALW:
-                    action = self.IPT_ACCEPT
-                elif parsed[0] == self.DROP:  # /
-                    action = self.IPT_DROP
-                elif parsed[0] == self.RJCT:  # //
-                    action = self.IPT_REJECT
-
-                current_rule = ""  # The current rule
-                if d_local and not s_local:  # If the destination is "local"
-                    current_rule = self.RULE_IN.format(protocol, source, sport,
-                                                       dport, rule_detail[5],
-                                                       action, l)
-                    # <> needs to add a second rule with switched operands
-                    if parsed[0] == self.TALW:
-                        # "-s" and "-i" becomes "-d" and "-o"
-                        source = self.switch_elements(source, self.SW_SOURCE)
-                        # "--dport" becomes "--sport"
-                        dport = self.switch_elements(dport, self.SW_DPORT)
-                        # "--sport" becomes "--dport"
-                        sport = self.switch_elements(sport, self.SW_SPORT)
-                        current_rule += self.RULE_OUT.format(protocol, dport,
-                                                             source, sport,
-                                                             rule_detail[5],
-                                                             action, l)
-                if s_local and not d_local:  # If the source is "local"
-                    current_rule = self.RULE_OUT.format(protocol, sport,
-                                                        destination, dport,
-                                                        rule_detail[5], action,
-                                                        l)
-                    if parsed[0] == self.TALW:  # <>
-                        destination = self.switch_elements(destination,
-                                                           self.SW_DESTINATION)
-                        dport = self.switch_elements(dport, self.SW_DPORT)
-                        sport = self.switch_elements(sport, self.SW_SPORT)
-                        current_rule += \
-                            self.RULE_IN.format(protocol, destination, dport,
-                                                sport, rule_detail[5], action,
-                                                l)
-                # Weird case: source and destination are "local"...
-                # Here we need 127.0.0.0/8
-                if d_local and s_local:
-                    lip = "127.0.0.0/8"
-                    ldest = self.DESTINATION_HOST + lip
-                    lsrc = self.SOURCE_HOST + lip
-                    current_rule = self.RULE_OUT.format(protocol, sport, ldest,
-                                                        dport, rule_detail[5],
-                                                        action, l)
-                    dport = self.switch_elements(dport, self.SW_DPORT)
-                    sport = self.switch_elements(sport, self.SW_SPORT)
-                    current_rule += self.RULE_IN.format(protocol, dport,
-                                                        lsrc + lip, sport,
-                                                        rule_detail[5], action,
-                                                        l)
-                    # <> is really stupid in this case: it doubles the rules
-                    if parsed[0] == self.TALW:
-                        current_rule += current_rule
-                if not d_local and not s_local:  # Standard case: no local
-                    current_rule = \
-                        self.RULE_FWD.format(protocol, source, sport,
-                                             destination, dport, rule_detail[5],
-                                             action, l)
-                    if parsed[0] == self.TALW:  # <>
-                        source = self.switch_elements(source, self.SW_SOURCE)
-                        destination = self.switch_elements(destination,
-                                                           self.SW_DESTINATION)
-                        sport = self.switch_elements(sport, self.SW_SPORT)
-                        dport = self.switch_elements(dport, self.SW_DPORT)
-                        current_rule += \
-                            self.RULE_FWD.format(protocol, destination, dport,
-                                                 source, sport, rule_detail[5],
-                                                 action, l)
-                filters += current_rule  # The set of filter rules is updated!
-
-                # We consider NATs only when the operator is a >
-                if parsed[0] == self.ALLW:
-                    # If we have a MASQUERADE case
-                    if rule_detail[1][0] == self.MASQUERADE:
-                        if source != "" and source[1] != 's':
-                            # if the source is an interface, translate it into
-                            # its corresponding net_ip
-                            source = \
-                                self.SOURCE_HOST + \
-                                self.get_ip_by_name(source[3:])[0]["net_ip"]
-                        nat += self.RULE_MASQUERADE.format(protocol, source,
-                                                           sport, destination,
-                                                           dport, l)
-                    elif rule_detail[1][0] != "":  # A Source NAT is requested
-                        if rule_detail[1][0][1] != "-":
-                            # A special case: NAT with an interface instead of
-                            # a host
-                            to_source = "None"
-                        else:
-                            to_source = rule_detail[1][0][2:]
-                        if rule_detail[1][2] != "0":  # The sNAT port
-                            to_source += ":" + rule_detail[1][2]
-                        # Again: translate interfaces into its net_ip
-                        if source != "" and source[1] != 's':
-                            source = \
-                                self.SOURCE_HOST + \
-                                self.get_ip_by_name(source[3:])[0]["net_ip"]
-                        nat += self.RULE_SNAT.format(protocol, source, sport,
-                                                     destination, dport,
-                                                     to_source, l)
-                    elif rule_detail[3][0] != "":  # Destination NAT
-                        # We avoid to open unnecessary doors...
-                        if destination != "" and destination[1] == 'o':
-                            dest_mangle = \
-                                self.DESTINATION_HOST + \
-                                self.get_ip_by_name(
-                                    destination[3:]
-                                )[0]["net_ip"]
-                        else:
-                            dest_mangle = destination
-                        binding_nat += self.MANGLE_NAT.format(protocol, source,
-                                                              sport,
-                                                              dest_mangle,
-                                                              dport, l)
-                        # Here all the parameters for the NAT rule are set
-                        int_index = destination.find(self.DESTINATION_INTF)
-                        if destination == "" or destination[1] != "d":
-                            to_destination = "None"
-                        else:
-                            if int_index == -1:
-                                to_destination = destination[3:]
-                            else:
-                                to_destination = destination[3:int_index - 1]
-                        if dport != "":
-                            to_destination += ":" + dport[8:]
-                        if rule_detail[3][0][1] != '-':
-                            destination = \
-                                self.DESTINATION_HOST + \
-                                self.get_ip_by_name(
-                                    rule_detail[3][0]
-                                )[0]["net_ip"]
-                        else:
-                            if int_index != -1:
-                                save = " " + \
-                                       self.DESTINATION_INTF + \
-                                       destination[int_index:]
-                            else:
-                                save = ""
-                            destination = \
-                                self.DESTINATION_HOST + \
-                                rule_detail[3][0][2:] + \
-                                save
-                        if rule_detail[3][2] != 0:
-                            dport = self.DPORT + rule_detail[3][2]
-                        else:
-                            dport = ""
-                        nat += self.RULE_DNAT.format(protocol, source, sport,
-                                                     destination, dport,
-                                                     to_destination, l)
+                self.translate_rule(record)
             # Here we have the policies
-            elif parsed[0] == self.PDRP or parsed[0] == self.PRJC:
-                # Set the action...
-                action = self.DROP if parsed[0] == self.PDRP else self.RJCT
-                # A policy can be translated as a normal firewall rule put below
-                # all the other rules, so we add a new rule to be evaluated...
+            elif record.command in ir_model.POLICIES:
+                # A policy can be translated as a normal DROP or RJCT firewall
+                # rule put below all the other rules, so we translate such a
+                # rule right away...
                 # @@@@@@@ IMPORTANT @@@@@@@
                 # THIS WORKS ONLY IF POLICIES RULES COMES AFTER ALL THE NORMAL
                 # RULES!
                 # USE THE MIGNIS COMPILER, DO NOT WRITE RULES BY HAND IN
                 # INTERMEDIATE REPRESENTATION!
                 # YOU ARE ADVICED!
-                new_command = action + ":" + parsed[1][0] + ";" + \
-                              parsed[1][1] + ";" + parsed[1][2] + ";;;0;" + \
-                              parsed[1][3] + ";" + parsed[1][4] + ";" + \
-                              parsed[1][5] + ";;;0;" + parsed[1][6] + ";"
-                lines.insert(index + 1, new_command)
+                self.translate_rule(record.as_rule())
             # Custom rules, they are put after the policies... Use with cautions
-            elif parsed[0] == self.CSTM:
-                filters += parsed[1][0] + "\n"
+            elif record.command == self.CSTM:
+                self.filter_rules.append((None, record.rule + "\n"))
 
-        for intf in intfs:  # For all the interfaces that accepts anything
-            comment = "BIND:" + intf + ";0.0.0.0/0"  # Set the comment...
-            # Add the drops and the final accept to the bindings string
-            bindings = bind_any_drop.format(intf, comment) + \
-                        self.BIND_ANY_ACCEPT.format(intf, comment) + \
-                        bindings
+        # Final filter rules list - First add established, then all the rest!
+        yield self.BASIC_FILTER
+        if estb:
+            yield self.DEFAULT_ESTABLISHED
+        if def_rul:
+            yield self.DEFAULT_FILTER
+        if self.dispatch:
+            for fragment in self.dispatch_fragments():
+                yield fragment
+        else:
+            for _, rule in self.filter_rules:
+                yield rule
+        if logging:
+            yield self.LOGGING_FILTER
+        yield "COMMIT\n"
 
         # Final mangle rules list
-        bindings = self.BASIC_MANGLE + \
-                    (self.DEFAULT_MANGLE if def_rul else "") + \
-                    binding_nat + \
-                    bindings + \
-                    self.MANGLE_LO + \
-                    (self.LOGGING_MANGLE if logging else "")
-        # Final filter rules list - First add established, then all the rest!
-        filters = (filters.format(self.DEFAULT_ESTABLISHED)
-                   if estb else filters.format("{0}"))
-        filters = (filters.format(self.DEFAULT_FILTER)
-                   if def_rul else filters.format("")) + \
-                  (self.LOGGING_FILTER if logging else "")
-
-        # Return!
-        return filters + "COMMIT\n" + \
-               bindings + "COMMIT\n" + \
-               nat + "COMMIT" + "\n"
-
-    ''' This method is used to extract the couple {int_name, net_ip} '''
-    def get_ip_by_name(self, name):
-        # List comprehension approach
-        return [item for item in self.int_ip if item['int_name'] == name]
+        yield self.BASIC_MANGLE
+        if def_rul:
+            yield self.DEFAULT_MANGLE
+        for rule in self.binding_nat:
+            yield rule
+        # For all the interfaces that accepts anything: the last one found
+        # comes first
+        for intf in reversed(intfs):
+            comment = "BIND:" + intf + ";0.0.0.0/0"  # Set the comment...
+            # Add the drops and the final accept
+            for ip in bind_any_drop:
+                yield self.BIND_ANY_DROP.format(intf, ip, comment)
+            yield self.BIND_ANY_ACCEPT.format(intf, comment)
+        for rule in bindings:
+            yield rule
+        yield self.MANGLE_LO
+        if logging:
+            yield self.LOGGING_MANGLE
+        yield "COMMIT\n"
+
+        # Final nat rules list
+        yield self.BASIC_NAT
+        for rule in self.nat_rules:
+            yield rule
+        yield "COMMIT" + "\n"
+
+    ''' This method returns the key of a rule (or policy) along the given axis
+        ("src" or "dst"): two rules with the same key differ only in the
+        address of that endpoint, so they can be collapsed into a single rule
+        that matches an ipset (see ir_model.runs). None is returned if the rule
+        cannot be collapsed: without the ipset option nothing is collapsed,
+        TALW rules and rules with NATs are never collapsed, and neither are
+        the rules whose address is a /0 network, that a hash:net set cannot
+        hold.
+        The keys along the ports are returned by port_key
+    '''
+    def collapse_key(self, record, axis):
+        if axis in self.PORT_AXES:
+            return self.port_key(record, axis)
+        if not self.ipset:
+            return None
+        if record.command in ir_model.POLICIES:
+            rule = record.as_rule()
+        elif record.command in ir_model.RULES:
+            rule = record
+        else:
+            return None
+        if rule.command == self.TALW or rule.snat.kind != ir_model.NONE or \
+                rule.dnat.kind != ir_model.NONE:
+            return None
+
+        if axis == "src":
+            varying, fixed = rule.source, rule.destination
+        else:
+            varying, fixed = rule.destination, rule.source
+        if not varying.is_address() or varying.address.endswith("/0"):
+            return None
+        return (rule.command, varying.interface, varying.port, str(fixed),
+                rule.protocol, rule.formula)
+
+    ''' This method returns the key of a rule (or policy) along a port axis:
+        "sport" or "dport" (the port of an endpoint) or "dnat" (the port of a
+        dNAT rule and of its destination, when they are the same). Two rules
+        with the same key differ only in that port, so they can be collapsed
+        with the multiport module (see translate_ports). None is returned if
+        the rule cannot be collapsed: without the multiport option nothing is
+        collapsed, and the protocol must have ports.
+        The destination ports of the dNATs are collapsed only when the dNAT
+        keeps the port of the packets: then the destination of the dNAT does
+        not need the port, and the same rule is right for all the ports
+    '''
+    def port_key(self, record, axis):
+        if not self.multiport:
+            return None
+        if record.command in ir_model.POLICIES:
+            rule = record.as_rule()
+        elif record.command in ir_model.RULES:
+            rule = record
+        else:
+            return None
+        if rule.protocol.upper() not in self.MULTIPORT_PROTOCOLS:
+            return None
+
+        src, dst = rule.source, rule.destination
+        common = (rule.command, rule.protocol, rule.formula, str(rule.snat))
+        if axis == "sport":
+            if not src.has_port():
+                return None
+            return common + (str(rule.dnat), src.host, src.interface,
+                             str(dst))
+        if axis == "dport":
+            if not dst.has_port() or rule.dnat.kind != ir_model.NONE:
+                return None
+            return common + (dst.host, dst.interface, str(src))
+        if rule.command != self.ALLW or rule.snat.kind != ir_model.NONE or \
+                rule.dnat.kind == ir_model.NONE or not dst.has_port() or \
+                rule.dnat.port != dst.port:
+            return None
+        return common + (rule.dnat.host, rule.dnat.interface, dst.host,
+                         dst.interface, str(src))
+
+    ''' This method translates a run of rules (or policies) that differ only
+        along the given axis (see ir_model.runs). If the run is long enough,
+        its addresses are put in a new ipset and a single rule, that matches
+        the ipset, is translated. Its comment is the line of the first rule.
+        The runs along the ports are translated by translate_ports
+    '''
+    def translate_run(self, axis, run):
+        run = [record.as_rule() if record.command in ir_model.POLICIES
+               else record for record in run]
+        if axis in self.PORT_AXES:
+            self.translate_ports(axis, run)
+            return
+        if len(run) < self.IPSET_MIN_RULES:
+            for rule in run:
+                self.translate_rule(rule)
+            return
+
+        if axis == "src":
+            addresses = [rule.source.address for rule in run]
+        else:
+            addresses = [rule.destination.address for rule in run]
+        name = self.ipset_name(axis, addresses)
+        src_set, dst_set = (name, None) if axis == "src" else (None, name)
+        if name not in [other for other, _ in self.ipsets]:
+            self.ipsets.append((name, addresses))
+        self.translate_rule(run[0], src_set, dst_set,
+                            self.IPSET_COMMENT.format(run[0].line,
+                                                      len(run) - 1, name))
+
+    ''' This method returns the name of the ipset of the given addresses,
+        collapsed along axis: it is made of a digest of the addresses, so a
+        set with the same name always holds the same addresses. Loading the
+        sets of a new configuration never changes the sets matched by the
+        rules still running, and the sets left unused can be destroyed after
+        the new rules are loaded (see netfilter_delta.stale_ipsets)
+    '''
+    def ipset_name(self, axis, addresses):
+        digest = hashlib.sha256("\n".join(sorted(set(addresses)))
+                                .encode("utf-8")).hexdigest()
+        return self.IPSET_NAME.format(axis, digest[:self.IPSET_DIGEST])
+
+    ''' This method translates a run of rules that differ only in a port (see
+        port_key). The ports are sorted, the overlapping and consecutive ones
+        are joined into ranges and they are split into lists of at most
+        MULTIPORT_MAX ports: a rule is translated for each list, with a
+        multiport match. If that does not make fewer rules, or if a port is
+        not understood, the rules are translated one by one
+    '''
+    def translate_ports(self, axis, run):
+        if axis == "sport":
+            ports = [rule.source.port for rule in run]
+        else:
+            ports = [rule.destination.port for rule in run]
+        lists = multiport_lists(ports, self.MULTIPORT_MAX)
+        if lists is None or len(lists) >= len(run):
+            for rule in run:
+                self.translate_rule(rule)
+            return
+
+        rule = run[0]
+        comment = self.MULTIPORT_COMMENT.format(rule.line, len(run) - 1)
+        for port_list in lists:
+            source, destination, dnat = rule.source, rule.destination, \
+                                        rule.dnat
+            if axis == "sport":
+                source = ir_model.Endpoint(source.host, source.interface,
+                                           port_list)
+            else:
+                destination = ir_model.Endpoint(destination.host,
+                                                destination.interface,
+                                                port_list)
+            if axis == "dnat":
+                dnat = ir_model.Endpoint(dnat.host, dnat.interface, port_list)
+            self.translate_rule(ir_model.Rule(rule.command, source, rule.snat,
+                                              destination, dnat,
+                                              rule.protocol, rule.formula),
+                                comment=comment, multiport=axis)
+
+    ''' This method translates a single firewall rule (ALLW, DROP, RJCT, TALW),
+        given as an ir_model.Rule. The filter rules are added to filter_rules,
+        the NAT rules to nat_rules and the mangle rules needed by the dNATs to
+        binding_nat. The line of the rule is used as comment, unless another
+        comment is given.
+        If src_set (dst_set) is given, the source (destination) address of the
+        rule is replaced by the ipset with that name.
+        If multiport is "dnat", the ports of the dNAT are kept (see port_key)
+    '''
+    def translate_rule(self, rule, src_set=None, dst_set=None, comment=None,
+                       multiport=None):
+        source = ""  # String for the source
+        sport = ""  # String for the source port
+        destination = ""  # String for the destination
+        dport = ""  # String for the destination port
+        # String for the protocol, the default case is "-p all"
+        protocol = self.PROTOCOL + "all"
+        action = ""  # The action
+        s_local = False  # Is there a local keyword in the source?
+        d_local = False  # Is there a local keyword in the destination?
+        # The comment of the final rules
+        l = rule.line if comment is None else comment
+
+        if rule.source.interface != "" or rule.destination.interface != "":
+            self.warn_once(self.MIGPLUS_WARNING)
+
+        # If the source addresses are in an ipset, we match it
+        if src_set is not None:
+            source = self.MATCH_SET.format(src_set, "src")
+        # If there's an ip in the source, we set "-s <ip>"
+        elif rule.source.is_address():
+            source = self.SOURCE_HOST + rule.source.address
+        # If there's a local il the source field, we set the flag
+        elif rule.source.kind == ir_model.LOCAL:
+            s_local = True
+        # If there isn't a star in the source field we set "-i <intf>"
+        elif rule.source.kind != ir_model.ANY:
+            source = self.SOURCE_INTF + rule.source.address
+
+        # If there's an interface (Mignis+) we set also the -i option
+        if rule.source.interface != "":
+            source += " " + self.SOURCE_INTF + rule.source.interface
+
+        # Same for destination but with "-d" and "-o" instead of
+        # "-s" and "-i" respectively
+        if dst_set is not None:
+            destination = self.MATCH_SET.format(dst_set, "dst")
+        elif rule.destination.is_address():
+            destination = self.DESTINATION_HOST + rule.destination.address
+        elif rule.destination.kind == ir_model.LOCAL:
+            d_local = True
+        elif rule.destination.kind != ir_model.ANY:
+            destination = self.DESTINATION_INTF + rule.destination.address
+
+        # If there's an interface (Mignis+) we set also the -o option
+        if rule.destination.interface != "":
+            destination += " " + self.DESTINATION_INTF + \
+                           rule.destination.interface
+
+        if rule.source.has_port():  # Source port
+            sport = self.port_match(rule.source.port, self.SPORT,
+                                    self.SPORTS)
+        if rule.destination.has_port():  # Destination port
+            dport = self.port_match(rule.destination.port, self.DPORT,
+                                    self.DPORTS)
+
+        # If a protocol is specified, we set it with "-p <protocol>"
+        if rule.protocol != self.ANY:
+            protocol = self.PROTOCOL + rule.protocol.lower()
+
+        # If the operator is > or <>
+        if rule.command == self.ALLW or rule.command == self.TALW:
+            action = self.IPT_ACCEPT
+        elif rule.command == self.DROP:  # /
+            action = self.IPT_DROP
+        elif rule.command == self.RJCT:  # //
+            action = self.IPT_REJECT
+
+        # The interfaces of the endpoints and the protocol: they are the keys
+        # used to dispatch the filter rules (see dispatch_fragments). The
+        # forwarded packets also get the interfaces of their addresses
+        src_intf = self.endpoint_interface(rule.source)
+        dst_intf = self.endpoint_interface(rule.destination)
+        proto = None
+        if self.protocols and rule.protocol != self.ANY:
+            proto = rule.protocol.lower()
+        fwd_key = self.forward_key(rule.source, src_set, rule.destination,
+                                   dst_set, proto)
+        back_key = self.forward_key(rule.destination, dst_set, rule.source,
+                                    src_set, proto)
+
+        # The current rules: tuples (key, rule) where the key is made of the
+        # chain, the interfaces (input, output), the protocol and, for the
+        # forwarded packets, how the rule meets the special ones (see
+        # forward_key)
+        current_rules = []
+        if d_local and not s_local:  # If the destination is "local"
+            current_rules.append((
+                (self.INPUT, src_intf, None, proto, None),
+                self.RULE_IN.format(protocol, source, sport, dport,
+                                    rule.formula, action, l)
+            ))
+            # <> needs to add a second rule with switched operands
+            if rule.command == self.TALW:
+                # "-s" and "-i" becomes "-d" and "-o"
+                source = self.switch_elements(source, self.SW_SOURCE)
+                # "--dport" becomes "--sport"
+                dport = self.switch_elements(dport, self.SW_DPORT)
+                # "--sport" becomes "--dport"
+                sport = self.switch_elements(sport, self.SW_SPORT)
+                current_rules.append((
+                    (self.OUTPUT, None, src_intf, proto, None),
+                    self.RULE_OUT.format(protocol, dport, source, sport,
+                                         rule.formula, action, l)
+                ))
+        if s_local and not d_local:  # If the source is "local"
+            current_rules.append((
+                (self.OUTPUT, None, dst_intf, proto, None),
+                self.RULE_OUT.format(protocol, sport, destination, dport,
+                                     rule.formula, action, l)
+            ))
+            if rule.command == self.TALW:  # <>
+                destination = self.switch_elements(destination,
+                                                   self.SW_DESTINATION)
+                dport = self.switch_elements(dport, self.SW_DPORT)
+                sport = self.switch_elements(sport, self.SW_SPORT)
+                current_rules.append((
+                    (self.INPUT, dst_intf, None, proto, None),
+                    self.RULE_IN.format(protocol, destination, dport, sport,
+                                        rule.formula, action, l)
+                ))
+        # Weird case: source and destination are "local"...
+        # Here we need 127.0.0.0/8
+        if d_local and s_local:
+            lip = "127.0.0.0/8"
+            ldest = self.DESTINATION_HOST + lip
+            lsrc = self.SOURCE_HOST + lip
+            current_rules.append((
+                (self.OUTPUT, None, None, proto, None),
+                self.RULE_OUT.format(protocol, sport, ldest, dport,
+                                     rule.formula, action, l)
+            ))
+            dport = self.switch_elements(dport, self.SW_DPORT)
+            sport = self.switch_elements(sport, self.SW_SPORT)
+            current_rules.append((
+                (self.INPUT, None, None, proto, None),
+                self.RULE_IN.format(protocol, dport, lsrc + lip, sport,
+                                    rule.formula, action, l)
+            ))
+            # <> is really stupid in this case: it doubles the rules
+            if rule.command == self.TALW:
+                current_rules += current_rules
+        if not d_local and not s_local:  # Standard case: no local
+            current_rules.append((
+                fwd_key,
+                self.RULE_FWD.format(protocol, source, sport, destination,
+                                     dport, rule.formula, action, l)
+            ))
+            if rule.command == self.TALW:  # <>
+                source = self.switch_elements(source, self.SW_SOURCE)
+                destination = self.switch_elements(destination,
+                                                   self.SW_DESTINATION)
+                sport = self.switch_elements(sport, self.SW_SPORT)
+                dport = self.switch_elements(dport, self.SW_DPORT)
+                current_rules.append((
+                    back_key,
+                    self.RULE_FWD.format(protocol, destination, dport,
+                                         source, sport, rule.formula,
+                                         action, l)
+                ))
+        # The set of filter rules is updated!
+        self.filter_rules += current_rules
+
+        # We consider NATs only when the operator is a >
+        if rule.command != self.ALLW:
+            return
+
+        # NAT rules need addresses: if the source is an interface, translate
+        # it into its corresponding net_ip
+        if rule.snat.kind != ir_model.NONE and \
+                rule.source.kind == ir_model.INTERFACE:
+            source = self.SOURCE_HOST + \
+                     self.get_network(rule.source.address)
+
+        # If we have a MASQUERADE case
+        if rule.snat.kind == ir_model.MASQUERADE:
+            self.nat_rules.append(
+                self.RULE_MASQUERADE.format(protocol, source, sport,
+                                            destination, dport, l)
+            )
+        elif rule.snat.kind != ir_model.NONE:  # A Source NAT is requested
+            if not rule.snat.is_address():
+                # A special case: NAT with an interface instead of
+                # a host
+                to_source = "None"
+            else:
+                to_source = rule.snat.address
+            if rule.snat.has_port():  # The sNAT port
+                to_source += ":" + rule.snat.port
+            self.nat_rules.append(
+                self.RULE_SNAT.format(protocol, source, sport,
+                                      destination, dport, to_source, l)
+            )
+        elif rule.dnat.kind != ir_model.NONE:  # Destination NAT
+            # We avoid to open unnecessary doors...
+            if rule.destination.kind == ir_model.INTERFACE:
+                dest_mangle = \
+                    self.DESTINATION_HOST + \
+                    self.get_network(rule.destination.address)
+            else:
+                dest_mangle = destination
+            self.binding_nat.append(
+                self.MANGLE_NAT.format(protocol, source, sport,
+                                       dest_mangle, dport, l)
+            )
+            # Here all the parameters for the NAT rule are set
+            if rule.destination.is_address():
+                to_destination = rule.destination.address
+            else:
+                to_destination = "None"
+            # The dNATs collapsed by port keep the port of the packets
+            if rule.destination.has_port() and multiport != "dnat":
+                to_destination += ":" + rule.destination.port
+            if not rule.dnat.is_address():
+                destination = \
+                    self.DESTINATION_HOST + \
+                    self.get_network(rule.dnat.address)
+            else:
+                # The output interfaces of the destination are kept
+                save = ""
+                if rule.destination.kind == ir_model.INTERFACE:
+                    save += " " + self.DESTINATION_INTF + \
+                            rule.destination.address
+                if rule.destination.interface != "":
+                    save += " " + self.DESTINATION_INTF + \
+                            rule.destination.interface
+                destination = self.DESTINATION_HOST + rule.dnat.address + \
+                              save
+            if rule.dnat.has_port():
+                dport = self.port_match(rule.dnat.port, self.DPORT,
+                                        self.DPORTS)
+            else:
+                dport = ""
+            self.nat_rules.append(
+                self.RULE_DNAT.format(protocol, source, sport,
+                                      destination, dport, to_destination,
+                                      l)
+            )
+
+    ''' This method returns the match of a port: option (--sport or --dport)
+        and the port, or, if the port is a list of ports (see
+        translate_ports), the multiport match with option_list
+    '''
+    def port_match(self, port, option, option_list):
+        if "," in port:
+            return self.MULTIPORT + option_list + port
+        return option + port
+
+    ''' This method returns the interface an endpoint is bound to (the one
+        that ends up in its -i or -o option), or None
+    '''
+    def endpoint_interface(self, endpoint):
+        if endpoint.interface != "":  # Mignis+
+            return endpoint.interface
+        if endpoint.kind == ir_model.INTERFACE:
+            return endpoint.address
+        return None
+
+    ''' This method returns the dispatch key of the forwarded packets from
+        source to destination with protocol proto (see translate_rule). The
+        interface of an endpoint is its -i or -o option or, for an address,
+        the only interface it can be found behind (see address_interface).
+        The addresses of an ipset (src_set, dst_set) are not looked up.
+        With the default rules, the multicast and broadcast packets (see
+        SPECIAL_NETWORKS) are let in whatever their source, so the last
+        field of the key is None if the rule cannot match them and, if it
+        may, whether its input interface has been inferred: in that case
+        they are dispatched apart (see dispatch_fragments)
+    '''
+    def forward_key(self, source, src_set, destination, dst_set, proto):
+        input_intf = self.endpoint_interface(source)
+        output_intf = self.endpoint_interface(destination)
+        if not self.dispatch:
+            return (self.FORWARD, input_intf, output_intf, proto, None)
+
+        special = True
+        if dst_set is None and destination.is_address():
+            special = self.is_special(destination.address)
+            if output_intf is None and not special:
+                output_intf = self.address_interface(destination.address)
+        inferred = False
+        if input_intf is None and src_set is None and source.is_address():
+            input_intf = self.address_interface(source.address)
+            inferred = input_intf is not None
+        if not special or not self.special_accepted:
+            inferred = None
+        return (self.FORWARD, input_intf, output_intf, proto, inferred)
+
+    ''' This method reads what the symbol table does not keep to find the
+        interface of an address (see address_interface): the interfaces
+        bound to 0.0.0.0/0, kept apart in any_interfaces, and the networks
+        covered by the bindings, that is the networks bound but /0 and the
+        loopback one, summarized in a trie. If a network cannot be parsed,
+        or it is bound to more than one interface (the symbol table keeps
+        only one of them), no address is looked up
+    '''
+    def build_bound_networks(self, configuration):
+        self.covered = RadixTrie()
+        self.any_interfaces = []
+        self.interface_cache = {}
+        # Without the default rules, the multicast and broadcast packets go
+        # through the bindings as well
+        self.special_accepted = True
+        bound = {}  # Network -> interface
+        for record in configuration.records:
+            if record.command == self.OPTN and \
+                    record.keyword == "default_rules" and \
+                    record.value in ("yes", "no"):
+                self.special_accepted = record.value == "yes"
+            if record.command != self.BIND:
+                continue
+            try:
+                network = cidr.parse_network(record.network)
+            except ValueError as _:
+                self.covered = None
+                return
+            if network[1] == 0:
+                if record.interface not in self.any_interfaces:
+                    self.any_interfaces.append(record.interface)
+            elif bound.setdefault(network,
+                                  record.interface) != record.interface:
+                self.covered = None
+                return
+
+        loopback = cidr.parse_network("127.0.0.0/8")
+        for network in cidr.summarize(list(bound) + [loopback]):
+            self.covered.insert(network, True)
+
+    ''' This method returns the only interface the forwarded packets from
+        (or to) the given address can come from (go to), or None if there
+        may be more than one. The bindings of the mangle table let in the
+        packets of an interface only if their source is in its networks or,
+        for the interfaces bound to 0.0.0.0/0, if it is in none of the
+        networks bound (nor in the loopback one). The packets to an address
+        are routed the same way, since the networks are bound to the
+        interfaces they are behind: so the candidates are the interfaces
+        with a network that contains the address or is contained in it (see
+        SymbolTable.networks) and, if the address is not covered by the
+        networks bound, the interfaces bound to 0.0.0.0/0
+    '''
+    def address_interface(self, address):
+        if self.covered is None:
+            return None
+        if address in self.interface_cache:
+            return self.interface_cache[address]
+
+        try:
+            network = cidr.parse_network(address)
+        except ValueError as _:
+            return None
+        networks = self.symbols.networks
+        # The networks containing the address come from the shortest: the
+        # first one is 0.0.0.0/0, if it is bound
+        containing = list(networks.matches(network))
+        candidates = set(containing[1:] if self.any_interfaces
+                         else containing)
+        candidates.update(networks.within(network))
+        if not self.covered.lookup(network, False):
+            candidates.update(self.any_interfaces)
+        interface = candidates.pop() if len(candidates) == 1 else None
+        self.interface_cache[address] = interface
+        return interface
+
+    ''' This method returns True if the given address (or network) may be a
+        multicast or broadcast address (see SPECIAL_NETWORKS)
+    '''
+    def is_special(self, address):
+        try:
+            network = cidr.parse_network(address)
+        except ValueError as _:
+            return True
+        for special in self.SPECIAL_NETWORKS:
+            special = cidr.parse_network(special)
+            if cidr.contains(special, network) or \
+                    cidr.contains(network, special):
+                return True
+        return False
+
+    ''' This method yields the filter rules when the dispatch option is set.
+        The rules of each base chain are put in a tree of sub-chains: at each
+        level the packets go (-g) to the sub-chain of their input interface,
+        output interface or protocol. A sub-chain holds, in the original
+        order, all the rules that can match its packets: the ones with its
+        key and the ones valid for any value of the key. The packets whose
+        key has no sub-chain fall through to the rules valid for any value.
+        So each packet meets only the rules that can match it, in the same
+        order, and it is checked against each rule at most once: the base
+        chain jumps (-j) to the root of the tree, so the rules that follow
+        (custom rules, logging) are met as before.
+        The forwarded multicast and broadcast packets that the default rules
+        let in whatever their source (see forward_key), if some rule that may
+        match them has an inferred input interface, go from the root to a
+        chain of their own, with all the rules that may match them.
+        Custom rules are kept in their place: the rules between two of them
+        get their own trees
+    '''
+    def dispatch_fragments(self):
+        segment = []  # The rules since the last custom rule
+        trees = 0  # The number of trees so far
+        for key, custom in self.filter_rules + [(None, None)]:
+            if key is not None:
+                segment.append((key, custom))
+                continue
+
+            for chain, prefix, options in self.DISPATCH_CHAINS:
+                # The key of each rule, without the chain and the fields
+                # unused by this chain
+                rules = [([value for value, option in zip(entry[0][1:4],
+                                                          options)
+                           if option is not None], entry[1])
+                         for entry in segment if entry[0][0] == chain]
+                if not any(value is not None
+                           for values, _ in rules for value in values):
+                    for _, rule in rules:  # Nothing to dispatch
+                        yield rule
+                    continue
+
+                root = prefix + (str(trees) if trees > 0 else "")
+                chains = []  # Tuples (name, list of rules)
+                self.dispatch_tree(chain, root, rules,
+                                   [option for option in options
+                                    if option is not None], chains)
+                special = [(key, rule) for key, rule in segment
+                           if key[0] == chain and key[4] is not None]
+                if any(key[4] for key, _ in special):
+                    special = [([], rule) for _, rule in special]
+                    name = root + "-special"
+                    chains[0][1][0:0] = [
+                        self.GOTO.format(root, self.DESTINATION_HOST, network,
+                                         name)
+                        for network in self.SPECIAL_NETWORKS]
+                    self.dispatch_tree(chain, name, special, [], chains)
+                for name, _ in chains:
+                    yield self.NEW_CHAIN.format(name)
+                yield self.JUMP.format(chain, root)
+                for _, lines in chains:
+                    for line in lines:
+                        yield line
+            trees += 1
+            segment = []
+            if custom is not None:  # The custom rule
+                yield custom
+
+    ''' This method builds the sub-chain name (and its sub-chains) for the
+        given rules of the base chain, as tuples (name, list of rules) added to
+        chains. rules are tuples (values, rule), where the first values
+        (already dispatched) are dropped level by level; options are the
+        options of the values still to be dispatched. lines, if given, is the
+        list the rules of the chain are added to (the chain is already in
+        chains)
+    '''
+    def dispatch_tree(self, chain, name, rules, options, chains, lines=None,
+                      path=None):
+        if lines is None:
+            lines = []
+            chains.append((name, lines))
+        if path is None:
+            path = name
+
+        if not options:  # A leaf: the rules, moved in this chain
+            prefix = "-A " + chain + " "
+            for _, rule in rules:
+                lines.append("-A " + name + " " + rule[len(prefix):])
+            return
+
+        values = []  # The values of the key, in order of appearance
+        for key, _ in rules:
+            if key[0] is not None and key[0] not in values:
+                values.append(key[0])
+        for value in values:
+            sub = path + "-" + value
+            if len(sub) > self.MAX_CHAIN_NAME:
+                sub = path.split("-")[0] + "-" + str(len(chains))
+            lines.append(self.GOTO.format(name, options[0], value, sub))
+            self.dispatch_tree(chain, sub,
+                               [(key[1:], rule) for key, rule in rules
+                                if key[0] in (None, value)],
+                               options[1:], chains)
+        # The other packets: they can match only the rules valid for any value
+        self.dispatch_tree(chain, name,
+                           [(key[1:], rule) for key, rule in rules
+                            if key[0] is None],
+                           options[1:], chains, lines, path + "-any")
+
+    ''' This method is used to get the net ip bound to an interface. The
+        interface must have been bound, otherwise we must exit
+    '''
+    def get_network(self, name):
+        network = self.symbols.network_of(name)
+        if network is None:
+            print("ERR: interface %s is not bound to any network" % name)
+            exit(-1)  # Unrecoverable error!
+        return network
+
+
+''' This function returns the engine working on the given directory, with the
+    options of target_compiler.parse_options (--ipset, --dispatch,
+    --dispatch-protocol and --counters). If the counters file cannot be read,
+    we must exit
+'''
+def from_options(directory, options):
+    counters = None
+    if options["counters"] is not None:
+        try:
+            counters = rule_optimizer.read_counters(options["counters"])
+        except IOError as _:
+            print("FATAL: unable to read the counters file %s"
+                  % options["counters"])
+            exit(-1)
+    return NetfilterEngine(directory, options["ipset"], options["dispatch"],
+                           options["dispatch_protocol"], counters,
+                           options["multiport"])
+
+
+''' This function returns the lists of ports (e.g. "22,80:90") that match
+    exactly the given ports (or port ranges), for the multiport module: the
+    overlapping and consecutive ports are joined into ranges, and each list
+    has at most limit ports, a range counting as two. None is returned if a
+    port is not understood
+'''
+def multiport_lists(ports, limit):
+    ranges = []
+    try:
+        for port in ports:
+            for separator in (":", "-"):
+                if separator in port:
+                    first, last = port.split(separator, 1)
+                    break
+            else:
+                first = last = port
+            ranges.append((int(first), int(last)))
+    except ValueError as _:
+        return None
+
+    joined = []
+    for first, last in sorted(ranges):
+        if joined and first <= joined[-1][1] + 1:
+            joined[-1] = (joined[-1][0], max(joined[-1][1], last))
+        else:
+            joined.append((first, last))
+
+    lists = []
+    current = []
+    size = 0
+    for first, last in joined:
+        weight = 1 if first == last else 2
+        if size + weight > limit:
+            lists.append(",".join(current))
+            current, size = [], 0
+        current.append(str(first) if first == last
+                       else "%d:%d" % (first, last))
+        size += weight
+    lists.append(",".join(current))
+    return lists
@@ -0,0 +1,630 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This module simulates a final configuration of NetfilterEngine (the
+    filter, mangle and nat tables, as written for iptables-restore) on big
+    batches of packets, without root privileges and without a kernel.
+    The packets are NumPy arrays (see Packets): source and destination
+    addresses and ports, protocol, input and output interface and connection
+    state. Each rule is matched against all the packets that reach it at
+    once, so millions of packets are classified per second.
+    A packet goes through the hooks of its path (see FORWARDED, INCOMING and
+    OUTGOING): a packet with both interfaces is forwarded, a packet without
+    output interface is for the firewall itself and a packet without input
+    interface comes from the firewall. The nat table is only walked by new
+    connections: DNAT and SNAT rewrite the packet for the hooks that follow.
+    For each packet the simulator gives the verdict, the rule that decided it
+    (the rule that dropped or rejected it, or the filter rule that accepted
+    it; -1 for the policy of a chain), the NAT rule that rewrote it and the
+    rewritten packet. The number of rules evaluated is counted too.
+    Rules with options the simulator does not know (e.g. the formulas of
+    Mignis+) never match.
+    Usage: ./netfilter_simulator.py [--packets <n>] [--flows <file>]
+               <fw.iptables> [<fw.ipset>]
+    Without --flows, n random packets (1000000 by default) are made up from
+    the interfaces and the addresses of the rules. A flows file has a packet
+    per line: src dst protocol sport dport iif oif [state], with "-" for a
+    missing interface
+'''
+
+import shlex
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:  # NumPy is needed only to simulate
+    numpy = None
+
+import cidr
+import netfilter_delta
+
+
+USAGE = "Usage: ./netfilter_simulator.py [--packets <n>] [--flows <file>] " + \
+        "<fw.iptables> [<fw.ipset>]"
+
+''' Following there are the verdicts, as stored in the verdict arrays '''
+UNDECIDED = -1
+ACCEPT = 0
+DROP = 1
+REJECT = 2
+VERDICTS = {"ACCEPT": ACCEPT, "DROP": DROP, "REJECT": REJECT}
+VERDICT_NAMES = ["ACCEPT", "DROP", "REJECT"]
+# The targets, but the chains, that change the path of a packet
+ACTIONS = ("ACCEPT", "DROP", "REJECT", "RETURN", "DNAT", "SNAT", "MASQUERADE")
+
+''' Following there are the connection states '''
+STATES = ["NEW", "ESTABLISHED", "RELATED", "INVALID", "UNTRACKED"]
+NEW = 0
+
+# The protocol numbers
+PROTOCOLS = {"icmp": 1, "tcp": 6, "udp": 17}
+# No interface (e.g. the input interface of a packet sent by the firewall)
+NO_INTERFACE = -1
+
+''' The hooks walked by each kind of packet, as (table, chain) '''
+FORWARDED = [("mangle", "PREROUTING"), ("nat", "PREROUTING"),
+             ("mangle", "FORWARD"), ("filter", "FORWARD"),
+             ("mangle", "POSTROUTING"), ("nat", "POSTROUTING")]
+INCOMING = [("mangle", "PREROUTING"), ("nat", "PREROUTING"),
+            ("mangle", "INPUT"), ("filter", "INPUT"), ("nat", "INPUT")]
+OUTGOING = [("mangle", "OUTPUT"), ("nat", "OUTPUT"), ("filter", "OUTPUT"),
+            ("mangle", "POSTROUTING"), ("nat", "POSTROUTING")]
+
+# The fields of a packet
+FIELDS = ("src", "dst", "sport", "dport", "proto", "iif", "oif", "state")
+# Packets are simulated in chunks of this size, that fit in the caches
+CHUNK = 65536
+# Maximum depth of nested jumps, as for iptables
+MAX_DEPTH = 64
+
+
+''' This class is a batch of packets: a NumPy array for each field. src and
+    dst are addresses as integers, proto is the protocol number (0 for any
+    protocol), iif and oif are indexes of interfaces of the simulator
+    (NO_INTERFACE if there is no interface) and state is the index of the
+    connection state in STATES
+'''
+class Packets(object):
+
+    ''' Constructor. The arrays must have the same length, state may be
+        omitted (all the packets are new)
+    '''
+    def __init__(self, src, dst, sport, dport, proto, iif, oif, state=None):
+        self.src = numpy.asarray(src, dtype=numpy.int64)
+        self.dst = numpy.asarray(dst, dtype=numpy.int64)
+        self.sport = numpy.asarray(sport, dtype=numpy.int32)
+        self.dport = numpy.asarray(dport, dtype=numpy.int32)
+        self.proto = numpy.asarray(proto, dtype=numpy.int16)
+        self.iif = numpy.asarray(iif, dtype=numpy.int16)
+        self.oif = numpy.asarray(oif, dtype=numpy.int16)
+        if state is None:
+            state = numpy.zeros(len(self.src), dtype=numpy.int8)
+        self.state = numpy.asarray(state, dtype=numpy.int8)
+
+    ''' The number of packets '''
+    def __len__(self):
+        return len(self.src)
+
+    ''' This method returns the packets in the given range, as a dictionary
+        of copies of the arrays by field
+    '''
+    def fields(self, start, stop):
+        return dict((field, getattr(self, field)[start:stop].copy())
+                    for field in FIELDS)
+
+
+''' This class is the result of a simulation: for each packet the verdict
+    (see VERDICTS), the index of the deciding rule, the index of the NAT rule
+    (-1 if not rewritten), whether it is masqueraded and the rewritten
+    packet. evaluated is the total number of rules evaluated
+'''
+class Result(object):
+
+    ''' Constructor: n undecided packets '''
+    def __init__(self, n):
+        self.verdict = numpy.empty(n, dtype=numpy.int8)
+        self.rule = numpy.empty(n, dtype=numpy.int32)
+        self.nat_rule = numpy.empty(n, dtype=numpy.int32)
+        self.masquerade = numpy.empty(n, dtype=bool)
+        self.packets = None
+        self.evaluated = 0
+
+
+''' This class is a rule of the ruleset, parsed into its matches and its
+    target. A rule that cannot be parsed is unknown, as a rule with an
+    unknown option: it never matches
+'''
+class Rule(object):
+
+    ''' Constructor. text is the rule without "-A <chain>", interface is
+        the function that gives the indexes of the interfaces matching a name
+        and sets maps the names of the ipsets to their networks
+    '''
+    def __init__(self, index, table, chain, text, interface, sets):
+        self.index = index
+        self.table = table
+        self.chain = chain
+        self.text = text
+        self.checks = []  # (kind, field, arguments)
+        self.target = None
+        self.goto = False
+        self.nat = None  # (address, port) of DNAT and SNAT
+        self.known = True  # False if an option is not understood
+        self.passive = False  # True if the target does nothing (see
+                              # Simulator)
+
+        try:
+            self.parse(shlex.split(text), interface, sets)
+        except (IndexError, KeyError, ValueError) as _:
+            self.known = False
+        # The fields the rule needs (the source, at least, gives the number
+        # of packets)
+        self.fields = sorted(set(["src"] + [field for _, field, _
+                                            in self.checks]))
+
+    ''' This method parses the options of the rule (see the constructor). A
+        ValueError (or a KeyError, or an IndexError) is raised if an option
+        is not well-formed
+    '''
+    def parse(self, options, interface, sets):
+        i = 0
+        while i < len(options):
+            option = options[i]
+            value = options[i + 1] if i + 1 < len(options) else None
+            i += 2
+            if option in ("-p", "--protocol"):
+                if value != "all":
+                    self.checks.append(("in", "proto",
+                                        [protocol_number(value)]))
+            elif option in ("-i", "--in-interface"):
+                self.checks.append(("in", "iif", interface(value)))
+            elif option in ("-o", "--out-interface"):
+                self.checks.append(("in", "oif", interface(value)))
+            elif option in ("-s", "--source"):
+                self.add_network("src", value)
+            elif option in ("-d", "--destination"):
+                self.add_network("dst", value)
+            elif option in ("--sport", "--source-port", "--sports"):
+                self.checks.append(("ports", "sport", port_ranges(value)))
+            elif option in ("--dport", "--destination-port", "--dports"):
+                self.checks.append(("ports", "dport", port_ranges(value)))
+            elif option in ("--state", "--ctstate"):
+                self.checks.append(("in", "state",
+                                    [STATES.index(state)
+                                     for state in value.split(",")]))
+            elif option == "--match-set":
+                # The direction: src or dst
+                self.checks.append(("set", options[i].split(",")[0],
+                                    sets.get(value, [])))
+                i += 1
+            elif option == "-m" and value in ("state", "conntrack",
+                                              "comment", "multiport", "set",
+                                              "tcp", "udp"):
+                pass
+            elif option in ("--comment", "--log-prefix", "--log-level",
+                            "--reject-with"):
+                pass
+            elif option in ("-j", "--jump", "-g", "--goto"):
+                self.target = value
+                self.goto = option in ("-g", "--goto")
+            elif option in ("--to-destination", "--to-source"):
+                address, _, port = value.partition(":")
+                self.nat = (cidr.ip_to_int(address),
+                            int(port.split("-")[0]) if port else None)
+            else:
+                self.known = False
+                i -= 1  # The value may be another option
+
+    ''' This method adds the check of an address against a network '''
+    def add_network(self, field, value):
+        address, length = cidr.parse_network(value)
+        if length > 0:
+            self.checks.append(("network", field,
+                                (address, cidr.netmask(length))))
+
+    ''' This method returns the mask of the packets (a dictionary of arrays
+        by field) matched by the rule
+    '''
+    def match(self, fields):
+        n = len(fields["src"])
+        if not self.known:
+            return numpy.zeros(n, dtype=bool)
+        mask = None
+        for kind, field, arguments in self.checks:
+            if kind == "network":
+                current = (fields[field] & arguments[1]) == arguments[0]
+            elif kind == "in":
+                values = fields[field]
+                if len(arguments) == 1:
+                    current = values == arguments[0]
+                else:
+                    current = numpy.isin(values, arguments)
+            elif kind == "ports":
+                values = fields[field]
+                current = None
+                for low, high in arguments:
+                    if low == high:
+                        check = values == low
+                    else:
+                        check = (values >= low) & (values <= high)
+                    current = check if current is None else current | check
+            else:  # ipset: src or dst
+                current = in_networks(fields[field], arguments)
+            mask = current if mask is None else mask & current
+        if mask is None:
+            return numpy.ones(n, dtype=bool)
+        return mask
+
+
+''' This function returns the number of a protocol, given by name or by
+    number
+'''
+def protocol_number(protocol):
+    if protocol.isdigit():
+        return int(protocol)
+    return PROTOCOLS[protocol.lower()]
+
+
+''' This function parses ports (80), port ranges (1024:2048) and lists of
+    them (80,443,8000:8080) into a list of (first, last) ranges
+'''
+def port_ranges(value):
+    ranges = []
+    for item in value.split(","):
+        if ":" in item:
+            first, last = item.split(":", 1)
+            ranges.append((int(first or 0), int(last or 65535)))
+        else:
+            ranges.append((int(item), int(item)))
+    return ranges
+
+
+''' This function returns the mask of the addresses contained in any of the
+    given networks. The networks are grouped by prefix length, so that each
+    length is checked at once
+'''
+def in_networks(addresses, networks):
+    mask = numpy.zeros(len(addresses), dtype=bool)
+    for length in sorted(set(length for _, length in networks)):
+        values = numpy.array([address for address, l in networks
+                              if l == length], dtype=numpy.int64)
+        mask |= numpy.isin(addresses & cidr.netmask(length), values)
+    return mask
+
+
+''' This function parses ipsets written in the format of "ipset restore", as
+    NetfilterEngine writes them (create, flush, add, swap and destroy). It
+    returns a dictionary that maps the name of each set to the list of its
+    networks
+'''
+def parse_ipsets(text):
+    sets = {}
+    for line in text.split("\n"):
+        fields = line.split()
+        if len(fields) >= 3 and fields[0] == "add":
+            sets.setdefault(fields[1], []).append(
+                cidr.parse_network(fields[2]))
+        elif len(fields) >= 2 and fields[0] == "create":
+            sets.setdefault(fields[1], [])
+        elif len(fields) >= 2 and fields[0] == "flush":
+            sets[fields[1]] = []
+        elif len(fields) >= 3 and fields[0] == "swap":
+            sets[fields[1]], sets[fields[2]] = \
+                sets.get(fields[2], []), sets.get(fields[1], [])
+        elif len(fields) >= 2 and fields[0] == "destroy":
+            sets.pop(fields[1], None)
+    return sets
+
+
+''' This class simulates a ruleset on batches of packets '''
+class Simulator(object):
+
+    ''' Constructor. text is a file for iptables-restore, ipsets the content
+        of its ipset file, if any. A ValueError is raised if the ruleset
+        cannot be loaded
+    '''
+    def __init__(self, text, ipsets=""):
+        ruleset = netfilter_delta.load(text)
+        self.sets = parse_ipsets(ipsets)
+        self.interfaces = []  # The names of the interfaces, by index
+        self.rules = []  # All the rules, by index
+        self.chains = {}  # The rules of each (table, chain)
+        self.policies = {}  # The policy of each built-in (table, chain)
+        self.unknown = 0  # Rules with options that are not understood
+
+        for table in ruleset.names:
+            for chain in ruleset.tables[table].chains:
+                rules = []
+                for text in ruleset.tables[table].rules[chain]:
+                    rule = Rule(len(self.rules), table, chain, text,
+                                self.interface, self.sets)
+                    if not rule.known:
+                        self.unknown += 1
+                    self.rules.append(rule)
+                    rules.append(rule)
+                self.chains[(table, chain)] = rules
+            for chain, policy in ruleset.tables[table].policies.items():
+                self.policies[(table, chain)] = policy
+        # Rules that never change the path of a packet, i.e. LOG rules and
+        # rules without target or with an unknown one
+        for rule in self.rules:
+            rule.passive = rule.target not in ACTIONS and \
+                (rule.table, rule.target) not in self.chains
+
+    ''' This method returns the indexes of the interfaces matched by a name
+        of iptables ("eth+" matches all the interfaces starting with "eth").
+        New interfaces are added as they are found
+    '''
+    def interface(self, name):
+        if name.endswith("+"):
+            return [i for i, interface in enumerate(self.interfaces)
+                    if interface.startswith(name[:-1])] or [NO_INTERFACE - 1]
+        if name not in self.interfaces:
+            self.interfaces.append(name)
+        return [self.interfaces.index(name)]
+
+    ''' This method simulates the ruleset on the packets and returns the
+        Result
+    '''
+    def simulate(self, packets):
+        result = Result(len(packets))
+        rewritten = dict((field, []) for field in FIELDS)
+        for start in range(0, len(packets), CHUNK):
+            fields = packets.fields(start, start + CHUNK)
+            verdict, rule, nat_rule, masquerade = self.simulate_chunk(
+                fields, result)
+            stop = start + len(verdict)
+            result.verdict[start:stop] = verdict
+            result.rule[start:stop] = rule
+            result.nat_rule[start:stop] = nat_rule
+            result.masquerade[start:stop] = masquerade
+            for field in FIELDS:
+                rewritten[field].append(fields[field])
+        result.packets = Packets(*[numpy.concatenate(rewritten[field])
+                                   if rewritten[field] else []
+                                   for field in FIELDS])
+        return result
+
+    ''' This method simulates a chunk of packets, given as a dictionary of
+        arrays that are rewritten by the NAT rules. It returns the arrays of
+        the verdicts, of the deciding rules, of the NAT rules and of the
+        masqueraded packets
+    '''
+    def simulate_chunk(self, fields, result):
+        n = len(fields["src"])
+        self.verdict = numpy.full(n, UNDECIDED, dtype=numpy.int8)
+        self.rule = numpy.full(n, -1, dtype=numpy.int32)
+        self.nat_rule = numpy.full(n, -1, dtype=numpy.int32)
+        self.masquerade = numpy.zeros(n, dtype=bool)
+        self.fields = fields
+        self.evaluated = 0
+
+        has_iif = fields["iif"] != NO_INTERFACE
+        has_oif = fields["oif"] != NO_INTERFACE
+        for path, mask in ((FORWARDED, has_iif & has_oif),
+                           (INCOMING, has_iif & ~has_oif),
+                           (OUTGOING, ~has_iif)):
+            packets = numpy.nonzero(mask)[0]
+            for table, chain in path:
+                if (table, chain) not in self.chains:
+                    continue
+                packets = packets[self.verdict[packets] == UNDECIDED]
+                if table == "nat":
+                    # Only new connections are NATted
+                    entering = packets[fields["state"][packets] == NEW]
+                else:
+                    entering = packets
+                left = self.walk(table, chain, entering, 0)
+                policy = VERDICTS.get(self.policies.get((table, chain)),
+                                      ACCEPT)
+                if policy != ACCEPT and len(left):
+                    self.verdict[left] = policy
+                    self.rule[left] = -1
+
+        result.evaluated += self.evaluated
+        verdict = self.verdict
+        verdict[verdict == UNDECIDED] = ACCEPT
+        return (verdict, self.rule, self.nat_rule, self.masquerade)
+
+    ''' This method walks the packets (array of indexes) through a chain and
+        returns the ones that reach its end, or return from it, without a
+        verdict. Packets accepted by the table are neither returned nor
+        decided: they just leave the table
+    '''
+    def walk(self, table, chain, packets, depth):
+        if depth > MAX_DEPTH:
+            raise ValueError("too many nested chains in %s" % chain)
+        returned = []
+        fields = self.fields
+        # The fields of the packets, gathered only once as long as the
+        # packets do not change
+        cache = {}
+        for rule in self.chains[(table, chain)]:
+            if not len(packets):
+                break
+            self.evaluated += len(packets)
+            for field in rule.fields:
+                if field not in cache:
+                    cache[field] = fields[field][packets]
+            mask = rule.match(cache)
+            if rule.passive or not mask.any():
+                continue
+            matched = packets[mask]
+            target = rule.target
+            mask = ~mask
+            packets = packets[mask]
+            cache = dict((field, values[mask])
+                         for field, values in cache.items())
+
+            if target in VERDICTS:
+                if target != "ACCEPT":
+                    self.verdict[matched] = VERDICTS[target]
+                    self.rule[matched] = rule.index
+                elif table == "filter":
+                    self.rule[matched] = rule.index
+            elif target == "RETURN":
+                returned.append(matched)
+            elif target in ("DNAT", "SNAT", "MASQUERADE"):
+                self.nat_rule[matched] = rule.index
+                if target == "MASQUERADE":
+                    self.masquerade[matched] = True
+                elif rule.nat is not None:
+                    address, port = rule.nat
+                    prefix = "dst" if target == "DNAT" else "src"
+                    fields[prefix][matched] = address
+                    if port is not None:
+                        fields[prefix[0] + "port"][matched] = port
+            elif (table, target) in self.chains:
+                left = self.walk(table, target, matched, depth + 1)
+                if rule.goto:  # Back to the calling chain
+                    returned.append(left)
+                elif len(left):
+                    packets = numpy.concatenate((packets, left))
+                    cache = {}
+        returned.append(packets)
+        return numpy.concatenate(returned)
+
+
+''' This function makes up n random packets for the simulator: the addresses
+    are taken, most of the times, from the networks of the rules, so that
+    the packets do match some rules. seed makes the packets reproducible
+'''
+def random_packets(simulator, n, seed=0):
+    rng = numpy.random.RandomState(seed)
+    networks = []
+    for rule in simulator.rules:
+        for kind, _, arguments in rule.checks:
+            if kind == "network":
+                networks.append(arguments)
+    if not networks:
+        networks = [(0, 0)]
+    base = numpy.array([address for address, _ in networks], dtype=numpy.int64)
+    masks = numpy.array([mask for _, mask in networks], dtype=numpy.int64)
+
+    def addresses():
+        chosen = rng.randint(0, len(networks), n)
+        values = base[chosen] | (rng.randint(0, 2 ** 32, n, numpy.int64) &
+                                 ~masks[chosen] & cidr.ALL_ONES)
+        # One address out of four is completely random
+        unrelated = rng.randint(0, 4, n) == 0
+        values[unrelated] = rng.randint(0, 2 ** 32, unrelated.sum(),
+                                        numpy.int64)
+        return values
+
+    def interfaces():
+        return rng.randint(NO_INTERFACE, len(simulator.interfaces), n)
+
+    ports = numpy.array([22, 25, 53, 80, 443, 8080], dtype=numpy.int32)
+    def random_ports():
+        values = rng.randint(1, 65536, n)
+        common = rng.randint(0, 2, n) == 0
+        values[common] = ports[rng.randint(0, len(ports), common.sum())]
+        return values
+
+    iif = interfaces()
+    oif = interfaces()
+    # No packet without both interfaces
+    oif[(iif == NO_INTERFACE) & (oif == NO_INTERFACE)] = 0
+    protocols = numpy.array([1, 6, 17], dtype=numpy.int16)
+    return Packets(addresses(), addresses(), random_ports(), random_ports(),
+                   protocols[rng.randint(0, 3, n)], iif, oif,
+                   rng.choice([0, 0, 0, 1, 2], n))
+
+
+''' This function reads the packets of a flows file (see the Usage). A
+    ValueError is raised if a line is not well-formed
+'''
+def read_flows(simulator, in_stream):
+    columns = [[] for _ in FIELDS]
+    for number, line in enumerate(in_stream):
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        try:
+            values = [cidr.ip_to_int(fields[0]), cidr.ip_to_int(fields[1]),
+                      int(fields[3]), int(fields[4]),
+                      protocol_number(fields[2])]
+            for name in fields[5:7]:
+                values.append(NO_INTERFACE if name == "-"
+                              else simulator.interface(name)[0])
+            values.append(STATES.index(fields[7].upper())
+                          if len(fields) > 7 else NEW)
+        except (IndexError, KeyError, ValueError) as _:
+            raise ValueError("bad flow at line %d" % (number + 1))
+        for column, value in zip(columns, values):
+            column.append(value)
+    return Packets(*columns)
+
+
+''' This function prints a report of a simulation '''
+def print_report(simulator, result, seconds):
+    n = len(result.verdict)
+    print("INF: %d packets simulated in %.3f seconds (%.0f packets/s)"
+          % (n, seconds, n / seconds if seconds > 0 else 0))
+    print("INF: %.2f rules evaluated per packet"
+          % (float(result.evaluated) / n if n else 0))
+    for verdict, name in enumerate(VERDICT_NAMES):
+        print("%-8s %10d" % (name, (result.verdict == verdict).sum()))
+    print("NAT      %10d" % (result.nat_rule >= 0).sum())
+    if simulator.unknown:
+        print("WARNING: %d rules with unknown options never match"
+              % simulator.unknown)
+
+    rules, counts = numpy.unique(result.rule, return_counts=True)
+    print("\nMost matched rules:")
+    for i in numpy.argsort(-counts)[:10]:
+        if rules[i] < 0:
+            description = "(policy)"
+        else:
+            rule = simulator.rules[rules[i]]
+            description = "%s %s: %s" % (rule.table, rule.chain, rule.text)
+        print("%10d %s" % (counts[i], description))
+
+
+''' Main function '''
+def main():
+    args = sys.argv[1:]
+    n = 1000000
+    flows = None
+    try:
+        while args and args[0] in ("--packets", "--flows"):
+            if args[0] == "--packets":
+                n = int(args[1])
+            else:
+                flows = args[1]
+            args = args[2:]
+    except (IndexError, ValueError) as _:
+        args = []
+    if len(args) not in (1, 2):
+        print(USAGE)
+        exit(-1)
+    if numpy is None:
+        print("FATAL: NumPy is needed by the simulator")
+        exit(-1)
+
+    try:
+        ipsets = netfilter_delta.read_file(args[1]) if len(args) > 1 else ""
+        simulator = Simulator(netfilter_delta.read_file(args[0]), ipsets)
+        if flows is None:
+            packets = random_packets(simulator, n)
+        else:
+            in_stream = open(flows, "r")
+            packets = read_flows(simulator, in_stream)
+            in_stream.close()
+    except IOError as e:
+        print("FATAL: %s" % e)
+        exit(-1)
+    except ValueError as e:
+        print("FATAL: %s" % e)
+        exit(-1)
+
+    start = time.time()
+    result = simulator.simulate(packets)
+    print_report(simulator, result, time.time() - start)
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,665 @@
+__author__ = "Alessio Zennaro"
+
+from generic_engine import GenericEngine
+import cidr
+import ir_model
+
+''' This class allows for the translation from mignis to nftables via the
+    intermediate representation. The final configuration is a script for
+    "nft -f": the whole table is replaced in a single transaction, so the
+    firewall is never left half configured.
+    The rules have the same meaning of the ones of NetfilterEngine, but:
+     * runs of consecutive rules that differ only in one address or in one
+       port are written as a single rule with an anonymous set
+     * runs of consecutive dNAT rules that differ only in their addresses are
+       written as a single "dnat to ip daddr map" rule
+     * the filter chains dispatch the packets with verdict maps on the
+       interface (iifname vmap, oifname vmap): each packet is checked only
+       against the rules of its interface and the rules valid for any
+       interface. The same is done for the bindings of the interfaces and
+       for the logging chains (on the protocol)
+    Set and map lookups take constant time in the kernel, whatever the number
+    of elements. Custom rules (CSTM) are written for iptables, so they are only
+    reported as comments.
+    See example_engine.py file for full documentation regarding the structure of
+    the file/class.
+'''
+
+
+class NftablesEngine(GenericEngine):
+
+    # The name of the table
+    TABLE = "mignis"
+
+    # The table is declared (in case it does not exist yet), deleted and
+    # defined again: nft -f runs the whole script in one transaction, so the
+    # previous rules are replaced atomically and the other tables are left
+    # untouched
+    HEADER = "#!/usr/sbin/nft -f\n" + \
+             "table ip {0}\n" + \
+             "delete table ip {0}\n" + \
+             "table ip {0} {{\n"
+    FOOTER = "}\n"
+
+    BASE_CHAIN = "\tchain {0} {{\n" + \
+                 "\t\ttype {1} hook {2} priority {3}; policy {4};\n"
+    CHAIN = "\tchain {0} {{\n"
+    END_CHAIN = "\t}\n"
+    RULE = "\t\t{0}\n"
+    NAMED_SET = "\tset {0} {{\n" + \
+                "\t\ttype ipv4_addr; flags interval;\n" + \
+                "\t\telements = {{ {1} }}\n" + \
+                "\t}}\n"
+    CUSTOM = "\t# {0}\n"
+
+    # The base chains: name, type, hook, priority and policy. The mangle
+    # chain has the same role of the PREROUTING chain of the mangle table of
+    # NetfilterEngine
+    MANGLE = ("mangle", "filter", "prerouting", "mangle", "drop")
+    INPUT = ("input", "filter", "input", "filter", "drop")
+    FORWARD = ("forward", "filter", "forward", "filter", "drop")
+    OUTPUT = ("output", "filter", "output", "filter", "drop")
+    NAT_PREROUTING = ("nat_prerouting", "nat", "prerouting", "dstnat",
+                      "accept")
+    NAT_POSTROUTING = ("nat_postrouting", "nat", "postrouting", "srcnat",
+                       "accept")
+
+    DEFAULT_ESTABLISHED = "ct state established,related accept"
+    DEFAULT_FILTER = [
+        "iifname \"lo\" accept comment \"loopback (default rules)\"",
+        "ip daddr 255.255.255.255 accept comment \"broadcast (default r.)\"",
+        "ip daddr 224.0.0.0/4 accept comment \"multicast (default r.)\"",
+    ]
+    DEFAULT_MANGLE = [
+        "ct state invalid,untracked drop comment \"inv. def.\"",
+        "ip daddr 255.255.255.255 accept comment \"default r.\"",
+        "ip daddr 224.0.0.0/4 accept comment \"default r.\"",
+    ]
+
+    # Logging chains: the packets are dispatched on the protocol. The last
+    # element of each tuple is the prefix of the packets of any other protocol
+    LOGGING_FILTER = ("filter_drop", "DROP-{0} ", ["icmp", "udp", "tcp"],
+                      "DROP-UNK ")
+    LOGGING_MANGLE = ("mangle_drop", "MANGLE-DROP-{0} ", ["ICMP", "UDP", "TCP"],
+                      "MANGLE-DROP-UNK ")
+    LOG_DROP = "log prefix \"{0}\" drop"
+    JUMP = "jump {0}"
+
+    # Sources that are never accepted on an interface bound to 0.0.0.0/0,
+    # together with the networks of the other interfaces
+    BOUND_SET = "bound_networks"
+    LOOPBACK = "127.0.0.0/8"
+
+    IIFNAME = "iifname"
+    OIFNAME = "oifname"
+    SADDR = "ip saddr"
+    DADDR = "ip daddr"
+    SPORT = "th sport"
+    DPORT = "th dport"
+    PROTOCOL = "meta l4proto {0}"
+
+    NFT_ACCEPT = "accept"
+    NFT_DROP = "drop"
+    NFT_REJECT = "reject"
+    NFT_MASQUERADE = "masquerade"
+    NFT_SNAT = "snat to {0}"
+    NFT_DNAT = "dnat to {0}"
+    NFT_DNAT_MAP = "dnat to ip daddr map {{ {0} }}"
+    NFT_NEW_DROP = "ct state new drop"
+
+    # Maximum length of a comment
+    MAX_COMMENT = 127
+    COMMENT = "comment \"{0}\""
+    RUN_COMMENT = "{0} (+{1} rules)"
+
+    # The fields along which the rules can be merged (see ir_model.runs)
+    AXES = ("src", "dst", "sport", "dport", "dnat")
+
+    ''' Constructor '''
+    def __init__(self, directory):
+        GenericEngine.__init__(self, directory)
+        self.language = "nft"
+
+    ''' Ok, let's do the job! '''
+    def translate(self, configuration):
+        return "".join(self.fragments(configuration))
+
+    ''' The fragments are written as soon as they are translated '''
+    def translate_fragments(self, configuration):
+        return self.fragments(configuration)
+
+    ''' This method does the actual translation. It yields the fragments of the
+        final configuration: the named sets, the mangle chain with the
+        bindings, the filter chains and the nat chains
+    '''
+    def fragments(self, configuration):
+        def_rul = True  # Default rules
+        logging = True  # Logging
+        estb = False  # Established
+        # The interfaces, in order of binding, and the rules of each one
+        bind_order = []
+        bind_rules = {}
+        # Networks of the interfaces that do not accept everything
+        bound_networks = [self.LOOPBACK]
+        # The rules of the filter chains: (chain, interface, rule) where
+        # interface is the one the packets must come from (input, forward) or
+        # go to (output), or None if the rule is valid for any interface
+        self.filter_rules = []
+        self.mangle_rules = []  # dNAT drops
+        self.nat_prerouting = []
+        self.nat_postrouting = []
+        self.custom_rules = []
+
+        configuration = self.parse_configuration(configuration)
+        self.build_symbol_table(configuration)
+        for axis, run in self.timed(ir_model.runs(configuration.records,
+                                                  self.collapse_key,
+                                                  self.AXES)):
+            record = run[0]
+            if axis is not None:  # A run of rules
+                self.translate_run(axis, run)
+            elif record.command == self.OPTN:
+                if record.keyword == "default_rules":
+                    def_rul = self.get_flag(record, def_rul)
+                elif record.keyword == "logging":
+                    logging = self.get_flag(record, logging)
+                elif record.keyword == "established":
+                    estb = self.get_flag(record, estb)
+                else:
+                    print("WARNING: Unknown option %s" % record.keyword)
+            elif record.command == self.BIND:
+                interface = record.interface
+                if interface not in bind_rules:
+                    bind_order.append(interface)
+                    bind_rules[interface] = []
+                if record.network == "0.0.0.0/0":
+                    # The sources bound to the other interfaces are dropped
+                    bind_rules[interface].append(
+                        self.SADDR + " @" + self.BOUND_SET + " " +
+                        self.NFT_DROP + " " + self.comment(record.line))
+                    bind_rules[interface].append(
+                        self.NFT_ACCEPT + " " + self.comment(record.line))
+                else:
+                    bind_rules[interface].append(
+                        self.SADDR + " " + record.network + " " +
+                        self.NFT_ACCEPT + " " + self.comment(record.line))
+                    bound_networks.append(record.network)
+            elif record.command in ir_model.RULES:
+                self.translate_rule(record)
+            elif record.command in ir_model.POLICIES:
+                # As in NetfilterEngine, a policy is a DROP or RJCT rule put
+                # below all the other rules
+                self.translate_rule(record.as_rule())
+            elif record.command == self.CSTM:
+                print("WARNING: Custom rules are iptables rules, they are " +
+                      "not translated: %s" % record.rule)
+                self.custom_rules.append(record.line)
+
+        yield self.HEADER.format(self.TABLE)
+
+        # Named sets
+        yield self.NAMED_SET.format(
+            self.BOUND_SET, ", ".join(distinct_elements(bound_networks)))
+
+        # Logging chains
+        if logging:
+            for chain in (self.LOGGING_FILTER, self.LOGGING_MANGLE):
+                for fragment in self.logging_chain(*chain):
+                    yield fragment
+
+        # The mangle chain: default rules, dNAT drops and bindings, dispatched
+        # on the input interface. The loopback interface is always accepted
+        yield self.BASE_CHAIN.format(*self.MANGLE)
+        if def_rul:
+            for rule in self.DEFAULT_MANGLE:
+                yield self.RULE.format(rule)
+        for rule in self.mangle_rules:
+            yield self.RULE.format(rule)
+        verdicts = []
+        for interface in bind_order:
+            verdicts.append((interface,
+                             self.JUMP.format(self.chain_name("bind",
+                                                              interface))))
+        if "lo" not in bind_rules:
+            verdicts.append(("lo", self.NFT_ACCEPT))
+        else:  # lo is bound, but everything is accepted anyway at the end
+            bind_rules["lo"].append(self.NFT_ACCEPT)
+        yield self.RULE.format(self.IIFNAME + " vmap " +
+                               vmap_elements(verdicts))
+        if logging:
+            yield self.RULE.format(self.JUMP.format(self.LOGGING_MANGLE[0]))
+        yield self.END_CHAIN
+        for interface in bind_order:
+            yield self.CHAIN.format(self.chain_name("bind", interface))
+            for rule in bind_rules[interface]:
+                yield self.RULE.format(rule)
+            yield self.END_CHAIN
+
+        # The filter chains
+        for chain in (self.INPUT, self.FORWARD, self.OUTPUT):
+            base = []
+            if estb:
+                base.append(self.DEFAULT_ESTABLISHED)
+            if def_rul and chain == self.INPUT:
+                base.extend(self.DEFAULT_FILTER)
+            rules = [(interface, rule)
+                     for name, interface, rule in self.filter_rules
+                     if name == chain[0]]
+            for fragment in self.filter_chain(chain, base, rules, logging):
+                yield fragment
+
+        # The nat chains
+        for chain, rules in ((self.NAT_PREROUTING, self.nat_prerouting),
+                             (self.NAT_POSTROUTING, self.nat_postrouting)):
+            yield self.BASE_CHAIN.format(*chain)
+            for rule in rules:
+                yield self.RULE.format(rule)
+            yield self.END_CHAIN
+
+        for line in self.custom_rules:
+            yield self.CUSTOM.format(line)
+        yield self.FOOTER
+
+    ''' This method returns the value of a yes/no option. If the value is not
+        valid, a warning is printed and the current value is returned
+    '''
+    def get_flag(self, option, current):
+        if option.value == "yes":
+            return True
+        elif option.value == "no":
+            return False
+        print("WARNING: Value for option '%s' not valid: %s"
+              % (option.keyword, option.value))
+        return current
+
+    ''' This method yields a logging chain: the packets are dispatched on
+        their protocol to a chain that logs and drops them
+    '''
+    def logging_chain(self, name, prefix, protocols, other):
+        verdicts = []
+        for protocol in protocols:
+            sub_chain = name + "_" + protocol.lower()
+            yield self.CHAIN.format(sub_chain)
+            yield self.RULE.format(self.LOG_DROP.format(
+                prefix.format(protocol)))
+            yield self.END_CHAIN
+            verdicts.append((protocol.lower(), self.JUMP.format(sub_chain)))
+        yield self.CHAIN.format(name)
+        yield self.RULE.format("meta l4proto vmap " +
+                               vmap_elements(verdicts, False))
+        yield self.RULE.format(self.LOG_DROP.format(other))
+        yield self.END_CHAIN
+
+    ''' This method yields a filter chain. base are the rules that come before
+        all the others, rules is the list of (interface, rule).
+        The rules bound to an interface are put, together with the rules valid
+        for any interface, in a chain of that interface, in the same order:
+        packets go to the chain of their interface through a verdict map, so
+        they meet the same rules, in the same order, they would meet in a
+        single chain. The packets of the other interfaces only meet the rules
+        valid for any interface
+    '''
+    def filter_chain(self, chain, base, rules, logging):
+        key = self.OIFNAME if chain == self.OUTPUT else self.IIFNAME
+        interfaces = []
+        for interface, _ in rules:
+            if interface is not None and interface not in interfaces:
+                interfaces.append(interface)
+        ending = [self.JUMP.format(self.LOGGING_FILTER[0])] if logging else []
+
+        yield self.BASE_CHAIN.format(*chain)
+        for rule in base:
+            yield self.RULE.format(rule)
+        if interfaces:
+            # goto: when the chain of the interface ends, the policy of the
+            # base chain is applied
+            yield self.RULE.format(key + " vmap " + vmap_elements(
+                [(interface, "goto " + self.chain_name(chain[0], interface))
+                 for interface in interfaces]))
+        for interface, rule in rules:
+            if interface is None:
+                yield self.RULE.format(rule)
+        for rule in ending:
+            yield self.RULE.format(rule)
+        yield self.END_CHAIN
+
+        for current in interfaces:
+            yield self.CHAIN.format(self.chain_name(chain[0], current))
+            for interface, rule in rules:
+                if interface is None or interface == current:
+                    yield self.RULE.format(rule)
+            for rule in ending:
+                yield self.RULE.format(rule)
+            yield self.END_CHAIN
+
+    ''' This method returns the name of the chain of an interface. Only
+        letters, digits and underscores are kept
+    '''
+    def chain_name(self, prefix, interface):
+        return prefix + "_" + "".join(c if c.isalnum() else "_"
+                                      for c in interface)
+
+    ''' This method returns a comment for a rule '''
+    def comment(self, text):
+        return self.COMMENT.format(text.replace("\"", "'")[:self.MAX_COMMENT])
+
+    ''' This method returns the key of a rule (or policy) along the given axis
+        (see ir_model.runs): "src", "dst" (the address of an endpoint), "sport",
+        "dport" (the port of an endpoint) or "dnat" (the addresses of a dNAT
+        rule and of its destination). None is returned if the rule cannot be
+        merged along the axis
+    '''
+    def collapse_key(self, record, axis):
+        if record.command in ir_model.POLICIES:
+            rule = record.as_rule()
+        elif record.command in ir_model.RULES:
+            rule = record
+        else:
+            return None
+
+        src, dst = rule.source, rule.destination
+        common = (rule.command, rule.protocol, rule.formula)
+        if axis == "dnat":
+            if rule.command != self.ALLW or \
+                    rule.snat.kind != ir_model.NONE or \
+                    not rule.dnat.is_address() or not dst.is_address() or \
+                    dst.port != rule.dnat.port:
+                return None
+            return common + (str(src), dst.interface, dst.port,
+                             rule.dnat.interface)
+        nats = (str(rule.snat), str(rule.dnat))
+        if axis == "src" and src.is_address():
+            return common + nats + (src.interface, src.port, str(dst))
+        if axis == "dst" and dst.is_address():
+            return common + nats + (dst.interface, dst.port, str(src))
+        if axis == "sport" and src.has_port():
+            return common + nats + (src.host, src.interface, str(dst))
+        if axis == "dport" and dst.has_port():
+            return common + nats + (dst.host, dst.interface, str(src))
+        return None
+
+    ''' This method translates a run of rules (or policies) that differ only
+        along the given axis, as a single rule with sets (or a map)
+    '''
+    def translate_run(self, axis, run):
+        run = [record.as_rule() if record.command in ir_model.POLICIES
+               else record for record in run]
+        sets = {}
+        if axis == "src":
+            sets["src"] = [rule.source.address for rule in run]
+        elif axis == "dst":
+            sets["dst"] = [rule.destination.address for rule in run]
+        elif axis == "sport":
+            sets["sport"] = [rule.source.port for rule in run]
+        elif axis == "dport":
+            sets["dport"] = [rule.destination.port for rule in run]
+        else:
+            sets["dst"] = [rule.destination.address for rule in run]
+            sets["dnat"] = [(rule.dnat.address, rule.destination.address)
+                            for rule in run]
+        self.translate_rule(run[0], sets,
+                            self.RUN_COMMENT.format(run[0].line, len(run) - 1))
+
+    ''' This method returns the statements that match an endpoint. side is
+        "src" or "dst"; addresses and ports, if given, are the sets that
+        replace the address and the port of the endpoint
+    '''
+    def endpoint_match(self, endpoint, side, addresses=None, ports=None):
+        if side == "src":
+            address_key, interface_key, port_key = \
+                self.SADDR, self.IIFNAME, self.SPORT
+        else:
+            address_key, interface_key, port_key = \
+                self.DADDR, self.OIFNAME, self.DPORT
+
+        match = []
+        if addresses is not None:
+            match.append(address_key + " " + set_elements(addresses))
+        elif endpoint.is_address():
+            match.append(address_key + " " + endpoint.address)
+        elif endpoint.kind == ir_model.INTERFACE:
+            match.append(interface_key + " \"" + endpoint.address + "\"")
+        if endpoint.interface != "":  # Mignis+
+            match.append(interface_key + " \"" + endpoint.interface + "\"")
+        if ports is not None:
+            match.append(port_key + " " + set_elements(ports, True))
+        elif endpoint.has_port():
+            match.append(port_key + " " + nft_port(endpoint.port))
+        return match
+
+    ''' This method returns the interface an endpoint is bound to, or None '''
+    def endpoint_interface(self, endpoint):
+        if endpoint.interface != "":
+            return endpoint.interface
+        if endpoint.kind == ir_model.INTERFACE:
+            return endpoint.address
+        return None
+
+    ''' This method translates a single firewall rule (ALLW, DROP, RJCT, TALW),
+        given as an ir_model.Rule, into filter and nat rules. sets are the
+        sets of a run (see translate_run); the line of the rule is used as
+        comment, unless another comment is given
+    '''
+    def translate_rule(self, rule, sets=None, comment=None):
+        if sets is None:
+            sets = {}
+        comment = self.comment(rule.line if comment is None else comment)
+
+        if rule.formula != "":
+            # Formulas are iptables matches. Without them an allow rule would
+            # allow more packets, a deny rule denies more packets
+            if rule.command in (self.DROP, self.RJCT):
+                print("WARNING: Formula ignored by nftables: %s" % rule.line)
+            else:
+                print("WARNING: Rule with a formula skipped by nftables: %s"
+                      % rule.line)
+                return
+
+        protocol = []
+        if rule.protocol != self.ANY:
+            protocol = [self.PROTOCOL.format(rule.protocol.lower())]
+
+        if rule.command == self.DROP:
+            verdict = self.NFT_DROP
+        elif rule.command == self.RJCT:
+            verdict = self.NFT_REJECT
+        else:
+            verdict = self.NFT_ACCEPT
+
+        src_sets = (sets.get("src"), sets.get("sport"))
+        dst_sets = (sets.get("dst"), sets.get("dport"))
+        self.add_filter_rule(rule.source, rule.destination, src_sets,
+                             dst_sets, protocol, verdict, comment)
+        if rule.command == self.TALW:  # <> allows the other direction too
+            self.add_filter_rule(rule.destination, rule.source, dst_sets,
+                                 src_sets, protocol, verdict, comment)
+
+        # We consider NATs only when the operator is a >
+        if rule.command == self.ALLW:
+            self.translate_nat(rule, sets, protocol, comment)
+
+    ''' This method adds the filter rule for the packets going from the src
+        endpoint to the dst endpoint. src_sets and dst_sets are the tuples
+        (addresses, ports) of the sets of the endpoints
+    '''
+    def add_filter_rule(self, src, dst, src_sets, dst_sets, protocol, verdict,
+                        comment):
+        s_local = src.kind == ir_model.LOCAL
+        d_local = dst.kind == ir_model.LOCAL
+        src_match = self.endpoint_match(src, "src", *src_sets)
+        dst_match = self.endpoint_match(dst, "dst", *dst_sets)
+
+        if s_local and d_local:
+            # Weird case: source and destination are "local"...
+            # Here we need 127.0.0.0/8, in both directions
+            self.add_statement(
+                self.OUTPUT[0], None, protocol + src_match +
+                [self.DADDR + " " + self.LOOPBACK] + dst_match, verdict,
+                comment)
+            self.add_statement(
+                self.INPUT[0], None, protocol +
+                [self.SADDR + " " + self.LOOPBACK] +
+                self.endpoint_match(dst, "src", *dst_sets) +
+                self.endpoint_match(src, "dst", *src_sets), verdict,
+                comment)
+        elif d_local:
+            self.add_statement(self.INPUT[0], self.endpoint_interface(src),
+                               protocol + src_match + dst_match, verdict,
+                               comment)
+        elif s_local:
+            self.add_statement(self.OUTPUT[0], self.endpoint_interface(dst),
+                               protocol + src_match + dst_match, verdict,
+                               comment)
+        else:
+            self.add_statement(self.FORWARD[0], self.endpoint_interface(src),
+                               protocol + src_match + dst_match, verdict,
+                               comment)
+
+    ''' This method adds a rule, made of a list of matches, a verdict and a
+        comment, to a filter chain
+    '''
+    def add_statement(self, chain, interface, match, verdict, comment):
+        self.filter_rules.append((chain, interface,
+                                  " ".join(match + [verdict, comment])))
+
+    ''' This method translates the NATs of an ALLW rule '''
+    def translate_nat(self, rule, sets, protocol, comment):
+        src, dst = rule.source, rule.destination
+        # NAT rules need addresses: if the source is an interface, translate
+        # it into its corresponding net_ip
+        if rule.snat.kind != ir_model.NONE and \
+                src.kind == ir_model.INTERFACE:
+            src_match = [self.SADDR + " " + self.get_network(src.address)]
+            if src.has_port():
+                src_match.append(self.SPORT + " " + nft_port(src.port))
+        else:
+            src_match = self.endpoint_match(src, "src", sets.get("src"),
+                                            sets.get("sport"))
+        dst_match = self.endpoint_match(dst, "dst", sets.get("dst"),
+                                        sets.get("dport"))
+
+        if rule.snat.kind == ir_model.MASQUERADE:
+            self.nat_postrouting.append(
+                " ".join(protocol + src_match + dst_match +
+                         [self.NFT_MASQUERADE, comment]))
+        elif rule.snat.kind != ir_model.NONE:  # A Source NAT is requested
+            if not rule.snat.is_address():
+                print("WARNING: Source NAT to an interface skipped by " +
+                      "nftables: %s" % rule.line)
+                return
+            to_source = rule.snat.address
+            if rule.snat.has_port():  # The sNAT port
+                to_source += ":" + rule.snat.port
+            self.nat_postrouting.append(
+                " ".join(protocol + src_match + dst_match +
+                         [self.NFT_SNAT.format(to_source), comment]))
+        elif rule.dnat.kind != ir_model.NONE:  # Destination NAT
+            if not dst.is_address():
+                print("WARNING: Destination NAT to an interface skipped by " +
+                      "nftables: %s" % rule.line)
+                return
+            # Output interfaces are unknown before routing
+            src_match = [match for match in src_match
+                         if not match.startswith(self.OIFNAME)]
+            # We avoid to open unnecessary doors: new connections towards the
+            # real destination are dropped
+            dport = []
+            if dst.has_port():
+                dport = [self.DPORT + " " + nft_port(dst.port)]
+            if sets.get("dst") is not None:
+                dest_mangle = [self.DADDR + " " + set_elements(sets["dst"])]
+            else:
+                dest_mangle = [self.DADDR + " " + dst.address]
+            self.mangle_rules.append(
+                " ".join(protocol + src_match + dest_mangle + dport +
+                         [self.NFT_NEW_DROP, comment]))
+
+            if rule.dnat.is_address():
+                dest_nat = [self.DADDR + " " + rule.dnat.address]
+            else:
+                dest_nat = [self.DADDR + " " +
+                            self.get_network(rule.dnat.address)]
+            if rule.dnat.has_port():
+                dest_nat.append(self.DPORT + " " + nft_port(rule.dnat.port))
+            if sets.get("dnat") is not None:
+                # A map from the public addresses to the real destinations
+                dest_nat = dest_nat[1:]
+                action = self.NFT_DNAT_MAP.format(", ".join(
+                    public + " : " + private
+                    for public, private in sets["dnat"]))
+            else:
+                to_destination = dst.address
+                if dst.has_port():
+                    to_destination += ":" + nft_port(dst.port)
+                action = self.NFT_DNAT.format(to_destination)
+            self.nat_prerouting.append(
+                " ".join(protocol + src_match + dest_nat + [action, comment]))
+
+    ''' This method is used to get the net ip bound to an interface. The
+        interface must have been bound, otherwise we must exit
+    '''
+    def get_network(self, name):
+        network = self.symbols.network_of(name)
+        if network is None:
+            print("ERR: interface %s is not bound to any network" % name)
+            exit(-1)  # Unrecoverable error!
+        return network
+
+
+''' This function converts a port (or a range of ports) of the intermediate
+    representation into the nftables syntax
+'''
+def nft_port(port):
+    return port.replace(":", "-")
+
+
+''' This function returns the list of the elements of a set made of the given
+    addresses (or ports, if ports is True). Repeated elements are removed, and
+    so are the networks (port ranges) contained in other elements:
+    overlapping intervals are not allowed in a set
+'''
+def distinct_elements(values, ports=False):
+    elements = []
+    for value in values:
+        if ports:
+            value = nft_port(value)
+        if value not in elements:
+            elements.append(value)
+
+    try:
+        if ports:
+            ranges = [tuple(int(p) for p in (e.split("-") + [e])[:2])
+                      if "-" in e else (int(e), int(e)) for e in elements]
+        else:
+            ranges = [cidr.network_range(cidr.parse_network(e))
+                      for e in elements]
+    except ValueError as _:
+        ranges = None  # Not checked, nft will complain if needed
+
+    if ranges is not None:
+        elements = [element for i, element in enumerate(elements)
+                    if not any(j != i and ranges[j][0] <= ranges[i][0] and
+                               ranges[i][1] <= ranges[j][1] and
+                               (ranges[j] != ranges[i] or j < i)
+                               for j in range(len(elements)))]
+    return elements
+
+
+''' This function returns an anonymous set made of the given addresses (or
+    ports, if ports is True), see distinct_elements. A set of a single
+    element is just the element
+'''
+def set_elements(values, ports=False):
+    elements = distinct_elements(values, ports)
+    if len(elements) == 1:
+        return elements[0]
+    return "{ " + ", ".join(elements) + " }"
+
+
+''' This function returns the elements of a verdict map: a list of tuples
+    (key, verdict). Keys are quoted, unless quote is False
+'''
+def vmap_elements(verdicts, quote=True):
+    template = "\"{0}\" : {1}" if quote else "{0} : {1}"
+    return "{ " + ", ".join(template.format(key, verdict)
+                            for key, verdict in verdicts) + " }"
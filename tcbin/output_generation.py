@@ -0,0 +1,233 @@
+__author__ = "Alessio Zennaro"
+
+''' This module publishes the final configurations atomically. Each
+    compilation writes its final files in a new generation, a numbered folder
+    of <directory>final.generations/, and <directory>final is a symbolic link
+    to the generation published last. The link is replaced with a rename, so
+    anybody reading final/ (e.g. a deploy) sees either the whole old
+    generation or the whole new one, never a half-written or empty folder,
+    even if the compiler crashes.
+    Before a generation is published, a manifest (MANIFEST.json) with the
+    SHA-256 hash and the size of each file is written in it and, optionally,
+    a bundle (bundle.tar) with all the files and the manifest, so that they
+    can be read with a single I/O. The engines hand their files to the
+    generation in batches (see write), that hashes them while writing them
+    and does not flush them one by one: the whole generation is flushed to
+    disk at once, just before the link is replaced.
+    The last KEEP_GENERATIONS generations are kept, so that a previous one can
+    be published again by hand:
+        ln -sfn final.generations/<number> final.tmp && mv -T final.tmp final
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import time
+
+
+# The folder of the generations, next to the final link
+GENERATIONS = "final.generations"
+# The number of generations kept, the published one included
+KEEP_GENERATIONS = 3
+# The manifest and the bundle of a generation
+MANIFEST = "MANIFEST.json"
+BUNDLE = "bundle.tar"
+# The size of the blocks the files are hashed by
+BLOCK_SIZE = 1024 * 1024
+
+
+''' This class is a generation of final configurations, being written. The
+    final files are written in its path, then the generation is published
+'''
+class OutputGeneration(object):
+
+    ''' Constructor. A new, empty generation of the final folder of
+        directory is created. An OSError is raised if it cannot be created
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.root = os.path.join(directory, GENERATIONS)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        # The number of the new generation comes after all the existing ones:
+        # mkdir fails if a concurrent compilation took it first
+        number = max(generation_numbers(self.root) + [0]) + 1
+        while True:
+            self.name = "%06d" % number
+            try:
+                os.mkdir(os.path.join(self.root, self.name))
+                break
+            except OSError as _:
+                if not os.path.isdir(os.path.join(self.root, self.name)):
+                    raise
+                number += 1
+        # The folder the final files are written in
+        self.path = os.path.join(self.root, self.name) + "/"
+        # The hash and the size of the files written by write, by file name
+        self.digests = {}
+
+    ''' This method writes a batch of final files in the generation (see
+        write_batch), recording their hashes for the manifest. It returns the
+        names of the files that could not be written
+    '''
+    def write(self, files):
+        return write_batch(files, self.digests)
+
+    ''' This method publishes the generation: the manifest (and the bundle,
+        if requested) is written, everything is flushed to disk and the final
+        link is replaced. The old generations are deleted, but the last
+        KEEP_GENERATIONS. It returns the manifest. An IOError or an OSError is
+        raised if something goes wrong: the published generation does not
+        change
+    '''
+    def publish(self, bundle=False):
+        manifest = self.manifest()
+        out_stream = open(self.path + MANIFEST, "w")
+        json.dump(manifest, out_stream, indent=2, sort_keys=True)
+        out_stream.write("\n")
+        out_stream.close()
+        files = sorted(manifest["files"]) + [MANIFEST]
+        if bundle:
+            archive = tarfile.open(self.path + BUNDLE, "w")
+            for name in files:
+                archive.add(self.path + name, name)
+            archive.close()
+            files.append(BUNDLE)
+        self.flush(files)
+
+        # The new link is created aside and renamed over the old one
+        final = os.path.join(self.directory, "final")
+        link = final + ".tmp"
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.join(GENERATIONS, self.name), link)
+        old = None
+        if os.path.isdir(final) and not os.path.islink(final):
+            # A final folder written before the generations existed: it is
+            # moved aside, so that final is missing only between the two
+            # renames, and deleted once the link has replaced it
+            old = final + ".old"
+            if os.path.isdir(old) and not os.path.islink(old):
+                shutil.rmtree(old)
+            elif os.path.lexists(old):
+                os.remove(old)
+            os.rename(final, old)
+        os.rename(link, final)
+        sync_directory(self.directory)
+        if old is not None:
+            shutil.rmtree(old, True)
+
+        self.prune()
+        return manifest
+
+    ''' This method returns the manifest of the generation: its name, the time
+        it has been created at and, for each file (by path relative to the
+        generation), its SHA-256 hash and its size. The files written by
+        write are not read again, unless their size has changed since
+    '''
+    def manifest(self):
+        files = {}
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                file_name = os.path.join(root, name)
+                relative = os.path.relpath(file_name, self.path)
+                if relative in (MANIFEST, BUNDLE):
+                    continue
+                size = os.path.getsize(file_name)
+                entry = self.digests.get(os.path.normpath(file_name))
+                if entry is None or entry["size"] != size:
+                    digest = hashlib.sha256()
+                    in_stream = open(file_name, "rb")
+                    for block in iter(lambda: in_stream.read(BLOCK_SIZE),
+                                      b""):
+                        digest.update(block)
+                    in_stream.close()
+                    entry = {"sha256": digest.hexdigest(), "size": size}
+                files[relative.replace(os.sep, "/")] = entry
+        return {"generation": self.name,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "files": files}
+
+    ''' This method flushes the given files of the generation (by path
+        relative to it) to disk, then the folders they are in and the folder
+        of the generations, that holds the new generation
+    '''
+    def flush(self, files):
+        folders = set([self.root])
+        for name in files:
+            file_name = os.path.join(self.path, name)
+            fd = os.open(file_name, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            folders.add(os.path.dirname(file_name))
+        for folder in sorted(folders):
+            sync_directory(folder)
+
+    ''' This method deletes the generation, that will never be published
+        (e.g. the compilation failed)
+    '''
+    def discard(self):
+        shutil.rmtree(self.path, True)
+
+    ''' This method deletes the generations older than the published one, but
+        the last KEEP_GENERATIONS (the published one included). The newer
+        ones may still be written by a concurrent compilation
+    '''
+    def prune(self):
+        current = int(self.name)
+        older = sorted([number for number in generation_numbers(self.root)
+                        if number < current], reverse=True)
+        for number in older[KEEP_GENERATIONS - 1:]:
+            shutil.rmtree(os.path.join(self.root, "%06d" % number), True)
+
+
+''' This function writes a batch of files, given as tuples (file name,
+    content), without flushing them. If digests is given, the SHA-256 hash
+    and the size of each file written are recorded in it, by file name (see
+    OutputGeneration.manifest). It returns the names of the files that could
+    not be written
+'''
+def write_batch(files, digests=None):
+    failed = []
+    for file_name, content in files:
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        try:
+            out_stream = open(file_name, "wb")
+            try:
+                out_stream.write(content)
+            finally:
+                out_stream.close()
+        except IOError as _:
+            failed.append(file_name)
+            continue
+        if digests is not None:
+            digests[os.path.normpath(file_name)] = {
+                "sha256": hashlib.sha256(content).hexdigest(),
+                "size": len(content)}
+    return failed
+
+
+''' This function returns the numbers of the generations in root '''
+def generation_numbers(root):
+    return [int(name) for name in os.listdir(root) if name.isdigit()]
+
+
+''' This function flushes the entries of a directory (e.g. a rename) to
+    disk, where directories can be opened
+'''
+def sync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError as _:  # Not supported (e.g. Windows)
+        return
+    try:
+        os.fsync(fd)
+    except OSError as _:
+        pass
+    finally:
+        os.close(fd)
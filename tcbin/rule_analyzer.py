@@ -0,0 +1,532 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' This module analyzes the firewall rules of a configuration written in
+    intermediate representation and finds:
+     * shadowed rules: allow rules (ALLW, TALW) whose packets are all dropped
+       or rejected by a DROP or RJCT rule, so they are useless
+     * redundant rules: rules whose packets are all matched by another rule
+       with the same action and the same NATs
+     * conflicting rules: rules that overlap another rule with a different
+       action (only for a part of their packets) or with different NATs
+    Unlike the checks of the frontend, which compare the rules as strings, the
+    packets matched by a rule are compared: a rule towards a /24 network is
+    shadowed by a DROP rule towards the /16 network containing it, a rule on
+    port 80 is redundant if the same hosts are allowed on all the ports, and so
+    on.
+    Every rule is translated into one entry (two for TALW rules, one for each
+    direction) made of the source and destination networks, zones (the
+    interface the endpoint is behind, or the firewall itself), port ranges,
+    protocol and formula. Entries are indexed in a radix trie of source
+    networks whose values are radix tries of destination networks, so that
+    each entry is compared only with the entries whose networks contain its
+    own. The entries whose networks are contained in its own can only
+    conflict with it, so they are looked for only among the entries with a
+    different action or NAT, which have their own tries. When NumPy is
+    available, the entries that share the same networks are compared all
+    together.
+    Usage: ./rule_analyzer.py <directory>
+'''
+
+import itertools
+import os
+import sys
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional: the analysis is just slower
+    numpy = None
+
+import cidr
+import ir_model
+from symbol_table import SymbolTable
+
+
+USAGE = "Usage: ./rule_analyzer.py <directory>"
+
+''' Following there are the kinds of finding '''
+SHADOWED = "shadowed"
+REDUNDANT = "redundant"
+CONFLICTING = "conflicting"
+
+# Commands that drop or reject packets
+DENY = (ir_model.DROP, ir_model.RJCT)
+# The range of an unspecified port
+ALL_PORTS = (0, 65535)
+# The network of an endpoint without an address
+ANY_NETWORK = (0, 0)
+# Entries sharing the same networks are compared with NumPy only if they are
+# at least this many: for fewer entries plain Python is faster
+VECTOR_MIN = 64
+
+
+''' A finding of the analysis: the rule at line_number (whose intermediate
+    representation is line) is shadowed by, redundant with or conflicting
+    with the rule at other_number (other_line)
+'''
+class Finding(object):
+    __slots__ = ("kind", "line_number", "line", "other_number", "other_line")
+
+    # How each kind of finding is written
+    FORMATS = {
+        SHADOWED: "line {0} is shadowed by line {1}",
+        REDUNDANT: "line {0} is redundant with line {1}",
+        CONFLICTING: "line {0} conflicts with line {1}",
+    }
+
+    ''' Constructor '''
+    def __init__(self, kind, line_number, line, other_number, other_line):
+        self.kind = kind
+        self.line_number = line_number
+        self.line = line
+        self.other_number = other_number
+        self.other_line = other_line
+
+    ''' The finding as it is shown to the user '''
+    def __str__(self):
+        return self.FORMATS[self.kind].format(self.line_number,
+                                              self.other_number) + \
+               "\n    " + self.line + "\n    " + self.other_line
+
+
+''' A group of entries with the same source and destination networks '''
+class Bucket(object):
+    __slots__ = ("destination", "entries")
+
+    ''' Constructor '''
+    def __init__(self, destination):
+        self.destination = destination
+        self.entries = []
+
+
+''' This class analyzes a single configuration. Each analyzer must be used
+    only once
+'''
+class RuleAnalyzer(object):
+
+    # The columns of the entries: all of them are integers
+    COLUMNS = ("rule", "src_zone", "dst_zone", "sport_lo", "sport_hi",
+               "dport_lo", "dport_hi", "protocol", "formula", "command",
+               "nat", "deny")
+
+    ''' Constructor '''
+    def __init__(self):
+        self.symbols = SymbolTable()
+        self.rules = []  # (line number, record) of each rule
+        # Codes of the zones, protocols, formulas, commands and NATs: 0 always
+        # means "any" (or "none")
+        self.codes = {}
+        # The entries, by column. Duplicates are entries equal to a previous
+        # one, they are not indexed
+        self.columns = dict((name, []) for name in self.COLUMNS)
+        self.networks = []  # (source, destination) networks of each entry
+        self.duplicates = {}  # Entry -> the equal entry found before it
+        self.seen = {}  # Entry key -> first entry with that key
+        # The index of all the entries: source network -> (source network,
+        # trie of destination networks -> bucket)
+        self.index = cidr.RadixTrie()
+        # The same kind of index for the deny entries, the allow entries and
+        # the allow entries with NATs
+        self.deny_index = cidr.RadixTrie()
+        self.allow_index = cidr.RadixTrie()
+        self.nat_index = cidr.RadixTrie()
+        self.arrays = None  # The columns as NumPy arrays, when available
+        # Results by entry: the rule that shadows it or makes it redundant
+        self.shadowed = {}
+        self.redundant = {}
+        # Results by rule: the first rule it conflicts with
+        self.conflicts = {}
+
+    ''' This method returns the code of a value of the given kind (zone,
+        protocol...). The empty string and ANY have code 0
+    '''
+    def code(self, kind, value):
+        if value == "" or value == ir_model.ANY:
+            return 0
+        codes = self.codes.setdefault(kind, {})
+        return codes.setdefault(value, len(codes) + 1)
+
+    ''' This method returns the tuple (network, zone, port range) of an
+        endpoint. A ValueError is raised if it cannot be analyzed
+    '''
+    def endpoint(self, endpoint):
+        if endpoint.is_address():
+            network = cidr.parse_network(endpoint.address)
+            zone = self.symbols.interface_of(network) or ""
+        elif endpoint.kind == ir_model.INTERFACE:
+            # Packets of an interface come from (or go to) its network
+            zone = endpoint.address
+            try:
+                network = cidr.parse_network(self.symbols.network_of(zone))
+            except (ValueError, TypeError, AttributeError) as _:
+                network = ANY_NETWORK
+        elif endpoint.kind == ir_model.LOCAL:  # The firewall is a zone too
+            network, zone = ANY_NETWORK, ir_model.LOCAL
+        else:
+            network, zone = ANY_NETWORK, ""
+
+        if endpoint.interface != "":  # Mignis+ endpoint
+            zone = endpoint.interface
+
+        return (network, self.code("zone", zone), port_range(endpoint.port))
+
+    ''' This method adds the entries of a rule '''
+    def add_rule(self, rule_index, rule):
+        source = self.endpoint(rule.source)
+        destination = self.endpoint(rule.destination)
+        self.add_entry(rule_index, rule, source, destination)
+        if rule.command == ir_model.TALW:  # The other direction is allowed too
+            self.add_entry(rule_index, rule, destination, source)
+
+    ''' This method adds a single entry, from the source endpoint to the
+        destination endpoint of a rule
+    '''
+    def add_entry(self, rule_index, rule, source, destination):
+        entry = len(self.networks)
+        nat = str(rule.snat) + ";" + str(rule.dnat)
+        values = (rule_index, source[1], destination[1],
+                  source[2][0], source[2][1],
+                  destination[2][0], destination[2][1],
+                  self.code("protocol", rule.protocol),
+                  self.code("formula", rule.formula),
+                  self.code("command", rule.command),
+                  self.code("nat", nat if nat != ";;0;;;0" else ""),
+                  int(rule.command in DENY))
+        for name, value in zip(self.COLUMNS, values):
+            self.columns[name].append(value)
+        self.networks.append((source[0], destination[0]))
+
+        # Equal entries are compared only once
+        key = (source[0], destination[0]) + values[1:]
+        if key in self.seen:
+            self.duplicates[entry] = self.seen[key]
+            return
+        self.seen[key] = entry
+
+        insert(self.index, entry, source[0], destination[0])
+        if rule.command in DENY:
+            insert(self.deny_index, entry, source[0], destination[0])
+        else:
+            insert(self.allow_index, entry, source[0], destination[0])
+            if values[10] != 0:
+                insert(self.nat_index, entry, source[0], destination[0])
+
+    ''' This method returns the indexes of the entries that may conflict with
+        entry i
+    '''
+    def conflict_indexes(self, i):
+        if self.columns["deny"][i]:
+            return (self.allow_index, self.deny_index)
+        if self.columns["nat"][i] != 0:
+            return (self.deny_index, self.allow_index)
+        return (self.deny_index, self.nat_index)
+
+    ''' This method converts the buckets with many entries (and the columns)
+        into NumPy arrays, if NumPy is available
+    '''
+    def vectorize(self):
+        if numpy is None:
+            return
+        self.arrays = dict((name, numpy.array(values, dtype=numpy.int64))
+                           for name, values in self.columns.items())
+        for index in (self.index, self.deny_index, self.allow_index,
+                      self.nat_index):
+            for _, inner in index.within(ANY_NETWORK):
+                for bucket in inner.within(ANY_NETWORK):
+                    if len(bucket.entries) >= VECTOR_MIN:
+                        bucket.entries = numpy.array(bucket.entries,
+                                                     dtype=numpy.int64)
+
+    ''' This method compares entry i with the entries j (an integer or a NumPy
+        array of integers) whose source network contains the source network of
+        i. up is True if their destination networks contain the destination
+        network of i (False if they are contained in it), src_exact and
+        dst_exact are True if the networks are the same ones of i.
+        It returns a tuple of three values (or arrays): j shadows i, j makes i
+        redundant, j conflicts with i
+    '''
+    def relations(self, col, i, j, up, src_exact, dst_exact):
+        c = self.columns
+        rule_i, rule_j = c["rule"][i], col["rule"][j]
+        sz_i, sz_j = c["src_zone"][i], col["src_zone"][j]
+        dz_i, dz_j = c["dst_zone"][i], col["dst_zone"][j]
+        spl_i, spl_j = c["sport_lo"][i], col["sport_lo"][j]
+        sph_i, sph_j = c["sport_hi"][i], col["sport_hi"][j]
+        dpl_i, dpl_j = c["dport_lo"][i], col["dport_lo"][j]
+        dph_i, dph_j = c["dport_hi"][i], col["dport_hi"][j]
+        pr_i, pr_j = c["protocol"][i], col["protocol"][j]
+        f_i, f_j = c["formula"][i], col["formula"][j]
+        deny_i, deny_j = c["deny"][i], col["deny"][j]
+
+        # Do the packets of the two entries overlap?
+        overlap = (rule_i != rule_j) & \
+                  ((sz_i == 0) | (sz_j == 0) | (sz_i == sz_j)) & \
+                  ((dz_i == 0) | (dz_j == 0) | (dz_i == dz_j)) & \
+                  (spl_j <= sph_i) & (spl_i <= sph_j) & \
+                  (dpl_j <= dph_i) & (dpl_i <= dph_j) & \
+                  ((pr_i == 0) | (pr_j == 0) | (pr_i == pr_j)) & \
+                  ((f_i == 0) | (f_j == 0) | (f_i == f_j))
+        # Does j contain i? The source network of j always contains the one
+        # of i
+        j_contains = overlap & up & \
+                     ((sz_j == 0) | (sz_j == sz_i)) & \
+                     ((dz_j == 0) | (dz_j == dz_i)) & \
+                     (spl_j <= spl_i) & (sph_i <= sph_j) & \
+                     (dpl_j <= dpl_i) & (dph_i <= dph_j) & \
+                     ((pr_j == 0) | (pr_j == pr_i)) & \
+                     ((f_j == 0) | (f_j == f_i))
+        # Does i contain j? Only if the source networks are the same
+        i_contains = overlap & src_exact & (dst_exact | (up ^ True)) & \
+                     ((sz_i == 0) | (sz_j == sz_i)) & \
+                     ((dz_i == 0) | (dz_j == dz_i)) & \
+                     (spl_i <= spl_j) & (sph_j <= sph_i) & \
+                     (dpl_i <= dpl_j) & (dph_j <= dph_i) & \
+                     ((pr_i == 0) | (pr_j == pr_i)) & \
+                     ((f_i == 0) | (f_j == f_i))
+
+        shadows = j_contains & (deny_i == 0) & (deny_j == 1)
+        # When the entries are equal, the first rule is the one that counts
+        redundant = j_contains & (c["command"][i] == col["command"][j]) & \
+                    (c["nat"][i] == col["nat"][j]) & \
+                    ((i_contains ^ True) | (rule_j < rule_i))
+        # An allow rule partially overlapped by a deny rule, two deny rules
+        # with different commands, two allow rules with different NATs. If a
+        # deny rule contains an allow rule, the latter is shadowed; if an allow
+        # rule contains a deny rule, this is just an exception
+        conflicts = overlap & \
+                    (((deny_i != deny_j) &
+                      ((j_contains | i_contains) ^ True)) |
+                     ((deny_i == 1) & (deny_j == 1) &
+                      (c["command"][i] != col["command"][j])) |
+                     ((deny_i == 0) & (deny_j == 0) &
+                      (c["nat"][i] != col["nat"][j])))
+
+        return (shadows, redundant, conflicts)
+
+    ''' This method compares entry i with all the entries of a bucket and
+        records the results
+    '''
+    def compare(self, i, bucket, up, src_exact, dst_exact):
+        entries = bucket.entries
+        if isinstance(entries, list):
+            found = ([], [], [])
+            for j in entries:
+                results = self.relations(self.columns, i, j, up, src_exact,
+                                         dst_exact)
+                for result, matches in zip(results, found):
+                    if result:
+                        matches.append(j)
+        else:  # NumPy array: all the entries are compared at once
+            results = self.relations(self.arrays, i, entries, up, src_exact,
+                                     dst_exact)
+            found = [entries[result].tolist() for result in results]
+
+        rules = self.columns["rule"]
+        shadows, redundant, conflicts = found
+        for j in shadows:
+            if i not in self.shadowed or rules[j] < self.shadowed[i]:
+                self.shadowed[i] = rules[j]
+        for j in redundant:
+            if i not in self.redundant or rules[j] < self.redundant[i]:
+                self.redundant[i] = rules[j]
+
+        deny = self.columns["deny"]
+        for j in conflicts:
+            # The conflict is reported on the allow rule or, if both rules
+            # allow or deny, on the last one
+            if deny[i] != deny[j]:
+                target, other = (rules[j], rules[i]) if deny[i] else \
+                                (rules[i], rules[j])
+            else:
+                target, other = max(rules[i], rules[j]), \
+                                min(rules[i], rules[j])
+            self.add_conflict(target, other)
+
+    ''' This method records that rule target conflicts with rule other '''
+    def add_conflict(self, target, other):
+        if target not in self.conflicts or other < self.conflicts[target]:
+            self.conflicts[target] = other
+
+    ''' This method compares each entry with all the entries it overlaps '''
+    def compare_all(self):
+        for i, (source, destination) in enumerate(self.networks):
+            if i in self.duplicates:
+                continue
+            # Destination networks containing the one of i...
+            for src_network, inner in self.index.matches(source):
+                src_exact = src_network == source
+                for bucket in inner.matches(destination):
+                    self.compare(i, bucket, True, src_exact,
+                                 bucket.destination == destination)
+            # ... and contained in it
+            for index in self.conflict_indexes(i):
+                for src_network, inner in index.matches(source):
+                    src_exact = src_network == source
+                    for bucket in inner.within(destination):
+                        if bucket.destination != destination:
+                            self.compare(i, bucket, False, src_exact, False)
+
+        # Duplicate entries share the results of the first equal entry
+        rules = self.columns["rule"]
+        for entry, first in sorted(self.duplicates.items()):
+            if first in self.shadowed:
+                self.shadowed[entry] = self.shadowed[first]
+            if rules[first] != rules[entry]:
+                self.redundant[entry] = rules[first]
+            elif first in self.redundant:
+                self.redundant[entry] = self.redundant[first]
+            if rules[first] in self.conflicts:
+                self.add_conflict(rules[entry], self.conflicts[rules[first]])
+
+    ''' This method analyzes a configuration, given as a string or as any
+        iterable of lines (e.g. an open file), and returns the list of the
+        findings, sorted by line number
+    '''
+    def analyze(self, configuration):
+        if isinstance(configuration, str):
+            configuration = configuration.split("\n")
+
+        parser = ir_model.Parser()
+        for number, line in enumerate(configuration):
+            record = parser.parse_line(line.rstrip("\n"))
+            if record is None:
+                continue
+            if record.command == ir_model.BIND:
+                self.symbols.bind(record.interface, record.network)
+            elif record.command in ir_model.RULES:
+                self.rules.append((number + 1, record))
+
+        # Bindings are all known only now
+        entries = {}  # Rule -> its entries
+        for rule_index, (number, rule) in enumerate(self.rules):
+            first = len(self.networks)
+            try:
+                self.add_rule(rule_index, rule)
+            except ValueError as e:
+                print("WARNING: line %d cannot be analyzed: %s" % (number, e))
+                continue
+            entries[rule_index] = range(first, len(self.networks))
+
+        self.vectorize()
+        self.compare_all()
+
+        findings = []
+        for rule_index, rule_entries in entries.items():
+            # A rule is shadowed (or redundant) only if all its entries are
+            if all(entry in self.shadowed for entry in rule_entries):
+                other = min(self.shadowed[entry] for entry in rule_entries)
+                findings.append(self.finding(SHADOWED, rule_index, other))
+            elif all(entry in self.redundant for entry in rule_entries):
+                other = min(self.redundant[entry] for entry in rule_entries)
+                findings.append(self.finding(REDUNDANT, rule_index, other))
+            if rule_index in self.conflicts:
+                findings.append(self.finding(CONFLICTING, rule_index,
+                                             self.conflicts[rule_index]))
+
+        findings.sort(key=lambda finding: finding.line_number)
+        return findings
+
+    ''' This method builds the finding of the given kind between two rules '''
+    def finding(self, kind, rule_index, other_index):
+        number, rule = self.rules[rule_index]
+        other_number, other = self.rules[other_index]
+        return Finding(kind, number, rule.line, other_number, other.line)
+
+
+''' This function inserts an entry in an index, given its source and
+    destination networks
+'''
+def insert(index, entry, source, destination):
+    inner = index.setdefault(source, (source, cidr.RadixTrie()))[1]
+    inner.setdefault(destination, Bucket(destination)).entries.append(entry)
+
+
+''' This function returns the range of a port of the intermediate
+    representation as a tuple (first, last). A ValueError is raised if the
+    port is not well-formed
+'''
+def port_range(port):
+    if port == ir_model.NO_PORT:
+        return ALL_PORTS
+    for separator in (":", "-"):
+        if separator in port:
+            first, last = port.split(separator, 1)
+            return (int(first), int(last))
+    return (int(port), int(port))
+
+
+''' This function analyzes a configuration and returns its findings (see
+    RuleAnalyzer.analyze)
+'''
+def analyze(configuration):
+    return RuleAnalyzer().analyze(configuration)
+
+
+''' This function analyzes all the configurations written in intermediate
+    representation in <directory>compiled/ and prints the findings. It returns
+    the total number of findings
+'''
+def analyze_directory(directory):
+    total = 0
+    for i in itertools.count():
+        file_name = directory + "compiled/fw" + str(i) + ".config"
+        if not os.path.isfile(file_name):
+            break
+        try:
+            in_stream = open(file_name, "r")
+            findings = analyze(in_stream)
+            in_stream.close()
+        except IOError as _:
+            print("ERR: Skipping input file %s since it isn't readable"
+                  % file_name)
+            continue
+        report(i, findings)
+        total += len(findings)
+
+    return total
+
+
+''' This function analyzes the configurations of conf_list, written in
+    intermediate representation (e.g. compiled in memory by the frontend, see
+    mignis_frontend.py), and prints the findings as analyze_directory does.
+    It returns the total number of findings
+'''
+def analyze_configurations(conf_list):
+    total = 0
+    for i, configuration in enumerate(conf_list):
+        findings = analyze(configuration)
+        report(i, findings)
+        total += len(findings)
+    return total
+
+
+''' This function prints the findings of the configuration with index i '''
+def report(i, findings):
+    counts = dict((kind, 0) for kind in Finding.FORMATS)
+    for finding in findings:
+        counts[finding.kind] += 1
+        print("WARNING: fw%d.config, %s" % (i, finding))
+    print("INF: fw%d.config: %d shadowed, %d redundant, %d conflicting "
+          "rules" % (i, counts[SHADOWED], counts[REDUNDANT],
+                     counts[CONFLICTING]))
+
+
+''' Main function '''
+def main():
+    if len(sys.argv) != 2:
+        print(USAGE)
+        exit(-1)
+
+    directory = sys.argv[1]
+    if directory[len(directory) - 1] != '/':
+        print("FATAL: <directory> must end with a '/' character")
+        exit(-1)
+
+    # The exit status tells if something has been found
+    exit(1 if analyze_directory(directory) > 0 else 0)
+
+
+''' The entry point of the program is the main() function '''
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+__author__ = "Alessio Zennaro"
+
+''' This module reorders the firewall rules of a configuration written in
+    intermediate representation, so that the rules that match more packets
+    come first and the packets walk shorter chains.
+    The number of packets matched by each rule comes from a dump of the
+    running firewall taken with "iptables-save -c": each rule written by
+    NetfilterEngine has its line of intermediate representation as comment,
+    so the counters are mapped back to the rules.
+    A rule is moved only by swapping it with the previous one, and only when
+    no packet can be matched by both of them (in any chain of any table the
+    rules are written in): the two rules never decide on the same packet, so
+    the swap cannot change any verdict, and neither can a sequence of swaps.
+    The match of a rule is taken from the options written by NetfilterEngine
+    (chain, interfaces, networks, ports, protocol). Formulas can only narrow
+    a match, so they are not considered; rules that cannot be understood are
+    never moved, and so are the other lines (options, bindings, custom
+    rules), that no rule can cross.
+'''
+
+import hashlib
+import re
+
+import cidr
+import ir_model
+from rule_analyzer import ANY_NETWORK, port_range
+
+
+# A rule of a dump taken with "iptables-save -c": the counters, the chain and
+# the comment (quoted or not)
+COUNTER_LINE = re.compile(r'^\[(\d+):\d+\]\s+-A\s+(\S+)\s.*' +
+                          r'--comment\s+("(?:[^"\\]|\\.)*"|\S+)')
+# The comment of a rule that matches an ipset (see NetfilterEngine)
+IPSET_COMMENT = re.compile(r'^(.*) \(\+\d+ rules in set \S+\)$')
+# The comment of a rule that matches a list of ports (see NetfilterEngine)
+MULTIPORT_COMMENT = re.compile(r'^(.*) \(\+\d+ rules\)$')
+# The chains the rules are written in, without the dispatch
+FILTER_CHAINS = ("INPUT", "FORWARD", "OUTPUT")
+# The network of the loopback
+LOOPBACK = cidr.parse_network("127.0.0.0/8")
+
+
+''' This function reads a dump of the rules taken with "iptables-save -c",
+    given as any iterable of lines (e.g. an open file), and returns a
+    dictionary that maps each line of intermediate representation to the
+    number of packets matched by the filter rules with that comment, in any
+    chain (the rules may be dispatched in sub-chains)
+'''
+def parse_counters(dump):
+    counters = {}
+    table = None
+    for line in dump:
+        line = line.strip()
+        if line.startswith("*"):
+            table = line[1:]
+            continue
+        match = COUNTER_LINE.match(line)
+        if match is None or table != "filter":
+            continue
+        comment = match.group(3)
+        if comment.startswith("\""):
+            comment = comment[1:-1].replace("\\\"", "\"")
+        for pattern in (IPSET_COMMENT, MULTIPORT_COMMENT):
+            merged = pattern.match(comment)
+            if merged is not None:
+                comment = merged.group(1)
+        counters[comment] = counters.get(comment, 0) + int(match.group(1))
+    return counters
+
+
+''' This function reads the counters from a file (see parse_counters). An
+    IOError is raised if the file cannot be read
+'''
+def read_counters(file_name):
+    in_stream = open(file_name, "r")
+    try:
+        return parse_counters(in_stream)
+    finally:
+        in_stream.close()
+
+
+''' This function returns a digest of the counters, used in the signature of
+    the engines
+'''
+def counters_digest(counters):
+    return hashlib.sha256(repr(sorted(counters.items()))
+                          .encode("utf-8")).hexdigest()
+
+
+''' This class reorders the rules of a single configuration '''
+class RuleOptimizer(object):
+
+    ''' Constructor. counters maps the lines of intermediate representation
+        to the number of matched packets, symbols is the symbol table of the
+        configuration
+    '''
+    def __init__(self, counters, symbols):
+        self.counters = counters
+        self.symbols = symbols
+        self.moved = 0  # The number of moved rules
+        self.depth_before = 0.0  # Average depth of the matched rules
+        self.depth_after = 0.0
+
+    ''' This method returns the tuple (interface, network, port range) of an
+        endpoint, as matched by the options of the final rules. A ValueError is
+        raised if it cannot be understood
+    '''
+    def endpoint(self, endpoint):
+        interface = None
+        network = ANY_NETWORK
+        if endpoint.is_address():
+            network = cidr.parse_network(endpoint.address)
+        elif endpoint.kind == ir_model.INTERFACE:
+            interface = endpoint.address
+        if endpoint.interface != "":  # Mignis+
+            interface = endpoint.interface
+        return (interface, network, port_range(endpoint.port))
+
+    ''' This method returns the network bound to an interface. A ValueError is
+        raised if there is no such network
+    '''
+    def network_of(self, interface):
+        network = self.symbols.network_of(interface)
+        if network is None:
+            raise ValueError("interface %s is not bound" % interface)
+        return cidr.parse_network(network)
+
+    ''' This method returns the matches of a rule (or policy): a list of tuples
+        (chain, input interface, output interface, source network,
+        destination network, source ports, destination ports, protocol), one
+        for each rule written by NetfilterEngine. None means "any" for the
+        interfaces and the protocol. A ValueError is raised if the rule cannot
+        be understood
+    '''
+    def matches(self, record):
+        rule = record.as_rule() if record.command in ir_model.POLICIES \
+            else record
+        protocol = None if rule.protocol == ir_model.ANY \
+            else rule.protocol.lower()
+        s_intf, s_net, s_ports = self.endpoint(rule.source)
+        d_intf, d_net, d_ports = self.endpoint(rule.destination)
+        s_local = rule.source.kind == ir_model.LOCAL
+        d_local = rule.destination.kind == ir_model.LOCAL
+
+        if s_local and d_local:
+            matches = [("OUTPUT", None, None, ANY_NETWORK, LOOPBACK,
+                        s_ports, d_ports, protocol),
+                       ("INPUT", None, None, ANY_NETWORK, ANY_NETWORK,
+                        d_ports, s_ports, protocol)]
+        elif d_local:
+            matches = [("INPUT", s_intf, None, s_net, ANY_NETWORK,
+                        s_ports, d_ports, protocol)]
+            if rule.command == ir_model.TALW:
+                matches.append(("OUTPUT", None, s_intf, ANY_NETWORK, s_net,
+                                d_ports, s_ports, protocol))
+        elif s_local:
+            matches = [("OUTPUT", None, d_intf, ANY_NETWORK, d_net,
+                        s_ports, d_ports, protocol)]
+            if rule.command == ir_model.TALW:
+                matches.append(("INPUT", d_intf, None, d_net, ANY_NETWORK,
+                                d_ports, s_ports, protocol))
+        else:
+            matches = [("FORWARD", s_intf, d_intf, s_net, d_net,
+                        s_ports, d_ports, protocol)]
+            if rule.command == ir_model.TALW:
+                matches.append(("FORWARD", d_intf, s_intf, d_net, s_net,
+                                d_ports, s_ports, protocol))
+
+        # NAT rules: their order matters in the nat table too
+        if rule.command == ir_model.ALLW and rule.snat.kind != ir_model.NONE:
+            if rule.source.kind == ir_model.INTERFACE:
+                s_net = self.network_of(rule.source.address)
+            matches.append(("POSTROUTING", None, d_intf, s_net, d_net,
+                            s_ports, d_ports, protocol))
+        elif rule.command == ir_model.ALLW and \
+                rule.dnat.kind != ir_model.NONE:
+            if rule.dnat.is_address():
+                n_net = cidr.parse_network(rule.dnat.address)
+            else:
+                n_net = self.network_of(rule.dnat.address)
+            matches.append(("PREROUTING", s_intf, None, s_net, n_net,
+                            s_ports, port_range(rule.dnat.port), protocol))
+        return matches
+
+    ''' This method reorders the records of a configuration and returns the
+        new list. Each rule moves up, one swap at a time, as long as the
+        previous rule matched fewer packets and no packet can be matched by
+        both of them. The statistics of the last reordering are kept in moved,
+        depth_before and depth_after
+    '''
+    def reorder(self, records):
+        records = list(records)
+        # The comments of the policies are the lines of their rules
+        hits = [self.counters.get((record.as_rule()
+                                   if record.command in ir_model.POLICIES
+                                   else record).line, 0)
+                for record in records]
+        # The matches of each rule, None if the record cannot be moved
+        matches = []
+        for record in records:
+            if record.command in ir_model.RULES or \
+                    record.command in ir_model.POLICIES:
+                try:
+                    matches.append(self.matches(record))
+                except ValueError as e:
+                    print("WARNING: rule not reordered (%s): %s"
+                          % (e, record.line))
+                    matches.append(None)
+            else:
+                matches.append(None)
+        positions = list(range(len(records)))
+
+        self.depth_before = average_depth(matches, hits)
+        for i in range(1, len(records)):
+            j = i
+            while j > 0 and hits[j - 1] < hits[j] and \
+                    matches[j] is not None and matches[j - 1] is not None \
+                    and not overlap(matches[j - 1], matches[j]):
+                for values in (records, hits, matches, positions):
+                    values[j - 1], values[j] = values[j], values[j - 1]
+                j -= 1
+        self.depth_after = average_depth(matches, hits)
+        self.moved = sum(1 for i, position in enumerate(positions)
+                         if i != position)
+        return records
+
+
+''' This function returns True if a packet can be matched by both the rules
+    whose matches are given (see RuleOptimizer.matches)
+'''
+def overlap(first, second):
+    for a in first:
+        for b in second:
+            if a[0] == b[0] and \
+                    (a[1] is None or b[1] is None or a[1] == b[1]) and \
+                    (a[2] is None or b[2] is None or a[2] == b[2]) and \
+                    (cidr.contains(a[3], b[3]) or cidr.contains(b[3], a[3])) \
+                    and \
+                    (cidr.contains(a[4], b[4]) or cidr.contains(b[4], a[4])) \
+                    and a[5][0] <= b[5][1] and b[5][0] <= a[5][1] and \
+                    a[6][0] <= b[6][1] and b[6][0] <= a[6][1] and \
+                    (a[7] is None or b[7] is None or a[7] == b[7]):
+                return True
+    return False
+
+
+''' This function returns the average number of rules a matched packet walks
+    through in its filter chain (itself included), given the matches and the
+    counters of the rules in their order
+'''
+def average_depth(matches, hits):
+    lengths = dict((chain, 0) for chain in FILTER_CHAINS)
+    total = 0
+    weighted = 0
+    for rule_matches, rule_hits in zip(matches, hits):
+        if rule_matches is None:
+            continue
+        chains = [match[0] for match in rule_matches
+                  if match[0] in FILTER_CHAINS]
+        if rule_hits > 0 and chains:
+            # The depth of its first rule
+            weighted += rule_hits * (lengths[chains[0]] + 1)
+            total += rule_hits
+        for chain in chains:
+            lengths[chain] += 1
+    if total == 0:
+        return 0.0
+    return float(weighted) / total
+
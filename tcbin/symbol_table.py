@@ -0,0 +1,56 @@
+__author__ = "Alessio Zennaro"
+
+from cidr import RadixTrie
+
+''' This class is the symbol table of a single configuration. It keeps:
+     * the interfaces, each one bound to its network (BIND lines), indexed by
+       name and in a radix trie, so that the interface that owns an address
+       is found with a longest prefix match
+     * the address book: a name for each address used by the configuration
+       (engines decide the names, e.g. JunOS address-book entries)
+    All the lookups take constant time (or, for the trie, a time bounded by
+    the length of an address) whatever the size of the configuration.
+'''
+class SymbolTable(object):
+
+    ''' Constructor '''
+    def __init__(self):
+        self.interfaces = {}  # Interface name -> network
+        self.interface_list = []  # Interface names, in order of declaration
+        self.networks = RadixTrie()  # Network -> interface name
+        self.addresses = {}  # Address -> name
+
+    ''' This method binds an interface to a network '''
+    def bind(self, interface, network):
+        if interface not in self.interfaces:
+            self.interface_list.append(interface)
+        self.interfaces[interface] = network
+        try:
+            self.networks.insert(network, interface)
+        except ValueError as _:
+            print("WARNING: Network %s of interface %s is not valid"
+                  % (network, interface))
+
+    ''' This method returns the network bound to the given interface, or None
+        if the interface has never been bound
+    '''
+    def network_of(self, interface):
+        return self.interfaces.get(interface)
+
+    ''' This method returns the name of the interface whose network is the
+        longest one containing the given address (or network), or None if
+        there is no such interface
+    '''
+    def interface_of(self, address):
+        try:
+            return self.networks.lookup(address)
+        except ValueError as _:
+            return None
+
+    ''' This method gives a name to an address '''
+    def add_address(self, address, name):
+        self.addresses[address] = name
+
+    ''' This method returns the name given to an address, or None '''
+    def address_name(self, address):
+        return self.addresses.get(address)
@@ -3,81 +3,397 @@
 __author__ = "Alessio Zennaro"
 
 
-''' The list of supported target languages, imported as classes '''
-from netfilter_engine import NetfilterEngine        # Netfilter/Iptables
-from example_engine import ExampleEngine            # Example
-from junos_engine import JunosEngine                # Juniper
+# The supported target languages are in the registry: only the engine of
+# the selected one is imported
+import engine_registry
+import generic_engine
+from compile_cache import CompileCache
+from compile_profiler import CompileProfiler
+from output_generation import OutputGeneration, GENERATIONS
 
 import os
-import shutil
 import sys
 
 
+USAGE = "Usage: ./target_compiler.py [-j <jobs>] [--cache <cache_dir>] " + \
+        "[--cache-size <MB>] [--analyze] [--ipset] [--dispatch] " + \
+        "[--dispatch-protocol] [--multiport] [--counters <file>] " + \
+        "[--consolidate] [--summarize] [--delta <deployed_dir>] " + \
+        "[--profile <file>] [--profile-dump <file>] [--stream] " + \
+        "[--bundle] " + \
+        "[list | <target_language>[,<target_language>...]] <directory>"
+
+
+''' This function separates the options from the other command line arguments.
+    Supported options are:
+     * -j <jobs> (or --jobs <jobs>): number of processes used to translate the
+       configurations. 0 means one process for each available core
+     * --cache <cache_dir>: directory of the cache of the final configurations:
+       only the configurations that changed since the previous compilations
+       are translated
+     * --cache-size <MB>: maximum size of the cache, in megabytes
+     * --analyze: the rules are analyzed (see rule_analyzer.py) before the
+       translation and the shadowed, redundant and conflicting ones are
+       reported
+     * --ipset: IPTABLES only, the runs of rules that differ only in the
+       source (or destination) address are collapsed into a single rule that
+       matches an ipset. The ipsets are written in the fw<index>.ipset files,
+       if there are any
+     * --dispatch: IPTABLES only, the filter rules are put in sub-chains by
+       input and output interface, so that each packet is checked only
+       against the rules of its interfaces
+     * --dispatch-protocol: as --dispatch, the sub-chains are by protocol too
+     * --multiport: IPTABLES only, the runs of rules that differ only in a
+       port are collapsed into rules that match lists of ports and port
+       ranges (-m multiport), dNATs included when they keep the port
+     * --counters <file>: IPTABLES only, a dump of the running firewall taken
+       with "iptables-save -c". The rules are reordered, where it is safe, so
+       that the most matched ones come first (see rule_optimizer.py)
+     * --consolidate: JUNOS only, the rules of each interface are written as
+       the terms of one filter for each direction instead of a filter for
+       each rule, and the addresses are grouped in prefix-lists (and the
+       ones of consecutive policies in address-sets)
+     * --summarize: the consecutive rules that differ only in one address are
+       replaced by the fewest rules that match the same addresses, adjacent
+       and overlapping networks being aggregated (see address_summarizer.py)
+     * --delta <deployed_dir>: IPTABLES only, deployed_dir holds the deployed
+       final configurations: for each fw<index>.iptables, the delta for
+       "iptables-restore --noflush" is written in fw<index>.delta (see
+       netfilter_delta.py)
+     * --profile <file>: every stage of the compilation, and the translation
+       of every firewall, is measured (wall time and peak memory) and the
+       metrics are written in file as JSON (see compile_profiler.py)
+     * --profile-dump <file>: the translations are run under cProfile and its
+       statistics are written in file
+     * --stream: the configurations are read, translated and written one at
+       a time, line by line, so that the memory used does not depend on the
+       number of firewalls (see GenericEngine.compile_stream). The cache and
+       the profiler are not used
+     * --bundle: all the final files are also written in a single file,
+       final/bundle.tar (see output_generation.py)
+    It returns a tuple made of the dictionary of the options and the list of
+    the remaining arguments (program name included)
+'''
+def parse_options(argv):
+    options = {"jobs": 1, "cache": None, "cache_size": None,
+               "analyze": False, "ipset": False, "dispatch": False,
+               "dispatch_protocol": False, "counters": None,
+               "delta": None, "profile": None, "profile_dump": None,
+               "stream": False, "bundle": False, "consolidate": False,
+               "summarize": False, "multiport": False}
+    args = []
+
+    i = 0
+    while i < len(argv):
+        if argv[i] in ("-j", "--jobs", "--cache-size"):
+            # The option needs a non negative number
+            if i + 1 == len(argv) or not argv[i + 1].isdigit():
+                print("FATAL: %s requires a non negative number" % argv[i])
+                exit(-1)
+            if argv[i] == "--cache-size":
+                options["cache_size"] = int(argv[i + 1]) * 1024 * 1024
+            else:
+                options["jobs"] = int(argv[i + 1])
+            i += 2
+        elif argv[i] == "--cache":
+            if i + 1 == len(argv):
+                print("FATAL: %s requires a directory" % argv[i])
+                exit(-1)
+            options["cache"] = argv[i + 1]
+            i += 2
+        elif argv[i] in ("--counters", "--delta", "--profile",
+                         "--profile-dump"):
+            if i + 1 == len(argv):
+                print("FATAL: %s requires a path" % argv[i])
+                exit(-1)
+            options[argv[i][2:].replace("-", "_")] = argv[i + 1]
+            i += 2
+        elif argv[i] in ("--analyze", "--ipset", "--dispatch",
+                         "--dispatch-protocol", "--stream", "--bundle",
+                         "--consolidate", "--summarize", "--multiport"):
+            options[argv[i][2:].replace("-", "_")] = True
+            i += 1
+        else:
+            args.append(argv[i])
+            i += 1
+
+    return (options, args)
+
+
+''' This function returns the engine that translates into the given target
+    language, working on the given directory. options are the options
+    returned by parse_options: only the ones of the engine are used. If the
+    language is unknown, None is returned
+'''
+def get_engine(language, directory, options=None):
+    if options is None:
+        options = parse_options([])[0]
+
+    info = engine_registry.find_engine(language)
+    if info is None:
+        return None
+    try:
+        engine = info.create(directory, options)
+    except (ImportError, AttributeError, ValueError) as e:
+        # The engine of another package is broken
+        print("FATAL: unable to load the engine of %s (%s): %s"
+              % (language, info.target, e))
+        exit(-1)
+    # Options that apply to every engine
+    engine.summarize = options["summarize"]
+    return engine
+
+
+''' This function returns the list of the engines of a comma separated list of
+    target languages (e.g. IPTABLES,JUNOS), working on the given directory.
+    With more than one language, each engine writes its final files in its
+    own folder, final/<language>/ (see compile_targets). If a language is
+    unknown, None is returned
+'''
+def get_engines(languages, directory, options=None):
+    names = languages.split(",")
+    engines = []
+    for name in names:
+        engine = get_engine(name, directory, options)
+        if engine is None:
+            return None
+        if len(names) > 1:
+            engine.final_subdir = name.lower() + "/"
+        engines.append(engine)
+    return engines
+
+
+''' This function compiles the intermediate representations into the target
+    languages of the given engines (see GenericEngine.compile) and returns
+    the number of final configurations written by each engine.
+    The configurations are read and parsed only once and then handed to all
+    the engines (see generic_engine.translate_targets), unless a cache or a
+    profiler is given or they are streamed: then the engines compile one
+    after the other
+'''
+def compile_targets(engines, jobs=1, cache=None, profiler=None, stream=False):
+    if len(engines) == 1 or cache is not None or profiler is not None or \
+            stream:
+        return [engine.compile(jobs, cache, profiler, stream)
+                for engine in engines]
+
+    written = [0] * len(engines)
+    conf_list = engines[0].read_files()
+    for index, final_confs in enumerate(
+            generic_engine.translate_targets(engines, conf_list, jobs)):
+        for k, (engine, final_files) in enumerate(zip(engines, final_confs)):
+            if engine.write_configuration(index, final_files):
+                written[k] += 1
+    return written
+
+
+''' This function returns the message printed at the end of the compilation,
+    given the engines and the number of final configurations written by each
+    one (see compile_targets)
+'''
+def complete_message(engines, written):
+    message = "\nComplete! Written %d final configurations" % sum(written)
+    if len(engines) > 1:
+        message += " (" + ", ".join("%d in final/%s" % (n, engine.final_subdir)
+                                    for engine, n in zip(engines, written)) \
+            + ")"
+    return message
+
+
+''' This function prints the list of the supported target languages. No
+    engine is imported, only their metadata are read
+'''
+def print_languages():
+    print("List of supported final target languages:")
+    print("^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^")
+    print("\n")
+    for info in engine_registry.all_engines():
+        print("%s:\t%s" % (info.language, info.description))
+    print("\n")
+
+
+''' This function returns the cache requested by the options, or None if no
+    cache has been requested
+'''
+def open_cache(options):
+    if options["cache"] is None:
+        return None
+    if options["stream"]:
+        print("WARNING: the cache is not used when streaming")
+        return None
+    if options["cache_size"] is None:
+        return CompileCache(options["cache"])
+    return CompileCache(options["cache"], options["cache_size"])
+
+
+''' This function returns the profiler requested by the options, or None if
+    no profiling has been requested
+'''
+def open_profiler(options):
+    if options["profile"] is None and options["profile_dump"] is None:
+        return None
+    if options["stream"]:
+        print("WARNING: the compilation is not profiled when streaming")
+        return None
+    if options["jobs"] != 1 or options["cache"] is not None:
+        print("WARNING: when profiling, the configurations are translated " + \
+              "in a single process, without the cache")
+    return CompileProfiler(options["profile_dump"])
+
+
+''' This function calls function with the given arguments and returns its
+    result. If there is a profiler, the call is measured as the stage with
+    the given name
+'''
+def run_stage(profiler, name, function, *args):
+    if profiler is None:
+        return function(*args)
+    return profiler.stage(name, function, *args)
+
+
+''' This function writes the metrics of the profiler, if any, in the files
+    requested by the options
+'''
+def write_profile(profiler, options):
+    if profiler is None:
+        return
+    try:
+        profiler.write(options["profile"])
+    except IOError as _:
+        print("ERR: unable to write the profile")
+        return
+    if options["profile"] is not None:
+        print("INF: profile written in %s" % options["profile"])
+
+
+''' This function creates a new generation of <main_dir>/final (see
+    output_generation.py): the engines write their final files in it, each
+    one in its own folder (see GenericEngine.final_directory). The
+    generation is published by publish_generation. It returns None if
+    something goes wrong
+'''
+def open_generation(main_dir, engines):
+    try:
+        generation = OutputGeneration(main_dir)
+        for engine in engines:
+            engine.output_dir = generation.path
+            engine.generation = generation
+            if not os.path.isdir(engine.final_directory()):
+                os.makedirs(engine.final_directory())
+    except (IOError, OSError) as _:
+        return None
+    return generation
+
+
+''' This function publishes a generation of final configurations, with its
+    bundle if the --bundle option is set (see parse_options). It returns
+    False if something goes wrong: the final folder is left as it was
+'''
+def publish_generation(generation, options):
+    try:
+        manifest = generation.publish(options["bundle"])
+    except (IOError, OSError) as e:
+        print("ERR: the final configurations have not been published: %s"
+              % e)
+        return False
+    print("INF: final -> %s/%s, files: %d"
+          % (GENERATIONS, generation.name, len(manifest["files"])))
+    return True
+
+
+''' This function writes the deltas of the final configurations of the
+    engines against the deployed ones, if the --delta option is set (see
+    parse_options)
+'''
+def write_deltas(engines, options):
+    if options["delta"] is None:
+        return
+    # Imported only when needed, like the engines
+    from netfilter_engine import NetfilterEngine
+    import netfilter_delta
+    engines = [engine for engine in engines
+               if isinstance(engine, NetfilterEngine)]
+    if not engines:
+        print("WARNING: --delta is supported only by IPTABLES")
+    for engine in engines:
+        netfilter_delta.delta_directory(engine.final_directory(),
+                                        options["delta"], engine.suffix())
+
+
+''' This function analyzes the rules of the intermediate representations in
+    main_dir (see rule_analyzer.py) and returns the number of findings
+'''
+def analyze_directory(main_dir):
+    import rule_analyzer  # NumPy makes it slow to import
+    return rule_analyzer.analyze_directory(main_dir)
+
+
+''' This function analyzes the rules of the intermediate representations of
+    conf_list (e.g. compiled in memory by the frontend) and returns the number
+    of findings
+'''
+def analyze_configurations(conf_list):
+    import rule_analyzer
+    return rule_analyzer.analyze_configurations(conf_list)
+
+
 ''' Main function '''
 def main():
+    options, argv = parse_options(sys.argv)
+
     # We must have a parameter stating which target language we want
-    if len(sys.argv) == 1 or (len(sys.argv) < 3 and sys.argv[1] != "list"):
-        print(
-            "Usage: ./target_compiler.py [list | <target_language>] <directory>"
-        )
+    if len(argv) == 1 or (len(argv) < 3 and argv[1] != "list"):
+        print(USAGE)
         exit(-1)
 
+    # Special value: we obtain a list of supported target languages
+    if argv[1] == "list":
+        print_languages()
+        exit(0)
+
     # We save the directory we want to work on and we check that the directory
     # name is well-formed
-    main_dir = sys.argv[2] if len(sys.argv) > 2 else ""
-    if len(main_dir) > 0 and main_dir[len(main_dir) - 1] != '/':
+    main_dir = argv[2]
+    if main_dir[len(main_dir) - 1] != '/':
         print("FATAL: <directory> must end with a '/' character")
         exit(-1)
 
-    if main_dir != "":
-        try:
-            # If <dir>/final already exists, we delete it.
-            # We remove it if it is a file or a dir as well
-            dir = main_dir + "/final"
-            if os.path.isdir(dir):
-                shutil.rmtree(dir)
-            elif os.path.isfile(dir):
-                os.remove(dir)
-
-            # Ok, a new empty directory is created
-            os.makedirs(dir)
-        except IOError as _:
-            # If something goes wrong, kill everything!
-            print("FATAL: I/O error")
-            exit(-1)
-
-    # Select the engine
-    engine = None
-    if sys.argv[1] == "IPTABLES":
-        engine = NetfilterEngine(main_dir)
-    elif sys.argv[1] == "JUNOS":
-        engine = JunosEngine(main_dir)
-    elif sys.argv[1] == "EXAMPLE":
-        engine = ExampleEngine(main_dir)
-    # Special value: we obtain a list of supported target languages
-    elif sys.argv[1] == "list":
-        print("List of supported final target languages:")
-        print("^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^")
-        print("\n")
-        print("IPTABLES:\tStandard Netfilter/iptables for Linux OS")
-        print("JUNOS:\tJuniper firewall appliance")
-        print(
-            "EXAMPLE:\tAn example used as test that produces a fake final " + \
-            "configuration"
-        )
-        print("\n")
-        exit(0)
-    else:  # Unknown language
+    # Select the engines, one for each target language
+    engines = get_engines(argv[1], main_dir, options)
+    if engines is None:  # Unknown language
         print("Unknown language. Type './target_compiler list' for the " + \
               "complete list of supported target languages"
         )
         exit(1)
 
-    # If we arrive here, we're done!
-    print("\nComplete! Written %d final configurations" % engine.compile())
+    generation = open_generation(main_dir, engines)
+    if generation is None:
+        # If something goes wrong, kill everything!
+        print("FATAL: I/O error")
+        exit(-1)
+
+    published = False
+    try:
+        profiler = open_profiler(options)
+        if options["analyze"]:
+            run_stage(profiler, "analyze", analyze_directory, main_dir)
 
+        # If we arrive here, we're done!
+        print(complete_message(engines, compile_targets(
+            engines, options["jobs"], open_cache(options), profiler,
+            options["stream"])))
+        run_stage(profiler, "delta", write_deltas, engines, options)
+        published = run_stage(profiler, "publish", publish_generation,
+                              generation, options)
+    finally:
+        # The generation of a failed compilation is not left behind
+        if not published:
+            generation.discard()
+    if not published:
+        exit(-1)
+    write_profile(profiler, options)
 
 
 ''' The entry point of the program is the main() function '''
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
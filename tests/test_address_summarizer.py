@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' Tests of tcbin/address_summarizer.py: the runs of rules are summarized
+    only where the networks keep the zone of their addresses and the packets
+    are matched against the addresses.
+    Usage: python -m pytest tests/  (or python -m unittest discover tests)
+'''
+
+import os
+import sys
+import unittest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+
+import ir_model
+from address_summarizer import AddressSummarizer
+
+
+''' This function summarizes a configuration written in intermediate
+    representation and returns the lines of its rules and policies
+'''
+def summarize(configuration):
+    records = AddressSummarizer().summarize(
+        ir_model.parse_configuration(configuration)).records
+    return [record.line for record in records
+            if record.command in ir_model.RULES or
+            record.command in ir_model.POLICIES]
+
+
+''' This function returns the lines "<source> > <host>:80 tcp", one for each
+    host
+'''
+def to_hosts(source, hosts):
+    return "".join("ALLW:%s;;0;;;0;%s;;80;;;0;TCP;\n" % (source, host)
+                   for host in hosts)
+
+
+class AddressSummarizerTest(unittest.TestCase):
+
+    def test_run(self):
+        hosts = ["h-10.0.0.%d" % i for i in range(4, 8)] + ["n-10.0.0.8/29"]
+        self.assertEqual(summarize("BIND:eth0;10.0.0.0/8\n" +
+                                   to_hosts("eth2", hosts)),
+                         ["ALLW:eth2;;0;;;0;n-10.0.0.4/30;;80;;;0;TCP;",
+                          "ALLW:eth2;;0;;;0;n-10.0.0.8/29;;80;;;0;TCP;"])
+
+    ''' A run whose addresses are behind two interfaces is summarized for
+        each interface
+    '''
+    def test_interface_boundary(self):
+        bindings = "BIND:eth0;10.0.0.0/25\nBIND:eth1;10.0.0.128/25\n" \
+                   "BIND:eth2;0.0.0.0/0\n"
+        hosts = ["h-10.0.0.%d" % i for i in range(124, 132)]
+        self.assertEqual(summarize(bindings + to_hosts("eth2", hosts)),
+                         ["ALLW:eth2;;0;;;0;n-10.0.0.124/30;;80;;;0;TCP;",
+                          "ALLW:eth2;;0;;;0;n-10.0.0.128/30;;80;;;0;TCP;"])
+
+    ''' The networks of a summary must belong to the interface of the
+        addresses of the run: 10.0.0.0/24 is not in the networks of eth0,
+        so it belongs to eth2
+    '''
+    def test_zone(self):
+        bindings = "BIND:eth0;10.0.0.0/25\nBIND:eth0;10.0.0.128/25\n" \
+                   "BIND:eth2;0.0.0.0/0\n"
+        networks = ["n-10.0.0.0/25", "n-10.0.0.128/25"]
+        rules = to_hosts("eth2", networks)
+        self.assertEqual(summarize(bindings + rules),
+                         [line for line in rules.split("\n") if line])
+        # A network bound as a whole is a single zone
+        self.assertEqual(summarize("BIND:eth0;10.0.0.0/24\n"
+                                   "BIND:eth2;0.0.0.0/0\n" + rules),
+                         ["ALLW:eth2;;0;;;0;n-10.0.0.0/24;;80;;;0;TCP;"])
+        # An address localized on an interface (Mignis+) has no zone
+        rules = "".join("ALLW:eth2;;0;;;0;%s;eth0;80;;;0;TCP;\n" % network
+                        for network in networks)
+        self.assertEqual(summarize(bindings + rules),
+                         ["ALLW:eth2;;0;;;0;n-10.0.0.0/24;eth0;80;;;0;TCP;"])
+
+    ''' The destinations of a run of dNATs are where the packets are sent
+        to, so they are not summarized; their sources are
+    '''
+    def test_dnat(self):
+        bindings = "BIND:eth0;10.0.0.0/8\nBIND:eth2;0.0.0.0/0\n"
+        rules = "".join("ALLW:eth2;;0;;;0;h-10.0.0.%d;;80;h-1.2.3.4;;80;"
+                        "TCP;\n" % i for i in range(4, 8))
+        self.assertEqual(summarize(bindings + rules),
+                         [line for line in rules.split("\n") if line])
+        rules = "".join("ALLW:h-8.8.8.%d;;0;;;0;h-10.0.0.4;;80;h-1.2.3.4;;"
+                        "80;TCP;\n" % i for i in range(4, 8))
+        self.assertEqual(summarize(bindings + rules),
+                         ["ALLW:n-8.8.8.4/30;;0;;;0;h-10.0.0.4;;80;"
+                          "h-1.2.3.4;;80;TCP;"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' Tests of tcbin/compile_cache.py: a configuration found in the cache gives
+    the same final files, and prints the same warnings, as its translation.
+    Usage: python -m pytest tests/  (or python -m unittest discover tests)
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+sys.path.insert(0, os.path.join(BASE_DIR, "bench"))
+sys.path.insert(0, BASE_DIR)
+
+from compile_cache import CompileCache
+import mignis
+import synthetic
+
+
+class CompileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        parameters = dict(synthetic.DEFAULTS)
+        parameters.update({"firewalls": 2, "rules": 50, "plus": True})
+        self.file_name = synthetic.write_configuration(parameters,
+                                                       self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    ''' This method compiles the configuration with the cache and returns
+        the final configurations, the warnings and the cache
+    '''
+    def compile(self, language, jobs=1):
+        cache = CompileCache(os.path.join(self.directory, "cache"))
+        final_confs, warnings = mignis.compile_config(self.file_name,
+                                                      language, jobs, cache)
+        return (final_confs, warnings, cache)
+
+    def test_warnings_replayed(self):
+        for language in ("NFTABLES", "IPTABLES"):
+            final_confs, warnings, cache = self.compile(language)
+            self.assertEqual(cache.misses, 2)
+            self.assertTrue(warnings, language)
+            for jobs in (1, 2):
+                cached_confs, cached_warnings, cache = self.compile(language,
+                                                                    jobs)
+                self.assertEqual(cache.hits, 2)
+                self.assertEqual(cached_confs, final_confs)
+                self.assertEqual(cached_warnings, warnings)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' Tests of tcbin/header_space_diff.py: the classes of packets that differ
+    are the ones whose verdict or rewritten fields differ, however the rules
+    are written.
+    Usage: python -m pytest tests/  (or python -m unittest discover tests)
+'''
+
+import os
+import sys
+import unittest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+
+from header_space_diff import HeaderSpaceDiff, DPORT
+
+
+# A firewall with a dNAT for each port, as NetfilterEngine writes the run of
+# rules "wan > [router:<port>] server:<port> tcp"
+DNAT_RULES = """*filter
+-P INPUT DROP
+-P FORWARD DROP
+-P OUTPUT DROP
+-A FORWARD -m state --state ESTABLISHED,RELATED -j ACCEPT
+%s
+COMMIT
+*mangle
+COMMIT
+*nat
+%s
+COMMIT
+"""
+FORWARD = "-A FORWARD -p tcp -i eth2 -d 10.0.0.3 --dport %s -j ACCEPT"
+PREROUTING = "-A PREROUTING -p tcp -i eth2 -d 1.2.3.4 --dport %s " \
+             "-j DNAT --to-destination %s"
+
+
+''' This function returns the firewall with the dNAT rules given as tuples
+    (ports of the rule, destination of the dNAT)
+'''
+def dnat_firewall(rules):
+    return DNAT_RULES % ("\n".join(FORWARD % ports for ports, _ in rules),
+                         "\n".join(PREROUTING % rule for rule in rules))
+
+
+''' This function returns the differences between two firewalls '''
+def differences(old, new):
+    return HeaderSpaceDiff(old, "", new, "").run()
+
+
+class HeaderSpaceDiffTest(unittest.TestCase):
+
+    def test_same_firewall(self):
+        old = dnat_firewall([("80", "10.0.0.3:80")])
+        self.assertEqual(differences(old, old), [])
+
+    ''' A run of dNAT rules collapsed into a rule that keeps the port (see
+        NetfilterEngine.translate_ports) gives the same packets
+    '''
+    def test_port_kept(self):
+        old = dnat_firewall([(str(port), "10.0.0.3:%d" % port)
+                             for port in (82, 81, 80)])
+        for ports in ("80:82", "80,81,82"):
+            new = dnat_firewall([(ports, "10.0.0.3")])
+            new = new.replace("--dport " + ports,
+                              "-m multiport --dports " + ports) \
+                if "," in ports else new
+            self.assertEqual(differences(old, new), [], ports)
+            self.assertEqual(differences(new, old), [], ports)
+
+    ''' A different port or address is a difference '''
+    def test_rewrite_changed(self):
+        old = dnat_firewall([(str(port), "10.0.0.3:%d" % port)
+                             for port in (82, 81, 80)])
+        for rule, port in [(("81", "10.0.0.3:8081"), 81),
+                           (("81", "10.0.0.4:81"), 81)]:
+            new = dnat_firewall([(str(p), "10.0.0.3:%d" % p)
+                                 for p in (82, 80)] + [rule])
+            found = differences(old, new)
+            self.assertTrue(found, rule)
+            self.assertEqual(set(difference.box[DPORT]
+                                 for difference in found),
+                             set([(port, port)]))
+        # The port kept for a range of ports differs from a single port
+        new = dnat_firewall([("80:82", "10.0.0.3:80")])
+        self.assertEqual(set(difference.box[DPORT]
+                             for difference in differences(old, new)),
+                         set([(81, 81), (82, 82)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
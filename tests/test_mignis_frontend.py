@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' Tests of tcbin/mignis_frontend.py against the golden files: for each
+    configuration golden/<name>.mignis, golden/<name>/ holds the expected
+    fw<i>.config files and, if any, the expected warnings (warnings.txt).
+    mignis_ic could not be built where they were written: they were derived
+    by hand from utils/compiler.ml, parser.mly and lexer.mll, so they are
+    unverified against mignis_ic while the file golden/UNVERIFIED exists.
+    bench/frontend.py --update-golden rewrites them from the output of
+    mignis_ic and removes that file.
+    Usage: python -m pytest tests/  (or python -m unittest discover tests)
+'''
+
+import os
+import sys
+import unittest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+sys.path.insert(0, BASE_DIR)
+
+import mignis
+import mignis_frontend
+from generic_engine import Capture
+from mignis_frontend import FrontendError
+
+# The folder of the golden files
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "golden")
+
+
+''' This function reads a whole file, with its line ends '''
+def read_file(file_name):
+    in_stream = open(file_name, "rb")
+    try:
+        return in_stream.read().decode()
+    finally:
+        in_stream.close()
+
+
+''' This function returns the golden files of a configuration: a tuple made
+    of the list of the intermediate representations and of the warnings
+'''
+def read_golden(name):
+    folder = os.path.join(GOLDEN_DIR, name)
+    conf_list = []
+    while os.path.isfile(os.path.join(folder, "fw%d.config"
+                                      % len(conf_list))):
+        conf_list.append(read_file(os.path.join(folder, "fw%d.config"
+                                                % len(conf_list))))
+    warnings = ""
+    if os.path.isfile(os.path.join(folder, "warnings.txt")):
+        warnings = read_file(os.path.join(folder, "warnings.txt"))
+    return (conf_list, warnings)
+
+
+class MignisFrontendTest(unittest.TestCase):
+
+    ''' This method compiles the configuration name and checks it against
+        its golden files
+    '''
+    def assertGolden(self, name):
+        conf_list, warnings = mignis_frontend.compile_file(
+            os.path.join(GOLDEN_DIR, name + ".mignis"))
+        expected = read_golden(name)
+        self.assertTrue(expected[0])
+        self.assertEqual(len(conf_list), len(expected[0]))
+        for index, (conf, other) in enumerate(zip(conf_list, expected[0])):
+            self.assertEqual(conf, other, "fw%d.config differs" % index)
+        self.assertEqual("".join(warnings), expected[1])
+
+    def test_golden_files(self):
+        names = sorted(name[:-len(".mignis")]
+                       for name in os.listdir(GOLDEN_DIR)
+                       if name.endswith(".mignis"))
+        self.assertIn("firewall", names)
+        for name in names:
+            self.assertGolden(name)
+
+    ''' The compile API returns the warnings of the frontend, and prints
+        nothing
+    '''
+    def test_compile_config(self):
+        stdout = sys.stdout
+        sys.stdout = Capture(open(os.devnull, "w"))
+        try:
+            final_confs, warnings = mignis.compile_config(
+                os.path.join(GOLDEN_DIR, "aliases.mignis"), "IPTABLES")
+        finally:
+            sys.stdout.stream.close()
+            capture, sys.stdout = sys.stdout, stdout
+        self.assertEqual(capture.lines(), [])
+        self.assertEqual(len(final_confs), len(read_golden("aliases")[0]))
+        expected = read_golden("aliases")[1].splitlines()
+        self.assertTrue(expected)
+        self.assertEqual(warnings[:len(expected)], expected)
+
+    ''' The configurations rejected by mignis_ic (see compiler.ml) '''
+    def test_rejected(self):
+        header = "OPTIONS\nINTERFACES\nlan eth0 10.0.0.0/8\n" \
+                 "ext eth1 0.0.0.0/0\nALIASES\ngw 1.2.3.4\nFIREWALL\n"
+        for rules, message in [
+                ("lan > ext\nlan@lan > ext@ext\n", "cannot be used together"),
+                ("lan@lan > ext@ext\nlan / ext\n", "negative rules"),
+                ("lan [.] > [gw] ext\n", "sNAT and a dNAT"),
+                ("lan > [.] ext\n", "Destination masquarade"),
+                ("lan > [*] ext\n", "Wildcard *"),
+                ("lan [local] > ext\n", "Keyword local"),
+                ("lan > dmz\n", "not declared")]:
+            try:
+                mignis_frontend.compile_source(header + rules +
+                                               "POLICIES\nCUSTOM\n")
+            except FrontendError as e:
+                self.assertIn(message, str(e))
+            else:
+                self.fail("accepted: %r" % rules)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' Tests of tcbin/netfilter_delta.py: each delta is applied (with --noflush)
+    to the deployed ruleset, and the result must be the new ruleset.
+    Usage: python -m pytest tests/  (or python -m unittest discover tests)
+'''
+
+import os
+import random
+import sys
+import unittest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+sys.path.insert(0, BASE_DIR)
+
+import netfilter_delta
+from netfilter_delta import NO_CHANGES
+
+
+# The deployed configuration most of the tests start from
+DEPLOYED = """*filter
+:INPUT DROP [0:0]
+:FORWARD DROP [0:0]
+:OUTPUT ACCEPT [0:0]
+:mig-fwd - [0:0]
+-A INPUT -i lo -j ACCEPT
+-A INPUT -m state --state ESTABLISHED,RELATED -j ACCEPT
+-A FORWARD -m state --state ESTABLISHED,RELATED -j ACCEPT
+-A FORWARD -j mig-fwd
+-A mig-fwd -s 10.0.0.0/8 -o eth2 -j ACCEPT
+-A mig-fwd -d 10.0.0.3 -p tcp --dport 80 -j ACCEPT
+-A mig-fwd -d 192.168.1.0/24 -j DROP
+COMMIT
+*nat
+:PREROUTING ACCEPT [0:0]
+:INPUT ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+-A POSTROUTING -s 10.0.0.0/8 -o eth2 -j MASQUERADE
+COMMIT
+"""
+
+
+''' This function returns the lines of text, without the ones that match
+    function
+'''
+def without(text, function):
+    return "\n".join(line for line in text.split("\n")
+                     if not function(line))
+
+
+class NetfilterDeltaTest(unittest.TestCase):
+
+    ''' This method computes the delta from deployed to final, applies it to
+        the deployed ruleset and checks that the result is the final one. It
+        returns the commands of the delta
+    '''
+    def assertDelta(self, deployed, final):
+        result = netfilter_delta.delta(deployed, final)
+        applied = netfilter_delta.load(deployed)
+        applied.restore(result, True)
+        self.assertTrue(applied == netfilter_delta.load(final))
+        return [line for line in result.split("\n") if line.startswith("-")]
+
+    def test_no_changes(self):
+        self.assertEqual(netfilter_delta.delta(DEPLOYED, DEPLOYED),
+                         NO_CHANGES)
+        # Spaces and counters do not matter
+        final = DEPLOYED.replace("-j ACCEPT", "-j  ACCEPT") \
+                        .replace("[0:0]", "[12:3400]")
+        self.assertEqual(netfilter_delta.delta(DEPLOYED, final), NO_CHANGES)
+        self.assertEqual(self.assertDelta(DEPLOYED, final), [])
+
+    def test_chain_added(self):
+        final = DEPLOYED.replace(
+            "-A FORWARD -j mig-fwd\n",
+            "-A FORWARD -i eth1 -j mig-wlan\n-A FORWARD -j mig-fwd\n"
+            "-A mig-wlan -o eth2 -j DROP\n"
+            "-A mig-wlan -d 10.0.0.2 -p tcp --dport 8080 -j ACCEPT\n"
+        ).replace(":mig-fwd - [0:0]\n",
+                  ":mig-fwd - [0:0]\n:mig-wlan - [0:0]\n")
+        commands = self.assertDelta(DEPLOYED, final)
+        # The chain exists before a rule jumps to it
+        self.assertIn("-N mig-wlan", commands)
+        jump = [k for k, command in enumerate(commands)
+                if "-j mig-wlan" in command]
+        self.assertEqual(len(jump), 1)
+        self.assertLess(commands.index("-N mig-wlan"), jump[0])
+        # The rules of the other chains are left alone
+        self.assertFalse([command for command in commands
+                          if " mig-fwd " in command])
+
+    def test_chain_removed(self):
+        final = without(DEPLOYED, lambda line: "mig-fwd" in line)
+        commands = self.assertDelta(DEPLOYED, final)
+        # The chain is deleted when no rule jumps to it any more
+        self.assertEqual(commands[-2:], ["-F mig-fwd", "-X mig-fwd"])
+        self.assertIn("-D FORWARD 2", commands)
+
+    def test_chain_renamed(self):
+        final = DEPLOYED.replace("mig-fwd", "mig-forward")
+        commands = self.assertDelta(DEPLOYED, final)
+        self.assertIn("-N mig-forward", commands)
+        self.assertIn("-X mig-fwd", commands)
+
+    def test_policy_changed(self):
+        final = DEPLOYED.replace(":FORWARD DROP", ":FORWARD ACCEPT") \
+                        .replace(":OUTPUT ACCEPT [0:0]\n:mig",
+                                 ":OUTPUT DROP [0:0]\n:mig")
+        commands = self.assertDelta(DEPLOYED, final)
+        self.assertEqual(sorted(commands),
+                         ["-P FORWARD ACCEPT", "-P OUTPUT DROP"])
+
+    def test_rules_reordered(self):
+        lines = DEPLOYED.split("\n")
+        rules = [k for k, line in enumerate(lines)
+                 if line.startswith("-A mig-fwd")]
+        reordered = list(lines)
+        for k, l in zip(rules, reversed(rules)):
+            reordered[k] = lines[l]
+        commands = self.assertDelta(DEPLOYED, "\n".join(reordered))
+        self.assertTrue(commands)
+        self.assertFalse([command for command in commands
+                          if not command.split()[1] == "mig-fwd"])
+
+    def test_rules_edited(self):
+        final = DEPLOYED.replace(
+            "-A INPUT -i lo -j ACCEPT\n",
+            "-A INPUT -i lo -j ACCEPT\n-A INPUT -p icmp -j ACCEPT\n"
+        ).replace("--dport 80 ", "--dport 443 ")
+        final = without(final, lambda line: "192.168.1.0/24" in line)
+        commands = self.assertDelta(DEPLOYED, final)
+        self.assertEqual(len(commands), 3)
+
+    def test_table_added(self):
+        final = DEPLOYED + "*mangle\n:PREROUTING ACCEPT [0:0]\n" \
+            "-A PREROUTING -i eth1 -s 172.22.0.0/16 -j ACCEPT\n" \
+            "-A PREROUTING -i eth1 -j DROP\nCOMMIT\n"
+        commands = self.assertDelta(DEPLOYED, final)
+        self.assertEqual(len(commands), 2)
+
+    ''' Random rulesets: chains are added, removed and emptied, rules are
+        moved, changed, added and removed, policies are changed
+    '''
+    def test_random(self):
+        generator = random.Random(2)
+        policies = ("ACCEPT", "DROP")
+
+        def ruleset():
+            chains = ["c%d" % k for k in range(generator.randint(0, 5))]
+            lines = ["*filter"]
+            lines += [":%s %s [0:0]" % (chain, generator.choice(policies))
+                      for chain in netfilter_delta.BUILTIN_CHAINS["filter"]]
+            lines += [":%s - [0:0]" % chain for chain in chains]
+            for chain in netfilter_delta.BUILTIN_CHAINS["filter"] + \
+                    tuple(chains):
+                for _ in range(generator.randint(0, 8)):
+                    target = generator.choice(("ACCEPT", "DROP", "RETURN"))
+                    if chains and not chain.startswith("c"):
+                        target = generator.choice((target,
+                                                   generator.choice(chains)))
+                    lines.append("-A %s -s 10.0.%d.0/24 -j %s"
+                                 % (chain, generator.randint(0, 3), target))
+            return "\n".join(lines) + "\nCOMMIT\n"
+
+        for _ in range(200):
+            deployed, final = ruleset(), ruleset()
+            self.assertDelta(deployed, final)
+            self.assertDelta(final, deployed)
+
+    ''' The final configurations of the engine, with and without the dispatch
+        of the rules in sub-chains (see NetfilterEngine.dispatch_fragments)
+    '''
+    def test_engine_configurations(self):
+        import mignis
+        import target_compiler
+        file_name = os.path.join(BASE_DIR, "firewall.mignis")
+        flat = mignis.compile_config(file_name, "IPTABLES")[0][0]
+        dispatched = mignis.compile_config(
+            file_name, "IPTABLES",
+            options=target_compiler.parse_options(["--dispatch"])[0])[0][0]
+        self.assertEqual(netfilter_delta.delta(flat, flat), NO_CHANGES)
+        commands = self.assertDelta(flat, dispatched)
+        self.assertTrue([command for command in commands
+                         if command.startswith("-N ")])
+        commands = self.assertDelta(dispatched, flat)
+        self.assertTrue([command for command in commands
+                         if command.startswith("-X ")])
+
+    ''' A delta that does not give the new ruleset is refused '''
+    def test_check(self):
+        final = DEPLOYED.replace(":FORWARD DROP", ":FORWARD ACCEPT")
+        self.assertTrue(netfilter_delta.check(DEPLOYED, "*filter\n"
+                                              "-P FORWARD ACCEPT\nCOMMIT\n",
+                                              final))
+        self.assertFalse(netfilter_delta.check(DEPLOYED, NO_CHANGES, final))
+        # A chain still referenced cannot be deleted
+        self.assertFalse(netfilter_delta.check(
+            DEPLOYED, "*filter\n-F mig-fwd\n-X mig-fwd\nCOMMIT\n",
+            without(DEPLOYED, lambda line: line.startswith("-A mig-fwd")
+                    or line.startswith(":mig-fwd"))))
+
+
+if __name__ == "__main__":
+    unittest.main()
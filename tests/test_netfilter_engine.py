@@ -0,0 +1,279 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' Tests of tcbin/netfilter_engine.py: the rulesets written with the options
+    that collapse or dispatch the rules are simulated (see
+    netfilter_simulator.py), and every packet must get the same verdict, and
+    the same rewrite, as with the plain ruleset.
+    Usage: python -m pytest tests/  (or python -m unittest discover tests)
+'''
+
+import os
+import random
+import sys
+import unittest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+
+import cidr
+import netfilter_delta
+import netfilter_simulator
+from netfilter_engine import NetfilterEngine, multiport_lists
+from symbol_table import SymbolTable
+
+
+# The suffix of the final configurations
+SUFFIX = ".iptables"
+# The bindings of the configurations of the tests
+BINDINGS = "BIND:eth0;10.0.0.0/8\nBIND:eth1;172.22.0.0/16\n" \
+           "BIND:eth2;0.0.0.0/0\n"
+# The endpoints of the rules of test_dispatch: interfaces, and addresses and
+# networks behind one or more interfaces
+ENDPOINTS = ["eth0", "eth1", "eth2", "h-10.1.2.3", "h-172.22.1.1",
+             "h-8.8.8.8", "h-127.0.0.1", "h-224.0.0.1", "n-10.0.0.0/16",
+             "n-172.22.0.0/15", "n-172.0.0.0/8", "n-0.0.0.0/1",
+             "n-0.0.0.0/0"]
+
+
+''' This function translates a configuration written in intermediate
+    representation with the given options of NetfilterEngine. It returns
+    the final files, by suffix
+'''
+def translate(configuration, **options):
+    engine = NetfilterEngine("", **options)
+    return engine.translate_files(configuration)
+
+
+''' This function returns the lines of intermediate representation of the
+    rules "<source> > <address>:<port> <protocol>", one for each address
+'''
+def allow_rules(source, addresses, port, protocol="TCP"):
+    return "".join("ALLW:%s;;0;;;0;h-%s;;%d;;;0;%s;\n"
+                   % (source, address, port, protocol)
+                   for address in addresses)
+
+
+''' This function simulates the same packets on the rulesets first and
+    second, and returns the two results. The interfaces of the packets are
+    mapped by name, as the simulators number them as they are found
+'''
+def simulate_both(first, second, packets):
+    names = list(first.interfaces)
+
+    def interfaces(indexes):
+        return [netfilter_simulator.NO_INTERFACE if i < 0
+                else second.interface(names[i])[0] for i in indexes]
+
+    other = netfilter_simulator.Packets(
+        packets.src, packets.dst, packets.sport, packets.dport,
+        packets.proto, interfaces(packets.iif), interfaces(packets.oif),
+        packets.state)
+    return (first.simulate(packets), second.simulate(other))
+
+
+''' This function returns the packets that come from (go to) the
+    interface, if any, their source (destination) is routed to with the
+    bindings of symbols, the loopback network being behind lo
+'''
+def routed(simulator, packets, symbols):
+    loopback = cidr.parse_network("127.0.0.0/8")
+
+    def route(address):
+        if cidr.contains(loopback, (int(address), cidr.BITS)):
+            return simulator.interface("lo")[0]
+        return simulator.interface(symbols.interface_of(
+            cidr.int_to_ip(int(address))))[0]
+
+    def consistent(interface, address):
+        return interface == netfilter_simulator.NO_INTERFACE or \
+            interface == route(address)
+
+    kept = [i for i in range(len(packets))
+            if consistent(packets.iif[i], packets.src[i]) and
+            consistent(packets.oif[i], packets.dst[i])]
+    return netfilter_simulator.Packets(
+        *[getattr(packets, field)[kept]
+          for field in netfilter_simulator.FIELDS])
+
+
+class NetfilterEngineTest(unittest.TestCase):
+
+    ''' This method checks that two final configurations (with their ipsets)
+        give the same verdict and rewrite to n random packets. If symbols is
+        given, only the packets routed as its bindings say are kept (see
+        routed). If ports is given, the destination ports of the packets are
+        those ports or the ones next to them
+    '''
+    def assertSameVerdicts(self, first, second, n=20000, symbols=None,
+                           ports=None):
+        if netfilter_simulator.numpy is None:
+            self.skipTest("NumPy is needed")
+        first = netfilter_simulator.Simulator(
+            first[SUFFIX],
+            first.get(NetfilterEngine.IPSET_SUFFIX, ""))
+        second = netfilter_simulator.Simulator(
+            second[SUFFIX],
+            second.get(NetfilterEngine.IPSET_SUFFIX, ""))
+        packets = netfilter_simulator.random_packets(first, n)
+        if ports is not None:
+            numpy = netfilter_simulator.numpy
+            rng = numpy.random.RandomState(0)
+            packets.dport = numpy.asarray(ports, dtype=numpy.int32)[
+                rng.randint(0, len(ports), n)] + rng.randint(-1, 2, n)
+        if symbols is not None:
+            packets = routed(first, packets, symbols)
+        expected, result = simulate_both(first, second, packets)
+        self.assertEqual((expected.verdict != result.verdict).sum(), 0)
+        for field in ("src", "dst", "sport", "dport"):
+            self.assertEqual((getattr(expected.packets, field) !=
+                              getattr(result.packets, field)).sum(), 0,
+                             field)
+
+    ''' The ipsets are named after their addresses '''
+    def test_ipset_names(self):
+        addresses = ["1.1.1.%d" % i for i in range(1, 6)]
+        configuration = BINDINGS + allow_rules("eth0", addresses, 80) + \
+            "DROP:eth2;;0;;;0;h-10.0.0.1;;0;;;0;ANY;\n" + \
+            allow_rules("eth0", reversed(addresses), 443)
+        final_files = translate(configuration, ipset=True)
+        sets = netfilter_simulator.parse_ipsets(
+            final_files[NetfilterEngine.IPSET_SUFFIX])
+        # The two runs share the same set
+        self.assertEqual(len(sets), 1)
+        name = list(sets)[0]
+        self.assertTrue(name.startswith(netfilter_delta.IPSET_PREFIX))
+        self.assertTrue(len(name + "-tmp") <= 31)
+        # Other addresses, other set
+        other = translate(BINDINGS + allow_rules("eth0", addresses[1:], 80),
+                          ipset=True)
+        other_sets = netfilter_simulator.parse_ipsets(
+            other[NetfilterEngine.IPSET_SUFFIX])
+        self.assertEqual(len(other_sets), 1)
+        self.assertNotIn(name, other_sets)
+        # Loading the new sets leaves the old set as it is, and it can be
+        # destroyed once the new rules are loaded
+        loaded = netfilter_simulator.parse_ipsets(
+            final_files[NetfilterEngine.IPSET_SUFFIX] +
+            other[NetfilterEngine.IPSET_SUFFIX])
+        self.assertEqual(loaded[name], sets[name])
+        self.assertEqual(netfilter_delta.stale_ipsets(
+            sorted(loaded) + ["other"], other[NetfilterEngine.IPSET_SUFFIX]),
+            "destroy %s\n" % name)
+        self.assertSameVerdicts(translate(configuration), final_files)
+
+    ''' The addresses are looked up with the bindings (see
+        NetfilterEngine.address_interface)
+    '''
+    def test_address_interface(self):
+        engine = NetfilterEngine("", dispatch=True)
+        configuration = engine.parse_configuration(BINDINGS)
+        engine.build_symbol_table(configuration)
+        engine.build_bound_networks(configuration)
+        for address, interface in [
+                ("10.1.2.3", "eth0"), ("10.0.0.0/16", "eth0"),
+                ("172.22.0.0/15", None), ("172.0.0.0/8", None),
+                ("8.8.8.8", "eth2"), ("127.0.0.1", None),
+                ("0.0.0.0/1", None), ("0.0.0.0/0", None),
+                ("11.0.0.0/8", "eth2"), ("bad", None)]:
+            self.assertEqual(engine.address_interface(address), interface,
+                             address)
+        # A network bound to two interfaces is not looked up
+        configuration = engine.parse_configuration(
+            BINDINGS + "BIND:eth3;10.0.0.0/8\n")
+        engine.build_symbol_table(configuration)
+        engine.build_bound_networks(configuration)
+        self.assertEqual(engine.address_interface("8.8.8.8"), None)
+
+    ''' The rules dispatched in sub-chains give the same verdicts to the
+        packets routed as the bindings say
+    '''
+    def test_dispatch(self):
+        symbols = SymbolTable()
+        for line in BINDINGS.split():
+            symbols.bind(*line[len("BIND:"):].split(";"))
+        for seed in range(3):
+            rng = random.Random(seed)
+            configuration = BINDINGS + "".join(
+                "%s:%s;;0;;;0;%s;;%d;;;0;%s;\n"
+                % (rng.choice(["ALLW", "ALLW", "DROP", "RJCT"]),
+                   rng.choice(ENDPOINTS), rng.choice(ENDPOINTS),
+                   rng.choice([0, 22, 80, 443]),
+                   rng.choice(["TCP", "UDP", "ANY"]))
+                for _ in range(60))
+            self.assertSameVerdicts(translate(configuration),
+                                    translate(configuration, dispatch=True),
+                                    n=50000, symbols=symbols)
+
+    def test_multiport_lists(self):
+        # Each list has at most 15 ports
+        ports = [str(port) for port in range(1000, 1040, 2)]
+        self.assertEqual(multiport_lists(ports, 15),
+                         [",".join(ports[:15]), ",".join(ports[15:])])
+        # The overlapping and consecutive ports are joined into ranges, that
+        # count as two ports
+        self.assertEqual(multiport_lists(["82", "80", "81", "90:95",
+                                          "94-100", "22"], 15),
+                         ["22,80:82,90:100"])
+        ranges = ["%d:%d" % (port, port + 1) for port in range(0, 80, 10)]
+        self.assertEqual(multiport_lists(ranges, 15),
+                         [",".join(ranges[:7]), ranges[7]])
+        self.assertEqual(multiport_lists(["80", "http"], 15), None)
+
+    ''' A run longer than 15 ports is split into more multiport rules '''
+    def test_multiport_split(self):
+        ports = list(range(1000, 1040, 2))
+        configuration = BINDINGS + "".join(
+            allow_rules("eth2", ["10.0.0.3"], port) for port in ports) + \
+            "DROP:eth2;;0;;;0;h-10.0.0.3;;0;;;0;ANY;\n"
+        flat = translate(configuration)
+        collapsed = translate(configuration, multiport=True)
+        lists = [line.split("--dports ")[1].split()[0]
+                 for line in collapsed[SUFFIX].split("\n")
+                 if line.startswith("-A FORWARD") and "--dports" in line]
+        self.assertEqual([len(ports_list.split(",")) for ports_list in lists],
+                         [15, 5])
+        self.assertSameVerdicts(flat, collapsed, ports=ports)
+
+    ''' The consecutive ports of a run are matched as ranges '''
+    def test_multiport_ranges(self):
+        ports = [22, 80, 81, 82, 83, 443, 444, 8080]
+        configuration = BINDINGS + "".join(
+            allow_rules("eth2", ["10.0.0.3"], port, protocol)
+            for protocol in ("TCP", "UDP") for port in reversed(ports))
+        flat = translate(configuration)
+        collapsed = translate(configuration, multiport=True)
+        lines = [line for line in collapsed[SUFFIX].split("\n")
+                 if line.startswith("-A FORWARD") and "10.0.0.3" in line]
+        self.assertEqual(len(lines), 2)
+        for line in lines:
+            self.assertIn("--dports 22,80:83,443:444,8080 ", line)
+        self.assertSameVerdicts(flat, collapsed, ports=ports)
+
+    ''' The dNATs that keep the port of the packets are collapsed, and their
+        destination is written without the port
+    '''
+    def test_multiport_dnat(self):
+        ports = [80, 81, 82, 443]
+        configuration = BINDINGS + "".join(
+            "ALLW:eth2;;0;;;0;h-10.0.0.3;;%d;h-1.2.3.4;;%d;TCP;\n"
+            % (port, port) for port in ports) + \
+            "ALLW:eth2;;0;;;0;h-10.0.0.3;;8080;h-1.2.3.4;;8443;TCP;\n" + \
+            "ALLW:eth2;;0;;;0;h-10.0.0.4;;22;h-1.2.3.4;;22;TCP;\n"
+        flat = translate(configuration)
+        collapsed = translate(configuration, multiport=True)
+        dnats = [line for line in collapsed[SUFFIX].split("\n")
+                 if " DNAT " in line]
+        self.assertEqual(len(dnats), 3)
+        self.assertIn("--dports 80:82,443 ", dnats[0])
+        self.assertTrue(dnats[0].split("--to-destination ")[1]
+                        .startswith("10.0.0.3 "))
+        # A dNAT that changes the port, or alone, keeps its port
+        self.assertIn("--to-destination 10.0.0.3:8080 ", dnats[1])
+        self.assertIn("--to-destination 10.0.0.4:22 ", dnats[2])
+        self.assertSameVerdicts(flat, collapsed, ports=ports + [8443, 22])
+
+
+if __name__ == "__main__":
+    unittest.main()
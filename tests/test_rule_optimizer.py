@@ -0,0 +1,225 @@
+#! /usr/bin/env python
+
+__author__ = "Alessio Zennaro"
+
+''' Tests of tcbin/rule_optimizer.py: the counters are read from dumps of
+    the rulesets of NetfilterEngine and the reordered rulesets are simulated
+    (see netfilter_simulator.py): every packet must get the same verdict, and
+    the same rewrite, as with the rules in their order.
+    Usage: python -m pytest tests/  (or python -m unittest discover tests)
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(BASE_DIR, "tcbin"))
+sys.path.insert(0, os.path.join(BASE_DIR, "bench"))
+sys.path.insert(0, BASE_DIR)
+
+import cidr
+import ir_model
+import mignis
+import netfilter_simulator
+import rule_optimizer
+import synthetic
+import target_compiler
+from rule_analyzer import ANY_NETWORK
+from rule_optimizer import RuleOptimizer
+from symbol_table import SymbolTable
+
+
+''' This function compiles a configuration file for IPTABLES with the given
+    command line options and returns the ruleset of the first firewall
+'''
+def compile_ruleset(file_name, args=()):
+    options = target_compiler.parse_options(list(args))[0]
+    return mignis.compile_config(file_name, "IPTABLES",
+                                 options=options)[0][0]
+
+
+''' This function returns a dump of a ruleset as "iptables-save -c" would
+    take it: each rule gets the number of packets given by function
+'''
+def dump(ruleset, function):
+    return ["[%d:0] %s" % (function(line), line) if line.startswith("-A ")
+            else line for line in ruleset.split("\n")]
+
+
+''' This function simulates the same packets on the rulesets first and
+    second (see netfilter_simulator.random_packets), and returns the two
+    results. The interfaces of the packets are mapped by name, as the
+    simulators number them as they are found
+'''
+def simulate_both(first, second, n=20000, seed=0):
+    packets = netfilter_simulator.random_packets(first, n, seed)
+    names = list(first.interfaces)
+    other = netfilter_simulator.Packets(
+        packets.src, packets.dst, packets.sport, packets.dport,
+        packets.proto,
+        [netfilter_simulator.NO_INTERFACE if i < 0
+         else second.interface(names[i])[0] for i in packets.iif],
+        [netfilter_simulator.NO_INTERFACE if i < 0
+         else second.interface(names[i])[0] for i in packets.oif],
+        packets.state)
+    return (first.simulate(packets), second.simulate(other))
+
+
+@unittest.skipIf(netfilter_simulator.numpy is None, "NumPy is needed")
+class RuleOptimizerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    ''' This method checks that two rulesets give every packet the same
+        verdict and the same rewrite
+    '''
+    def assertSameVerdicts(self, first, second):
+        first = netfilter_simulator.Simulator(first)
+        second = netfilter_simulator.Simulator(second)
+        expected, result = simulate_both(first, second)
+        self.assertEqual((expected.verdict != result.verdict).sum(), 0)
+        for field in ("src", "dst", "sport", "dport"):
+            self.assertEqual((getattr(expected.packets, field) !=
+                              getattr(result.packets, field)).sum(), 0,
+                             field)
+
+    ''' This method writes a synthetic configuration and returns its file
+        name
+    '''
+    def synthetic(self, seed, rules=150):
+        parameters = dict(synthetic.DEFAULTS)
+        parameters.update({"rules": rules, "aliases": 20, "seed": seed})
+        return synthetic.write_configuration(parameters, self.directory)
+
+    ''' This method writes the counters of a dump and returns the file name
+    '''
+    def write_counters(self, lines):
+        file_name = os.path.join(self.directory, "counters")
+        out_stream = open(file_name, "w")
+        out_stream.write("\n".join(lines) + "\n")
+        out_stream.close()
+        return file_name
+
+    def test_parse_counters(self):
+        file_name = self.synthetic(1)
+        flat = rule_optimizer.parse_counters(
+            dump(compile_ruleset(file_name), lambda line: 1))
+        self.assertTrue(flat)
+        self.assertFalse([line for line in flat if "(+" in line])
+        # The rules dispatched in sub-chains and the lists of ports are
+        # counted as the rules they come from
+        for args in (["--dispatch"], ["--multiport"], ["--ipset"]):
+            counters = rule_optimizer.parse_counters(
+                dump(compile_ruleset(file_name, args), lambda line: 1))
+            self.assertTrue(set(counters) <= set(flat), args)
+            self.assertFalse([line for line in counters if "(+" in line])
+            if args == ["--dispatch"]:
+                self.assertEqual(set(counters), set(flat))
+        # Only the filter table is counted, quoted comments are unquoted
+        counters = rule_optimizer.parse_counters([
+            "*nat", '[5:0] -A PREROUTING -j DNAT -m comment --comment "A"',
+            "*filter", '[3:0] -A in-eth0 -j ACCEPT -m comment --comment "A"',
+            '[4:0] -A OUTPUT -j ACCEPT -m comment --comment "\\"B\\""',
+            "[1:0] -A FORWARD -j DROP -m comment --comment "
+            '"A (+2 rules)"'])
+        self.assertEqual(counters, {"A": 4, '"B"': 4})
+
+    ''' The policies are found by the comments of their rules '''
+    def test_policies(self):
+        records = ir_model.parse_configuration(
+            "BIND:eth0;10.0.0.0/8\nBIND:eth2;0.0.0.0/0\n"
+            "ALLW:eth0;;0;;;0;eth2;;0;;;0;ANY;\n"
+            "PRJC:ANY;;0;eth0;;0;ANY\n").records
+        symbols = SymbolTable()
+        symbols.bind("eth0", "10.0.0.0/8")
+        symbols.bind("eth2", "0.0.0.0/0")
+        optimizer = RuleOptimizer(
+            {"RJCT:ANY;;0;;;0;eth0;;0;;;0;ANY;": 10}, symbols)
+        reordered = optimizer.reorder(records)
+        self.assertEqual(optimizer.moved, 2)
+        self.assertEqual(reordered[2].command, ir_model.PRJC)
+
+    def test_overlap(self):
+        def match(chain="FORWARD", i=None, o=None, s=ANY_NETWORK,
+                  d=ANY_NETWORK, sports=(0, 65535), dports=(0, 65535),
+                  protocol=None):
+            return [(chain, i, o, s, d, sports, dports, protocol)]
+
+        net = cidr.parse_network
+        self.assertTrue(rule_optimizer.overlap(match(), match()))
+        for first, second in [
+                (match(chain="INPUT"), match(chain="OUTPUT")),
+                (match(i="eth0"), match(i="eth1")),
+                (match(o="eth0"), match(o="eth1")),
+                (match(s=net("10.0.0.0/8")), match(s=net("11.0.0.0/8"))),
+                (match(d=net("10.0.0.1")), match(d=net("10.0.0.2"))),
+                (match(sports=(80, 80)), match(sports=(81, 90))),
+                (match(dports=(22, 22)), match(dports=(80, 80))),
+                (match(protocol="tcp"), match(protocol="udp"))]:
+            self.assertFalse(rule_optimizer.overlap(first, second))
+            self.assertFalse(rule_optimizer.overlap(second, first))
+        for first, second in [
+                (match(i="eth0"), match()),
+                (match(s=net("10.0.0.0/8")), match(s=net("10.1.0.0/16"))),
+                (match(dports=(20, 80)), match(dports=(80, 443))),
+                (match(protocol="tcp"), match())]:
+            self.assertTrue(rule_optimizer.overlap(first, second))
+            self.assertTrue(rule_optimizer.overlap(second, first))
+        # A rule overlaps if any of its matches does
+        self.assertTrue(rule_optimizer.overlap(
+            match(chain="INPUT") + match(o="eth0"), match(o="eth0")))
+
+    def test_matches(self):
+        symbols = SymbolTable()
+        symbols.bind("eth0", "10.0.0.0/8")
+        optimizer = RuleOptimizer({}, symbols)
+        parse = ir_model.Parser().parse_line
+        # A two-way rule matches the replies too
+        matches = optimizer.matches(parse(
+            "TALW:eth0;;0;;;0;h-1.2.3.4;;80;;;0;TCP;"))
+        self.assertEqual([match[:3] for match in matches],
+                         [("FORWARD", "eth0", None),
+                          ("FORWARD", None, "eth0")])
+        self.assertEqual(matches[1][6], (0, 65535))
+        self.assertEqual(matches[1][5], (80, 80))
+        # A masquerade is matched in the nat table too, with the network of
+        # the interface
+        matches = optimizer.matches(parse(
+            "ALLW:eth0;;0;MASQUERADE;;0;eth2;;0;;;0;ANY;"))
+        self.assertEqual(matches[-1][:4], ("POSTROUTING", None, "eth2",
+                                           cidr.parse_network("10.0.0.0/8")))
+        # An interface without binding cannot be understood
+        self.assertRaises(ValueError, optimizer.matches, parse(
+            "ALLW:eth1;;0;MASQUERADE;;0;eth2;;0;;;0;ANY;"))
+
+    ''' The reordered rulesets of synthetic configurations give the same
+        verdicts
+    '''
+    def test_verdicts(self):
+        for seed in range(3):
+            file_name = self.synthetic(seed)
+            ruleset = compile_ruleset(file_name)
+            rng = random.Random(seed)
+            # Mostly the rules at the end are matched
+            lines = [line for line in ruleset.split("\n")
+                     if line.startswith("-A ")]
+            hits = dict((line, rng.randint(0, 10 * k))
+                        for k, line in enumerate(lines))
+            counters = self.write_counters(dump(ruleset, hits.get))
+            reordered = compile_ruleset(file_name, ["--counters", counters])
+            self.assertNotEqual(ruleset, reordered)
+            self.assertEqual(sorted(ruleset.split("\n")),
+                             sorted(reordered.split("\n")))
+            self.assertSameVerdicts(ruleset, reordered)
+
+
+if __name__ == "__main__":
+    unittest.main()